@@ -0,0 +1,354 @@
+"""APIのやり取りの記録と再生（カセット）
+
+.envのCLAUDE_TK_CASSETTEにファイルのパスを設定すると、クライアントを包んで
+messages.create・beta.messages.create・models.listと、トークン数の確認（messages.count_tokens・
+beta.messages.count_tokens）・Files APIのアップロード（beta.files.upload）のリクエストと応答をJSON Lines形式で記録し
+（CLAUDE_TK_CASSETTE_MODE=record）、ネットワークなしで再生する（replay、既定）。
+ストリーミング（stream=True）は各イベントの開始からの経過時間も記録し、再生時は記録した間隔で返す。
+CLAUDE_TK_CASSETTE_SPEEDで再生速度の倍率を指定できる（既定1、0なら待たずにすぐ返す）。
+
+リクエストはbase64の画像データやアップロードするファイルの内容を内容ハッシュに置き換えてから
+正規化したJSONのSHA-256で照合し、
+同じリクエストが複数回記録されている場合は記録した順に返す。
+"""
+import os
+import json
+import time
+import hashlib
+import threading
+from collections import defaultdict, deque
+from anthropic._models import construct_type
+from anthropic.types import Message, MessageTokensCount, ModelInfo, RawMessageStreamEvent
+from anthropic.types.beta import BetaMessage, BetaMessageTokensCount, BetaRawMessageStreamEvent
+try:
+    from anthropic.types.beta import FileMetadata
+except ImportError:  # 新しいSDKでは名前が変わっている
+    from anthropic.types.beta import BetaFileMetadata as FileMetadata
+
+MODE_RECORD = "record"
+MODE_REPLAY = "replay"
+
+MESSAGES_CREATE = "messages.create"
+BETA_MESSAGES_CREATE = "beta.messages.create"
+MODELS_LIST = "models.list"
+MESSAGES_COUNT_TOKENS = "messages.count_tokens"
+BETA_MESSAGES_COUNT_TOKENS = "beta.messages.count_tokens"
+BETA_FILES_UPLOAD = "beta.files.upload"
+
+# 再生時に応答・イベントを戻す型（SDKが応答を読むときと同じく、記録時とSDKのバージョンが違っても
+# 足りない・増えたフィールドでエラーにしないconstruct_typeで作る）
+_RESPONSE_TYPES = {
+    MESSAGES_CREATE: Message,
+    BETA_MESSAGES_CREATE: BetaMessage,
+    MESSAGES_COUNT_TOKENS: MessageTokensCount,
+    BETA_MESSAGES_COUNT_TOKENS: BetaMessageTokensCount,
+    BETA_FILES_UPLOAD: FileMetadata,
+}
+_EVENT_TYPES = {
+    MESSAGES_CREATE: RawMessageStreamEvent,
+    BETA_MESSAGES_CREATE: BetaRawMessageStreamEvent,
+}
+
+
+class CassetteMissError(LookupError):
+    """再生時に記録されていないリクエストが来た"""
+
+
+class ReplayedAPIError(Exception):
+    """記録時にAPIが返したエラーの再生"""
+
+    def __init__(self, message, error_type=None, status_code=None):
+        super().__init__(message)
+        self.error_type = error_type
+        self.status_code = status_code
+
+
+def _redact(value):
+    """base64の画像データ・アップロードするファイルの内容を内容ハッシュに置き換えたコピー（カセットを小さくし、照合にも使う）"""
+    if isinstance(value, (bytes, bytearray)):
+        return f"sha256:{hashlib.sha256(value).hexdigest()}"
+    if isinstance(value, dict):
+        if value.get("type") == "base64" and isinstance(value.get("data"), str):
+            digest = hashlib.sha256(value["data"].encode("ascii", "replace")).hexdigest()
+            return {**value, "data": f"sha256:{digest}"}
+        return {key: _redact(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_redact(item) for item in value]
+    return value
+
+
+def request_record(kwargs):
+    """リクエストの引数を記録用の形とキーにする"""
+    request = json.loads(json.dumps(_redact(kwargs), ensure_ascii=False, default=str))
+    canonical = json.dumps(request, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return request, hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def _dump(model):
+    return model.model_dump(mode="json", exclude_unset=True)
+
+
+def _error_record(e):
+    return {"type": type(e).__name__, "status_code": getattr(e, "status_code", None), "message": str(e)}
+
+
+class Cassette:
+    """記録したやり取りのファイル（1行1件のJSON）"""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._queues = defaultdict(deque)
+        self.entries = []
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # 記録中に終了した末尾の行は読み飛ばす
+                        continue
+                    self.entries.append(entry)
+                    self._queues[(entry["method"], entry["key"])].append(entry)
+
+    def append(self, entry):
+        with self._lock:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry, ensure_ascii=False, separators=(",", ":")) + "\n")
+            self.entries.append(entry)
+
+    def take(self, method, key):
+        """照合するやり取りを記録した順に取り出す"""
+        with self._lock:
+            queue = self._queues.get((method, key))
+            if not queue:
+                raise CassetteMissError(f"カセットに記録されていないリクエストです: {method} ({key[:12]})")
+            return queue.popleft()
+
+
+class _Proxy:
+    """一部のメソッドだけを差し替え、残りは元のオブジェクトに任せる"""
+
+    def __init__(self, target, **overrides):
+        self._target = target
+        self.__dict__.update(overrides)
+
+    def __getattr__(self, name):
+        if self._target is None:
+            raise AttributeError(f"カセットの再生では{name}は使えません")
+        return getattr(self._target, name)
+
+
+class _RecordingStream:
+    """ストリームのイベントを返しながら経過時間とともに記録し、最後まで読むか閉じたときに保存する"""
+
+    def __init__(self, stream, cassette, entry, start):
+        self._stream = stream
+        self._iterator = iter(stream)
+        self._cassette = cassette
+        self._entry = entry
+        self._start = start
+        self._saved = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            event = next(self._iterator)
+        except StopIteration:
+            self._save()
+            raise
+        except Exception as e:
+            self._entry["error"] = _error_record(e)
+            self._save()
+            raise
+        self._entry["events"].append([time.monotonic() - self._start, _dump(event)])
+        return event
+
+    def _save(self):
+        if not self._saved:
+            self._saved = True
+            self._cassette.append(self._entry)
+
+    def close(self):
+        self._save()
+        close = getattr(self._stream, "close", None)
+        if close:
+            close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class ReplayStream:
+    """記録したイベントを記録した間隔（速度の倍率で割った時間）で返す"""
+
+    def __init__(self, entry, event_type, speed):
+        self._events = deque(entry["events"])
+        self._error = entry.get("error")
+        self._event_type = event_type
+        self._speed = speed
+        self._start = time.monotonic()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if not self._events:
+            if self._error:
+                error, self._error = self._error, None
+                raise ReplayedAPIError(error["message"], error.get("type"), error.get("status_code"))
+            raise StopIteration
+        offset, data = self._events.popleft()
+        _wait_until(self._start, offset, self._speed)
+        return construct_type(type_=self._event_type, value=data)
+
+    def close(self):
+        self._events.clear()
+        self._error = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class ReplayPage:
+    """models.listの再生結果（SyncPageと同じくdataと反復で使う）"""
+
+    def __init__(self, data, has_more=False, first_id=None, last_id=None):
+        self.data = data
+        self.has_more = has_more
+        self.first_id = first_id
+        self.last_id = last_id
+
+    def __iter__(self):
+        return iter(self.data)
+
+
+def _wait_until(start, offset, speed):
+    if speed <= 0:
+        return
+    delay = start + offset / speed - time.monotonic()
+    if delay > 0:
+        time.sleep(delay)
+
+
+class RecordingClient:
+    """実際のクライアントを呼び出し、やり取りをカセットに追記する"""
+
+    def __init__(self, client, cassette):
+        self._client = client
+        self.cassette = cassette
+        self.messages = _Proxy(
+            client.messages,
+            create=self._recorder(MESSAGES_CREATE, client.messages.create),
+            count_tokens=self._recorder(MESSAGES_COUNT_TOKENS, client.messages.count_tokens)
+        )
+        self.models = _Proxy(client.models, list=self._recorder(MODELS_LIST, client.models.list))
+        beta_messages = client.beta.messages
+        self.beta = _Proxy(
+            client.beta,
+            messages=_Proxy(
+                beta_messages,
+                create=self._recorder(BETA_MESSAGES_CREATE, beta_messages.create),
+                count_tokens=self._recorder(BETA_MESSAGES_COUNT_TOKENS, beta_messages.count_tokens)
+            ),
+            files=_Proxy(client.beta.files, upload=self._recorder(BETA_FILES_UPLOAD, client.beta.files.upload))
+        )
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+    def _recorder(self, method, call):
+        def record(**kwargs):
+            request, key = request_record(kwargs)
+            entry = {"method": method, "key": key, "request": request, "recorded_at": time.time()}
+            start = time.monotonic()
+            try:
+                result = call(**kwargs)
+            except Exception as e:
+                entry["latency"] = time.monotonic() - start
+                entry["error"] = _error_record(e)
+                self.cassette.append(entry)
+                raise
+            if kwargs.get("stream") and method != MODELS_LIST:
+                entry["events"] = []
+                return _RecordingStream(result, self.cassette, entry, start)
+            entry["latency"] = time.monotonic() - start
+            if method == MODELS_LIST:
+                entry["response"] = {
+                    "data": [_dump(model) for model in result.data],
+                    "has_more": getattr(result, "has_more", False),
+                    "first_id": getattr(result, "first_id", None),
+                    "last_id": getattr(result, "last_id", None),
+                }
+            else:
+                entry["response"] = _dump(result)
+            self.cassette.append(entry)
+            return result
+        return record
+
+
+class ReplayClient:
+    """カセットから応答を返すクライアント（ネットワークを使わない）"""
+
+    def __init__(self, cassette, speed=1.0):
+        self.cassette = cassette
+        self.speed = speed
+        self.messages = _Proxy(
+            None, create=self._replayer(MESSAGES_CREATE), count_tokens=self._replayer(MESSAGES_COUNT_TOKENS)
+        )
+        self.models = _Proxy(None, list=self._replayer(MODELS_LIST))
+        self.beta = _Proxy(
+            None,
+            messages=_Proxy(
+                None, create=self._replayer(BETA_MESSAGES_CREATE), count_tokens=self._replayer(BETA_MESSAGES_COUNT_TOKENS)
+            ),
+            files=_Proxy(None, upload=self._replayer(BETA_FILES_UPLOAD))
+        )
+
+    def _replayer(self, method):
+        def replay(**kwargs):
+            _, key = request_record(kwargs)
+            entry = self.cassette.take(method, key)
+            if "events" in entry:
+                return ReplayStream(entry, _EVENT_TYPES[method], self.speed)
+            _wait_until(time.monotonic(), entry.get("latency", 0), self.speed)
+            error = entry.get("error")
+            if error:
+                raise ReplayedAPIError(error["message"], error.get("type"), error.get("status_code"))
+            response = entry["response"]
+            if method == MODELS_LIST:
+                return ReplayPage(
+                    [construct_type(type_=ModelInfo, value=model) for model in response["data"]],
+                    response.get("has_more", False), response.get("first_id"), response.get("last_id")
+                )
+            return construct_type(type_=_RESPONSE_TYPES[method], value=response)
+        return replay
+
+
+def from_env(client):
+    """.envの設定に応じてクライアントを記録・再生用に包む（CLAUDE_TK_CASSETTEが未設定ならそのまま返す）"""
+    path = os.getenv("CLAUDE_TK_CASSETTE")
+    if not path:
+        return client
+    cassette = Cassette(path)
+    if os.getenv("CLAUDE_TK_CASSETTE_MODE", MODE_REPLAY).strip().lower() == MODE_RECORD:
+        return RecordingClient(client, cassette)
+    try:
+        speed = float(os.getenv("CLAUDE_TK_CASSETTE_SPEED", "1"))
+    except ValueError:
+        speed = 1.0
+    return ReplayClient(cassette, speed)
@@ -0,0 +1,138 @@
+"""複数の会話をタブで並べて表示する
+
+各タブはClaudeChatApp（画像対応版）の1つの画面で、会話履歴・添付画像・リクエスト用メッセージ・
+表示中のサムネイル・見積もりはタブごとに持つ。APIクライアント・メディアストア・サムネイルと送信用の
+画像データのキャッシュ・回答キャッシュ・データベースは最初のタブのものを共有する。
+APIへのリクエストは共有の作業スレッドで実行するため、回答を待っている間も他のタブで質問できる
+（同時に送るリクエストの数はmax_concurrent_requestsまで）。
+"""
+import os
+import tkinter as tk
+from tkinter import ttk, messagebox
+from concurrent.futures import ThreadPoolExecutor
+
+# 同時に送るリクエストの上限（.envのCLAUDE_TK_MAX_CONCURRENT_REQUESTSで変更可）
+DEFAULT_MAX_CONCURRENT_REQUESTS = 4
+BUSY_SUFFIX = "（回答待ち）"
+
+
+def max_concurrent_requests():
+    """同時に送るリクエストの上限を.envから取得"""
+    try:
+        return max(1, int(os.getenv("CLAUDE_TK_MAX_CONCURRENT_REQUESTS") or DEFAULT_MAX_CONCURRENT_REQUESTS))
+    except ValueError:
+        return DEFAULT_MAX_CONCURRENT_REQUESTS
+
+
+class ChatTabs:
+    """app_class(root, host=..., container=..., shared=...)の画面をタブとして並べる"""
+
+    def __init__(self, root, app_class, title, max_workers=None):
+        self.root = root
+        self.app_class = app_class
+        self.tabs = []
+        self._count = 0
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_workers or max_concurrent_requests(), thread_name_prefix="claude_tk_request"
+        )
+        self.root.title(title)
+        self.root.geometry("1000x760")
+        self.root.protocol("WM_DELETE_WINDOW", self.close_window)
+        self.setup_ui()
+        if self.add_tab() is None:
+            # APIキーやモデル一覧がなく最初のタブを作れなかった（ウィンドウは閉じられている）
+            self.executor.shutdown(wait=False)
+
+    def setup_ui(self):
+        toolbar = ttk.Frame(self.root, padding=(10, 5, 10, 0))
+        toolbar.grid(row=0, column=0, sticky=(tk.W, tk.E))
+        ttk.Button(toolbar, text="新しいタブ", command=self.add_tab).grid(row=0, column=0, padx=(0, 5))
+        ttk.Button(toolbar, text="タブを閉じる", command=self.close_current_tab).grid(row=0, column=1)
+        self.notebook = ttk.Notebook(self.root)
+        self.notebook.grid(row=1, column=0, sticky=(tk.W, tk.E, tk.N, tk.S))
+        self.root.columnconfigure(0, weight=1)
+        self.root.rowconfigure(1, weight=1)
+        self.root.bind("<Control-t>", lambda event: self.add_tab())
+
+    def add_tab(self):
+        """新しい会話のタブを追加して選択する（作れなければNone）"""
+        frame = ttk.Frame(self.notebook)
+        shared = self.tabs[0] if self.tabs else None
+        app = self.app_class(self.root, host=self, container=frame, shared=shared)
+        if not hasattr(app, "conversation_history"):
+            frame.destroy()
+            return None
+        self._count += 1
+        app.tab_frame = frame
+        app.tab_title = f"会話 {self._count}"
+        self.tabs.append(app)
+        self.notebook.add(frame, text=app.tab_title)
+        self.notebook.select(frame)
+        return app
+
+    def current_tab(self):
+        selected = self.notebook.select()
+        for app in self.tabs:
+            if str(app.tab_frame) == str(selected):
+                return app
+        return self.tabs[-1] if self.tabs else None
+
+    def set_busy(self, app, busy):
+        """回答を待っているタブの名前に印を付ける"""
+        if app in self.tabs:
+            self.notebook.tab(app.tab_frame, text=app.tab_title + (BUSY_SUFFIX if busy else ""))
+
+    def close_current_tab(self):
+        app = self.current_tab()
+        if app is not None:
+            self.close_tab(app)
+
+    def close_tab(self, app):
+        """タブを閉じる（最後のタブなら終了する）。閉じたらTrue"""
+        if len(self.tabs) == 1:
+            self.exit_application()
+            return False
+        if app._request_pending:
+            messagebox.showwarning("警告", "回答を待っています。回答が届いてから閉じてください。")
+            return False
+        if not app.prompt_save_conversation("タブを閉じる"):
+            return False
+        app.wait_for_background_jobs()
+        app.journal.discard()
+        app.token_estimator.shutdown()
+        self.tabs.remove(app)
+        self.notebook.forget(app.tab_frame)
+        app.tab_frame.destroy()
+        return True
+
+    def exit_application(self):
+        for app in self.tabs:
+            self.notebook.select(app.tab_frame)
+            if not app.prompt_save_conversation("終了"):
+                return
+        for app in self.tabs:
+            app.wait_for_background_jobs()
+            # 保存した、または保存しないことを選んだ会話のジャーナルは不要
+            app.journal.discard()
+        self.shutdown()
+        self.root.destroy()
+
+    def close_window(self):
+        """ウィンドウの閉じるボタン（保存・読み込み中のタブがあれば完了してから閉じる）
+
+        終了ボタンと同じく各タブの保存を確認し、保存した・保存しないことを選んだ会話のジャーナルを消す。
+        """
+        busy = [app for app in self.tabs if app._background_jobs]
+        if busy:
+            for app in busy:
+                app._close_requested = True
+            return
+        for app in self.tabs:
+            app._close_requested = False
+        self.exit_application()
+
+    def shutdown(self):
+        # 回答を待っているリクエストは捨てる
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        for app in self.tabs:
+            app.token_estimator.shutdown()
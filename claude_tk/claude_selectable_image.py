@@ -13,6 +13,10 @@ import tempfile
 import shutil
 import zipfile
 from datetime import datetime
+try:
+    from claude_tk import output_limits
+except ImportError:  # スクリプトとして直接実行された場合
+    import output_limits
 
 class ClaudeChatApp:
     def __init__(self, root):
@@ -90,6 +94,8 @@ class ClaudeChatApp:
         """APIからモデル一覧を取得してJSONファイルを更新"""
         try:
             models = self.client.models.list()
+            # 取得できればモデルごとの出力上限を回答のmax_tokensに使う
+            output_limits.register_models(models.data)
             models_dict = {}
             
             for model in models.data:
@@ -453,9 +459,9 @@ class ClaudeChatApp:
                 image_path = self.selected_image_path
             
             # APIリクエスト
-            message = self.client.messages.create(
+            answer, _ = output_limits.create_with_continuation(
+                self.client.messages.create,
                 model=selected_model,
-                max_tokens=1000,
                 messages=[
                     {
                         "role": "user",
@@ -464,8 +470,6 @@ class ClaudeChatApp:
                 ]
             )
             
-            answer = message.content[0].text
-            
             # Markdownをプレーンテキストに変換
             plain_text = self.markdown_to_text(answer)
             
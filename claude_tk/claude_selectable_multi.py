@@ -5,8 +5,23 @@ import anthropic
 import markdown
 import re
 import json
+import queue
+import threading
 from datetime import datetime
 from dotenv import load_dotenv
+try:
+    from claude_tk import json_stream, request_builder, response_cache, api_cassette, output_limits
+except ImportError:  # スクリプトとして直接実行された場合
+    import json_stream
+    import request_builder
+    import response_cache
+    import api_cassette
+    import output_limits
+
+# 大きな履歴ファイルの再開時に最初に表示するターン数
+RECENT_TURNS = 20
+# 古い履歴を表示に追加する1回あたりのメッセージ数
+HISTORY_CHUNK = 200
 
 class ClaudeChatApp:
     def __init__(self, root):
@@ -22,7 +37,7 @@ class ClaudeChatApp:
             root.destroy()
             return
         
-        self.client = anthropic.Anthropic(api_key=self.api_key)
+        self.client = api_cassette.from_env(anthropic.Anthropic(api_key=self.api_key))
         
         # モデル一覧を取得
         self.models = self.get_available_models()
@@ -36,6 +51,14 @@ class ClaudeChatApp:
         
         # 会話履歴を保持
         self.conversation_history = []
+        # APIリクエスト用のメッセージ（送信ごとに増えた分だけ追加する）
+        self.request_builder = request_builder.RequestBuilder()
+        # .envのCLAUDE_TK_RESPONSE_CACHEを設定すると、同じリクエストには保存してある回答を使う
+        self.response_cache = response_cache.from_env()
+        self.bypass_cache_var = None
+        # 履歴ファイルをバックグラウンドで読み込み中か（世代が変わると読み込みを中止する）
+        self._loading_history = False
+        self._load_generation = 0
         
         self.setup_ui()
         self.center_window()
@@ -45,6 +68,8 @@ class ClaudeChatApp:
         try:
             # APIからモデル一覧を取得
             models_response = self.client.models.list()
+            # 取得できればモデルごとの出力上限を回答のmax_tokensに使う
+            output_limits.register_models(models_response.data)
             
             models_dict = {}
             for model in models_response.data:
@@ -247,6 +272,15 @@ class ClaudeChatApp:
         )
         self.send_button.pack(side=tk.LEFT, padx=(0, 10))
         
+        if self.response_cache is not None:
+            # 応答キャッシュを使う場合は、次の1回だけキャッシュを使わずに送信できる
+            self.bypass_cache_var = tk.BooleanVar(self.root, value=False)
+            ttk.Checkbutton(
+                button_frame, 
+                text="キャッシュを使わない", 
+                variable=self.bypass_cache_var
+            ).pack(side=tk.LEFT, padx=(0, 10))
+        
         self.clear_button = ttk.Button(
             button_frame, 
             text="会話をクリア", 
@@ -272,26 +306,37 @@ class ClaudeChatApp:
         # Enterキーで質問送信
         self.question_text.bind('<Control-Return>', lambda e: self.send_question() or "break")
     
-    def update_history_display(self):
-        """会話履歴の表示を更新"""
-        self.history_text.config(state=tk.NORMAL)
-        self.history_text.delete("1.0", tk.END)
-        
-        pair_num = 0
-        for msg in self.conversation_history:
+    def insert_history_messages(self, index, messages, pair_num=0):
+        """messagesを履歴欄のindexの位置に挿入する（pair_numは直前までの質問数）"""
+        self.history_text.mark_set("history_insert", index)
+        self.history_text.mark_gravity("history_insert", tk.RIGHT)
+        for msg in messages:
             if msg["role"] == "user":
                 pair_num += 1
-                self.history_text.insert(tk.END, f"【質問 {pair_num}】\n", "user")
-                self.history_text.insert(tk.END, f"{msg['content']}\n\n", "user_content")
+                self.history_text.insert("history_insert", f"【質問 {pair_num}】\n", "user")
+                self.history_text.insert("history_insert", f"{msg['content']}\n\n", "user_content")
             else:
-                self.history_text.insert(tk.END, f"【回答 {pair_num}】\n", "assistant")
-                self.history_text.insert(tk.END, f"{msg['content']}\n\n", "assistant_content")
+                if msg.get("cached"):
+                    self.history_text.insert("history_insert", f"【回答 {pair_num}】", "assistant")
+                    self.history_text.insert("history_insert", "（キャッシュ）\n", "cached")
+                else:
+                    self.history_text.insert("history_insert", f"【回答 {pair_num}】\n", "assistant")
+                self.history_text.insert("history_insert", f"{msg['content']}\n\n", "assistant_content")
+        self.history_text.mark_unset("history_insert")
+
+    def update_history_display(self, pair_offset=0):
+        """会話履歴の表示を更新（pair_offsetは読み込み中の古い履歴の質問数）"""
+        self.history_text.config(state=tk.NORMAL)
+        self.history_text.delete("1.0", tk.END)
+        
+        self.insert_history_messages("1.0", self.conversation_history, pair_offset)
         
         # タグの設定
         self.history_text.tag_config("user", foreground="blue", font=("Arial", 9, "bold"))
         self.history_text.tag_config("user_content", foreground="black", font=("Arial", 9))
         self.history_text.tag_config("assistant", foreground="green", font=("Arial", 9, "bold"))
         self.history_text.tag_config("assistant_content", foreground="black", font=("Arial", 9))
+        self.history_text.tag_config("cached", foreground="gray", font=("Arial", 8, "italic"))
         
         # 最新の位置にスクロール
         self.history_text.see(tk.END)
@@ -302,6 +347,9 @@ class ClaudeChatApp:
         if not question:
             messagebox.showwarning("警告", "質問を入力してください。")
             return
+        if self._loading_history:
+            messagebox.showwarning("警告", "会話履歴の読み込みが終わるまでお待ちください。")
+            return
         
         # 現在選択されているモデルを取得
         self.model = self.model_var.get()
@@ -318,28 +366,40 @@ class ClaudeChatApp:
             if len(self.conversation_history) == 1:
                 self.model_combo.config(state="disabled")
             
-            # APIリクエスト用のメッセージリストを作成
-            messages = []
-            for msg in self.conversation_history:
-                messages.append({
-                    "role": msg["role"],
-                    "content": msg["content"] if msg["role"] == "user" else msg.get("markdown", msg["content"])
-                })
+            # 同じモデル・過去の会話・質問・パラメータなら保存してある回答を使う
+            answer = None
+            cache_key = None
+            if self.response_cache is not None:
+                self.request_builder.sync(self.conversation_history, len(self.conversation_history) - 1)
+                cache_key = response_cache.request_key(
+                    self.model, self.request_builder.prefix_key(), {"content": question}, max_tokens=output_limits.max_tokens_for(self.model)
+                )
+                if not self.bypass_cache_var.get():
+                    answer = self.response_cache.get(cache_key)
+            cached = answer is not None
             
-            # APIリクエスト
-            message = self.client.messages.create(
-                model=self.model,
-                max_tokens=1000,
-                messages=messages
-            )
-            
-            answer = message.content[0].text
+            if not cached:
+                # APIリクエスト用のメッセージリストを作成（過去のメッセージは前回までの分を再利用）
+                messages = self.request_builder.build(self.conversation_history)
+                
+                # APIリクエスト
+                answer, _ = output_limits.create_with_continuation(
+                    self.client.messages.create,
+                    model=self.model,
+                    messages=messages
+                )
+                
+                if cache_key is not None:
+                    self.response_cache.put(cache_key, answer, self.model)
             
             # Markdownをプレーンテキストに変換
             plain_text = self.markdown_to_text(answer)
             
-            # 会話履歴に回答を追加（plain_textとmarkdown両方保持）
-            self.conversation_history.append({"role": "assistant", "content": plain_text, "markdown": answer})
+            # 会話履歴に回答を追加（plain_textとmarkdown両方保持、キャッシュの回答は履歴欄に表示する）
+            assistant_msg = {"role": "assistant", "content": plain_text, "markdown": answer}
+            if cached:
+                assistant_msg["cached"] = True
+            self.conversation_history.append(assistant_msg)
             
             # 履歴表示を更新
             self.update_history_display()
@@ -355,6 +415,8 @@ class ClaudeChatApp:
             
             # 質問欄をクリア
             self.question_text.delete("1.0", tk.END)
+            if self.bypass_cache_var is not None:
+                self.bypass_cache_var.set(False)
                 
         except Exception as e:
             messagebox.showerror("エラー", f"通信エラー: {str(e)}")
@@ -375,7 +437,9 @@ class ClaudeChatApp:
             return
         
         if messagebox.askyesno("確認", "会話履歴をクリアしますか？"):
+            self.cancel_history_loading()
             self.conversation_history = []
+            self.request_builder.reset()
             self.update_history_display()
             self.question_text.delete("1.0", tk.END)
             self.latest_answer_text.config(state=tk.NORMAL)
@@ -389,6 +453,9 @@ class ClaudeChatApp:
         """会話履歴をファイルに保存（Markdown/JSON/両方選択可）"""
         if not self.conversation_history:
             return False
+        if self._loading_history:
+            messagebox.showwarning("警告", "会話履歴の読み込み中は保存できません。読み込みが終わってから保存してください。")
+            return False
 
         # 保存形式を選択
         save_type = self.ask_save_format()
@@ -528,8 +595,35 @@ class ClaudeChatApp:
         
         self.root.destroy()
 
+    def convert_message(self, msg):
+        """保存JSONのメッセージを会話履歴の形式にする（assistantはmarkdownも保持）"""
+        if msg["role"] == "assistant":
+            return {
+                "role": "assistant",
+                "content": self.markdown_to_text(msg.get("content", "")),
+                "markdown": msg.get("content", "")
+            }
+        return {"role": "user", "content": msg["content"]}
+
+    def show_latest_answer(self):
+        """最新回答欄を会話履歴の最後の回答に合わせる"""
+        last_assistant = next((m for m in reversed(self.conversation_history) if m["role"] == "assistant"), None)
+        self.latest_answer_text.config(state=tk.NORMAL)
+        self.latest_answer_text.delete("1.0", tk.END)
+        if last_assistant:
+            self.latest_answer_text.insert("1.0", last_assistant["content"])
+            self.latest_answer_text.config(state=tk.DISABLED)
+            self.latest_answer_text.master.grid()
+        else:
+            self.latest_answer_text.config(state=tk.DISABLED)
+            self.latest_answer_text.master.grid_remove()
+
     def resume_conversation(self):
-        """JSONファイルから会話履歴をインポートして再開"""
+        """JSONファイルから会話履歴をインポートして再開
+
+        大きなファイルは末尾の最新ターンだけを先に表示し、古い履歴は別スレッドで読み込んで
+        新しいものから順に履歴欄の先頭へ追加する。
+        """
         file_path = filedialog.askopenfilename(
             title="会話履歴ファイル（JSON）を選択してください",
             defaultextension=".json",
@@ -538,66 +632,160 @@ class ClaudeChatApp:
         if not file_path:
             return  # キャンセル
         try:
-            with open(file_path, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-            
-            # モデル情報を取得（metadataから）
-            if "metadata" in data and "model" in data["metadata"]:
-                saved_model = data["metadata"]["model"]
-                # 保存されたモデルが利用可能なモデルリストに含まれているかチェック
-                if saved_model in self.models:
-                    self.model = saved_model
-                    self.model_var.set(self.model)
-                else:
-                    messagebox.showwarning("警告", f"保存されたモデル '{saved_model}' が現在利用できません。\n現在選択されているモデルを使用します。")
-            
-            # conversationキーがあればそれを使う
-            conversation = data.get("conversation", data)
-            # conversationはリストであることを確認
-            if not isinstance(conversation, list):
-                raise ValueError("不正な会話履歴ファイルです（conversationがリストではありません）")
-            # 各メッセージのroleとcontent/markdownを検証
-            new_history = []
-            for msg in conversation:
-                if not isinstance(msg, dict) or "role" not in msg or "content" not in msg:
-                    raise ValueError("不正な会話履歴ファイルです（メッセージ形式エラー）")
-                # assistantの場合はmarkdownも保持
-                if msg["role"] == "assistant":
-                    new_history.append({
-                        "role": "assistant",
-                        "content": self.markdown_to_text(msg.get("content", "")),
-                        "markdown": msg.get("content", "")
-                    })
-                else:
-                    new_history.append({
-                        "role": "user",
-                        "content": msg["content"]
-                    })
-            
-            self.conversation_history = new_history
-            self.update_history_display()
-            
-            # 会話履歴がある場合はモデル選択を無効化
-            if self.conversation_history:
-                self.model_combo.config(state="disabled")
-            
-            # 最新回答欄も更新
-            last_assistant = next((m for m in reversed(self.conversation_history) if m["role"] == "assistant"), None)
-            if last_assistant:
-                self.latest_answer_text.config(state=tk.NORMAL)
-                self.latest_answer_text.delete("1.0", tk.END)
-                self.latest_answer_text.insert("1.0", last_assistant["content"])
-                self.latest_answer_text.config(state=tk.DISABLED)
-                self.latest_answer_text.master.grid()
-            else:
-                self.latest_answer_text.config(state=tk.NORMAL)
-                self.latest_answer_text.delete("1.0", tk.END)
-                self.latest_answer_text.config(state=tk.DISABLED)
-                self.latest_answer_text.master.grid_remove()
-            
-            messagebox.showinfo("インポート完了", "会話履歴を再開しました。")
+            # TAIL_WINDOWはバイト数なので、文字数ではなくファイルサイズで比べる
+            if os.path.getsize(file_path) < json_stream.TAIL_WINDOW:
+                # 小さなファイルはそのまま読み込む
+                with open(file_path, 'r', encoding='utf-8') as f:
+                    head = f.read()
+                stream = json_stream.ConversationStream(json_stream.text_reader(head))
+                new_history = [self.convert_message(msg) for msg in stream]
+                self.cancel_history_loading()
+                self.restore_saved_model(stream.data)
+                self.conversation_history = new_history
+                self.request_builder.reset()
+                self.update_history_display()
+                self.update_model_combo_state()
+                self.show_latest_answer()
+                messagebox.showinfo("インポート完了", "会話履歴を再開しました。")
+                return
+            tail, offset = json_stream.read_tail(file_path, RECENT_TURNS)
+            # モデル情報はファイルの先頭（metadata）だけを読んで取得する
+            self.restore_saved_model(json_stream.read_metadata(file_path))
         except Exception as e:
             messagebox.showerror("インポートエラー", f"会話履歴のインポートに失敗しました:\n{str(e)}")
+            return
+        self.start_history_loading(file_path, tail, offset)
+
+    def restore_saved_model(self, data):
+        """保存JSONのmetadataのモデルを選択する"""
+        metadata = data.get("metadata")
+        if isinstance(metadata, dict) and "model" in metadata:
+            saved_model = metadata["model"]
+            # 保存されたモデルが利用可能なモデルリストに含まれているかチェック
+            if saved_model in self.models:
+                self.model = saved_model
+                self.model_var.set(self.model)
+            else:
+                messagebox.showwarning("警告", f"保存されたモデル '{saved_model}' が現在利用できません。\n現在選択されているモデルを使用します。")
+
+    def update_model_combo_state(self):
+        """会話履歴がある場合はモデル選択を無効化する"""
+        self.model_combo.config(state="disabled" if self.conversation_history else "readonly")
+
+    def start_history_loading(self, file_path, tail, offset):
+        """最新のターンを表示し、残りの読み込みを別スレッドで始める"""
+        self.cancel_history_loading()
+        previous = self.conversation_history
+        older = []
+        shown = []
+        if tail is not None:
+            # 末尾から読んだ分のうち、最新のRECENT_TURNSターンだけをすぐに表示する
+            users = [i for i, msg in enumerate(tail) if msg["role"] == "user"]
+            split = users[-RECENT_TURNS] if len(users) > RECENT_TURNS else 0
+            older = tail[:split]
+            shown = [self.convert_message(msg) for msg in tail[split:]]
+        self._loading_history = True
+        self._load_generation += 1
+        generation = self._load_generation
+        self.conversation_history = shown
+        self.request_builder.reset()
+        self.update_history_display()
+        self.show_latest_answer()
+        self.send_button.config(state=tk.DISABLED)
+        self.model_combo.config(state="disabled")
+        results = queue.Queue()
+        threading.Thread(
+            target=self.load_history_worker,
+            args=(file_path, offset if tail is not None else None, older, generation, results),
+            daemon=True
+        ).start()
+        self.root.after(20, self.poll_history_loading, generation, results, previous)
+
+    def load_history_worker(self, file_path, offset, older, generation, results):
+        """先頭からoffsetバイトまで（Noneなら全体）の会話を読み込み、新しい順に変換して渡す"""
+        try:
+            with open(file_path, 'rb') as f:
+                if offset is None:
+                    reader = json_stream.bounded_reader(f, os.path.getsize(file_path))
+                    raw = list(json_stream.ConversationStream(reader))
+                else:
+                    reader = json_stream.bounded_reader(f, offset)
+                    raw = list(json_stream.ConversationStream(reader, partial=True)) + older
+            pair_nums = []
+            pair_num = 0
+            for msg in raw:
+                pair_nums.append(pair_num)
+                if msg["role"] == "user":
+                    pair_num += 1
+            results.put(("count", pair_num))
+            end = len(raw)
+            while end > 0:
+                if generation != self._load_generation:
+                    return  # 中止された
+                start = max(0, end - HISTORY_CHUNK)
+                # 質問と回答の間で区切らない
+                while start > 0 and raw[start]["role"] != "user":
+                    start -= 1
+                results.put(("chunk", pair_nums[start], [self.convert_message(msg) for msg in raw[start:end]]))
+                end = start
+            results.put(("done",))
+        except Exception as e:
+            results.put(("error", e))
+
+    def poll_history_loading(self, generation, results, previous):
+        """読み込みスレッドの結果を履歴欄に反映する"""
+        if generation != self._load_generation:
+            return
+        try:
+            while True:
+                item = results.get_nowait()
+                if item[0] == "count":
+                    # 古い履歴の質問数が分かったので、表示中のターンの番号を付け直す
+                    self.update_history_display(pair_offset=item[1])
+                elif item[0] == "chunk":
+                    self.prepend_history_chunk(item[1], item[2])
+                elif item[0] == "done":
+                    self.finish_history_loading()
+                    messagebox.showinfo("インポート完了", "会話履歴を再開しました。")
+                    return
+                else:
+                    self.finish_history_loading()
+                    self.conversation_history = previous
+                    self.update_history_display()
+                    self.update_model_combo_state()
+                    self.show_latest_answer()
+                    messagebox.showerror("インポートエラー", f"会話履歴のインポートに失敗しました:\n{str(item[1])}")
+                    return
+        except queue.Empty:
+            pass
+        self.root.after(20, self.poll_history_loading, generation, results, previous)
+
+    def prepend_history_chunk(self, pair_num, messages):
+        """読み込んだ古い履歴を会話履歴と履歴欄の先頭に追加する"""
+        self.conversation_history[:0] = messages
+        at_bottom = self.history_text.yview()[1] >= 1.0
+        top_line = int(self.history_text.index("@0,0").split(".")[0])
+        lines_before = int(self.history_text.index("end-1c").split(".")[0])
+        self.history_text.config(state=tk.NORMAL)
+        self.insert_history_messages("1.0", messages, pair_num)
+        self.history_text.config(state=tk.DISABLED)
+        # 表示位置がずれないようにする
+        if at_bottom:
+            self.history_text.see(tk.END)
+        else:
+            added = int(self.history_text.index("end-1c").split(".")[0]) - lines_before
+            self.history_text.yview(f"{top_line + added}.0")
+
+    def finish_history_loading(self):
+        self._loading_history = False
+        self.send_button.config(state=tk.NORMAL)
+        self.update_model_combo_state()
+
+    def cancel_history_loading(self):
+        """バックグラウンドでの履歴の読み込みを中止する"""
+        if self._loading_history:
+            self._load_generation += 1
+            self.finish_history_loading()
 
 def main():
     root = tk.Tk()
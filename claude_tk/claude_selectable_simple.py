@@ -7,6 +7,10 @@ import re
 from dotenv import load_dotenv
 import json
 from datetime import datetime
+try:
+    from claude_tk import output_limits
+except ImportError:  # スクリプトとして直接実行された場合
+    import output_limits
 
 class ClaudeChatApp:
     def __init__(self, root):
@@ -42,6 +46,8 @@ class ClaudeChatApp:
         try:
             # APIからモデル一覧を取得
             models_response = self.client.models.list()
+            # 取得できればモデルごとの出力上限を回答のmax_tokensに使う
+            output_limits.register_models(models_response.data)
             
             models_dict = {}
             for model in models_response.data:
@@ -227,6 +233,8 @@ class ClaudeChatApp:
         try:
             # APIからモデル一覧を取得
             models_response = self.client.models.list()
+            # 取得できればモデルごとの出力上限を回答のmax_tokensに使う
+            output_limits.register_models(models_response.data)
             
             models_dict = {}
             for model in models_response.data:
@@ -270,9 +278,9 @@ class ClaudeChatApp:
         
         try:
             # APIリクエスト
-            message = self.client.messages.create(
+            answer, _ = output_limits.create_with_continuation(
+                self.client.messages.create,
                 model=self.model,
-                max_tokens=1000,
                 messages=[
                     {
                         "role": "user",
@@ -281,8 +289,6 @@ class ClaudeChatApp:
                 ]
             )
             
-            answer = message.content[0].text
-            
             # Markdownをプレーンテキストに変換
             plain_text = self.markdown_to_text(answer)
             
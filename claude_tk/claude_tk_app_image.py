@@ -13,6 +13,10 @@ import tempfile
 import shutil
 import zipfile
 from datetime import datetime
+try:
+    from claude_tk import output_limits
+except ImportError:  # スクリプトとして直接実行された場合
+    import output_limits
 
 class ClaudeChatApp:
     def __init__(self, root):
@@ -293,9 +297,9 @@ class ClaudeChatApp:
                 image_path = self.selected_image_path
             
             # APIリクエスト
-            message = self.client.messages.create(
+            answer, _ = output_limits.create_with_continuation(
+                self.client.messages.create,
                 model=self.model,
-                max_tokens=1000,
                 messages=[
                     {
                         "role": "user",
@@ -304,8 +308,6 @@ class ClaudeChatApp:
                 ]
             )
             
-            answer = message.content[0].text
-            
             # Markdownをプレーンテキストに変換
             plain_text = self.markdown_to_text(answer)
             
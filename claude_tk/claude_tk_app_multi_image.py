@@ -1,23 +1,62 @@
 import tkinter as tk
 from tkinter import ttk, scrolledtext, messagebox, filedialog
 import os
+import io
 import anthropic
-import markdown
-import re
-import json
+import sqlite3
+import sys
+import threading
 from datetime import datetime
 from dotenv import load_dotenv
 from PIL import Image, ImageTk  # 画像表示用
-import base64
-import shutil
-import tempfile
-import zipfile
+try:
+    from claude_tk import image_attachments, conversation_archive, media_store, conversation_journal, conversation_db, conversation_container, session_snapshot, request_builder, file_uploads, response_cache, question_index, api_cassette, output_limits, token_estimate, chat_tabs, markdown_plain
+except ImportError:  # スクリプトとして直接実行された場合
+    import image_attachments
+    import conversation_archive
+    import media_store
+    import conversation_journal
+    import conversation_db
+    import conversation_container
+    import session_snapshot
+    import request_builder
+    import file_uploads
+    import response_cache
+    import question_index
+    import api_cassette
+    import output_limits
+    import token_estimate
+    import chat_tabs
+    import markdown_plain
+
+# 保存・読み込みがこの秒数で終わらなければ進捗ダイアログを表示する
+PROGRESS_DIALOG_DELAY = 0.3
+# .ctkの再開では最新のこのターン数を先に表示し、それより前はこの件数ずつ読み込んで加える
+RESUME_INITIAL_TURNS = 20
+RESUME_CHUNK_MESSAGES = 200
+# 入力が止まってからこのミリ秒後にトークン数などを見積もり、結果をこの間隔で確認する
+ESTIMATE_DELAY_MS = 400
+ESTIMATE_POLL_MS = 30
+# タブ表示で回答を待つ間、作業スレッドの完了を確かめる間隔（ミリ秒）
+REQUEST_POLL_MS = 50
 
 class ClaudeChatApp:
-    def __init__(self, root):
+    # タブ表示（chat_tabs.py）で最初のタブと共有するもの（クライアント・キャッシュ・データベースなど）
+    # 表示中のサムネイル・同じ画像の検出・見積もりはタブごとに持つ（init_tab_resources）
+    SHARED_ATTRIBUTES = (
+        "client", "media_store", "image_cache", "file_uploader", "response_cache",
+        "conversation_db", "similar_mode", "question_index",
+    )
+
+    def __init__(self, root, host=None, container=None, shared=None):
+        """hostを渡すとタブ表示の1つのタブとしてcontainer（タブのフレーム）に画面を作り、
+        sharedに渡したタブとクライアント・キャッシュなどを共有する"""
         self.root = root
-        self.root.title("Claude Chat App - Multi Turn and Image")
-        self.root.geometry("1000x700")
+        self.host = host
+        self.container = container or root
+        if host is None:
+            self.root.title("Claude Chat App - Multi Turn and Image")
+            self.root.geometry("1000x700")
         
         # API設定
         load_dotenv()
@@ -27,19 +66,287 @@ class ClaudeChatApp:
             root.destroy()
             return
         
-        self.client = anthropic.Anthropic(api_key=self.api_key)
+        if shared is None:
+            self.init_shared_resources()
+        else:
+            for name in self.SHARED_ATTRIBUTES:
+                setattr(self, name, getattr(shared, name))
+        self.init_tab_resources()
+        
         self.model = "claude-sonnet-4-20250514"
         
         # 会話履歴を保持
         self.conversation_history = []
-        self.attached_image_path = None
-        self.attached_image_preview = None
+        self.attached_image_paths = []  # 添付画像（複数可、パスまたはMemoryImage）
+        self._clipboard_count = 0  # 貼り付け画像の連番
+        self.attached_image_previews = []  # プレビュー画像参照保持用
         self.history_images = []  # 履歴欄の画像参照保持用
-        self._imported_tempdir = None  # zip復元用一時ディレクトリ参照
+        # APIリクエスト用のメッセージ（送信ごとに増えた分だけ追加する）
+        self.request_builder = request_builder.RequestBuilder(file_ids=self.file_uploader is not None)
+        self.bypass_cache_var = None
+        self.bypass_similar_var = None
+        self._estimate_after = None
+        self._estimate_generation = 0
+        self._imported_archive = None  # 再開した会話のzip（画像を必要時に読み込むため開いたまま保持）
+        self._history_loader = None  # 再開した.ctkの残りのメッセージを読み込み中（load_earlier_messages）
+        self._last_json_zip_path = None  # 前回保存・再開したzip（同じzipへの保存は差分だけを追記）
+        # 会話はメッセージごとにジャーナルへ追記し、異常終了時に復元できるようにする（保存先は.envのCLAUDE_TK_JOURNAL_DIRで変更可）
+        self.journal_dir = os.getenv("CLAUDE_TK_JOURNAL_DIR") or conversation_journal.DEFAULT_JOURNAL_DIR
+        self.journal = conversation_journal.ConversationJournal(self.journal_dir, store=self.media_store)
+        self._db_conversation_id = None  # データベース上の現在の会話（保存し直すと差分だけを追加）
+        # 実行中の保存・読み込み（終了時は完了を待つ）
+        self._background_jobs = []
+        self._close_requested = False
+        self._request_pending = False  # 回答を待っている（タブ表示では作業スレッドで受信する）
+        if host is None:
+            self.root.protocol("WM_DELETE_WINDOW", self.close_window)
+        # 終了時に表示中の会話をスナップショットに書き出し、次回起動時にすぐ復元する
+        # （場所は.envのCLAUDE_TK_SESSION_FILE、復元方法はCLAUDE_TK_SESSION_RESTORE=always/ask/never）
+        self.session_path = os.getenv("CLAUDE_TK_SESSION_FILE") or session_snapshot.DEFAULT_SESSION_PATH
+        self.session_restore = (os.getenv("CLAUDE_TK_SESSION_RESTORE") or session_snapshot.RESTORE_ASK).lower()
         
         self.setup_ui()
-        self.center_window()
+        if host is None:
+            self.center_window()
+            self.offer_journal_recovery()
+            if not self.conversation_history:
+                self.offer_session_restore()
+        elif shared is None:
+            # タブ表示では最初のタブだけ、前回保存せずに終了した会話の復元を確認する
+            self.offer_journal_recovery()
+    
+    def init_shared_resources(self):
+        """クライアント・メディアストア・キャッシュ・データベースなど、タブ間で共有するものを作る"""
+        self.client = api_cassette.from_env(anthropic.Anthropic(api_key=self.api_key))
+        # 添付画像は内容ハッシュで管理するメディアストアに取り込む（保存先は.envのCLAUDE_TK_MEDIA_DIRで変更可）
+        self.media_store = media_store.MediaStore(
+            os.getenv("CLAUDE_TK_MEDIA_DIR") or media_store.DEFAULT_MEDIA_DIR
+        )
+        # サムネイルと送信用の画像データは内容ハッシュごとに保持し、どのタブで表示・送信しても作り直さない
+        self.image_cache = image_attachments.ImageCache(media_store.content_hash)
+        # .envのCLAUDE_TK_FILES_APIを設定すると、添付画像をFiles APIで1回だけアップロードしてファイルIDで参照する
+        self.file_uploader = None
+        if (os.getenv("CLAUDE_TK_FILES_API") or "").lower() in ("1", "true", "yes", "on"):
+            self.file_uploader = file_uploads.FileUploader(
+                self.client, os.path.join(self.media_store.root, file_uploads.FILE_MAP_NAME), self.api_key
+            )
+        # .envのCLAUDE_TK_RESPONSE_CACHEを設定すると、同じリクエストには保存してある回答を使う
+        self.response_cache = response_cache.from_env()
+        # .envのCLAUDE_TK_DBを設定すると、会話をSQLiteデータベースにも保存して全文検索できる
+        self.conversation_db = None
+        db_path = os.getenv("CLAUDE_TK_DB")
+        if db_path:
+            try:
+                self.conversation_db = conversation_db.ConversationDB(db_path, store=self.media_store)
+            except (OSError, sqlite3.Error) as e:
+                messagebox.showerror("エラー", f"会話データベースを開けませんでした:\n{str(e)}")
+        # .envのCLAUDE_TK_SIMILAR_QUESTIONS=ask/alwaysを設定すると、過去の似た質問（画像なし）には以前の回答を使う
+        # （索引はデータベースの質問と回答から別スレッドで作り、このアプリで受け取った回答も追加する）
+        self.similar_mode = (os.getenv("CLAUDE_TK_SIMILAR_QUESTIONS") or "").lower()
+        self.question_index = None
+        if self.similar_mode in (question_index.SIMILAR_ASK, question_index.SIMILAR_ALWAYS):
+            self.question_index = question_index.QuestionIndex(self.get_similar_threshold())
+            if self.conversation_db is not None:
+                threading.Thread(target=self.build_question_index, args=(self.conversation_db.path,), daemon=True).start()
     
+    def init_tab_resources(self):
+        """サムネイル・同じ画像の検出・見積もりなど、タブごとに持つものを作る"""
+        self.history_thumbnails = {}  # 履歴欄に表示中の画像ソースごとのPhotoImage（元のPIL画像は共有のimage_cache）
+        self.history_thumbnail_images = {}  # サムネイルのPIL画像（終了時のスナップショット用）
+        self.history_thumbnail_files = {}  # 復元したzipに同梱されたサムネイル（画像パス→サムネイルパス）
+        # 再保存・再圧縮しただけの同じ画像は1つにまとめる（似ているとみなす距離は.envのCLAUDE_TK_DEDUP_THRESHOLDで変更可）
+        self.image_deduplicator = image_attachments.ImageDeduplicator(
+            self.get_dedup_threshold()
+        )
+        # 送信前のトークン数・料金・待ち時間の見積もり（.envのCLAUDE_TK_COUNT_TOKENSを設定するとcount_tokens APIで確認する）
+        # 新しい見積もりは同じ見積もり係のまだ始まっていない見積もりを取り消すため、タブごとに持つ
+        count_tokens = None
+        if (os.getenv("CLAUDE_TK_COUNT_TOKENS") or "").lower() in ("1", "true", "yes", "on"):
+            if self.file_uploader is not None:
+                count_tokens = lambda **kwargs: self.client.beta.messages.count_tokens(betas=[file_uploads.FILES_API_BETA], **kwargs)
+            else:
+                count_tokens = lambda **kwargs: self.client.messages.count_tokens(**kwargs)
+        self.token_estimator = token_estimate.TokenEstimator(count_tokens)
+
+    def get_dedup_threshold(self):
+        """同じ画像の候補とみなす知覚ハッシュの距離を.envから取得"""
+        try:
+            return int(os.getenv("CLAUDE_TK_DEDUP_THRESHOLD", image_attachments.DEFAULT_DEDUP_THRESHOLD))
+        except (TypeError, ValueError):
+            return image_attachments.DEFAULT_DEDUP_THRESHOLD
+
+    def get_similar_threshold(self):
+        """似た質問とみなす類似度（0-1）を.envから取得"""
+        try:
+            return float(os.getenv("CLAUDE_TK_SIMILAR_THRESHOLD", question_index.DEFAULT_THRESHOLD))
+        except (TypeError, ValueError):
+            return question_index.DEFAULT_THRESHOLD
+
+    def build_question_index(self, db_path):
+        """データベースの質問と回答から似た質問の索引を作る（作業スレッドで実行、接続はこのスレッド用に開く）"""
+        try:
+            db = conversation_db.ConversationDB(db_path, store=self.media_store)
+            try:
+                pairs = db.question_answer_pairs()
+            finally:
+                db.close()
+            self.question_index.build(pairs)
+        except (OSError, sqlite3.Error) as e:
+            print(f"似た質問の索引を作成できませんでした: {e}")
+
+    def confirm_similar_answer(self, match):
+        """似た質問の回答を使うか確認する（alwaysなら確認しない）"""
+        if self.similar_mode == question_index.SIMILAR_ALWAYS:
+            return True
+        score, question, _answer = match
+        return messagebox.askyesno(
+            "似た質問",
+            f"以前の似た質問への回答があります（類似度 {score:.0%}）。\n\n{question[:200]}\n\n"
+            "この回答を使いますか？\n「いいえ」を選ぶとAPIに送信します。"
+        )
+
+    def offer_journal_recovery(self):
+        """前回保存せずに終了した会話があれば復元するか確認する"""
+        try:
+            sessions = conversation_journal.find_unsaved_sessions(self.journal_dir)
+        except OSError:
+            return
+        for path in sessions:
+            if not messagebox.askyesno(
+                "会話の復元",
+                f"保存されていない会話が見つかりました（{datetime.fromtimestamp(os.path.getmtime(path)).strftime('%Y-%m-%d %H:%M')}）。\n復元しますか？\n\n"
+                "「いいえ」を選ぶとこの会話は破棄されます。"
+            ):
+                os.remove(path)
+                continue
+            try:
+                history, _model, archives = conversation_journal.load_session(path)
+            except (OSError, ValueError, KeyError) as e:
+                messagebox.showerror("復元エラー", f"会話の復元に失敗しました:\n{str(e)}")
+                continue
+            self.conversation_history = history
+            if archives:
+                self._imported_archive = archives[0]
+            # 復元した会話は新しいジャーナルに引き継ぎ、元のジャーナルは削除する
+            self.journal.append_all(history, self.model)
+            os.remove(path)
+            self.update_history_display()
+            break
+
+    def offer_session_restore(self):
+        """前回終了時の会話のスナップショットがあれば、確認して（alwaysなら確認せずに）復元する"""
+        if self.session_restore == session_snapshot.RESTORE_NEVER or not os.path.exists(self.session_path):
+            return
+        try:
+            state, blobs = session_snapshot.read_snapshot(self.session_path)
+        except (OSError, ValueError, KeyError):
+            return  # 壊れたスナップショットは無視する
+        if self.session_restore != session_snapshot.RESTORE_ALWAYS:
+            turns = sum(1 for record in state["history"] if record["role"] == "user")
+            saved_at = datetime.fromisoformat(state["saved_at"]).strftime('%Y-%m-%d %H:%M')
+            if not messagebox.askyesno("前回の会話", f"前回終了時の会話（{turns}ターン、{saved_at}）を続けますか？"):
+                return
+        try:
+            history, archives = session_snapshot.load_history(state)
+            self.conversation_history = history
+            # 保存してあるAPI形式のメッセージをそのまま使う
+            self.request_builder.reset(history, state.get("api_messages"))
+            if archives:
+                self._imported_archive = archives[0]
+            self._last_json_zip_path = state.get("last_json_zip_path")
+            self._db_conversation_id = state.get("db_conversation_id")
+            self.restore_history_view(state["view"], blobs)
+        except Exception as e:
+            self.conversation_history = []
+            messagebox.showerror("復元エラー", f"前回の会話の復元に失敗しました:\n{str(e)}")
+            return
+        # 異常終了に備えてジャーナルにも記録する（画面の表示を待たせないよう後で行う）
+        self.root.after_idle(self.journal.append_all, history, self.model)
+
+    def capture_history_view(self):
+        """履歴欄の表示内容を(テキスト・タグ・画像の位置, サムネイルのPNGデータのリスト)として取り出す"""
+        positions = {}  # 画像ソース→(メッセージの番号, 画像の番号)
+        for m, msg in enumerate(self.conversation_history):
+            for k, source in enumerate(image_attachments.get_image_paths(msg)):
+                positions.setdefault(source, (m, k))
+        photo_sources = {str(photo): source for source, photo in self.history_thumbnails.items() if photo is not None}
+        segments = [""]
+        images = []
+        blobs = []
+        blob_ids = {}
+        for key, value, index in self.history_text.dump("1.0", "end-1c", text=True, image=True):
+            if key == "text":
+                segments[-1] += value
+                continue
+            source = photo_sources[str(self.history_text.image_cget(index, "image"))]
+            if source not in blob_ids:
+                out = io.BytesIO()
+                self.history_thumbnail_images[source].save(out, format="PNG")
+                blob_ids[source] = len(blobs)
+                blobs.append(out.getvalue())
+            m, k = positions[source]
+            images.append({"message": m, "image": k, "blob": blob_ids[source]})
+            segments.append("")
+        tags = {}
+        for tag in self.history_text.tag_names():
+            if tag == "sel" or tag.startswith("history_image_"):
+                continue
+            ranges = [str(index) for index in self.history_text.tag_ranges(tag)]
+            if ranges:
+                tags[tag] = ranges
+        return {"segments": segments, "tags": tags, "images": images}, blobs
+
+    def restore_history_view(self, view, blobs):
+        """capture_history_viewで取り出した内容を履歴欄に戻す（Markdownの変換やサムネイルの作成はしない）"""
+        self.history_text.config(state=tk.NORMAL)
+        self.history_text.delete("1.0", tk.END)
+        self.history_images.clear()
+        segments = view["segments"]
+        self.history_text.insert(tk.END, segments[0])
+        for n, (image, segment) in enumerate(zip(view["images"], segments[1:]), 1):
+            source = image_attachments.get_image_paths(self.conversation_history[image["message"]])[image["image"]]
+            if source not in self.history_thumbnails:
+                img = Image.open(io.BytesIO(blobs[image["blob"]]))
+                img.load()
+                self.history_thumbnail_images[source] = img
+                self.history_thumbnails[source] = ImageTk.PhotoImage(img)
+            photo = self.history_thumbnails[source]
+            self.history_images.append(photo)  # 参照保持
+            self.history_text.image_create(tk.END, image=photo)
+            image_tag = f"history_image_{n}"
+            self.history_text.tag_add(image_tag, "end-2c")
+            self.history_text.tag_bind(image_tag, "<Button-1>", lambda e, p=source: self.show_full_image(p))
+            self.history_text.insert(tk.END, segment)
+        for tag, ranges in view["tags"].items():
+            self.history_text.tag_add(tag, *ranges)
+        self.configure_history_tags()
+        self.history_text.see(tk.END)
+        self.history_text.config(state=tk.DISABLED)
+
+    def save_session_snapshot(self):
+        """表示中の会話をスナップショットに書き出す（会話がなければスナップショットを削除）
+
+        スナップショットが今の会話を表すようになったらTrueを返す。
+        """
+        if self.session_restore == session_snapshot.RESTORE_NEVER or self.history_loading():
+            return False
+        try:
+            if not self.conversation_history:
+                session_snapshot.remove_snapshot(self.session_path)
+                return True
+            view, blobs = self.capture_history_view()
+            state = session_snapshot.build_state(
+                self.conversation_history, self.model, view, self.media_store,
+                last_json_zip_path=self._last_json_zip_path,
+                db_conversation_id=self._db_conversation_id
+            )
+            session_snapshot.write_snapshot(self.session_path, state, blobs)
+            return True
+        except (OSError, ValueError, KeyError, tk.TclError) as e:
+            # 終了を妨げないよう、失敗しても表示だけにする
+            print(f"セッションのスナップショットを保存できませんでした: {e}")
+            return False
+
     def center_window(self):
         self.root.update_idletasks()
         width = self.root.winfo_width()
@@ -49,33 +356,16 @@ class ClaudeChatApp:
         self.root.geometry(f"{width}x{height}+{x}+{y}")
     
     def markdown_to_text(self, markdown_text):
-        html = markdown.markdown(markdown_text)
-        html = re.sub(r'<h[1-6]>(.*?)</h[1-6]>', r'\1\n', html, flags=re.DOTALL)
-        html = re.sub(r'<p>(.*?)</p>', r'\1\n\n', html, flags=re.DOTALL)
-        html = re.sub(r'<li>(.*?)</li>', r'• \1\n', html, flags=re.DOTALL)
-        html = re.sub(r'<pre><code>(.*?)</code></pre>', r'\1', html, flags=re.DOTALL)
-        html = re.sub(r'<code>(.*?)</code>', r'\1', html)
-        html = re.sub(r'<a[^>]*>(.*?)</a>', r'\1', html)
-        html = re.sub(r'<(strong|b)>(.*?)</(strong|b)>', r'\2', html)
-        html = re.sub(r'<(em|i)>(.*?)</(em|i)>', r'\2', html)
-        html = re.sub(r'<[^>]+>', '', html)
-        html = html.replace('&amp;', '&')
-        html = html.replace('&lt;', '<')
-        html = html.replace('&gt;', '>')
-        html = html.replace('&quot;', '"')
-        html = html.replace('&#39;', "'")
-        text = re.sub(r'\n\s*\n\s*\n', '\n\n', html)
-        text = re.sub(r'^[\-\*]\s+', '・', text, flags=re.MULTILINE)
-        return text.strip()
+        return markdown_plain.markdown_to_text(markdown_text)
 
     def setup_ui(self):
         # メインフレーム
-        main_frame = ttk.Frame(self.root, padding="10")
+        main_frame = ttk.Frame(self.container, padding="10")
         main_frame.grid(row=0, column=0, sticky=(tk.W, tk.E, tk.N, tk.S))
         
         # グリッドの重み設定
-        self.root.columnconfigure(0, weight=1)
-        self.root.rowconfigure(0, weight=1)
+        self.container.columnconfigure(0, weight=1)
+        self.container.rowconfigure(0, weight=1)
         main_frame.columnconfigure(0, weight=1)
         main_frame.columnconfigure(1, weight=1)
         main_frame.rowconfigure(0, weight=1)
@@ -90,13 +380,17 @@ class ClaudeChatApp:
         image_frame.grid(row=0, column=0, sticky=(tk.W, tk.E), pady=(0, 5))
         
         self.attach_image_button = ttk.Button(
-            image_frame, text="画像を選択", command=self.attach_image
+            image_frame, text="画像を追加", command=self.attach_image
         )
         self.attach_image_button.pack(side=tk.LEFT, padx=(0, 5))
         self.remove_image_button = ttk.Button(
-            image_frame, text="画像を削除", command=self.remove_image, state=tk.DISABLED
+            image_frame, text="画像をすべて削除", command=self.remove_image, state=tk.DISABLED
         )
         self.remove_image_button.pack(side=tk.LEFT)
+        self.paste_image_button = ttk.Button(
+            image_frame, text="貼り付け", command=self.paste_image
+        )
+        self.paste_image_button.pack(side=tk.LEFT, padx=(5, 0))
         self.image_label = ttk.Label(image_frame, text="画像が選択されていません")
         self.image_label.pack(side=tk.LEFT, padx=(10, 0))
         
@@ -104,7 +398,10 @@ class ClaudeChatApp:
         preview_frame = ttk.LabelFrame(question_frame, text="画像プレビュー", padding="5")
         preview_frame.grid(row=1, column=0, sticky=(tk.W, tk.E), pady=(0, 5))
         self.image_preview_label = ttk.Label(preview_frame, text="画像プレビュー", width=30)
-        self.image_preview_label.pack()
+        self.image_preview_label.pack(side=tk.LEFT)
+        # 複数画像のプレビューを横に並べるストリップ
+        self.image_preview_strip = ttk.Frame(preview_frame)
+        self.image_preview_strip.pack(side=tk.LEFT, fill=tk.X)
         
         # 質問テキストエリア
         self.question_text = scrolledtext.ScrolledText(
@@ -136,10 +433,24 @@ class ClaudeChatApp:
         # ボタンフレーム（下部）
         button_frame = ttk.Frame(main_frame)
         button_frame.grid(row=1, column=0, columnspan=2, pady=(10, 0), sticky=(tk.W, tk.E))
+        # ステータスバー（送信前の入力トークン数・料金・待ち時間の見積もり）
+        self.estimate_label = ttk.Label(main_frame, text="", anchor=tk.W, foreground="gray")
+        self.estimate_label.grid(row=2, column=0, columnspan=2, pady=(5, 0), sticky=(tk.W, tk.E))
         self.send_button = ttk.Button(
             button_frame, text="質問を送信する", command=self.send_question
         )
         self.send_button.pack(side=tk.LEFT, padx=(0, 10))
+        # 応答キャッシュ・似た質問の回答は、それぞれ次の1回だけ使わずに送信できる
+        if self.response_cache is not None:
+            self.bypass_cache_var = tk.BooleanVar(self.root, value=False)
+            ttk.Checkbutton(
+                button_frame, text="キャッシュを使わない", variable=self.bypass_cache_var
+            ).pack(side=tk.LEFT, padx=(0, 10))
+        if self.question_index is not None:
+            self.bypass_similar_var = tk.BooleanVar(self.root, value=False)
+            ttk.Checkbutton(
+                button_frame, text="似た質問の回答を使わない", variable=self.bypass_similar_var
+            ).pack(side=tk.LEFT, padx=(0, 10))
         self.clear_button = ttk.Button(
             button_frame, text="会話をクリア", command=self.clear_conversation
         )
@@ -148,144 +459,396 @@ class ClaudeChatApp:
             button_frame, text="会話を再開", command=self.resume_conversation
         )
         self.resume_button.pack(side=tk.LEFT, padx=(0, 10))
+        self.search_button = ttk.Button(
+            button_frame, text="会話を検索", command=self.open_search_dialog,
+            state=tk.NORMAL if self.conversation_db else tk.DISABLED
+        )
+        self.search_button.pack(side=tk.LEFT, padx=(0, 10))
         self.exit_button = ttk.Button(
             button_frame, text="終了する", command=self.exit_application
         )
         self.exit_button.pack(side=tk.LEFT)
         self.question_text.bind('<Control-Return>', lambda e: self.send_question() or "break")
+        # クリップボードに画像があれば画像として添付（なければ通常のテキスト貼り付け）
+        self.question_text.bind('<<Paste>>', self.paste_image)
+        self.question_text.bind('<KeyRelease>', self.schedule_estimate, add="+")
 
     def attach_image(self):
-        file_path = filedialog.askopenfilename(
-            title="画像ファイルを選択", filetypes=[("画像ファイル", "*.png;*.jpg;*.jpeg;*.bmp;*.gif"), ("すべてのファイル", "*.*")]
+        file_paths = filedialog.askopenfilenames(
+            title="画像ファイルを選択（複数選択可）", filetypes=[("画像ファイル", "*.png;*.jpg;*.jpeg;*.bmp;*.gif;*.webp"), ("すべてのファイル", "*.*")]
         )
-        if not file_path:
+        if not file_paths:
             return
-        self.attached_image_path = file_path
-        # プレビュー表示
+        self.add_images(list(file_paths))
+
+    def paste_image(self, event=None):
+        """クリップボードの画像を一時ファイルを作らずメモリ上のまま添付"""
+        self._clipboard_count += 1
+        name = f"clipboard_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{self._clipboard_count}.png"
+        content = image_attachments.grab_clipboard_image(name)
+        if content is None:
+            return None  # 画像がなければ通常の貼り付け処理に任せる
+        self.add_images(content if isinstance(content, list) else [content])
+        return "break"
+
+    def add_images(self, sources):
+        """画像ソース（パスまたはMemoryImage）を添付画像に追加"""
+        # ファイルはメディアストアに取り込み、元ファイルが移動・削除されても参照できるようにする
+        # 再保存・再圧縮しただけの同じ画像は既出の画像ソースに置き換え（置き換えたことは知らせる）、
+        # 内容（SHA-256）が同じ画像は同じ質問内で1回だけ添付する
+        originals = list(sources)
+        stored = self.media_store.add_sources(originals)
+        canonical = self.image_deduplicator.canonicalize(stored)
+        merged = [
+            image_attachments.image_name(original)
+            for original, source, existing in zip(originals, stored, canonical) if existing != source
+        ]
+        attached = {self.attachment_key(path) for path in self.attached_image_paths}
+        unique = {}
+        for source in canonical:
+            key = self.attachment_key(source)
+            if key not in attached:
+                unique.setdefault(key, source)
+        sources = list(unique.values())
+        # サムネイルは並列に作成し、PhotoImage化だけTkスレッドで行う
+        failed = []
+        for path, (img, error) in zip(sources, self.image_cache.thumbnails(sources, (90, 90))):
+            if error is not None:
+                failed.append(f"{image_attachments.image_name(path)}: {str(error)}")
+                continue
+            self.attached_image_paths.append(path)
+            self.attached_image_previews.append(ImageTk.PhotoImage(img))
+        if failed:
+            messagebox.showerror("画像エラー", "画像の読み込みに失敗しました:\n" + "\n".join(failed))
+        if merged:
+            messagebox.showinfo("同じ画像", "次の画像は添付済みの画像と同じため、1つにまとめました:\n" + "\n".join(merged))
+        self.update_image_preview()
+
+    def attachment_key(self, source):
+        """添付画像の重複を判定するキー（内容ハッシュ、読めなければ画像ソース自身）"""
         try:
-            img = Image.open(file_path)
-            img.thumbnail((180, 180))
-            self.attached_image_preview = ImageTk.PhotoImage(img)
-            self.image_preview_label.config(image=self.attached_image_preview, text="")
+            return media_store.content_hash(source)
+        except OSError:
+            return source
+
+    def update_image_preview(self):
+        """添付画像のプレビューストリップを更新"""
+        for child in self.image_preview_strip.winfo_children():
+            child.destroy()
+        for photo in self.attached_image_previews:
+            ttk.Label(self.image_preview_strip, image=photo).pack(side=tk.LEFT, padx=2)
+        count = len(self.attached_image_paths)
+        if count:
+            self.image_preview_label.config(image="", text="")
+            self.image_label.config(text=f"{count}枚の画像を選択中")
             self.remove_image_button.config(state=tk.NORMAL)
-        except Exception as e:
-            messagebox.showerror("画像エラー", f"画像の読み込みに失敗しました: {str(e)}")
-            self.attached_image_path = None
+        else:
             self.image_preview_label.config(image="", text="")
+            self.image_label.config(text="画像が選択されていません")
             self.remove_image_button.config(state=tk.DISABLED)
+        self.schedule_estimate()
 
     def remove_image(self):
-        self.attached_image_path = None
-        self.image_preview_label.config(image="", text="")
-        self.remove_image_button.config(state=tk.DISABLED)
+        self.attached_image_paths = []
+        self.attached_image_previews = []
+        self.update_image_preview()
 
     def update_history_display(self):
         self.history_text.config(state=tk.NORMAL)
         self.history_text.delete("1.0", tk.END)
         self.history_images.clear()  # 画像参照をクリア
+        # 未作成のサムネイルだけまとめて並列に作成（同じ画像ソースは1つのサムネイルを共有）
+        pending = list(dict.fromkeys(
+            image_path
+            for msg in self.conversation_history
+            for image_path in image_attachments.get_image_paths(msg)
+            if image_path not in self.history_thumbnails
+        ))
+        # zipに同梱されたサムネイルがあれば元画像の代わりにそれを読み込む
+        thumb_sources = [self.history_thumbnail_files.get(image_path, image_path) for image_path in pending]
+        for image_path, (img, error) in zip(pending, self.image_cache.thumbnails(thumb_sources, (200, 200))):
+            self.history_thumbnails[image_path] = ImageTk.PhotoImage(img) if error is None else None
+            if error is None:
+                self.history_thumbnail_images[image_path] = img
         pair_num = 0
         for msg in self.conversation_history:
             if msg["role"] == "user":
                 pair_num += 1
                 self.history_text.insert(tk.END, f"【質問 {pair_num}】\n", "user")
                 self.history_text.insert(tk.END, f"{msg['content']}\n", "user_content")
-                if msg.get("image_path"):
-                    try:
-                        img = Image.open(msg["image_path"])
-                        img.thumbnail((200, 200))
-                        photo = ImageTk.PhotoImage(img)
-                        self.history_images.append(photo)  # 参照保持
-                        self.history_text.image_create(tk.END, image=photo)
-                        self.history_text.insert(tk.END, "\n", "user_image")
-                    except Exception as e:
-                        self.history_text.insert(tk.END, f"[画像表示エラー: {os.path.basename(msg['image_path'])}]\n", "user_image")
+                for image_path in image_attachments.get_image_paths(msg):
+                    photo = self.history_thumbnails.get(image_path)
+                    if photo is None:
+                        self.history_text.insert(tk.END, f"[画像表示エラー: {image_attachments.image_name(image_path)}]\n", "user_image")
+                        continue
+                    self.history_images.append(photo)  # 参照保持
+                    self.history_text.image_create(tk.END, image=photo)
+                    # サムネイルをクリックすると元画像を表示
+                    image_tag = f"history_image_{len(self.history_images)}"
+                    self.history_text.tag_add(image_tag, "end-2c")
+                    self.history_text.tag_bind(image_tag, "<Button-1>", lambda e, p=image_path: self.show_full_image(p))
+                    self.history_text.insert(tk.END, "\n", "user_image")
                 self.history_text.insert(tk.END, "\n")
             else:
-                self.history_text.insert(tk.END, f"【回答 {pair_num}】\n", "assistant")
+                if msg.get("cached") or msg.get("reused_from"):
+                    self.history_text.insert(tk.END, f"【回答 {pair_num}】", "assistant")
+                    self.history_text.insert(tk.END, "（キャッシュ）\n" if msg.get("cached") else "（似た質問の回答）\n", "cached")
+                else:
+                    self.history_text.insert(tk.END, f"【回答 {pair_num}】\n", "assistant")
                 self.history_text.insert(tk.END, f"{msg['content']}\n\n", "assistant_content")
+        self.configure_history_tags()
+        self.history_text.see(tk.END)
+        self.history_text.config(state=tk.DISABLED)
+        self.schedule_estimate()
+
+    def schedule_estimate(self, event=None):
+        """入力が止まってから見積もりを更新する（キー入力のたびには計算しない）"""
+        if self._estimate_after is not None:
+            self.root.after_cancel(self._estimate_after)
+        self._estimate_after = self.root.after(ESTIMATE_DELAY_MS, self.start_estimate)
+
+    def start_estimate(self):
+        """入力中の質問・会話履歴・添付画像のトークン数・料金・待ち時間の見積もりを作業スレッドで始める"""
+        self._estimate_after = None
+        self._estimate_generation += 1
+        question = self.question_text.get("1.0", tk.END).strip()
+        self.request_builder.sync(self.conversation_history)
+        prefix_messages = list(self.request_builder.messages)
+        future = self.token_estimator.submit_local(
+            self.model, self.request_builder.prefix_key(), prefix_messages, question, list(self.attached_image_paths)
+        )
+        self.poll_estimate(self._estimate_generation, future, prefix_messages, question)
+
+    def poll_estimate(self, generation, future, prefix_messages=None, question=None):
+        """見積もりが終わったらステータスバーに表示する（prefix_messagesを渡すとAPIでの確認を続けて頼む）"""
+        if generation != self._estimate_generation or future.cancelled():
+            return
+        if not future.done():
+            self.root.after(ESTIMATE_POLL_MS, self.poll_estimate, generation, future, prefix_messages, question)
+            return
+        try:
+            estimate = future.result()
+        except Exception:
+            # APIでの確認に失敗した場合は手元の見積もりのまま
+            return
+        self.estimate_label.config(text=token_estimate.describe(estimate))
+        if prefix_messages is not None and self.token_estimator.count_tokens is not None and question:
+            self.poll_estimate(generation, self.token_estimator.submit_confirm(estimate, prefix_messages, question))
+
+    def configure_history_tags(self):
         self.history_text.tag_config("user", foreground="blue", font=("Arial", 9, "bold"))
         self.history_text.tag_config("user_content", foreground="black", font=("Arial", 9))
         self.history_text.tag_config("user_image", foreground="purple", font=("Arial", 8, "italic"))
         self.history_text.tag_config("assistant", foreground="green", font=("Arial", 9, "bold"))
         self.history_text.tag_config("assistant_content", foreground="black", font=("Arial", 9))
-        self.history_text.see(tk.END)
-        self.history_text.config(state=tk.DISABLED)
+        self.history_text.tag_config("cached", foreground="gray", font=("Arial", 8, "italic"))
+
+    def show_full_image(self, image_path):
+        """元画像を別ウィンドウで表示（元画像はこのとき初めて読み込む）"""
+        try:
+            img = image_attachments.open_image(image_path)
+            img.thumbnail((self.root.winfo_screenwidth() - 100, self.root.winfo_screenheight() - 100))
+            photo = ImageTk.PhotoImage(img)
+        except Exception as e:
+            messagebox.showerror("画像エラー", f"画像の読み込みに失敗しました: {str(e)}")
+            return
+        win = tk.Toplevel(self.root)
+        win.title(image_attachments.image_name(image_path))
+        label = ttk.Label(win, image=photo)
+        label.image = photo  # 参照保持
+        label.pack()
 
     def send_question(self):
         question = self.question_text.get("1.0", tk.END).strip()
         if not question:
             messagebox.showwarning("警告", "質問を入力してください。")
             return
+        if self._request_pending:
+            return
+        if self.history_loading():
+            messagebox.showinfo("読み込み中", "会話履歴を読み込んでいます。読み込みが終わってから送信してください。")
+            return
+        self._request_pending = True
         self.send_button.config(state=tk.DISABLED)
-        self.root.config(cursor="wait")
+        self.set_busy(True)
+        user_msg = None
         try:
             # 会話履歴に質問を追加
             user_msg = {"role": "user", "content": question}
-            if self.attached_image_path:
-                user_msg["image_path"] = self.attached_image_path
+            if self.attached_image_paths:
+                user_msg["image_paths"] = list(self.attached_image_paths)
             self.conversation_history.append(user_msg)
-            # APIリクエスト用メッセージリスト
-            messages = []
-            for i, msg in enumerate(self.conversation_history):
-                if msg["role"] == "user":
-                    # 最新のuserメッセージだけ画像付き
-                    if i == len(self.conversation_history) - 1 and msg.get("image_path"):
-                        with open(msg["image_path"], "rb") as f:
-                            img_bytes = f.read()
-                        img_b64 = base64.b64encode(img_bytes).decode("utf-8")
-                        mime_type = self.get_mime_type(msg["image_path"])
-                        messages.append({
-                            "role": "user",
-                            "content": [
-                                {"type": "image", "source": {"type": "base64", "media_type": mime_type, "data": img_b64}},
-                                {"type": "text", "text": msg["content"]}
-                            ]
-                        })
-                    else:
-                        # 過去のuserメッセージはテキストのみ
-                        messages.append({"role": "user", "content": msg["content"]})
-                else:
-                    messages.append({
-                        "role": "assistant",
-                        "content": msg.get("markdown", msg["content"])
-                    })
-            # APIリクエスト
-            message = self.client.messages.create(
-                model=self.model,
-                max_tokens=1000,
+            self.journal.append(user_msg, self.model)
+            image_paths = image_attachments.get_image_paths(user_msg)
+            # 同じモデル・過去の会話・質問・画像（内容ハッシュ）・パラメータなら保存してある回答を使う
+            answer = None
+            cache_key = None
+            if self.response_cache is not None:
+                self.request_builder.sync(self.conversation_history, len(self.conversation_history) - 1)
+                cache_key = response_cache.request_key(
+                    self.model, self.request_builder.prefix_key(),
+                    {"content": question, "images": [media_store.content_hash(source) for source in image_paths]},
+                    max_tokens=output_limits.max_tokens_for(self.model)
+                )
+                if not self.bypass_cache_var.get():
+                    answer = self.response_cache.get(cache_key)
+            if answer is not None:
+                self.finish_question(user_msg, answer, cached=True)
+                return
+            # 会話の最初の質問（画像なし）なら、似た質問への以前の回答を使う
+            # （続きの質問は前の会話によって意味が変わるため、索引にも登録せず検索もしない）
+            similar_question = self.question_index is not None and not image_paths and len(self.conversation_history) == 1
+            if similar_question and not self.bypass_similar_var.get():
+                match = self.question_index.find_similar(question)
+                if match is not None and self.confirm_similar_answer(match):
+                    self.finish_question(user_msg, match[2], reused_from=match[1])
+                    return
+            # APIリクエスト用メッセージリスト（過去のメッセージはテキストのみで、前回までの分を再利用）
+            # Files APIを使う場合は、過去の質問の画像もファイルIDで含める
+            messages = self.request_builder.build(self.conversation_history)
+            model = self.model
+            # Files APIへのアップロードはキャッシュ・似た質問で回答が見つからなかったときだけ、作業スレッドで行う
+            upload = self.file_uploader is not None and bool(image_paths)
+            self.run_request(
+                lambda: self.request_answer(model, messages, image_paths, question, user_msg if upload else None),
+                lambda answer: self.finish_question(user_msg, answer, cache_key=cache_key, from_api=True, index_question=similar_question, uploaded=upload),
+                lambda error: self.fail_question(user_msg, error)
+            )
+        except Exception as e:
+            self.fail_question(user_msg, e)
+
+    def request_answer(self, model, messages, image_paths, question, upload_msg=None):
+        """APIに質問を送って回答を返す（タブ表示では作業スレッドで実行する）
+
+        upload_msgを渡すと画像をFiles APIでアップロードし、そのメッセージにファイルIDを残す
+        （以降の送信でもIDで画像を参照する）。
+        """
+        if upload_msg is not None:
+            upload_msg["file_ids"] = self.file_uploader.upload_all(image_paths)
+            messages = messages[:-1] + [request_builder.api_message(upload_msg, file_ids=True)]
+        if image_paths and self.file_uploader is None:
+            # 最新のuserメッセージだけ画像付き（複数画像は並列にエンコードし、送信済みの画像は共有キャッシュを使う）
+            image_blocks = self.image_cache.encode(image_paths)
+            messages = messages[:-1] + [{"role": "user", "content": image_blocks + [{"type": "text", "text": question}]}]
+        # APIリクエスト
+        if self.file_uploader is not None:
+            answer, _ = output_limits.create_with_continuation(
+                self.client.beta.messages.create,
+                model=model,
+                messages=messages,
+                betas=[file_uploads.FILES_API_BETA]
+            )
+        else:
+            answer, _ = output_limits.create_with_continuation(
+                self.client.messages.create,
+                model=model,
                 messages=messages
             )
-            answer = message.content[0].text
+        return answer
+
+    def run_request(self, request, done, failed):
+        """request()の結果をdone、例外をfailedに渡す
+
+        ウィンドウ1つのときはその場で実行する。タブ表示では共有の作業スレッドで実行し、
+        待っている間も他のタブは操作・送信できる（結果は画面のスレッドで受け取る）。
+        """
+        if self.host is None:
+            try:
+                answer = request()
+            except Exception as e:
+                failed(e)
+                return
+            done(answer)
+            return
+        future = self.host.executor.submit(request)
+        self.root.after(REQUEST_POLL_MS, self.poll_request, future, done, failed)
+
+    def poll_request(self, future, done, failed):
+        if not future.done():
+            self.root.after(REQUEST_POLL_MS, self.poll_request, future, done, failed)
+            return
+        try:
+            answer = future.result()
+        except Exception as e:
+            failed(e)
+            return
+        done(answer)
+
+    def finish_question(self, user_msg, answer, cache_key=None, cached=False, reused_from=None, from_api=False, index_question=False, uploaded=False):
+        """回答を会話履歴に追加して表示する（index_questionなら似た質問の索引にも登録する）
+
+        uploadedなら、送信時にアップロードした画像のファイルIDもジャーナルに記録する。
+        """
+        try:
+            self.end_request()
+            if from_api:
+                if cache_key is not None:
+                    self.response_cache.put(cache_key, answer, self.model)
+                if index_question:
+                    self.question_index.add(user_msg["content"], answer)
+            # 待っている間に会話をクリア・再開した場合は回答を捨てる
+            if not self.conversation_history or self.conversation_history[-1] is not user_msg:
+                return
+            if uploaded:
+                self.journal.set_file_ids(user_msg["file_ids"])
             plain_text = self.markdown_to_text(answer)
-            self.conversation_history.append({"role": "assistant", "content": plain_text, "markdown": answer})
+            assistant_msg = {"role": "assistant", "content": plain_text, "markdown": answer}
+            # 履歴欄に「キャッシュ」「似た質問の回答」と表示する
+            if cached:
+                assistant_msg["cached"] = True
+            elif reused_from is not None:
+                assistant_msg["reused_from"] = reused_from
+            self.conversation_history.append(assistant_msg)
+            self.journal.append(assistant_msg, self.model)
             self.update_history_display()
             self.question_text.delete("1.0", tk.END)
             self.remove_image()
+            for var in (self.bypass_cache_var, self.bypass_similar_var):
+                if var is not None:
+                    var.set(False)
         except Exception as e:
-            messagebox.showerror("エラー", f"通信エラー: {str(e)}")
-            if self.conversation_history and self.conversation_history[-1]["role"] == "user":
-                self.conversation_history.pop()
-        finally:
-            self.send_button.config(state=tk.NORMAL)
-            self.root.config(cursor="")
+            self.fail_question(user_msg, e)
+
+    def fail_question(self, user_msg, error):
+        self.end_request()
+        messagebox.showerror("エラー", f"通信エラー: {str(error)}")
+        if user_msg is not None and self.conversation_history and self.conversation_history[-1] is user_msg:
+            self.conversation_history.pop()
+            self.journal.pop()
+
+    def end_request(self):
+        self._request_pending = False
+        self.send_button.config(state=tk.NORMAL)
+        self.set_busy(False)
+
+    def set_busy(self, busy):
+        """回答待ちの表示（ウィンドウ1つのときはカーソル、タブ表示では質問欄とタブ名）"""
+        if self.host is None:
+            self.root.config(cursor="wait" if busy else "")
+            return
+        self.question_text.config(state=tk.DISABLED if busy else tk.NORMAL)
+        self.host.set_busy(self, busy)
 
     def get_mime_type(self, path):
-        ext = os.path.splitext(path)[1].lower()
-        if ext in [".jpg", ".jpeg"]:
-            return "image/jpeg"
-        elif ext == ".png":
-            return "image/png"
-        elif ext == ".bmp":
-            return "image/bmp"
-        elif ext == ".gif":
-            return "image/gif"
-        return "application/octet-stream"
+        return image_attachments.get_mime_type(path)
 
     def clear_conversation(self):
         if not self.prompt_save_conversation("会話クリア"):
             return
         if messagebox.askyesno("確認", "会話履歴をクリアしますか？"):
+            self._history_loader = None
             self.conversation_history = []
+            self.request_builder.reset()
+            self.history_thumbnails = {}
+            self.history_thumbnail_images = {}
+            self.history_thumbnail_files = {}
+            self.image_deduplicator.clear()
+            if self._imported_archive is not None:
+                self._imported_archive.close()
+                self._imported_archive = None
+            self._last_json_zip_path = None
+            self._db_conversation_id = None
+            self.journal.reset()
             self.update_history_display()
             self.question_text.delete("1.0", tk.END)
             self.history_text.config(state=tk.NORMAL)
@@ -296,129 +859,129 @@ class ClaudeChatApp:
     def save_conversation_history(self):
         if not self.conversation_history:
             return False
+        if self.history_loading():
+            messagebox.showinfo("読み込み中", "会話履歴を読み込んでいます。読み込みが終わってから保存してください。")
+            return False
         save_type = self.ask_save_format()
         if save_type is None:
             return False
+        if save_type == "db":
+            return self.save_to_database(show_message=True)
+        if save_type == "ctk":
+            return self.save_container()
+        if save_type == "zip":
+            save_type = "json"  # 「ZIP形式」はJSON＋画像のzip
         timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
         default_json = f"claude_conversation_{timestamp}.json"
-        default_md = f"claude_conversation_{timestamp}.md"
         default_json_zip = f"claude_conversation_{timestamp}_json.zip"
         default_md_zip = f"claude_conversation_{timestamp}_md.zip"
-        result = True
+        json_zip_path = None
+        md_zip_path = None
         if save_type in ("json", "both"):
-            file_path = filedialog.asksaveasfilename(
+            # 前回と同じzipを既定にする（既存の会話zipへの保存は追記になる）
+            last_path = self._last_json_zip_path
+            json_zip_path = filedialog.asksaveasfilename(
                 title="会話履歴をZIPで保存",
                 defaultextension=".zip",
                 filetypes=[("ZIP files", "*.zip"), ("All files", "*.*")],
-                initialfile=default_json_zip
+                initialfile=os.path.basename(last_path) if last_path else default_json_zip,
+                initialdir=os.path.dirname(last_path) if last_path else None
             )
-            if file_path:
-                try:
-                    with tempfile.TemporaryDirectory() as tmpdir:
-                        img_dir = os.path.join(tmpdir, "img")
-                        os.makedirs(img_dir, exist_ok=True)
-                        # JSONデータ作成
-                        save_data = {
-                            "metadata": {
-                                "created_at": datetime.now().isoformat(),
-                                "model": self.model,
-                                "total_messages": len(self.conversation_history)
-                            },
-                            "conversation": []
-                        }
-                        for msg in self.conversation_history:
-                            if msg["role"] == "user" and msg.get("image_path"):
-                                img_filename = os.path.basename(msg["image_path"])
-                                img_dst = os.path.join(img_dir, img_filename)
-                                shutil.copy2(msg["image_path"], img_dst)
-                                msg_copy = dict(msg)
-                                msg_copy["image_path"] = f"img/{img_filename}"
-                                save_data["conversation"].append(msg_copy)
-                            elif msg["role"] == "assistant":
-                                save_data["conversation"].append({
-                                    "role": "assistant",
-                                    "content": msg.get("markdown", msg["content"])
-                                })
-                            else:
-                                save_data["conversation"].append(dict(msg))
-                        json_path = os.path.join(tmpdir, default_json)
-                        with open(json_path, 'w', encoding='utf-8') as f:
-                            json.dump(save_data, f, ensure_ascii=False, indent=2)
-                        # zip作成
-                        with zipfile.ZipFile(file_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
-                            zipf.write(json_path, arcname=default_json)
-                            for root, _, files in os.walk(img_dir):
-                                for fname in files:
-                                    fpath = os.path.join(root, fname)
-                                    arcname = os.path.relpath(fpath, tmpdir)
-                                    zipf.write(fpath, arcname=arcname)
-                except Exception as e:
-                    messagebox.showerror("保存エラー", f"ZIP保存に失敗しました:\n{str(e)}")
-                    result = False
-            elif save_type == "json":
+            if not json_zip_path and save_type == "json":
                 return False
         if save_type in ("markdown", "both"):
-            file_path = filedialog.asksaveasfilename(
+            md_zip_path = filedialog.asksaveasfilename(
                 title="会話履歴をMarkdown ZIPで保存",
                 defaultextension=".zip",
                 filetypes=[("ZIP files", "*.zip"), ("All files", "*.*")],
                 initialfile=default_md_zip
             )
-            if file_path:
-                try:
-                    with tempfile.TemporaryDirectory() as tmpdir:
-                        md_name = os.path.splitext(os.path.basename(file_path))[0] + ".md"
-                        md_path = os.path.join(tmpdir, md_name)
-                        img_dir = os.path.join(tmpdir, "img")
-                        os.makedirs(img_dir, exist_ok=True)
-                        md_lines = []
-                        pair_num = 0
-                        for msg in self.conversation_history:
-                            if msg["role"] == "user":
-                                pair_num += 1
-                                md_lines.append(f"## 質問{pair_num}\n{msg['content']}")
-                                if msg.get("image_path"):
-                                    img_filename = os.path.basename(msg["image_path"])
-                                    img_dst = os.path.join(img_dir, img_filename)
-                                    try:
-                                        if not os.path.exists(img_dst):
-                                            shutil.copy2(msg["image_path"], img_dst)
-                                        md_lines.append(f"![添付画像](img/{img_filename})")
-                                    except Exception as e:
-                                        md_lines.append(f"[画像保存エラー: {img_filename}]")
-                            else:
-                                md = msg.get("markdown", msg["content"])
-                                md_lines.append(f"## 回答{pair_num}\n{md}")
-                        with open(md_path, 'w', encoding='utf-8') as f:
-                            f.write('\n'.join(md_lines))
-                        # zip化
-                        with zipfile.ZipFile(file_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
-                            zipf.write(md_path, arcname=md_name)
-                            for root, _, files in os.walk(img_dir):
-                                for fname in files:
-                                    fpath = os.path.join(root, fname)
-                                    arcname = os.path.relpath(fpath, tmpdir)
-                                    zipf.write(fpath, arcname=arcname)
-                except Exception as e:
-                    messagebox.showerror("保存エラー", f"Markdown ZIP保存に失敗しました:\n{str(e)}")
-                    result = False
-            elif save_type == "markdown":
+            if not md_zip_path and save_type == "markdown":
                 return False
-        if result:
-            messagebox.showinfo("保存完了", "会話履歴を保存しました。")
-        return result
+        if not json_zip_path and not md_zip_path:
+            return False
+        history = list(self.conversation_history)
+        try:
+            # 一時ディレクトリを使わずzipへ直接書き込む（両方保存時も画像の読み込みは1回）
+            compact_error = self.run_background_job("会話履歴を保存しています", lambda progress: conversation_archive.export_conversation(
+                history,
+                self.model,
+                json_zip_path=json_zip_path or None,
+                md_zip_path=md_zip_path or None,
+                json_name=default_json,
+                progress=progress
+            ))
+        except conversation_archive.ArchiveCancelled:
+            messagebox.showinfo("保存中止", "会話履歴の保存を中止しました。")
+            return False
+        except Exception as e:
+            messagebox.showerror("保存エラー", f"ZIP保存に失敗しました:\n{str(e)}")
+            return False
+        if compact_error is not None:
+            messagebox.showwarning("保存", f"会話履歴は保存しましたが、ZIPの詰め直しに失敗しました（次回の保存で再試行します）:\n{compact_error}")
+        if json_zip_path:
+            self._last_json_zip_path = json_zip_path
+        return self.finish_save()
+
+    def save_container(self):
+        """会話履歴をコンパクト形式（.ctk）で保存する"""
+        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        file_path = filedialog.asksaveasfilename(
+            title="会話履歴をコンパクト形式で保存",
+            defaultextension=conversation_container.CONTAINER_EXTENSION,
+            filetypes=[("Claude TK files", "*.ctk"), ("All files", "*.*")],
+            initialfile=f"claude_conversation_{timestamp}.ctk"
+        )
+        if not file_path:
+            return False
+        history = list(self.conversation_history)
+        try:
+            self.run_background_job("会話履歴を保存しています", lambda progress: conversation_container.write_container(
+                history, self.model, file_path, progress=progress
+            ))
+        except conversation_archive.ArchiveCancelled:
+            messagebox.showinfo("保存中止", "会話履歴の保存を中止しました。")
+            return False
+        except Exception as e:
+            messagebox.showerror("保存エラー", f"コンパクト形式での保存に失敗しました:\n{str(e)}")
+            return False
+        return self.finish_save()
+
+    def finish_save(self):
+        """ファイル保存後の共通処理"""
+        # データベースが有効ならファイルと一緒に保存する
+        if self.conversation_db and not self.save_to_database():
+            return False
+        self.journal.mark_saved()
+        messagebox.showinfo("保存完了", "会話履歴を保存しました。")
+        return True
+
+    def save_to_database(self, show_message=False):
+        """会話をデータベースに保存する（同じ会話は増えたメッセージだけを追加）"""
+        try:
+            self._db_conversation_id = self.conversation_db.save_conversation(
+                self.conversation_history, self.model, self._db_conversation_id
+            )
+        except (OSError, sqlite3.Error) as e:
+            messagebox.showerror("保存エラー", f"データベースへの保存に失敗しました:\n{str(e)}")
+            return False
+        if show_message:
+            self.journal.mark_saved()
+            messagebox.showinfo("保存完了", "会話履歴をデータベースに保存しました。")
+        return True
 
     def ask_save_format(self):
         win = tk.Toplevel(self.root)
         win.title("保存形式の選択")
         win.grab_set()
-        win.geometry("320x160")
+        height = 185 + (25 if self.conversation_db else 0)
+        win.geometry(f"320x{height}")
         win.update_idletasks()
         w = win.winfo_width()
         h = win.winfo_height()
         x = (win.winfo_screenwidth() // 2) - (w // 2)
         y = (win.winfo_screenheight() // 2) - (h // 2)
-        win.geometry(f"320x160+{x}+{y}")
+        win.geometry(f"320x{height}+{x}+{y}")
         label = ttk.Label(win, text="会話履歴の保存形式を選択してください:")
         label.pack(pady=10)
         var = tk.StringVar(value="markdown")
@@ -428,6 +991,9 @@ class ClaudeChatApp:
         rb1.pack(anchor=tk.W, padx=30)
         rb2.pack(anchor=tk.W, padx=30)
         rb3.pack(anchor=tk.W, padx=30)
+        ttk.Radiobutton(win, text="コンパクト形式（.ctk）で保存", variable=var, value="ctk").pack(anchor=tk.W, padx=30)
+        if self.conversation_db:
+            ttk.Radiobutton(win, text="データベースにのみ保存", variable=var, value="db").pack(anchor=tk.W, padx=30)
         result = {"value": None}
         def ok():
             result["value"] = var.get()
@@ -443,7 +1009,8 @@ class ClaudeChatApp:
         return result["value"]
 
     def prompt_save_conversation(self, action_name):
-        if not self.conversation_history:
+        if not self.conversation_history or self.history_loading():
+            # 読み込み中の会話は再開したファイルに保存済みで、読み込みが終わるまで増えない
             return True
         result = messagebox.askyesnocancel(
             "会話履歴の保存",
@@ -460,67 +1027,323 @@ class ClaudeChatApp:
             return True
 
     def exit_application(self):
+        if self.host is not None:
+            # タブ表示ではすべてのタブを確認してから終了する
+            self.host.exit_application()
+            return
         if not self.prompt_save_conversation("終了"):
             return
+        self.wait_for_background_jobs()
+        self.save_session_snapshot()
+        # 保存した、または保存しないことを選んだ会話のジャーナルは不要
+        self.journal.discard()
+        self.token_estimator.shutdown()
         self.root.destroy()
 
+    def close_window(self):
+        """ウィンドウの閉じるボタン（保存・読み込み中なら完了してから閉じる）"""
+        if self.host is not None:
+            self.host.close_window()
+            return
+        if self._background_jobs:
+            self._close_requested = True
+            return
+        if self.save_session_snapshot():
+            # 次回はスナップショットから復元するため、ジャーナルからの復元は不要
+            self.journal.discard()
+        self.token_estimator.shutdown()
+        self.root.destroy()
+
+    def run_background_job(self, title, job):
+        """job(progress)を別スレッドで実行し、終わるまで待つ（jobの戻り値を返し、例外はそのまま送出）
+
+        PROGRESS_DIALOG_DELAY秒で終わらない場合は進捗ダイアログを表示し、その間も画面は応答する。
+        """
+        progress = conversation_archive.ArchiveProgress()
+        result = {}
+
+        def worker():
+            try:
+                result["value"] = job(progress)
+            except BaseException as e:
+                result["error"] = e
+
+        # アプリの終了で書き込みが途中で打ち切られないよう、デーモンスレッドにはしない
+        thread = threading.Thread(target=worker, name=title)
+        self._background_jobs.append(thread)
+        thread.start()
+        try:
+            thread.join(PROGRESS_DIALOG_DELAY)
+            if thread.is_alive():
+                self.show_progress_dialog(title, progress, thread)
+        finally:
+            thread.join()
+            self._background_jobs.remove(thread)
+            if self._close_requested and not self._background_jobs:
+                self.root.after_idle(self.close_window)
+        if "error" in result:
+            raise result["error"]
+        return result.get("value")
+
+    def show_progress_dialog(self, title, progress, thread):
+        """threadが終わるまで進捗（件数・バイト数）と中止ボタンを表示する"""
+        win = tk.Toplevel(self.root)
+        win.title(title)
+        win.transient(self.root)
+        win.resizable(False, False)
+        ttk.Label(win, text=title).pack(padx=20, pady=(15, 5))
+        bar = ttk.Progressbar(win, length=300, mode="determinate")
+        bar.pack(padx=20)
+        status = ttk.Label(win, text="")
+        status.pack(pady=5)
+
+        def cancel():
+            progress.cancel()
+            cancel_button.config(state=tk.DISABLED)
+            status.config(text="中止しています...")
+
+        cancel_button = ttk.Button(win, text="中止", command=cancel)
+        cancel_button.pack(pady=(0, 15))
+        win.protocol("WM_DELETE_WINDOW", cancel)
+        win.grab_set()
+        try:
+            while thread.is_alive():
+                if not progress.cancelled:
+                    if progress.total_bytes:
+                        bar.config(maximum=progress.total_bytes, value=progress.done_bytes)
+                    else:
+                        bar.config(maximum=max(progress.total_files, 1), value=progress.done_files)
+                    status.config(text=progress.describe())
+                win.update()
+                thread.join(0.05)
+        finally:
+            win.grab_release()
+            win.destroy()
+
+    def wait_for_background_jobs(self):
+        """実行中の保存・読み込みが終わるまで待つ"""
+        for thread in list(self._background_jobs):
+            while thread.is_alive():
+                self.root.update()
+                thread.join(0.05)
+
+    def convert_archive_message(self, msg, resolve_image):
+        """保存ファイルのメッセージを会話履歴のメッセージに変換する（画像はresolve_imageで画像ソースにする）"""
+        if not isinstance(msg, dict) or "role" not in msg or "content" not in msg:
+            raise ValueError("不正な会話履歴ファイルです（メッセージ形式エラー）")
+        if msg["role"] == "assistant":
+            return {
+                "role": "assistant",
+                "content": self.markdown_to_text(msg.get("content", "")),
+                "markdown": msg.get("content", "")
+            }
+        user_msg = {"role": "user", "content": msg["content"]}
+        image_paths = image_attachments.get_image_paths(msg)
+        if image_paths:
+            # zip内の画像を参照する（旧形式のimage_pathも受け付ける）
+            user_msg["image_paths"] = [resolve_image(img_rel) for img_rel in image_paths]
+            if self.file_uploader is not None:
+                # 以前にアップロードした画像はファイルIDで参照する（ここではアップロードしない）
+                file_ids = self.file_uploader.known_ids(user_msg["image_paths"])
+                if file_ids:
+                    user_msg["file_ids"] = file_ids
+        return user_msg
+
+    def load_archive(self, file_path, is_container, progress):
+        """保存ファイルを開いて会話履歴に変換し、(開いたままの保存ファイル, 会話履歴, 会話履歴の先頭の位置)を返す
+
+        .ctkは最新のRESUME_INITIAL_TURNSターンだけを読み込み、それより前のメッセージ（先頭の位置まで）は
+        表示してからload_earlier_messagesで読み込む。zipは全体を読み込む（位置は0）。
+        """
+        # zipは展開せず、JSONだけを読み込む（画像は表示・送信時にzipから読み込む）
+        # コンパクト形式は必要なメッセージだけをシークして読み込む（画像はインデックスから必要時に読み込む）
+        if is_container:
+            archive = conversation_container.ContainerReader(file_path)
+        else:
+            archive = conversation_archive.ArchiveReader(file_path)
+        try:
+            if is_container:
+                conversation = archive.last_turns(RESUME_INITIAL_TURNS)
+                start = len(archive) - len(conversation)
+                resolve_image = lambda image: image  # 読み込んだ時点で画像ソースになっている
+            else:
+                data = archive.load_json()
+                conversation = data.get("conversation", data)
+                if not isinstance(conversation, list):
+                    raise ValueError("不正な会話履歴ファイルです（conversationがリストではありません）")
+                start = 0
+                resolve_image = archive.image
+            progress.start(len(conversation))
+            new_history = []
+            for msg in conversation:
+                new_history.append(self.convert_archive_message(msg, resolve_image))
+                progress.advance()
+        except Exception:
+            archive.close()
+            raise
+        return archive, new_history, start
+
+    def load_earlier_messages(self, archive, stop):
+        """再開した.ctkの先頭からstopまでのメッセージを、画面を止めないようRESUME_CHUNK_MESSAGES件ずつ読み込む
+
+        揃ったら会話履歴の先頭に加えて表示し直し、ジャーナルに記録する。
+        途中で会話をクリア・切り替えた場合は読み込みをやめる。
+        """
+        loader = object()
+        self._history_loader = loader
+        earlier = []
+
+        def step():
+            if self._history_loader is not loader:
+                return
+            try:
+                for msg in archive.messages(len(earlier), min(len(earlier) + RESUME_CHUNK_MESSAGES, stop)):
+                    earlier.append(self.convert_archive_message(msg, lambda image: image))
+            except Exception as e:
+                self._history_loader = None
+                self.journal.append_all(self.conversation_history, self.model)
+                messagebox.showerror("インポートエラー", f"会話履歴の読み込みに失敗しました（最新の{RESUME_INITIAL_TURNS}ターンだけを再開しました）:\n{str(e)}")
+                return
+            if len(earlier) < stop:
+                self.root.after_idle(step)
+                return
+            self._history_loader = None
+            self.conversation_history[:0] = earlier
+            self.request_builder.reset()
+            self.journal.append_all(self.conversation_history, self.model)
+            self.update_history_display()
+
+        self.root.after_idle(step)
+
+    def history_loading(self):
+        """再開した会話の残りを読み込んでいる間はTrue（送信・保存すると途中までの会話になる）"""
+        return self._history_loader is not None
+
     def resume_conversation(self):
         file_path = filedialog.askopenfilename(
-            title="会話履歴ファイル（ZIP）を選択してください",
+            title="会話履歴ファイル（ZIP / .ctk）を選択してください",
             defaultextension=".zip",
-            filetypes=[("ZIP files", "*.zip"), ("All files", "*.*")]
+            filetypes=[("ZIP files", "*.zip"), ("Claude TK files", "*.ctk"), ("All files", "*.*")]
         )
         if not file_path:
             return
+        is_container = file_path.lower().endswith(conversation_container.CONTAINER_EXTENSION)
         try:
-            with zipfile.ZipFile(file_path, 'r') as zipf:
-                # 既存の一時ディレクトリがあればクリーンアップ
-                if self._imported_tempdir is not None:
-                    self._imported_tempdir.cleanup()
-                self._imported_tempdir = tempfile.TemporaryDirectory()
-                tmpdir_name = self._imported_tempdir.name
-                zipf.extractall(tmpdir_name)
-                # JSONファイル名を自動検出
-                json_name = None
-                for name in zipf.namelist():
-                    if name.endswith('.json') and not name.startswith('img/'):
-                        json_name = name
-                        break
-                if not json_name:
-                    raise ValueError("ZIP内にJSONファイルが見つかりません")
-                json_path = os.path.join(tmpdir_name, json_name)
-                with open(json_path, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                conversation = data.get("conversation", data)
-                if not isinstance(conversation, list):
-                    raise ValueError("不正な会話履歴ファイルです（conversationがリストではありません）")
-                new_history = []
-                for msg in conversation:
-                    if not isinstance(msg, dict) or "role" not in msg or "content" not in msg:
-                        raise ValueError("不正な会話履歴ファイルです（メッセージ形式エラー）")
-                    if msg["role"] == "assistant":
-                        new_history.append({
-                            "role": "assistant",
-                            "content": self.markdown_to_text(msg.get("content", "")),
-                            "markdown": msg.get("content", "")
-                        })
-                    else:
-                        user_msg = {"role": "user", "content": msg["content"]}
-                        if "image_path" in msg:
-                            # img/パスを絶対パスに変換
-                            img_rel = msg["image_path"]
-                            img_abs = os.path.join(tmpdir_name, img_rel)
-                            user_msg["image_path"] = img_abs
-                        new_history.append(user_msg)
-                self.conversation_history = new_history
-                self.update_history_display()
-                messagebox.showinfo("インポート完了", "会話履歴を再開しました。")
+            # 読み込みと変換は別スレッドで行う（中止した場合は何も変更しない）
+            archive, new_history, start = self.run_background_job(
+                "会話履歴を読み込んでいます", lambda progress: self.load_archive(file_path, is_container, progress)
+            )
+        except conversation_archive.ArchiveCancelled:
+            return
+        except Exception as e:
+            messagebox.showerror("インポートエラー", f"会話履歴のインポートに失敗しました:\n{str(e)}")
+            return
+        try:
+            self._history_loader = None
+            if self._imported_archive is not None:
+                self._imported_archive.close()
+            self._imported_archive = archive
+            self._last_json_zip_path = None if is_container else file_path
+            self._db_conversation_id = None
+            self.conversation_history = new_history
+            self.request_builder.reset()
+            self.history_thumbnails = {}
+            self.history_thumbnail_images = {}
+            # 同梱サムネイルがあれば表示に使う（古いzipでは元画像から作成）
+            self.history_thumbnail_files = archive.thumbnail_sources()
+            self.image_deduplicator.clear()
+            self.journal.reset()
+            if start:
+                # 最新のターンを先に表示し、それより前のメッセージは後から読み込む（ジャーナルには揃ってから記録する）
+                self.load_earlier_messages(archive, start)
+            else:
+                self.journal.append_all(new_history, self.model)
+            self.update_history_display()
+            messagebox.showinfo("インポート完了", "会話履歴を再開しました。")
         except Exception as e:
             messagebox.showerror("インポートエラー", f"会話履歴のインポートに失敗しました:\n{str(e)}")
 
+    def open_search_dialog(self):
+        """データベースの会話を全文検索するダイアログ"""
+        if not self.conversation_db:
+            messagebox.showinfo("会話の検索", "検索するには.envのCLAUDE_TK_DBにデータベースのパスを設定してください。")
+            return
+        win = tk.Toplevel(self.root)
+        win.title("会話の検索")
+        win.geometry("600x400")
+        entry_frame = ttk.Frame(win, padding="5")
+        entry_frame.pack(fill=tk.X)
+        query_var = tk.StringVar()
+        entry = ttk.Entry(entry_frame, textvariable=query_var)
+        entry.pack(side=tk.LEFT, fill=tk.X, expand=True, padx=(0, 5))
+        results = tk.Listbox(win, font=("Arial", 9))
+        results.pack(fill=tk.BOTH, expand=True, padx=5, pady=(0, 5))
+        hits = []
+
+        def search(event=None):
+            try:
+                rows = self.conversation_db.search(query_var.get())
+            except sqlite3.Error as e:
+                messagebox.showerror("検索エラー", f"検索に失敗しました:\n{str(e)}", parent=win)
+                return
+            hits[:] = rows
+            results.delete(0, tk.END)
+            for row in rows:
+                role = "質問" if row["role"] == "user" else "回答"
+                snippet = " ".join(row["snippet"].split())
+                results.insert(tk.END, f"{row['updated_at'][:16].replace('T', ' ')}  {row['title']}  [{role}] {snippet}")
+
+        def open_hit(event=None):
+            selection = results.curselection()
+            if not selection:
+                return
+            conversation_id = hits[selection[0]]["conversation_id"]
+            win.destroy()
+            self.open_database_conversation(conversation_id)
+
+        ttk.Button(entry_frame, text="検索", command=search).pack(side=tk.LEFT)
+        ttk.Button(entry_frame, text="開く", command=open_hit).pack(side=tk.LEFT, padx=(5, 0))
+        entry.bind('<Return>', search)
+        results.bind('<Double-Button-1>', open_hit)
+        entry.focus_set()
+
+    def open_database_conversation(self, conversation_id):
+        """データベースの会話をファイルを読まずに会話履歴へ読み込む"""
+        if not self.prompt_save_conversation("会話の切り替え"):
+            return
+        try:
+            history, _model, archives = self.conversation_db.load_conversation(conversation_id)
+        except (KeyError, OSError, ValueError, sqlite3.Error) as e:
+            messagebox.showerror("インポートエラー", f"会話の読み込みに失敗しました:\n{str(e)}")
+            return
+        self._history_loader = None
+        if self._imported_archive is not None:
+            self._imported_archive.close()
+        self._imported_archive = archives[0] if archives else None
+        self._last_json_zip_path = None
+        self._db_conversation_id = conversation_id
+        self.conversation_history = history
+        self.request_builder.reset()
+        self.history_thumbnails = {}
+        self.history_thumbnail_images = {}
+        self.history_thumbnail_files = {}
+        for archive in archives:
+            self.history_thumbnail_files.update(archive.thumbnail_sources())
+        self.image_deduplicator.clear()
+        # データベースに保存済みの会話なので、ジャーナルには保存済みとして記録する
+        self.journal.reset()
+        self.journal.append_all(history, self.model)
+        self.journal.mark_saved()
+        self.update_history_display()
+
 def main():
     root = tk.Tk()
-    app = ClaudeChatApp(root)
+    # --tabs（または.envのCLAUDE_TK_TABS）で複数の会話をタブで並べる
+    load_dotenv()
+    if "--tabs" in sys.argv[1:] or (os.getenv("CLAUDE_TK_TABS") or "").lower() in ("1", "true", "yes", "on"):
+        app = chat_tabs.ChatTabs(root, ClaudeChatApp, "Claude Chat App - Multi Turn and Image")
+    else:
+        app = ClaudeChatApp(root)
     root.mainloop()
 
 if __name__ == "__main__":
@@ -7,6 +7,10 @@ import re
 from dotenv import load_dotenv
 import json
 from datetime import datetime
+try:
+    from claude_tk import output_limits
+except ImportError:  # スクリプトとして直接実行された場合
+    import output_limits
 
 class ClaudeChatApp:
     def __init__(self, root):
@@ -168,9 +172,9 @@ class ClaudeChatApp:
         
         try:
             # APIリクエスト
-            message = self.client.messages.create(
+            answer, _ = output_limits.create_with_continuation(
+                self.client.messages.create,
                 model=self.model,
-                max_tokens=1000,
                 messages=[
                     {
                         "role": "user",
@@ -179,8 +183,6 @@ class ClaudeChatApp:
                 ]
             )
             
-            answer = message.content[0].text
-            
             # Markdownをプレーンテキストに変換
             plain_text = self.markdown_to_text(answer)
             
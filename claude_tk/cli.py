@@ -0,0 +1,335 @@
+"""端末で使う対話モード（Tkのウィンドウを開かない）
+
+マルチターン＋画像対応版と同じ会話履歴・Markdown変換・保存形式（.zip / .json / .ctk）を使い、
+回答はストリーミングで受け取りながら標準出力へ書き出す。
+
+使い方:
+    python -m claude_tk.cli                      対話モード（/helpでコマンド一覧、Ctrl+Dで終了）
+    python -m claude_tk.cli "質問" [-i 画像]      1回だけ質問して終了
+    cat memo.txt | python -m claude_tk.cli "要約して"   標準入力を質問に含めて1回だけ質問
+
+質問の中の画像ファイルのパス（.png / .jpg など、存在するもの）は添付画像として送る。
+起動を速くするため、tkinterは読み込まず、PILなどの画像処理は画像を添付・保存・再開するときに、
+anthropicは起動直後から別スレッドで読み込む（最初の質問を送るまでに読み込みが終わる）。
+"""
+import os
+import re
+import json
+import sys
+import argparse
+import importlib
+import threading
+from dotenv import load_dotenv
+try:
+    from claude_tk import output_limits, request_builder
+except ImportError:  # スクリプトとして直接実行された場合
+    import output_limits
+    import request_builder
+
+DEFAULT_MODEL = "claude-sonnet-4-20250514"
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".gif", ".webp")
+PROMPT = "> "
+CONTINUATION_PROMPT = ". "
+COMMANDS_HELP = """コマンド:
+  /save パス      会話を保存（.zip=JSON＋画像のzip、.json=画像なしのJSON、.ctk=コンパクト形式）
+  /resume パス    保存した会話を再開（.zip / .json / .ctk）
+  /clear          会話をクリア
+  /model [モデル] 使用するモデルを表示・変更
+  /help           このヘルプ
+  /exit           終了（Ctrl+Dでも終了）
+行末に \\ を付けると次の行に続けて入力できます。"""
+
+# 質問の中の語（引用符で囲んだパスも1語とみなす）と後続の空白
+_TOKEN_RE = re.compile(r'("[^"]+"|\'[^\']+\'|\S+)(\s*)')
+
+
+def _import(name):
+    """claude_tkのモジュールを必要になった時点で読み込む"""
+    try:
+        return importlib.import_module(f"claude_tk.{name}")
+    except ImportError:  # スクリプトとして直接実行された場合
+        return importlib.import_module(name)
+
+
+def preload_client_modules():
+    """anthropicの読み込み（1秒程度かかる）を別スレッドで始めておく"""
+    def worker():
+        try:
+            importlib.import_module("anthropic")
+            _import("api_cassette")
+        except Exception:
+            pass  # 失敗した場合は最初の質問を送るときに改めて読み込み、エラーを表示する
+    threading.Thread(target=worker, name="claude_tk_preload", daemon=True).start()
+
+
+def create_client(api_key):
+    anthropic = importlib.import_module("anthropic")
+    api_cassette = _import("api_cassette")
+    return api_cassette.from_env(anthropic.Anthropic(api_key=api_key))
+
+
+def parse_question(line):
+    """入力行から添付画像のパスを取り出し、(質問, 画像パスのリスト)を返す"""
+    image_paths = []
+
+    def replace(match):
+        path = os.path.expanduser(match.group(1).strip("\"'"))
+        if path.lower().endswith(IMAGE_EXTENSIONS) and os.path.isfile(path):
+            image_paths.append(path)
+            return ""
+        return match.group(0)
+    question = _TOKEN_RE.sub(replace, line).strip()
+    return question, image_paths
+
+
+class ChatSession:
+    """端末での会話（履歴の形はClaudeChatAppと同じ）"""
+
+    def __init__(self, model=DEFAULT_MODEL, client=None, api_key=None):
+        self.model = model
+        self.api_key = api_key
+        self._client = client
+        self.history = []
+        self.request_builder = request_builder.RequestBuilder()
+        self._archive = None  # 再開した保存ファイル（画像を必要時に読み込むため開いたまま保持）
+
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = create_client(self.api_key)
+        return self._client
+
+    def request_messages(self, question, image_paths=()):
+        """今回の質問を送るメッセージのリスト（過去のメッセージはテキストのみで、前回までの分を再利用）"""
+        self.request_builder.sync(self.history)
+        content = question
+        if image_paths:
+            # 最新のuserメッセージだけ画像付き（複数画像は並列にエンコード）
+            image_attachments = _import("image_attachments")
+            content = image_attachments.encode_images(image_paths) + [{"type": "text", "text": question}]
+        return self.request_builder.messages + [{"role": "user", "content": content}]
+
+    def add_exchange(self, question, image_paths, answer, **flags):
+        """質問と回答を履歴に追加する（flagsはcachedなど回答に付ける印）"""
+        user_msg = {"role": "user", "content": question}
+        if image_paths:
+            user_msg["image_paths"] = list(image_paths)
+        markdown_plain = _import("markdown_plain")
+        self.history += [user_msg, {"role": "assistant", "content": markdown_plain.markdown_to_text(answer), "markdown": answer, **flags}]
+
+    def ask(self, question, image_paths=(), out=None):
+        """質問を送り、回答をoutへストリーミングで書き出して返す（失敗・中断した質問は履歴に残さない）"""
+        out = out or sys.stdout
+        messages = self.request_messages(question, image_paths)
+
+        def write(text):
+            out.write(text)
+            out.flush()
+        answer, _ = output_limits.stream_with_continuation(self.client.messages.create, self.model, messages, write)
+        out.write("\n")
+        out.flush()
+        self.add_exchange(question, image_paths, answer)
+        return answer
+
+    def clear(self):
+        self.history = []
+        self.request_builder.reset()
+        if self._archive is not None:
+            self._archive.close()
+            self._archive = None
+
+    def resume(self, path):
+        """保存した会話を読み込んで続ける"""
+        conversation_container = _import("conversation_container")
+        markdown_plain = _import("markdown_plain")
+        archive, saved, _ = conversation_container.open_conversation(path)
+        history = []
+        for msg in saved:
+            if msg["role"] == "assistant":
+                history.append({"role": "assistant", "content": markdown_plain.markdown_to_text(msg["content"]), "markdown": msg["content"]})
+            else:
+                history.append(msg)
+        self.clear()
+        self.history = history
+        self._archive = archive
+        return len(history)
+
+    def save(self, path):
+        """会話を保存する（形式は拡張子で判定）。zipの詰め直しに失敗した場合はその例外を返す"""
+        ext = os.path.splitext(path)[1].lower()
+        conversation_archive = _import("conversation_archive")
+        conversation_container = _import("conversation_container")
+        if ext == conversation_container.CONTAINER_EXTENSION:
+            conversation_container.write_container(self.history, self.model, path)
+        elif ext == ".zip":
+            json_name = os.path.splitext(os.path.basename(path))[0] + ".json"
+            return conversation_archive.export_conversation(self.history, self.model, json_zip_path=path, json_name=json_name)
+        elif ext == ".json":
+            if any(msg.get("image_paths") for msg in self.history):
+                raise ValueError("画像付きの会話はJSONに保存できません（zip形式を使ってください）")
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(conversation_archive.build_save_data(self.history, self.model, {}), f, ensure_ascii=False, indent=2)
+        else:
+            raise ValueError(f"対応していない形式です: {path}")
+
+    def close(self):
+        if self._archive is not None:
+            self._archive.close()
+            self._archive = None
+
+
+def read_question(read_line):
+    """1つの質問を読む（行末の\\で次の行に続く）。入力の終わりならNone"""
+    lines = []
+    prompt = PROMPT
+    while True:
+        try:
+            line = read_line(prompt)
+        except EOFError:
+            if not lines:
+                return None
+            break
+        if line.endswith("\\"):
+            lines.append(line[:-1])
+            prompt = CONTINUATION_PROMPT
+            continue
+        lines.append(line)
+        break
+    return "\n".join(lines)
+
+
+def run_command(session, line, out, err):
+    """/で始まるコマンドを実行する。コマンドでなければNone、終了ならFalse"""
+    command, _, arg = line.strip().partition(" ")
+    arg = os.path.expanduser(arg.strip().strip("\"'"))
+    if command in ("/exit", "/quit"):
+        return False
+    if command == "/help":
+        print(COMMANDS_HELP, file=out)
+    elif command == "/clear":
+        session.clear()
+        print("会話をクリアしました。", file=err)
+    elif command == "/model":
+        if arg:
+            session.model = arg
+        print(f"モデル: {session.model}", file=err)
+    elif command in ("/save", "/resume"):
+        if not arg:
+            print(f"使い方: {command} パス", file=err)
+            return True
+        try:
+            if command == "/save":
+                compact_error = session.save(arg)
+                print(f"保存しました: {arg}", file=err)
+                if compact_error is not None:
+                    print(f"ZIPの詰め直しに失敗しました（次回の保存で再試行します）: {compact_error}", file=err)
+            else:
+                count = session.resume(arg)
+                print(f"{count}件のメッセージを読み込みました: {arg}", file=err)
+        except Exception as e:
+            print(f"{'保存' if command == '/save' else '読み込み'}に失敗しました: {e}", file=err)
+    else:
+        return None
+    return True
+
+
+def interactive(session, read_line=input, out=None, err=None):
+    """対話モード"""
+    out = out or sys.stdout
+    err = err or sys.stderr
+    try:
+        import readline  # noqa: F401  入力行の編集・履歴（使えない環境では標準のinputのまま）
+    except ImportError:
+        pass
+    print(f"Claude（{session.model}）に質問できます。/helpでコマンド一覧、Ctrl+Dで終了します。", file=err)
+    while True:
+        try:
+            line = read_question(read_line)
+        except KeyboardInterrupt:
+            print(file=err)
+            continue
+        if line is None:
+            print(file=err)
+            return
+        if not line.strip():
+            continue
+        if line.startswith("/"):
+            result = run_command(session, line, out, err)
+            if result is False:
+                return
+            if result is not None:
+                continue
+        question, image_paths = parse_question(line)
+        if not question:
+            print("質問を入力してください。", file=err)
+            continue
+        if image_paths:
+            print(f"（画像{len(image_paths)}枚を添付）", file=err)
+        try:
+            session.ask(question, image_paths, out)
+        except KeyboardInterrupt:
+            print("\n（中断しました）", file=err)
+        except Exception as e:
+            print(f"\n通信エラー: {e}", file=err)
+
+
+def main(argv=None):
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Claudeに端末から質問します（質問も標準入力もなければ対話モード）")
+    parser.add_argument("prompt", nargs="*", help="質問（標準入力がパイプの場合はその内容の前に付ける）")
+    parser.add_argument("-i", "--image", action="append", default=[], help="添付する画像（複数指定可）")
+    parser.add_argument("-m", "--model", default=DEFAULT_MODEL, help="使用するモデル")
+    parser.add_argument("--resume", help="保存した会話（.zip / .json / .ctk）を読み込んで続ける")
+    parser.add_argument("--save", help="終了時に会話を保存する（.zip / .json / .ctk）")
+    args = parser.parse_args(argv)
+    api_key = os.getenv("ANTHROPIC_API_KEY")
+    if not api_key:
+        print("ANTHROPIC_API_KEYが設定されていません。.envファイルを確認してください。", file=sys.stderr)
+        return 1
+    preload_client_modules()
+    session = ChatSession(args.model, api_key=api_key)
+    try:
+        if args.resume:
+            try:
+                session.resume(args.resume)
+            except Exception as e:
+                print(f"読み込みに失敗しました: {e}", file=sys.stderr)
+                return 1
+        piped = not sys.stdin.isatty()
+        if not args.prompt and not args.image and not piped:
+            interactive(session)
+            status = 0
+        else:
+            question, image_paths = parse_question(" ".join(args.prompt))
+            if piped:
+                question = "\n\n".join(part for part in (question, sys.stdin.read().strip()) if part)
+            missing = [path for path in args.image if not os.path.isfile(path)]
+            if missing:
+                print(f"画像ファイルが見つかりません: {', '.join(missing)}", file=sys.stderr)
+                return 1
+            if not question:
+                print("質問を入力してください。", file=sys.stderr)
+                return 2
+            try:
+                session.ask(question, image_paths + args.image)
+                status = 0
+            except KeyboardInterrupt:
+                return 130
+            except Exception as e:
+                print(f"通信エラー: {e}", file=sys.stderr)
+                return 1
+        if args.save and session.history:
+            try:
+                compact_error = session.save(args.save)
+            except Exception as e:
+                print(f"保存に失敗しました: {e}", file=sys.stderr)
+                return 1
+            if compact_error is not None:
+                print(f"ZIPの詰め直しに失敗しました（次回の保存で再試行します）: {compact_error}", file=sys.stderr)
+        return status
+    finally:
+        session.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,600 @@
+"""会話履歴のzip保存（JSON/Markdown＋画像）
+
+一時ディレクトリを経由せず、JSON/Markdownはwritestrで、画像は元ファイルから直接zipへ書き込む。
+JPEG/PNG/WebP/GIFは圧縮済みのためZIP_STOREDで格納し、無駄な再圧縮を避ける。
+zip内の画像名は内容ハッシュ（img/<sha256>.<拡張子>）で、同名ファイルの衝突や同じ画像の重複格納が起きない。
+
+読み込み時はzipを展開せず、ArchiveReaderでzipを開いたままJSONだけを読み、
+画像はサムネイル・元画像が必要になった時点でメンバーをメモリに読み込む。
+
+既存の保存zipに保存し直す場合は、zipを追記モードで開き、まだ含まれていない画像と
+新しいリビジョンのJSON・サムネイルマニフェストだけを追記する（同名メンバーは後のものが有効）。
+置き換えられた古いエントリが一定の割合を超えたら、有効なエントリだけのzipに詰め直す。
+追記の前には上書きされる中央ディレクトリを<保存先>.append-backupに退避してfsyncしておき、
+追記の途中でアプリが落ちた場合は、次にzipを開くときに書き戻して追記前の状態に戻す。
+同じzipを開いているArchiveReaderは、zipを置き換える間だけ閉じて開き直す
+（Windowsでは開いているファイルを置き換えられないため）。
+
+新規の保存は一時ファイル（<保存先>.tmp）に書き込み、完了してから保存先へ置き換える。
+別スレッドで保存する場合はArchiveProgressで進捗を受け取り、中止を要求できる。
+"""
+import os
+import json
+import struct
+import zipfile
+import weakref
+import warnings
+import threading
+from contextlib import ExitStack, contextmanager
+from datetime import datetime
+try:
+    from claude_tk import image_attachments, media_store
+except ImportError:  # スクリプトとして直接実行された場合
+    import image_attachments
+    import media_store
+
+# 圧縮済みの画像形式（deflateしても小さくならない）
+COMPRESSED_MIME_TYPES = ("image/jpeg", "image/png", "image/webp", "image/gif")
+# 置き換えられたエントリがzip全体のこの割合を超えたら詰め直す
+COMPACT_RATIO = 0.5
+# 書きかけの保存ファイルの拡張子（完了後に保存先へ置き換える）
+TEMP_SUFFIX = ".tmp"
+# 追記中に退避しておく中央ディレクトリの拡張子（追記が終わったら削除する）
+APPEND_BACKUP_SUFFIX = ".append-backup"
+_BACKUP_HEADER = struct.Struct("<QQ")  # 中央ディレクトリの位置, 退避したデータの長さ
+
+
+class ArchiveCancelled(Exception):
+    """保存・読み込みが中止された"""
+
+
+class ArchiveProgress:
+    """保存・読み込みの進捗（作業スレッドが更新し、UIスレッドが読む）と中止要求"""
+
+    def __init__(self):
+        self.total_files = 0
+        self.total_bytes = 0
+        self.done_files = 0
+        self.done_bytes = 0
+        self._cancel = threading.Event()
+
+    def start(self, total_files, total_bytes=0):
+        self.total_files = total_files
+        self.total_bytes = total_bytes
+        self.check()
+
+    def advance(self, nbytes=0, files=1):
+        """1件分の処理が終わったことを記録する（中止されていればArchiveCancelledを送出）"""
+        self.done_files += files
+        self.done_bytes += nbytes
+        self.check()
+
+    def cancel(self):
+        self._cancel.set()
+
+    @property
+    def cancelled(self):
+        return self._cancel.is_set()
+
+    def check(self):
+        if self._cancel.is_set():
+            raise ArchiveCancelled("中止しました")
+
+    def describe(self):
+        """進捗の表示用テキスト"""
+        text = f"{self.done_files} / {self.total_files} 件"
+        if self.total_bytes:
+            text += f"（{self.done_bytes / 1024 / 1024:.1f} / {self.total_bytes / 1024 / 1024:.1f} MB）"
+        return text
+
+
+class ZipImage(image_attachments.MemoryImage):
+    """zipのメンバーを参照する画像ソース（データは参照されるたびにzipから読み込む）"""
+
+    def __init__(self, archive, member):
+        self.archive = archive
+        self.member = member
+        self.name = os.path.basename(member)
+        self.mime_type = image_attachments.get_mime_type(member)
+
+    @property
+    def data(self):
+        return self.archive.read(self.member)
+
+    @property
+    def size(self):
+        return self.archive.size(self.member)
+
+    def exists(self):
+        return self.archive.has_member(self.member)
+
+    def __repr__(self):
+        return f"ZipImage({self.archive.path!r}, {self.member!r})"
+
+
+class ArchiveReader:
+    """保存zipを展開せずに開いたまま保持し、必要なメンバーだけを読み込む"""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()  # 複数スレッドからのメンバー読み込みを直列化
+        self._images = {}
+        self._open()
+        with _readers_lock:
+            _open_readers.add(self)
+
+    def _open(self):
+        recover_interrupted_append(self.path)
+        self._zip = zipfile.ZipFile(self.path, 'r')
+        # 追記保存で同名のメンバーが複数ある場合は最後（最新のリビジョン）を使う
+        self._infos = latest_infos(self._zip)
+        self._names = set(self._infos)
+
+    def suspend(self):
+        """zipを置き換える間だけ閉じる（resumeまでメンバーの読み込みは待たせる）"""
+        self._lock.acquire()
+        self._zip.close()
+
+    def resume(self):
+        """置き換えられたzipを開き直す"""
+        try:
+            self._open()
+        finally:
+            self._lock.release()
+
+    def has_member(self, member):
+        return member in self._names
+
+    def size(self, member):
+        return self._infos[member].file_size
+
+    def read(self, member):
+        with self._lock:
+            return self._zip.read(self._infos[member])
+
+    def find_json_name(self):
+        """会話履歴のJSONメンバー名を探す"""
+        return find_json_name(self._zip.namelist())
+
+    def load_json(self):
+        json_name = self.find_json_name()
+        if not json_name:
+            raise ValueError("ZIP内にJSONファイルが見つかりません")
+        return json.loads(self.read(json_name).decode('utf-8'))
+
+    def image(self, member):
+        """メンバーの画像ソースを返す（同じメンバーには同じオブジェクトを返す）"""
+        if member not in self._images:
+            self._images[member] = ZipImage(self, member)
+        return self._images[member]
+
+    def thumbnail_sources(self):
+        """同梱サムネイルの{画像ソース: サムネイルの画像ソース}を返す（古いzipでは空）"""
+        if not self.has_member(image_attachments.THUMBNAIL_MANIFEST):
+            return {}
+        manifest = _parse_manifest(self.read(image_attachments.THUMBNAIL_MANIFEST))
+        return {
+            self.image(member): self.image(thumb)
+            for member, thumb in manifest.get("thumbnails", {}).items()
+            if self.has_member(thumb)
+        }
+
+    def close(self):
+        with _readers_lock:
+            _open_readers.discard(self)
+        self._zip.close()
+
+
+_open_readers = weakref.WeakSet()
+_readers_lock = threading.Lock()
+
+
+@contextmanager
+def _released(path):
+    """pathを開いているArchiveReaderを閉じておき、ブロックを抜けたら開き直す"""
+    target = os.path.abspath(path)
+    with _readers_lock:
+        readers = [reader for reader in _open_readers if os.path.abspath(reader.path) == target]
+    for reader in readers:
+        reader.suspend()
+    try:
+        yield
+    finally:
+        for reader in readers:
+            reader.resume()
+
+
+def latest_infos(zipf):
+    """メンバー名→最新のZipInfo（同名のエントリは後に追記されたものが有効）"""
+    return {info.filename: info for info in zipf.infolist()}
+
+
+def find_json_name(names):
+    """メンバー名の一覧から会話履歴のJSONを探す"""
+    for name in names:
+        if name.endswith('.json') and not name.startswith(('img/', 'thumbs/')):
+            return name
+    return None
+
+
+def _parse_manifest(data):
+    try:
+        manifest = json.loads(data.decode('utf-8'))
+    except ValueError:
+        return {"thumbnails": {}}
+    return manifest if isinstance(manifest.get("thumbnails"), dict) else {"thumbnails": {}}
+
+
+def compress_type_for(source):
+    """画像ソースに適したzipの圧縮方式"""
+    if image_attachments.get_mime_type(source) in COMPRESSED_MIME_TYPES:
+        return zipfile.ZIP_STORED
+    return zipfile.ZIP_DEFLATED
+
+
+def assign_image_names(history):
+    """履歴中の画像ソースにzip内のパスを割り当てる（同じ内容の画像は同じパスを共有）
+
+    読み込めない画像ファイルには元のファイル名を割り当てる。
+    """
+    image_names = {}
+    for msg in history:
+        if msg["role"] != "user":
+            continue
+        for source in image_attachments.get_image_paths(msg):
+            if source in image_names:
+                continue
+            try:
+                image_names[source] = f"img/{media_store.hashed_name(source)}"
+            except OSError:
+                image_names[source] = f"img/{image_attachments.image_name(source)}"
+    return image_names
+
+
+def build_save_data(history, model, image_names, revision=1):
+    """JSON保存用のデータを作成（assistantはMarkdownのまま）"""
+    save_data = {
+        "metadata": {
+            "created_at": datetime.now().isoformat(),
+            "model": model,
+            "total_messages": len(history),
+            "revision": revision
+        },
+        "conversation": []
+    }
+    for msg in history:
+        image_paths = image_attachments.get_image_paths(msg)
+        if msg["role"] == "user" and image_paths:
+            msg_copy = {k: v for k, v in msg.items() if k != "image_path"}
+            msg_copy["image_paths"] = [image_names[source] for source in image_paths]
+            save_data["conversation"].append(msg_copy)
+        elif msg["role"] == "assistant":
+            save_data["conversation"].append({
+                "role": "assistant",
+                "content": msg.get("markdown", msg["content"])
+            })
+        else:
+            save_data["conversation"].append(dict(msg))
+    return save_data
+
+
+def build_markdown(history, image_names, missing=()):
+    """Markdown保存用のテキストを作成（保存できない画像はエラー表記にする）"""
+    md_lines = []
+    pair_num = 0
+    for msg in history:
+        if msg["role"] == "user":
+            pair_num += 1
+            md_lines.append(f"## 質問{pair_num}\n{msg['content']}")
+            for source in image_attachments.get_image_paths(msg):
+                if source in missing:
+                    md_lines.append(f"[画像保存エラー: {image_attachments.image_name(source)}]")
+                else:
+                    md_lines.append(f"![添付画像]({image_names[source]})")
+        else:
+            md = msg.get("markdown", msg["content"])
+            md_lines.append(f"## 回答{pair_num}\n{md}")
+    return '\n'.join(md_lines)
+
+
+def find_missing_images(image_names):
+    """読み込めない画像（移動・削除されたファイル、zipにないメンバー）を返す"""
+    missing = set()
+    for source in image_names:
+        if isinstance(source, ZipImage):
+            if not source.exists():
+                missing.add(source)
+        elif not isinstance(source, image_attachments.MemoryImage) and not os.path.isfile(source):
+            missing.add(source)
+    return missing
+
+
+def _write_image(zipf, source, arcname):
+    """画像ソースをzipへ書き込む（ファイルは読み込まずにzipfileへ渡す）"""
+    compress_type = compress_type_for(source)
+    if isinstance(source, image_attachments.MemoryImage):
+        zipf.writestr(arcname, source.data, compress_type=compress_type)
+    else:
+        zipf.write(source, arcname=arcname, compress_type=compress_type)
+
+
+def _writestr_latest(zipf, arcname, data, compress_type=None):
+    """同名メンバーの新しいリビジョンを追記する（zipfileの重複名警告は想定どおりなので抑制）"""
+    with warnings.catch_warnings():
+        warnings.filterwarnings("ignore", message="Duplicate name", category=UserWarning)
+        zipf.writestr(arcname, data, compress_type=compress_type)
+
+
+def _fsync_path(path):
+    with open(path, 'r+b') as f:
+        os.fsync(f.fileno())
+
+
+def _remove_append_backup(zip_path):
+    try:
+        os.remove(zip_path + APPEND_BACKUP_SUFFIX)
+    except FileNotFoundError:
+        pass
+
+
+def _write_append_backup(zip_path, start_dir, tail):
+    """追記で上書きされる中央ディレクトリ（start_dir以降）を退避してディスクへ書き出す"""
+    with open(zip_path + APPEND_BACKUP_SUFFIX, 'wb') as f:
+        f.write(_BACKUP_HEADER.pack(start_dir, len(tail)))
+        f.write(tail)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def recover_interrupted_append(zip_path):
+    """追記の途中で終了した保存zipを、退避しておいた中央ディレクトリで追記前の状態に戻す
+
+    追記が最後まで書かれていた（新しい中央ディレクトリで開ける）場合はそのまま使う。
+    戻した場合はTrueを返す。
+    """
+    backup_path = zip_path + APPEND_BACKUP_SUFFIX
+    try:
+        with open(backup_path, 'rb') as f:
+            backup = f.read()
+    except FileNotFoundError:
+        return False
+    if len(backup) < _BACKUP_HEADER.size or len(backup) - _BACKUP_HEADER.size != _BACKUP_HEADER.unpack_from(backup)[1]:
+        # 退避を書き終える前に終了した（zipはまだ変更していない）
+        os.remove(backup_path)
+        return False
+    start_dir = _BACKUP_HEADER.unpack_from(backup)[0]
+    try:
+        with zipfile.ZipFile(zip_path, 'r') as zipf:
+            completed = zipf.start_dir > start_dir
+    except (OSError, zipfile.BadZipFile):
+        completed = False
+    if not completed:
+        with open(zip_path, 'r+b') as f:
+            f.seek(start_dir)
+            f.write(backup[_BACKUP_HEADER.size:])
+            f.truncate()
+            f.flush()
+            os.fsync(f.fileno())
+    os.remove(backup_path)
+    return not completed
+
+
+def appendable_json_name(path):
+    """追記保存できる会話zipならJSONメンバー名を、そうでなければNoneを返す"""
+    try:
+        recover_interrupted_append(path)
+        with zipfile.ZipFile(path, 'r') as zipf:
+            return find_json_name(zipf.namelist())
+    except (OSError, zipfile.BadZipFile):
+        return None
+
+
+def append_conversation(history, model, zip_path, image_names=None, progress=None):
+    """既存の保存zipに、含まれていない画像と新しいリビジョンのJSON・マニフェストだけを追記する
+
+    書き込み量は前回の保存から増えた分（新しい画像とJSON）だけになる。
+    失敗した場合・中止された場合はzipを追記前の状態に戻して例外を送出する。
+    途中でアプリが落ちた場合も、退避した中央ディレクトリから次に開くときに追記前の状態へ戻す
+    （recover_interrupted_append）。
+    置き換えられたエントリが多くなったらcompact_archiveで詰め直し、
+    詰め直しに失敗した場合はその例外を返す（zipは追記済みの状態で有効で、次回の保存で再試行する）。
+    """
+    if image_names is None:
+        image_names = assign_image_names(history)
+    json_name = appendable_json_name(zip_path)
+    if json_name is None:
+        raise ValueError("追記できる会話履歴のZIPではありません")
+    zipf = zipfile.ZipFile(zip_path, 'a', zipfile.ZIP_DEFLATED)
+    # 失敗時・異常終了時に元へ戻せるよう、上書きされる中央ディレクトリを退避しておく
+    start_dir = zipf.start_dir
+    try:
+        with open(zip_path, 'rb') as f:
+            f.seek(start_dir)
+            original_tail = f.read()
+        _write_append_backup(zip_path, start_dir, original_tail)
+    except BaseException:
+        zipf.close()
+        _remove_append_backup(zip_path)
+        raise
+    try:
+        infos = latest_infos(zipf)
+        try:
+            revision = json.loads(zipf.read(infos[json_name]).decode('utf-8'))["metadata"]["revision"] + 1
+        except (ValueError, KeyError, TypeError):
+            revision = 2
+        live_images = {}
+        for source, arcname in image_names.items():
+            live_images.setdefault(arcname, source)
+        new_images = {arcname: source for arcname, source in live_images.items() if arcname not in infos}
+        sizes = {arcname: image_attachments.image_size(source) for arcname, source in new_images.items()} if progress else {}
+        if progress:
+            progress.start(len(new_images), sum(sizes.values()))
+        for arcname, source in new_images.items():
+            _write_image(zipf, source, arcname)
+            if progress:
+                progress.advance(sizes[arcname])
+        thumbs, new_manifest = image_attachments.build_thumbnail_sidecars(new_images)
+        for arcname, data in thumbs.items():
+            zipf.writestr(arcname, data, compress_type=zipfile.ZIP_STORED)
+        manifest = {"thumbnails": {}}
+        if image_attachments.THUMBNAIL_MANIFEST in infos:
+            manifest = _parse_manifest(zipf.read(infos[image_attachments.THUMBNAIL_MANIFEST]))
+        new_manifest["thumbnails"] = {
+            **{arcname: thumb for arcname, thumb in manifest["thumbnails"].items() if arcname in live_images and thumb in infos},
+            **new_manifest["thumbnails"]
+        }
+        if progress:
+            progress.check()
+        _writestr_latest(zipf, json_name, json.dumps(build_save_data(history, model, image_names, revision), ensure_ascii=False, indent=2))
+        _writestr_latest(zipf, image_attachments.THUMBNAIL_MANIFEST, json.dumps(new_manifest, ensure_ascii=False, indent=2))
+        zipf.close()
+        # 新しい中央ディレクトリをディスクへ書き出してから退避を消す
+        _fsync_path(zip_path)
+    except BaseException:
+        try:
+            zipf.close()
+        except Exception:
+            pass
+        with open(zip_path, 'r+b') as f:
+            f.seek(start_dir)
+            f.write(original_tail)
+            f.truncate()
+        _remove_append_backup(zip_path)
+        raise
+    _remove_append_backup(zip_path)
+    live = {json_name, image_attachments.THUMBNAIL_MANIFEST, *live_images, *new_manifest["thumbnails"].values()}
+    # 開いているzipの画像をハッシュ名以外のメンバー名で参照している場合（古い形式のzip）も残す
+    target = os.path.abspath(zip_path)
+    live.update(
+        source.member for source in image_names
+        if isinstance(source, ZipImage) and os.path.abspath(source.archive.path) == target
+    )
+    if garbage_ratio(zip_path, live) > COMPACT_RATIO:
+        try:
+            compact_archive(zip_path, live)
+        except OSError as e:
+            return e
+    return None
+
+
+def garbage_ratio(zip_path, live):
+    """置き換えられた・参照されなくなったエントリがzip内のデータに占める割合"""
+    with zipfile.ZipFile(zip_path, 'r') as zipf:
+        infos = zipf.infolist()
+        latest = latest_infos(zipf)
+    total = sum(info.compress_size for info in infos)
+    if not total:
+        return 0.0
+    live_size = sum(latest[name].compress_size for name in live if name in latest)
+    return (total - live_size) / total
+
+
+def compact_archive(zip_path, live=None):
+    """有効なエントリ（liveのメンバーの最新リビジョン）だけのzipに詰め直す
+
+    liveを省略した場合は最新のJSONとサムネイルマニフェストから参照されているメンバーを残す。
+    """
+    tmp_path = zip_path + ".compact.tmp"
+    try:
+        with zipfile.ZipFile(zip_path, 'r') as src:
+            latest = latest_infos(src)
+            if live is None:
+                json_name = find_json_name(latest)
+                live = {json_name, image_attachments.THUMBNAIL_MANIFEST}
+                for msg in json.loads(src.read(latest[json_name]).decode('utf-8')).get("conversation", []):
+                    live.update(image_attachments.get_image_paths(msg))
+                if image_attachments.THUMBNAIL_MANIFEST in latest:
+                    manifest = _parse_manifest(src.read(latest[image_attachments.THUMBNAIL_MANIFEST]))
+                    live.update(thumb for arcname, thumb in manifest["thumbnails"].items() if arcname in live)
+            with zipfile.ZipFile(tmp_path, 'w', zipfile.ZIP_DEFLATED) as dst:
+                for name, info in latest.items():
+                    if name not in live:
+                        continue
+                    zinfo = zipfile.ZipInfo(name, info.date_time)
+                    zinfo.compress_type = info.compress_type
+                    dst.writestr(zinfo, src.read(info))
+        with _released(zip_path):
+            os.replace(tmp_path, zip_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def export_conversation(history, model, json_zip_path=None, md_zip_path=None, json_name="conversation.json", incremental=True, progress=None):
+    """会話履歴をJSON zip・Markdown zipの一方または両方に保存する
+
+    両方保存する場合も画像の読み込みは1回だけで、同じデータを両方のzipへ書き込む。
+    incrementalがTrueで、JSON zipの保存先が既存の会話zipなら差分だけを追記する。
+    zipは一時ファイルに書き込み、すべて書き終えてから保存先へ置き換える。
+    失敗した場合・progressで中止された場合は一時ファイルを削除して例外を送出する（保存先は変更しない）。
+    追記した保存zipの詰め直しに失敗した場合はその例外を返す（保存は完了している）。
+    """
+    image_names = assign_image_names(history)
+    missing = find_missing_images(image_names)
+    if json_zip_path and missing:
+        names = ", ".join(sorted(image_attachments.image_name(source) for source in missing))
+        raise FileNotFoundError(f"画像ファイルが見つかりません: {names}")
+    compact_error = None
+    if json_zip_path and incremental and os.path.exists(json_zip_path) and appendable_json_name(json_zip_path):
+        compact_error = append_conversation(history, model, json_zip_path, image_names, progress)
+        json_zip_path = None
+    if not json_zip_path and not md_zip_path:
+        return compact_error
+    output_paths = [path for path in (json_zip_path, md_zip_path) if path]
+    images = {}
+    for source, arcname in image_names.items():
+        if source not in missing:
+            images.setdefault(arcname, source)
+    sizes = {arcname: image_attachments.image_size(source) for arcname, source in images.items()} if progress else {}
+    if progress:
+        progress.start(len(images), sum(sizes.values()))
+    try:
+        with ExitStack() as stack:
+            files = [stack.enter_context(open(path + TEMP_SUFFIX, 'wb')) for path in output_paths]
+            targets = []
+            if json_zip_path:
+                json_zip = stack.enter_context(zipfile.ZipFile(files[0], 'w', zipfile.ZIP_DEFLATED))
+                json_zip.writestr(json_name, json.dumps(build_save_data(history, model, image_names), ensure_ascii=False, indent=2))
+                targets.append(json_zip)
+            if md_zip_path:
+                md_zip = stack.enter_context(zipfile.ZipFile(files[-1], 'w', zipfile.ZIP_DEFLATED))
+                md_name = os.path.splitext(os.path.basename(md_zip_path))[0] + ".md"
+                md_zip.writestr(md_name, build_markdown(history, image_names, missing))
+                targets.append(md_zip)
+            # 画像は1回だけ読み込み、すべての出力先へ書き込む（同じ内容の画像は1つだけ格納）
+            for arcname, source in images.items():
+                if len(targets) == 1:
+                    _write_image(targets[0], source, arcname)
+                else:
+                    data = image_attachments.read_image_bytes(source)
+                    compress_type = compress_type_for(source)
+                    for zipf in targets:
+                        zipf.writestr(arcname, data, compress_type=compress_type)
+                if progress:
+                    progress.advance(sizes[arcname])
+            if json_zip_path:
+                # 再開時に元画像を読まずに済むよう、サムネイルとマニフェストを同梱
+                thumbs, manifest = image_attachments.build_thumbnail_sidecars(
+                    {arcname: source for source, arcname in reversed(image_names.items()) if source not in missing}
+                )
+                for arcname, data in thumbs.items():
+                    json_zip.writestr(arcname, data, compress_type=zipfile.ZIP_STORED)
+                json_zip.writestr(image_attachments.THUMBNAIL_MANIFEST, json.dumps(manifest, ensure_ascii=False, indent=2))
+            if progress:
+                progress.check()
+            # 置き換える前にディスクへ書き出す（途中で落ちても保存先は元のまま）
+            for zipf in targets:
+                zipf.close()
+            for f in files:
+                f.flush()
+                os.fsync(f.fileno())
+        for path in output_paths:
+            with _released(path):
+                os.replace(path + TEMP_SUFFIX, path)
+            # 置き換える前のzipへの追記で残った退避は新しいzipには当てはまらない
+            _remove_append_backup(path)
+    finally:
+        for path in output_paths:
+            if os.path.exists(path + TEMP_SUFFIX):
+                os.remove(path + TEMP_SUFFIX)
+    return compact_error
@@ -0,0 +1,428 @@
+"""会話履歴のコンパクトなバイナリ形式（.ctk）
+
+JSON保存（indent=2の1つのドキュメント）と違い、メッセージと画像を長さ付きのレコードとして順に書き込み、
+末尾に各レコードの位置を記録したインデックスを置く。
+読み込み側はインデックスから必要なメッセージだけをシークして読み込めるため、
+会話全体を読まずに最新のnターンだけを表示したり、画像を表示時まで読み込まずにおける。
+
+ファイルの構造:
+    MAGIC
+    レコード（種類1バイト＋長さ4バイト＋データ）の並び
+        メタデータ: JSON（model, created_at）
+        画像: 名前の長さ2バイト＋名前（内容ハッシュ.拡張子）＋画像データ
+        メッセージ: JSON（role, content, images=画像の番号のリスト）
+        インデックス: JSON（メタデータ、メッセージ・画像の位置、ターンの開始位置）
+    トレーラー（インデックスの位置8バイト＋TRAILER_MAGIC）
+
+メッセージはJSON保存と同じ形（assistantのcontentはMarkdown）で格納し、既存のJSON/zipと相互に変換できる。
+インデックスがない（書き込み途中で終了した）ファイルは先頭から順に読んで復元する。
+
+変換コマンド:
+    python -m claude_tk.conversation_container 入力ファイル 出力ファイル
+    （拡張子で.json/.zip/.ctkを判定）
+"""
+import os
+import sys
+import json
+import struct
+import threading
+from datetime import datetime
+try:
+    from claude_tk import image_attachments, conversation_archive, media_store
+except ImportError:  # スクリプトとして直接実行された場合
+    import image_attachments
+    import conversation_archive
+    import media_store
+
+MAGIC = b"CTKCONV1"
+TRAILER_MAGIC = b"CTKINDEX"
+CONTAINER_EXTENSION = ".ctk"
+
+REC_METADATA = 1
+REC_BLOB = 2
+REC_MESSAGE = 3
+REC_INDEX = 4
+
+_RECORD = struct.Struct("<BI")  # 種類, データ長
+_NAME_LENGTH = struct.Struct("<H")
+_TRAILER = struct.Struct("<Q8s")  # インデックスの位置, TRAILER_MAGIC
+
+
+def _dumps(obj):
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+class ContainerImage(image_attachments.MemoryImage):
+    """コンテナ内の画像を参照する画像ソース（データは参照されるたびにファイルから読み込む）"""
+
+    def __init__(self, reader, blob_id):
+        self.reader = reader
+        self.blob_id = blob_id
+        self.name = reader.blob_name(blob_id)
+        self.mime_type = image_attachments.get_mime_type(self.name)
+
+    @property
+    def data(self):
+        return self.reader.read_blob(self.blob_id)
+
+    @property
+    def size(self):
+        return self.reader.blob_size(self.blob_id)
+
+    def __repr__(self):
+        return f"ContainerImage({self.reader.path!r}, {self.blob_id})"
+
+
+class ContainerWriter:
+    """メッセージを1件ずつコンテナに書き込む（同じ内容の画像は1回だけ格納）"""
+
+    def __init__(self, path, model=None, created_at=None):
+        self.path = path
+        self.metadata = {"model": model, "created_at": created_at or datetime.now().isoformat()}
+        self._file = open(path, "wb")
+        self._file.write(MAGIC)
+        self._messages = []
+        self._turns = []
+        self._blobs = []
+        self._blob_ids = {}
+        self._write_record(REC_METADATA, _dumps(self.metadata))
+
+    def _write_record(self, kind, payload):
+        offset = self._file.tell()
+        self._file.write(_RECORD.pack(kind, len(payload)))
+        self._file.write(payload)
+        return offset
+
+    def add_image(self, source):
+        """画像を格納して番号を返す"""
+        name = media_store.hashed_name(source)
+        if name not in self._blob_ids:
+            data = image_attachments.read_image_bytes(source)
+            encoded_name = name.encode("utf-8")
+            offset = self._write_record(REC_BLOB, _NAME_LENGTH.pack(len(encoded_name)) + encoded_name + data)
+            data_offset = offset + _RECORD.size + _NAME_LENGTH.size + len(encoded_name)
+            self._blob_ids[name] = len(self._blobs)
+            self._blobs.append([name, data_offset, len(data)])
+        return self._blob_ids[name]
+
+    def add_message(self, msg):
+        """JSON保存と同じ形のメッセージ（image_pathsは画像ソース）を追加する"""
+        record = {"role": msg["role"], "content": msg["content"]}
+        images = image_attachments.get_image_paths(msg)
+        if images:
+            record["images"] = [self.add_image(source) for source in images]
+        if msg["role"] == "user":
+            self._turns.append(len(self._messages))
+        self._messages.append(self._write_record(REC_MESSAGE, _dumps(record)))
+
+    def close(self):
+        """インデックスとトレーラーを書き込んで閉じる"""
+        index = {
+            "metadata": dict(self.metadata, total_messages=len(self._messages)),
+            "messages": self._messages,
+            "turns": self._turns,
+            "blobs": self._blobs
+        }
+        index_offset = self._write_record(REC_INDEX, _dumps(index))
+        self._file.write(_TRAILER.pack(index_offset, TRAILER_MAGIC))
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+
+    def abort(self):
+        """書きかけのファイルを削除する"""
+        self._file.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class ContainerReader:
+    """コンテナを開いたまま保持し、必要なメッセージ・画像だけを読み込む
+
+    conversation_archive.ArchiveReaderと同じload_json / image / thumbnail_sources / closeを持ち、
+    zipと同じ手順で会話を再開できる。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, "rb")
+        self._lock = threading.Lock()  # 複数スレッドからの読み込みを直列化
+        self._images = {}
+        try:
+            if self._file.read(len(MAGIC)) != MAGIC:
+                raise ValueError("会話コンテナ（.ctk）ではありません")
+            index = self._read_index()
+            if index is None:
+                index = self._scan()  # インデックスが書き込まれる前に終了したファイル
+        except Exception:
+            self._file.close()
+            raise
+        self.metadata = index["metadata"]
+        self._messages = index["messages"]
+        self._turns = index["turns"]
+        self._blobs = index["blobs"]
+
+    def _read_record_at(self, offset):
+        with self._lock:
+            self._file.seek(offset)
+            header = self._file.read(_RECORD.size)
+            if len(header) < _RECORD.size:
+                raise ValueError("コンテナが途中で切れています")
+            kind, length = _RECORD.unpack(header)
+            payload = self._file.read(length)
+        if len(payload) < length:
+            raise ValueError("コンテナが途中で切れています")
+        return kind, payload
+
+    def _read_index(self):
+        self._file.seek(0, os.SEEK_END)
+        size = self._file.tell()
+        if size < len(MAGIC) + _TRAILER.size:
+            return None
+        self._file.seek(size - _TRAILER.size)
+        index_offset, magic = _TRAILER.unpack(self._file.read(_TRAILER.size))
+        if magic != TRAILER_MAGIC:
+            return None
+        kind, payload = self._read_record_at(index_offset)
+        if kind != REC_INDEX:
+            raise ValueError("コンテナのインデックスが壊れています")
+        return json.loads(payload.decode("utf-8"))
+
+    def _scan(self):
+        """先頭から順にレコードを読み、インデックスを作り直す（途切れた最後のレコードは無視）"""
+        index = {"metadata": {}, "messages": [], "turns": [], "blobs": []}
+        offset = len(MAGIC)
+        while True:
+            try:
+                kind, payload = self._read_record_at(offset)
+            except ValueError:
+                break
+            if kind == REC_METADATA:
+                index["metadata"] = json.loads(payload.decode("utf-8"))
+            elif kind == REC_BLOB:
+                (name_length,) = _NAME_LENGTH.unpack_from(payload)
+                name = payload[_NAME_LENGTH.size:_NAME_LENGTH.size + name_length].decode("utf-8")
+                data_offset = offset + _RECORD.size + _NAME_LENGTH.size + name_length
+                index["blobs"].append([name, data_offset, len(payload) - _NAME_LENGTH.size - name_length])
+            elif kind == REC_MESSAGE:
+                if json.loads(payload.decode("utf-8")).get("role") == "user":
+                    index["turns"].append(len(index["messages"]))
+                index["messages"].append(offset)
+            else:
+                break
+            offset += _RECORD.size + len(payload)
+        index["metadata"]["total_messages"] = len(index["messages"])
+        return index
+
+    def __len__(self):
+        return len(self._messages)
+
+    @property
+    def turn_count(self):
+        return len(self._turns)
+
+    def blob_name(self, blob_id):
+        return self._blobs[blob_id][0]
+
+    def blob_size(self, blob_id):
+        return self._blobs[blob_id][2]
+
+    def read_blob(self, blob_id):
+        _, offset, length = self._blobs[blob_id]
+        with self._lock:
+            self._file.seek(offset)
+            return self._file.read(length)
+
+    def image(self, blob_id):
+        """画像の番号に対応する画像ソースを返す（同じ番号には同じオブジェクトを返す）"""
+        if blob_id not in self._images:
+            self._images[blob_id] = ContainerImage(self, blob_id)
+        return self._images[blob_id]
+
+    def read_message(self, position, resolve_images=True):
+        """position番目のメッセージをJSON保存と同じ形で読み込む"""
+        kind, payload = self._read_record_at(self._messages[position])
+        if kind != REC_MESSAGE:
+            raise ValueError("コンテナのインデックスが壊れています")
+        record = json.loads(payload.decode("utf-8"))
+        msg = {"role": record["role"], "content": record["content"]}
+        if record.get("images"):
+            msg["image_paths"] = [self.image(i) if resolve_images else i for i in record["images"]]
+        return msg
+
+    def messages(self, start=0, stop=None):
+        """メッセージを1件ずつ読み込むイテレータ"""
+        for position in range(start, len(self._messages) if stop is None else stop):
+            yield self.read_message(position)
+
+    def last_turns_start(self, n):
+        """最新のnターンの先頭メッセージの位置"""
+        if n <= 0:
+            return len(self._messages)
+        return self._turns[-n] if n < len(self._turns) else 0
+
+    def last_turns(self, n):
+        """最新のnターン（質問とその回答）だけをシークして読み込む"""
+        return list(self.messages(self.last_turns_start(n)))
+
+    def load_json(self):
+        """JSON保存と同じ形のデータを返す（画像は番号のまま。imageで画像ソースに変換する）"""
+        return {
+            "metadata": dict(self.metadata),
+            "conversation": [self.read_message(i, resolve_images=False) for i in range(len(self._messages))]
+        }
+
+    def thumbnail_sources(self):
+        return {}
+
+    def close(self):
+        self._file.close()
+
+
+def write_container(history, model, path, created_at=None, progress=None):
+    """アプリの会話履歴をコンテナに保存する（assistantはMarkdownのまま）
+
+    一時ファイルに書き込み、書き終えてから保存先へ置き換える。
+    失敗した場合・progress（conversation_archive.ArchiveProgress）で中止された場合は
+    書きかけのファイルを削除して例外を送出する。進捗はメッセージ単位で報告する。
+    """
+    if progress:
+        sources = {source for msg in history for source in image_attachments.get_image_paths(msg)}
+        progress.start(len(history), sum(image_attachments.image_size(source) for source in sources))
+    writer = ContainerWriter(path + conversation_archive.TEMP_SUFFIX, model, created_at)
+    try:
+        seen = set()
+        for msg in history:
+            if msg["role"] == "assistant":
+                msg = {"role": "assistant", "content": msg.get("markdown", msg["content"])}
+            writer.add_message(msg)
+            if progress:
+                new_sources = set(image_attachments.get_image_paths(msg)) - seen
+                seen |= new_sources
+                progress.advance(sum(image_attachments.image_size(source) for source in new_sources))
+        writer.close()
+        os.replace(writer.path, path)
+    except Exception:
+        writer.abort()
+        raise
+
+
+def _saved_history(reader):
+    """JSON保存と同じ形の会話（画像は画像ソース）とメタデータを返す"""
+    data = reader.load_json()
+    conversation = data.get("conversation", data)
+    if not isinstance(conversation, list):
+        raise ValueError("不正な会話履歴ファイルです（conversationがリストではありません）")
+    history = []
+    for msg in conversation:
+        if not isinstance(msg, dict) or "role" not in msg or "content" not in msg:
+            raise ValueError("不正な会話履歴ファイルです（メッセージ形式エラー）")
+        item = {"role": msg["role"], "content": msg["content"]}
+        images = image_attachments.get_image_paths(msg)
+        if images:
+            item["image_paths"] = [reader.image(image) for image in images]
+        history.append(item)
+    return history, data.get("metadata", {}) if isinstance(data, dict) else {}
+
+
+class _JsonReader:
+    """画像なしのJSON保存ファイル（multi版）をArchiveReaderと同じ形で読む"""
+
+    def __init__(self, path):
+        with open(path, "r", encoding="utf-8") as f:
+            self.data = json.load(f)
+
+    def load_json(self):
+        return self.data
+
+    def image(self, member):
+        raise ValueError(f"JSONファイルの画像は変換できません（zip形式を使ってください）: {member}")
+
+    def close(self):
+        pass
+
+
+def _open_reader(path):
+    ext = os.path.splitext(path)[1].lower()
+    if ext == CONTAINER_EXTENSION:
+        return ContainerReader(path)
+    if ext == ".zip":
+        return conversation_archive.ArchiveReader(path)
+    if ext == ".json":
+        return _JsonReader(path)
+    raise ValueError(f"対応していない形式です: {path}")
+
+
+def open_conversation(path):
+    """保存ファイル（.json / .zip / .ctk）を開き、(開いたままの読み込み元, 会話, メタデータ)を返す
+
+    会話はJSON保存と同じ形（assistantはMarkdown、画像は読み込み元から必要時に読み込む画像ソース）。
+    画像を使い終えたら読み込み元をclose()する。
+    """
+    reader = _open_reader(path)
+    try:
+        history, metadata = _saved_history(reader)
+    except Exception:
+        reader.close()
+        raise
+    return reader, history, metadata
+
+
+def convert(src_path, dst_path):
+    """.json / .zip（JSON zip） / .ctk を相互に変換する"""
+    reader, history, metadata = open_conversation(src_path)
+    try:
+        model = metadata.get("model")
+        ext = os.path.splitext(dst_path)[1].lower()
+        if ext == CONTAINER_EXTENSION:
+            writer = ContainerWriter(dst_path, model, metadata.get("created_at"))
+            try:
+                for msg in history:
+                    writer.add_message(msg)
+                writer.close()
+            except Exception:
+                writer.abort()
+                raise
+        elif ext == ".zip":
+            # export_conversationはアプリの履歴（assistantはmarkdownキー）を受け取る
+            app_history = [
+                {"role": "assistant", "content": msg["content"], "markdown": msg["content"]}
+                if msg["role"] == "assistant" else msg
+                for msg in history
+            ]
+            json_name = os.path.splitext(os.path.basename(dst_path))[0] + ".json"
+            conversation_archive.export_conversation(app_history, model, json_zip_path=dst_path, json_name=json_name, incremental=False)
+        elif ext == ".json":
+            if any(image_attachments.get_image_paths(msg) for msg in history):
+                raise ValueError("画像付きの会話はJSONに変換できません（zip形式を使ってください）")
+            save_data = {
+                "metadata": {
+                    "created_at": metadata.get("created_at") or datetime.now().isoformat(),
+                    "model": model,
+                    "total_messages": len(history)
+                },
+                "conversation": history
+            }
+            with open(dst_path, "w", encoding="utf-8") as f:
+                json.dump(save_data, f, ensure_ascii=False, indent=2)
+        else:
+            raise ValueError(f"対応していない形式です: {dst_path}")
+    finally:
+        reader.close()
+
+
+def main(argv=None):
+    args = sys.argv[1:] if argv is None else argv
+    if len(args) != 2:
+        print("使い方: python -m claude_tk.conversation_container 入力ファイル 出力ファイル（.json / .zip / .ctk）", file=sys.stderr)
+        return 2
+    try:
+        convert(args[0], args[1])
+    except (OSError, ValueError) as e:
+        print(f"変換に失敗しました: {e}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,272 @@
+"""SQLiteによる会話履歴ストア（FTS5による全文検索付き）
+
+会話・メッセージ・モデル・日時・画像の参照を1つのデータベースファイルに保存する。
+メッセージ本文はFTS5で索引付けし、保存したファイルを開かずに検索・再開できる。
+日本語は単語の区切りがないため、使えればtrigramトークナイザを使う（3文字未満の検索語はLIKEで検索）。
+画像はジャーナルと同じ形式（メディアストアのパス、またはzipとメンバー）で参照する。
+"""
+import os
+import json
+import sqlite3
+from datetime import datetime
+try:
+    from claude_tk import image_attachments, conversation_journal, media_store
+except ImportError:  # スクリプトとして直接実行された場合
+    import image_attachments
+    import conversation_journal
+    import media_store
+
+DEFAULT_DB_PATH = "conversations.db"
+# 一覧に表示する会話タイトルの最大文字数
+TITLE_LENGTH = 50
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS conversations (
+    id INTEGER PRIMARY KEY,
+    title TEXT NOT NULL,
+    model TEXT,
+    created_at TEXT NOT NULL,
+    updated_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY,
+    conversation_id INTEGER NOT NULL REFERENCES conversations(id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    role TEXT NOT NULL,
+    content TEXT NOT NULL,
+    markdown TEXT,
+    model TEXT,
+    created_at TEXT NOT NULL,
+    UNIQUE (conversation_id, position)
+);
+CREATE TABLE IF NOT EXISTS images (
+    message_id INTEGER NOT NULL REFERENCES messages(id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    ref TEXT NOT NULL,
+    PRIMARY KEY (message_id, position)
+);
+CREATE TABLE IF NOT EXISTS sources (
+    path TEXT PRIMARY KEY,
+    mtime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    hash TEXT NOT NULL,
+    conversation_id INTEGER REFERENCES conversations(id) ON DELETE SET NULL
+);
+CREATE TRIGGER IF NOT EXISTS messages_ai AFTER INSERT ON messages BEGIN
+    INSERT INTO messages_fts(rowid, content) VALUES (new.id, new.content);
+END;
+CREATE TRIGGER IF NOT EXISTS messages_ad AFTER DELETE ON messages BEGIN
+    INSERT INTO messages_fts(messages_fts, rowid, content) VALUES ('delete', old.id, old.content);
+END;
+"""
+
+
+def fts_tokenizer(conn):
+    """使えるFTS5トークナイザ（trigramはSQLite 3.34以降）"""
+    try:
+        conn.execute("CREATE VIRTUAL TABLE temp.tokenizer_check USING fts5(x, tokenize='trigram')")
+        conn.execute("DROP TABLE temp.tokenizer_check")
+        return "trigram"
+    except sqlite3.OperationalError:
+        return "unicode61"
+
+
+def make_title(history):
+    """最初の質問から会話のタイトルを作る"""
+    for msg in history:
+        if msg["role"] == "user":
+            title = " ".join(msg["content"].split())
+            return title[:TITLE_LENGTH] + ("…" if len(title) > TITLE_LENGTH else "")
+    return "(無題)"
+
+
+class ConversationDB:
+    """会話履歴のSQLiteデータベース"""
+
+    def __init__(self, path=DEFAULT_DB_PATH, store=None):
+        self.path = path
+        self.store = store or media_store.MediaStore()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.conn = sqlite3.connect(path)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA foreign_keys = ON")
+        self.conn.execute("PRAGMA journal_mode = WAL")
+        with self.conn:
+            exists = self.conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE name = 'messages_fts'"
+            ).fetchone()
+            if not exists:
+                self.conn.execute(
+                    "CREATE VIRTUAL TABLE messages_fts USING fts5("
+                    f"content, content='messages', content_rowid='id', tokenize='{fts_tokenizer(self.conn)}')"
+                )
+            self.conn.executescript(_SCHEMA)
+        self.tokenizer = self.conn.execute(
+            "SELECT sql FROM sqlite_master WHERE name = 'messages_fts'"
+        ).fetchone()[0]
+
+    def save_conversation(self, history, model, conversation_id=None):
+        """会話を保存してIDを返す
+
+        同じIDで保存し直す場合、前回の保存から増えたメッセージだけを追加する。
+        """
+        now = datetime.now().isoformat()
+        with self.conn:
+            row = None
+            if conversation_id is not None:
+                row = self.conn.execute(
+                    "SELECT COUNT(m.id) AS n FROM conversations c LEFT JOIN messages m ON m.conversation_id = c.id "
+                    "WHERE c.id = ? GROUP BY c.id", (conversation_id,)
+                ).fetchone()
+            if row is None:
+                conversation_id = self.conn.execute(
+                    "INSERT INTO conversations (title, model, created_at, updated_at) VALUES (?, ?, ?, ?)",
+                    (make_title(history), model, now, now)
+                ).lastrowid
+                start = 0
+            else:
+                start = row["n"]
+                if start > len(history):
+                    # 保存済みの方が長い（別の会話に切り替わった）場合は入れ直す
+                    self.conn.execute("DELETE FROM messages WHERE conversation_id = ?", (conversation_id,))
+                    start = 0
+                self.conn.execute(
+                    "UPDATE conversations SET title = ?, model = ?, updated_at = ? WHERE id = ?",
+                    (make_title(history), model, now, conversation_id)
+                )
+            for position, msg in enumerate(history[start:], start):
+                image_refs = [
+                    conversation_journal.serialize_image(source, self.store)
+                    for source in image_attachments.get_image_paths(msg)
+                ]
+                self._insert_message(conversation_id, position, msg, image_refs, model, now)
+        return conversation_id
+
+    def _insert_message(self, conversation_id, position, msg, image_refs, model, created_at):
+        message_id = self.conn.execute(
+            "INSERT INTO messages (conversation_id, position, role, content, markdown, model, created_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (conversation_id, position, msg["role"], msg["content"], msg.get("markdown"), model, created_at)
+        ).lastrowid
+        self.conn.executemany(
+            "INSERT INTO images (message_id, position, ref) VALUES (?, ?, ?)",
+            [(message_id, i, json.dumps(ref, ensure_ascii=False)) for i, ref in enumerate(image_refs)]
+        )
+
+    # 既存の保存ファイルの索引（conversation_indexer用）。トランザクションは呼び出し側で管理する
+
+    def source_states(self):
+        """索引済みファイルの{パス: (更新時刻ns, サイズ, ハッシュ)}"""
+        return {
+            row["path"]: (row["mtime_ns"], row["size"], row["hash"])
+            for row in self.conn.execute("SELECT path, mtime_ns, size, hash FROM sources")
+        }
+
+    def index_source(self, path, mtime_ns, size, digest, conversation=None):
+        """ファイルから読み込んだ会話を登録する（以前の内容は置き換える）
+
+        conversationは{"model", "created_at", "messages"}で、各メッセージの画像は"image_refs"に
+        ジャーナルと同じ形式で持つ。会話でないファイルはNoneとして記録し、次回は読み込まない。
+        """
+        self.remove_source(path)
+        conversation_id = None
+        if conversation is not None:
+            messages = conversation["messages"]
+            model = conversation.get("model")
+            created_at = conversation.get("created_at") or datetime.fromtimestamp(mtime_ns / 1e9).isoformat()
+            conversation_id = self.conn.execute(
+                "INSERT INTO conversations (title, model, created_at, updated_at) VALUES (?, ?, ?, ?)",
+                (make_title(messages), model, created_at, created_at)
+            ).lastrowid
+            for position, msg in enumerate(messages):
+                self._insert_message(conversation_id, position, msg, msg.get("image_refs", []), model, created_at)
+        self.conn.execute(
+            "INSERT INTO sources (path, mtime_ns, size, hash, conversation_id) VALUES (?, ?, ?, ?, ?)",
+            (path, mtime_ns, size, digest, conversation_id)
+        )
+        return conversation_id
+
+    def touch_source(self, path, mtime_ns, size):
+        """内容が変わっていないファイルの更新時刻だけを記録し直す"""
+        self.conn.execute("UPDATE sources SET mtime_ns = ?, size = ? WHERE path = ?", (mtime_ns, size, path))
+
+    def remove_source(self, path):
+        """ファイルの索引と、そこから登録した会話を削除する"""
+        row = self.conn.execute("SELECT conversation_id FROM sources WHERE path = ?", (path,)).fetchone()
+        if row is None:
+            return
+        if row["conversation_id"] is not None:
+            self.conn.execute("DELETE FROM conversations WHERE id = ?", (row["conversation_id"],))
+        self.conn.execute("DELETE FROM sources WHERE path = ?", (path,))
+
+    def search(self, query, limit=50):
+        """本文を全文検索し、ヒットしたメッセージを関連度順に返す
+
+        各行はconversation_id, title, model, updated_at, position, role, snippetを持つ。
+        """
+        query = query.strip()
+        if not query:
+            return []
+        columns = ("c.id AS conversation_id, c.title, c.model, c.updated_at, m.position, m.role, ")
+        if "trigram" in self.tokenizer and len(query) < 3:
+            # trigramは3文字未満の語を索引で引けない
+            pattern = "%" + query.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+            return self.conn.execute(
+                f"SELECT {columns} substr(m.content, max(1, instr(m.content, ?) - 20), 60) AS snippet "
+                "FROM messages m JOIN conversations c ON c.id = m.conversation_id "
+                "WHERE m.content LIKE ? ESCAPE '\\' ORDER BY c.updated_at DESC, m.position LIMIT ?",
+                (query, pattern, limit)
+            ).fetchall()
+        # 検索語はフレーズとして扱う（FTS5の演算子として解釈させない）
+        phrase = '"' + query.replace('"', '""') + '"'
+        return self.conn.execute(
+            f"SELECT {columns} snippet(messages_fts, 0, '[', ']', '…', 16) AS snippet "
+            "FROM messages_fts JOIN messages m ON m.id = messages_fts.rowid "
+            "JOIN conversations c ON c.id = m.conversation_id "
+            "WHERE messages_fts MATCH ? ORDER BY bm25(messages_fts) LIMIT ?",
+            (phrase, limit)
+        ).fetchall()
+
+    def load_conversation(self, conversation_id):
+        """会話を読み込み、(履歴, モデル, 開いたzipのリスト)を返す"""
+        row = self.conn.execute("SELECT model FROM conversations WHERE id = ?", (conversation_id,)).fetchone()
+        if row is None:
+            raise KeyError(f"会話が見つかりません: {conversation_id}")
+        images = {}
+        for image in self.conn.execute(
+            "SELECT i.message_id, i.ref FROM images i JOIN messages m ON m.id = i.message_id "
+            "WHERE m.conversation_id = ? ORDER BY i.message_id, i.position", (conversation_id,)
+        ):
+            images.setdefault(image["message_id"], []).append(json.loads(image["ref"]))
+        archives = {}
+        history = []
+        for msg in self.conn.execute(
+            "SELECT id, role, content, markdown FROM messages WHERE conversation_id = ? ORDER BY position",
+            (conversation_id,)
+        ):
+            item = {"role": msg["role"], "content": msg["content"]}
+            if msg["markdown"] is not None:
+                item["markdown"] = msg["markdown"]
+            if msg["id"] in images:
+                item["image_paths"] = [conversation_journal.deserialize_image(ref, archives) for ref in images[msg["id"]]]
+            history.append(item)
+        return history, row["model"], [archive for archive in archives.values() if archive is not None]
+
+    def question_answer_pairs(self):
+        """会話の最初の質問（画像なし）とその直後の回答（Markdown）の組を返す（似た質問の索引用）
+
+        続きの質問は前の会話がなければ意味が決まらないため含めない。
+        """
+        return [
+            (row["question"], row["answer"]) for row in self.conn.execute(
+                "SELECT q.content AS question, COALESCE(a.markdown, a.content) AS answer "
+                "FROM messages q JOIN messages a ON a.conversation_id = q.conversation_id AND a.position = q.position + 1 "
+                "WHERE q.role = 'user' AND q.position = 0 AND a.role = 'assistant' "
+                "AND NOT EXISTS (SELECT 1 FROM images i WHERE i.message_id = q.id) "
+                "ORDER BY q.id"
+            )
+        ]
+
+    def close(self):
+        self.conn.close()
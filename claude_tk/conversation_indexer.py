@@ -0,0 +1,250 @@
+"""保存済みの会話ファイルを会話データベースにまとめて索引付けするコマンド
+
+各アプリの保存ダイアログで作成したファイルをディレクトリごと走査し、
+プロセスプールで並列に読み込んで1つの会話データベース（conversation_db）に登録する。
+
+対応する形式:
+- JSON（simple版の質問・回答、multi版の会話履歴）
+- Markdown（simple版の「# 質問」「# 回答」、multi版の「## 質問n」「## 回答n」）
+- ZIP（image版・multi_image版のJSON zip、Markdown zip）
+
+2回目以降は更新時刻とサイズが変わったファイルだけを読み込み、
+内容ハッシュも同じなら読み込み直さない。削除されたファイルの会話は索引から取り除く。
+
+使い方:
+    python -m claude_tk.conversation_indexer 保存先ディレクトリ [--db conversations.db] [--workers N] [--full]
+"""
+import os
+import re
+import sys
+import json
+import zipfile
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from dotenv import load_dotenv
+try:
+    from claude_tk import conversation_archive, conversation_db, image_attachments, media_store
+except ImportError:  # スクリプトとして直接実行された場合
+    import conversation_archive
+    import conversation_db
+    import image_attachments
+    import media_store
+
+INDEX_EXTENSIONS = (".json", ".md", ".zip")
+# この件数ごとにデータベースへコミットする
+COMMIT_INTERVAL = 500
+# 1回にワーカープロセスへ渡すファイル数
+CHUNK_SIZE = 32
+
+_HEADING_RE = re.compile(r"^#{1,2} (質問|回答)\d*\s*$", re.MULTILINE)
+_MD_IMAGE_RE = re.compile(r"^!\[[^\]]*\]\(([^)]+)\)\s*$|^\[画像保存エラー: [^\]]*\]\s*$", re.MULTILINE)
+
+
+def iter_files(root):
+    """索引対象のファイルを(パス, 更新時刻ns, サイズ)で列挙する"""
+    stack = [root]
+    while stack:
+        try:
+            entries = os.scandir(stack.pop())
+        except OSError:
+            continue
+        with entries:
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        if not entry.name.startswith("."):
+                            stack.append(entry.path)
+                    elif entry.name.lower().endswith(INDEX_EXTENSIONS) and entry.is_file():
+                        st = entry.stat()
+                        yield os.path.abspath(entry.path), st.st_mtime_ns, st.st_size
+                except OSError:
+                    continue
+
+
+def _image_ref(member, zip_path, base_dir):
+    """画像の参照をジャーナルと同じ形式にする（zip内のメンバー、またはファイルからの相対パス）"""
+    if zip_path:
+        return {"zip": zip_path, "member": member}
+    return {"path": os.path.join(base_dir, member)}
+
+
+def parse_json_data(data, zip_path=None, base_dir=""):
+    """保存JSONのdictを{"model", "created_at", "messages"}に変換する（会話でなければNone）"""
+    if not isinstance(data, dict):
+        return None
+    metadata = data.get("metadata") if isinstance(data.get("metadata"), dict) else {}
+    messages = []
+    if isinstance(data.get("conversation"), list):
+        # multi版・multi_image版の会話履歴
+        for msg in data["conversation"]:
+            if not isinstance(msg, dict) or "role" not in msg or "content" not in msg:
+                return None
+            item = {"role": msg["role"], "content": str(msg["content"])}
+            if msg["role"] == "assistant":
+                item["markdown"] = item["content"]
+            refs = [_image_ref(member, zip_path, base_dir) for member in image_attachments.get_image_paths(msg)]
+            if refs:
+                item["image_refs"] = refs
+            messages.append(item)
+    else:
+        # simple版は直下に、image版は"qa"に質問・回答を保存している
+        qa = data.get("qa") if isinstance(data.get("qa"), dict) else data
+        if "question" not in qa or "answer" not in qa:
+            return None
+        question = {"role": "user", "content": str(qa["question"])}
+        if qa.get("image_path"):
+            question["image_refs"] = [_image_ref(qa["image_path"], zip_path, base_dir)]
+        messages = [question, {"role": "assistant", "content": str(qa["answer"]), "markdown": str(qa["answer"])}]
+    return {"model": metadata.get("model"), "created_at": metadata.get("created_at"), "messages": messages}
+
+
+def parse_markdown(text, zip_path=None, base_dir=""):
+    """保存Markdownを{"model", "created_at", "messages"}に変換する（会話でなければNone）"""
+    parts = _HEADING_RE.split(text)
+    if len(parts) < 3:
+        return None
+    messages = []
+    # parts = [見出し前, 種類, 本文, 種類, 本文, ...]
+    for kind, body in zip(parts[1::2], parts[2::2]):
+        refs = [_image_ref(m.group(1), zip_path, base_dir) for m in _MD_IMAGE_RE.finditer(body) if m.group(1)]
+        content = _MD_IMAGE_RE.sub("", body).strip()
+        if kind == "質問":
+            item = {"role": "user", "content": content}
+            if refs:
+                item["image_refs"] = refs
+        else:
+            item = {"role": "assistant", "content": content, "markdown": content}
+        messages.append(item)
+    return {"model": None, "created_at": None, "messages": messages}
+
+
+def parse_file(path):
+    """保存ファイルから会話を読み込む（会話でなければNone）
+
+    zipは中央ディレクトリと会話のJSON/Markdownだけを読み、画像は読み込まない。
+    """
+    ext = os.path.splitext(path)[1].lower()
+    base_dir = os.path.dirname(path)
+    if ext == ".json":
+        with open(path, "r", encoding="utf-8-sig") as f:
+            return parse_json_data(json.load(f), base_dir=base_dir)
+    if ext == ".md":
+        with open(path, "r", encoding="utf-8-sig") as f:
+            return parse_markdown(f.read(), base_dir=base_dir)
+    if ext == ".zip":
+        with zipfile.ZipFile(path) as zipf:
+            latest = conversation_archive.latest_infos(zipf)
+            json_name = conversation_archive.find_json_name(latest)
+            if json_name:
+                return parse_json_data(json.loads(zipf.read(latest[json_name]).decode("utf-8-sig")), path)
+            md_name = next((name for name in latest if name.endswith(".md") and "/" not in name), None)
+            if md_name:
+                return parse_markdown(zipf.read(latest[md_name]).decode("utf-8-sig"), path)
+    return None
+
+
+def index_file(task):
+    """ワーカープロセスで1ファイルを読み込む
+
+    taskは(パス, 前回のハッシュ)。戻り値は(パス, ハッシュ, 会話, エラー)で、
+    ハッシュが前回と同じ場合は読み込みを省略して会話をNoneのまま返す。
+    """
+    path, known_hash = task
+    try:
+        digest = media_store.file_digest(path)
+        if digest == known_hash:
+            return path, digest, None, None
+        try:
+            conversation = parse_file(path)
+        except (ValueError, KeyError, TypeError, zipfile.BadZipFile):
+            conversation = None  # 会話の保存ファイルではない
+        return path, digest, conversation, None
+    except OSError as e:
+        return path, None, None, str(e)
+
+
+def build_index(root, db, workers=None, full=False, progress=None):
+    """rootの保存ファイルをdbに索引付けし、件数の集計を返す"""
+    states = {} if full else db.source_states()
+    root_prefix = os.path.join(os.path.abspath(root), "")
+    files = {}
+    tasks = []
+    for path, mtime_ns, size in iter_files(root):
+        files[path] = (mtime_ns, size)
+        state = states.get(path)
+        if state and state[:2] == (mtime_ns, size):
+            continue
+        tasks.append((path, state[2] if state else None))
+    stats = {"files": len(files), "indexed": 0, "unchanged": len(files) - len(tasks), "skipped": 0, "removed": 0, "errors": 0}
+    with db.conn:
+        if full:
+            for path in db.source_states():
+                if path.startswith(root_prefix):
+                    db.remove_source(path)
+        else:
+            for path in states:
+                if path.startswith(root_prefix) and path not in files:
+                    db.remove_source(path)
+                    stats["removed"] += 1
+    if not tasks:
+        return stats
+    if workers == 1 or len(tasks) < CHUNK_SIZE:
+        results = map(index_file, tasks)
+        executor = None
+    else:
+        executor = ProcessPoolExecutor(max_workers=workers)
+        results = executor.map(index_file, tasks, chunksize=CHUNK_SIZE)
+    try:
+        pending = 0
+        for done, (path, digest, conversation, error) in enumerate(results, 1):
+            mtime_ns, size = files[path]
+            if error is not None:
+                stats["errors"] += 1
+                if progress:
+                    progress(f"エラー: {path}: {error}")
+            elif conversation is None and not full and states.get(path, (None, None, None))[2] == digest:
+                db.touch_source(path, mtime_ns, size)
+                stats["unchanged"] += 1
+            else:
+                db.index_source(path, mtime_ns, size, digest, conversation)
+                stats["indexed" if conversation is not None else "skipped"] += 1
+            pending += 1
+            if pending >= COMMIT_INTERVAL:
+                db.conn.commit()
+                pending = 0
+                if progress:
+                    progress(f"{done}/{len(tasks)}件を処理しました")
+        db.conn.commit()
+    except BaseException:
+        db.conn.rollback()
+        raise
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+    return stats
+
+
+def main(argv=None):
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="保存済みの会話ファイルを会話データベースに索引付けします")
+    parser.add_argument("root", help="保存ファイルを探すディレクトリ")
+    parser.add_argument("--db", default=os.getenv("CLAUDE_TK_DB") or conversation_db.DEFAULT_DB_PATH, help="会話データベースのパス")
+    parser.add_argument("--workers", type=int, default=None, help="ワーカープロセス数（既定はCPUコア数）")
+    parser.add_argument("--full", action="store_true", help="更新されていないファイルも読み込み直す")
+    args = parser.parse_args(argv)
+    if not os.path.isdir(args.root):
+        parser.error(f"ディレクトリが見つかりません: {args.root}")
+    db = conversation_db.ConversationDB(args.db)
+    try:
+        stats = build_index(args.root, db, workers=args.workers, full=args.full, progress=lambda msg: print(msg, file=sys.stderr))
+    finally:
+        db.close()
+    print(
+        f"{stats['files']}件中 登録: {stats['indexed']} 変更なし: {stats['unchanged']} "
+        f"会話以外: {stats['skipped']} 削除: {stats['removed']} エラー: {stats['errors']}"
+    )
+    return 1 if stats["errors"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,279 @@
+"""会話履歴の追記型ジャーナル（クラッシュ時の自動復元用）
+
+conversation_historyにメッセージが追加されるたびに1行（JSONL）だけ追記するため、
+1ターンあたりの書き込み量は履歴の長さに依存しない。
+fsyncは一定間隔でまとめて行い、アプリが異常終了しても直前までの会話を復元できる。
+保存済み・破棄済みのジャーナルは削除し、残っているものを次回起動時に復元候補として提示する。
+先頭行に書いたプロセスIDのプロセスが動いている（別に起動したアプリが使っている）ジャーナルは提示しない。
+"""
+import os
+import sys
+import json
+import glob
+import threading
+from datetime import datetime
+try:
+    from claude_tk import image_attachments, conversation_archive, media_store
+except ImportError:  # スクリプトとして直接実行された場合
+    import image_attachments
+    import conversation_archive
+    import media_store
+
+DEFAULT_JOURNAL_DIR = "journal"
+# fsyncをまとめて行う間隔（秒）
+FSYNC_INTERVAL = 1.0
+
+
+def serialize_image(source, store):
+    """画像ソースをジャーナル用のdictに変換（メモリ上の画像はメディアストアに書き出す）"""
+    if isinstance(source, conversation_archive.ZipImage):
+        return {"zip": os.path.abspath(source.archive.path), "member": source.member}
+    if isinstance(source, image_attachments.MemoryImage):
+        return {"path": os.path.abspath(store.add_bytes(source.data, media_store.image_extension(source)))}
+    return {"path": os.path.abspath(source)}
+
+
+def deserialize_image(record, archives):
+    """ジャーナルのdictを画像ソースに戻す（zipはパスごとに1つだけ開く）"""
+    if "zip" in record:
+        zip_path = record["zip"]
+        if zip_path not in archives:
+            try:
+                archives[zip_path] = conversation_archive.ArchiveReader(zip_path)
+            except (OSError, ValueError):
+                archives[zip_path] = None
+        if archives[zip_path] is None:
+            # zipが見つからない場合は表示エラーになるパスとして残す
+            return os.path.join(zip_path, record["member"])
+        return archives[zip_path].image(record["member"])
+    return record["path"]
+
+
+def serialize_message(msg, store):
+    """履歴のメッセージをJSONに書けるdictに変換する（画像はserialize_imageの形式）"""
+    record = {"role": msg["role"], "content": msg["content"]}
+    if "markdown" in msg:
+        record["markdown"] = msg["markdown"]
+    images = image_attachments.get_image_paths(msg)
+    if images:
+        record["images"] = [serialize_image(source, store) for source in images]
+    if msg.get("file_ids"):
+        record["file_ids"] = list(msg["file_ids"])
+    if msg.get("cached"):
+        record["cached"] = True
+    if msg.get("reused_from"):
+        record["reused_from"] = msg["reused_from"]
+    return record
+
+
+def deserialize_message(record, archives):
+    """serialize_messageのdictを履歴のメッセージに戻す"""
+    msg = {"role": record["role"], "content": record["content"]}
+    if "markdown" in record:
+        msg["markdown"] = record["markdown"]
+    if record.get("images"):
+        msg["image_paths"] = [deserialize_image(image, archives) for image in record["images"]]
+    if record.get("file_ids"):
+        msg["file_ids"] = list(record["file_ids"])
+    if record.get("cached"):
+        msg["cached"] = True
+    if record.get("reused_from"):
+        msg["reused_from"] = record["reused_from"]
+    return msg
+
+
+class ConversationJournal:
+    """1つの会話セッションのジャーナルファイル"""
+
+    def __init__(self, journal_dir=DEFAULT_JOURNAL_DIR, store=None, fsync_interval=FSYNC_INTERVAL):
+        self.journal_dir = journal_dir
+        self.store = store or media_store.MediaStore()
+        self.fsync_interval = fsync_interval
+        self.path = None
+        self._file = None
+        self._dirty = False
+        self._unsaved = False
+        self._lock = threading.Lock()
+        self._stop = None  # fsyncスレッドの停止用
+
+    def _open(self):
+        """最初の書き込み時にファイルを作成する"""
+        os.makedirs(self.journal_dir, exist_ok=True)
+        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S_%f')
+        self.path = os.path.join(self.journal_dir, f"session_{timestamp}_{os.getpid()}.jsonl")
+        self._file = open(self.path, "a", encoding="utf-8")
+        # 別に起動したアプリが使用中のジャーナルを復元候補にしないよう、プロセスIDを記録する
+        self._file.write(json.dumps({"type": "session", "pid": os.getpid()}) + "\n")
+        self._stop = threading.Event()
+        threading.Thread(target=self._fsync_loop, args=(self._stop,), name="claude_tk_journal", daemon=True).start()
+
+    def _write(self, record):
+        with self._lock:
+            if self._file is None:
+                self._open()
+            self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+            self._file.flush()  # プロセスが落ちてもOSのバッファには残る
+            self._dirty = True
+
+    def _fsync_loop(self, stop):
+        while not stop.wait(self.fsync_interval):
+            self.sync()
+
+    def sync(self):
+        """未同期の書き込みがあればfsyncする"""
+        with self._lock:
+            if self._file is not None and self._dirty:
+                os.fsync(self._file.fileno())
+                self._dirty = False
+
+    def append(self, msg, model=None):
+        """履歴に追加したメッセージを1行追記する"""
+        record = {"type": "message", **serialize_message(msg, self.store)}
+        if model:
+            record["model"] = model
+        self._write(record)
+        self._unsaved = True
+
+    def append_all(self, history, model=None):
+        """再開した会話など、既存の履歴をまとめて記録する"""
+        for msg in history:
+            self.append(msg, model)
+
+    def pop(self):
+        """送信に失敗して履歴から取り除いた最後のメッセージを取り消す"""
+        self._write({"type": "pop"})
+
+    def set_file_ids(self, file_ids):
+        """最後のメッセージの画像を送信時にFiles APIでアップロードしたファイルIDを記録する"""
+        self._write({"type": "file_ids", "file_ids": list(file_ids)})
+
+    def mark_saved(self):
+        """ファイルに保存済みであることを記録する"""
+        if self._file is not None:
+            self._write({"type": "saved", "at": datetime.now().isoformat()})
+            self.sync()
+        self._unsaved = False
+
+    def has_unsaved(self):
+        return self._unsaved
+
+    def discard(self):
+        """ジャーナルを閉じて削除する（保存済み・破棄した会話）"""
+        self.close()
+        if self.path and os.path.exists(self.path):
+            os.remove(self.path)
+        self.path = None
+        self._unsaved = False
+
+    def reset(self):
+        """会話をクリアしたときに新しいジャーナルに切り替える（次の書き込みで新しいファイルを作成）"""
+        self.discard()
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.flush()
+                os.fsync(self._file.fileno())
+                self._file.close()
+                self._file = None
+            self._dirty = False
+            if self._stop is not None:
+                self._stop.set()
+                self._stop = None
+
+
+def _process_alive(pid):
+    """プロセスIDのプロセスが動いているか"""
+    if sys.platform == "win32":
+        # Windowsのos.killはプロセスを終了させるため、OpenProcessで確かめる
+        import ctypes
+        kernel32 = ctypes.windll.kernel32
+        handle = kernel32.OpenProcess(0x1000, False, pid)  # PROCESS_QUERY_LIMITED_INFORMATION
+        if not handle:
+            return kernel32.GetLastError() == 5  # ERROR_ACCESS_DENIED: 他のユーザーのプロセス
+        try:
+            code = ctypes.c_ulong()
+            return bool(kernel32.GetExitCodeProcess(handle, ctypes.byref(code))) and code.value == 259  # STILL_ACTIVE
+        finally:
+            kernel32.CloseHandle(handle)
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True  # 他のユーザーのプロセス
+    except OSError:
+        return False
+    return True
+
+
+def session_pid(path):
+    """ジャーナルを書いたプロセスのID（記録のない古いジャーナルはNone）"""
+    with open(path, "r", encoding="utf-8") as f:
+        try:
+            header = json.loads(f.readline())
+        except ValueError:
+            return None
+    if isinstance(header, dict) and header.get("type") == "session" and isinstance(header.get("pid"), int):
+        return header["pid"]
+    return None
+
+
+def in_use_by_other_process(path):
+    """別に起動して動いているアプリのジャーナルか（このプロセスのものはFalse）"""
+    pid = session_pid(path)
+    return pid is not None and pid != os.getpid() and _process_alive(pid)
+
+
+def find_unsaved_sessions(journal_dir=DEFAULT_JOURNAL_DIR, exclude=None):
+    """未保存のメッセージが残っているジャーナルを新しい順に返す
+
+    別に起動して動いているアプリのジャーナルは、そのアプリが書き込み中のため含めない
+    （異常終了したプロセスのIDを別のプロセスが使っている間も含めない）。
+    """
+    sessions = []
+    for path in glob.glob(os.path.join(journal_dir, "session_*.jsonl")):
+        if exclude and os.path.abspath(path) == os.path.abspath(exclude):
+            continue
+        if in_use_by_other_process(path):
+            continue
+        messages, _ = read_session(path)
+        if messages is not None:
+            sessions.append(path)
+    return sorted(sessions, key=os.path.getmtime, reverse=True)
+
+
+def read_session(path):
+    """ジャーナルを読み、(未保存分を含む場合は履歴のレコード, モデル)を返す
+
+    保存済みの記録以降にメッセージがない場合、履歴はNone。
+    書き込み途中で途切れた最終行は無視する。
+    """
+    records = []
+    unsaved = False
+    model = None
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                break
+            if record.get("type") == "saved":
+                unsaved = False
+            elif record.get("type") == "message":
+                records.append(record)
+                unsaved = True
+                model = record.get("model", model)
+            elif record.get("type") == "pop" and records:
+                records.pop()
+            elif record.get("type") == "file_ids" and records:
+                records[-1]["file_ids"] = record["file_ids"]
+    return (records if unsaved else None), model
+
+
+def load_session(path):
+    """ジャーナルから会話履歴を復元し、(履歴, モデル, 開いたzipのリスト)を返す"""
+    records, model = read_session(path)
+    archives = {}
+    history = [deserialize_message(record, archives) for record in records or []]
+    return history, model, [archive for archive in archives.values() if archive is not None]
@@ -0,0 +1,96 @@
+"""Files APIによる添付画像のアップロード（1回だけアップロードしてファイルIDで参照する）
+
+.envのCLAUDE_TK_FILES_APIを設定すると、添付画像をFiles APIでアップロードし、返されたファイルIDを
+履歴のメッセージ（file_ids）に残す。以降のリクエストは画像をbase64で送り直さずにIDで参照するため、
+過去の質問の画像も毎回の送信量を増やさずに文脈に含められる。
+内容ハッシュ→ファイルIDの対応はメディアストアのfile_ids.jsonに保存し、再起動後も同じ画像は
+アップロードしない（ファイルIDはAPIキーごとのため、キーが変わった場合は対応を捨てる）。
+"""
+import os
+import json
+import hashlib
+import threading
+try:
+    from claude_tk import image_attachments, media_store
+except ImportError:  # スクリプトとして直接実行された場合
+    import image_attachments
+    import media_store
+
+FILES_API_BETA = "files-api-2025-04-14"
+FILE_MAP_NAME = "file_ids.json"
+
+
+def account_key(api_key):
+    """APIキーを保存せずに区別するための短いハッシュ"""
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:16]
+
+
+class FileIdMap:
+    """内容ハッシュ→ファイルIDの対応（JSONファイルに保存）"""
+
+    def __init__(self, path, account):
+        self.path = path
+        self.account = account
+        self._ids = {}
+        self._lock = threading.Lock()
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        if isinstance(data, dict) and data.get("account") == account and isinstance(data.get("files"), dict):
+            self._ids = data["files"]
+
+    def get(self, digest):
+        with self._lock:
+            return self._ids.get(digest)
+
+    def set(self, digest, file_id):
+        with self._lock:
+            self._ids[digest] = file_id
+            self._save()
+
+    def _save(self):
+        """一時ファイルに書いてから置き換える（書き込み中に終了しても対応が壊れない）"""
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"account": self.account, "files": self._ids}, f)
+            os.replace(tmp_path, self.path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+
+class FileUploader:
+    """画像ソースをアップロードし、同じ内容の画像には保存してあるファイルIDを返す"""
+
+    def __init__(self, client, map_path, api_key):
+        self.client = client
+        self.file_map = FileIdMap(map_path, account_key(api_key))
+
+    def upload(self, source):
+        """画像1枚のファイルIDを返す（未アップロードなら縮小・変換してからアップロード）"""
+        digest = media_store.content_hash(source)
+        file_id = self.file_map.get(digest)
+        if file_id:
+            return file_id
+        data, mime_type = image_attachments.preprocess_image(source)
+        metadata = self.client.beta.files.upload(
+            file=(image_attachments.image_name(source), data, mime_type),
+            betas=[FILES_API_BETA]
+        )
+        self.file_map.set(digest, metadata.id)
+        return metadata.id
+
+    def upload_all(self, sources):
+        """複数画像を並列にアップロードし、入力と同じ順序でファイルIDのリストを返す"""
+        if len(sources) == 1:
+            return [self.upload(sources[0])]
+        return list(image_attachments.get_executor().map(self.upload, sources))
+
+    def known_ids(self, sources):
+        """すべてアップロード済みならファイルIDのリスト、そうでなければNone（アップロードはしない）"""
+        file_ids = [self.file_map.get(media_store.content_hash(source)) for source in sources]
+        return file_ids if all(file_ids) else None
@@ -0,0 +1,645 @@
+"""ローカルのHTTPゲートウェイ（他のスクリプトから会話を使う）
+
+1つのAPIクライアント（接続プールを共有）・レート制限・応答キャッシュをすべての呼び出し元で共有し、
+会話履歴と保存形式（.zip / .json / .ctk）はアプリ・端末の対話モード（cli.py）と同じものを使う。
+
+使い方:
+    python -m claude_tk.gateway [--host 127.0.0.1] [--port 8765] [--dir gateway]
+
+エンドポイント（リクエストは「Content-Type: application/json」、レスポンスはJSON）:
+    POST /conversations        {"model"}                          → 会話を作る
+    GET  /conversations/<id>                                      → 会話の内容（assistantはMarkdown）
+    DELETE /conversations/<id>                                    → 会話を破棄する
+    POST /send    {"conversation_id", "question", "images", "model"} → 回答（conversation_idを省略すると新しい会話）
+    POST /stream  （/sendと同じ）                                  → Server-Sent Events（text, done, error）
+    POST /count   {"conversation_id", "question", "images"}        → 送った場合の入力トークン数（count_tokens API）
+    POST /save    {"conversation_id", "path"}                      → 会話を保存する（形式は拡張子で判定）
+    POST /resume  {"path", "model"}                                → 保存した会話を新しい会話として読み込む
+                                                                     （pathは保存用ディレクトリ内のみ）
+    GET  /stats                                                   → エンドポイントごとの待ち時間・レート制限の状態
+
+imagesは添付する画像ファイルのパス（ゲートウェイから読めるもの）のリスト。
+すべてのリクエストに「Authorization: Bearer <トークン>」が必要で、トークンは.envのCLAUDE_TK_GATEWAY_TOKEN
+（設定がなければ起動時に作って表示する）。ブラウザから他のサイト経由で使われないよう、
+Hostがこのマシン以外のもの・Originが付いたもの・JSON以外のContent-TypeのPOSTは拒否する。
+保存・再開できるのは.envのCLAUDE_TK_GATEWAY_DIR（既定はgateway/）の中のファイルだけ。
+使い終わった会話はDELETEで破棄する。破棄されずに残った会話は、新しい会話を作るときに
+.envのCLAUDE_TK_GATEWAY_IDLE_MINUTES（既定60分）より長く使われていないものと、
+CLAUDE_TK_GATEWAY_MAX_CONVERSATIONS（既定100）を超えた分の最も長く使われていないものを破棄する（0なら破棄しない）。
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import secrets
+import argparse
+import zipfile
+import threading
+from collections import defaultdict, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from dotenv import load_dotenv
+try:
+    from claude_tk import cli, media_store, output_limits, response_cache
+except ImportError:  # スクリプトとして直接実行された場合
+    import cli
+    import media_store
+    import output_limits
+    import response_cache
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+# 受け付けるHost（このマシン自身を表す名前）
+LOOPBACK_HOSTS = ("127.0.0.1", "localhost", "::1")
+# /save・/resumeで使えるディレクトリ（.envのCLAUDE_TK_GATEWAY_DIRで変更可）
+DEFAULT_DATA_DIR = "gateway"
+# レート制限（.envのCLAUDE_TK_GATEWAY_RPMは1分あたりのリクエスト数、0なら制限なし）
+DEFAULT_REQUESTS_PER_MINUTE = 50
+DEFAULT_MAX_CONCURRENT_REQUESTS = 4
+# 保持する会話の数と、使われないまま保持する時間（分）（.envのCLAUDE_TK_GATEWAY_MAX_CONVERSATIONS・
+# CLAUDE_TK_GATEWAY_IDLE_MINUTESで変更可、0なら制限なし）
+DEFAULT_MAX_CONVERSATIONS = 100
+DEFAULT_IDLE_MINUTES = 60
+# 待ち時間の統計に使う直近のリクエスト数（エンドポイントごと）
+LATENCY_WINDOW = 1000
+
+
+class GatewayError(Exception):
+    """HTTPのステータスコード付きのエラー"""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def _env_int(name, default):
+    try:
+        return int(os.getenv(name) or default)
+    except ValueError:
+        return default
+
+
+class RateLimiter:
+    """APIへのリクエストの間隔（1分あたりの数、burst件までは続けて送れる）と同時に送る数を制限する"""
+
+    def __init__(self, requests_per_minute=DEFAULT_REQUESTS_PER_MINUTE, max_concurrent=DEFAULT_MAX_CONCURRENT_REQUESTS, burst=None):
+        self.interval = 60.0 / requests_per_minute if requests_per_minute > 0 else 0.0
+        self.burst = max(1, burst or max_concurrent)
+        self._slots = threading.Semaphore(max(1, max_concurrent))
+        self._lock = threading.Lock()
+        self._tat = 0.0  # 次のリクエストを間隔どおりに送れる時刻
+        self.waiting = 0
+        self.in_flight = 0
+        self.requests = 0
+        self.total_wait = 0.0
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            _env_int("CLAUDE_TK_GATEWAY_RPM", DEFAULT_REQUESTS_PER_MINUTE),
+            _env_int("CLAUDE_TK_MAX_CONCURRENT_REQUESTS", DEFAULT_MAX_CONCURRENT_REQUESTS),
+        )
+
+    def acquire(self):
+        """送ってよくなるまで待つ（送り終えたらrelease()を呼ぶ）"""
+        start = time.monotonic()
+        with self._lock:
+            self.waiting += 1
+        self._slots.acquire()
+        with self._lock:
+            now = time.monotonic()
+            tat = max(self._tat, now)
+            at = max(now, tat - (self.burst - 1) * self.interval)
+            self._tat = tat + self.interval
+        if at > now:
+            time.sleep(at - now)
+        with self._lock:
+            self.waiting -= 1
+            self.in_flight += 1
+            self.requests += 1
+            self.total_wait += time.monotonic() - start
+
+    def release(self):
+        with self._lock:
+            self.in_flight -= 1
+        self._slots.release()
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "in_flight": self.in_flight,
+                "waiting": self.waiting,
+                "mean_wait_ms": round(self.total_wait / self.requests * 1000, 1) if self.requests else 0.0,
+            }
+
+
+class _LimitedStream:
+    """ストリーミングの応答（読み終えるか閉じるまで同時に送る数の枠を使う）"""
+
+    def __init__(self, stream, release):
+        self._stream = stream
+        self._release = release
+
+    def __iter__(self):
+        try:
+            yield from self._stream
+        finally:
+            self.close()
+
+    def close(self):
+        release, self._release = self._release, None
+        if release is None:
+            return
+        try:
+            close = getattr(self._stream, "close", None)
+            if close is not None:
+                close()
+        finally:
+            release()
+
+
+class _LimitedMessages:
+    def __init__(self, messages, limiter):
+        self._messages = messages
+        self._limiter = limiter
+
+    def create(self, **kwargs):
+        self._limiter.acquire()
+        try:
+            result = self._messages.create(**kwargs)
+        except BaseException:
+            self._limiter.release()
+            raise
+        if kwargs.get("stream"):
+            return _LimitedStream(result, self._limiter.release)
+        self._limiter.release()
+        return result
+
+    def count_tokens(self, **kwargs):
+        self._limiter.acquire()
+        try:
+            return self._messages.count_tokens(**kwargs)
+        finally:
+            self._limiter.release()
+
+
+class RateLimitedClient:
+    """client.messagesへのリクエストをRateLimiterで順番に送る"""
+
+    def __init__(self, client, limiter):
+        self.client = client
+        self.limiter = limiter
+        self.messages = _LimitedMessages(client.messages, limiter)
+
+
+class LatencyStats:
+    """エンドポイントごとの待ち時間（直近LATENCY_WINDOW件）"""
+
+    def __init__(self, window=LATENCY_WINDOW):
+        self._lock = threading.Lock()
+        self._samples = defaultdict(lambda: deque(maxlen=window))
+        self._counts = defaultdict(int)
+        self._errors = defaultdict(int)
+
+    def record(self, name, seconds, error=False):
+        with self._lock:
+            self._samples[name].append(seconds)
+            self._counts[name] += 1
+            if error:
+                self._errors[name] += 1
+
+    def snapshot(self):
+        with self._lock:
+            samples = {name: sorted(values) for name, values in self._samples.items()}
+            counts = dict(self._counts)
+            errors = dict(self._errors)
+        result = {}
+        for name, values in samples.items():
+            def percentile(p):
+                return round(values[min(len(values) - 1, int(p * len(values)))] * 1000, 1)
+            result[name] = {
+                "count": counts[name],
+                "errors": errors.get(name, 0),
+                "mean_ms": round(sum(values) / len(values) * 1000, 1),
+                "p50_ms": percentile(0.5),
+                "p95_ms": percentile(0.95),
+                "max_ms": round(values[-1] * 1000, 1),
+            }
+        return result
+
+
+class Conversation:
+    """ゲートウェイで保持する会話（同じ会話への質問は1つずつ）"""
+
+    def __init__(self, conversation_id, session):
+        self.id = conversation_id
+        self.session = session
+        self.lock = threading.Lock()
+        self.last_used = time.monotonic()
+
+
+class Gateway:
+    """HTTPのリクエストから呼ばれる処理（クライアント・レート制限・キャッシュを共有する）"""
+
+    def __init__(self, client, model=cli.DEFAULT_MODEL, limiter=None, cache=None, data_dir=DEFAULT_DATA_DIR,
+                 max_conversations=None, idle_timeout=None):
+        """idle_timeoutは会話を使われないまま保持する秒数（省略時は.envから、0なら制限なし）"""
+        self.limiter = limiter or RateLimiter.from_env()
+        self.client = RateLimitedClient(client, self.limiter)
+        self.model = model
+        self.cache = cache
+        self.data_dir = os.path.realpath(data_dir)
+        self.stats = LatencyStats()
+        self.cache_hits = 0
+        self.conversations = {}
+        if max_conversations is None:
+            max_conversations = _env_int("CLAUDE_TK_GATEWAY_MAX_CONVERSATIONS", DEFAULT_MAX_CONVERSATIONS)
+        if idle_timeout is None:
+            idle_timeout = _env_int("CLAUDE_TK_GATEWAY_IDLE_MINUTES", DEFAULT_IDLE_MINUTES) * 60
+        self.max_conversations = max_conversations
+        self.idle_timeout = idle_timeout
+        self._lock = threading.Lock()
+
+    def _expire(self):
+        """使われていない会話と上限を超えた分の古い会話を取り除いて返す（回答を待っている会話は残す、_lockの中で呼ぶ）"""
+        now = time.monotonic()
+        idle = [c for c in self.conversations.values() if not c.lock.locked()]
+        expired = []
+        if self.idle_timeout > 0:
+            expired = [c for c in idle if now - c.last_used > self.idle_timeout]
+        if self.max_conversations > 0:
+            excess = len(self.conversations) - len(expired) + 1 - self.max_conversations
+            rest = sorted((c for c in idle if c not in expired), key=lambda c: c.last_used)
+            expired += rest[:max(0, excess)]
+        for conversation in expired:
+            del self.conversations[conversation.id]
+        return expired
+
+    def add_conversation(self, conversation):
+        """会話を保持する（保持しきれない古い会話は破棄する）"""
+        with self._lock:
+            expired = self._expire()
+            self.conversations[conversation.id] = conversation
+        for old in expired:
+            old.session.close()
+        return conversation
+
+    def create_conversation(self, model=None):
+        return self.add_conversation(Conversation(uuid.uuid4().hex, cli.ChatSession(model or self.model, client=self.client)))
+
+    def new_conversation(self, body):
+        conversation = self.create_conversation(body.get("model"))
+        return {"conversation_id": conversation.id, "model": conversation.session.model}
+
+    def get_conversation(self, conversation_id):
+        with self._lock:
+            conversation = self.conversations.get(conversation_id)
+            if conversation is not None:
+                conversation.last_used = time.monotonic()
+        if conversation is None:
+            raise GatewayError(404, f"会話が見つかりません: {conversation_id}")
+        return conversation
+
+    def delete_conversation(self, conversation_id):
+        with self._lock:
+            conversation = self.conversations.pop(conversation_id, None)
+        if conversation is None:
+            raise GatewayError(404, f"会話が見つかりません: {conversation_id}")
+        conversation.session.close()
+        return {"conversation_id": conversation_id}
+
+    def describe(self, conversation_id):
+        """会話の内容（保存時と同じくassistantはMarkdown、画像は枚数）"""
+        conversation = self.get_conversation(conversation_id)
+        messages = []
+        for msg in list(conversation.session.history):
+            item = {"role": msg["role"], "content": msg.get("markdown", msg["content"])}
+            if msg.get("image_paths"):
+                item["images"] = len(msg["image_paths"])
+            messages.append(item)
+        return {"conversation_id": conversation.id, "model": conversation.session.model, "messages": messages}
+
+    def _question(self, body):
+        question = body.get("question")
+        if not isinstance(question, str) or not question.strip():
+            raise GatewayError(400, "questionを指定してください")
+        images = body.get("images") or []
+        if not isinstance(images, list) or not all(isinstance(path, str) for path in images):
+            raise GatewayError(400, "imagesは画像ファイルのパスのリストで指定してください")
+        missing = [path for path in images if not os.path.isfile(path)]
+        if missing:
+            raise GatewayError(400, f"画像ファイルが見つかりません: {', '.join(missing)}")
+        return question.strip(), images
+
+    def _lock_conversation(self, conversation):
+        if not conversation.lock.acquire(blocking=False):
+            raise GatewayError(409, "この会話は回答を待っています")
+
+    def send(self, body, on_text=None):
+        """質問を送って回答を返す（on_textを渡すとストリーミングで受け取り、届いた分ごとに呼ぶ）"""
+        question, images = self._question(body)
+        if body.get("conversation_id"):
+            conversation = self.get_conversation(body["conversation_id"])
+        else:
+            conversation = self.create_conversation(body.get("model"))
+        session = conversation.session
+        self._lock_conversation(conversation)
+        try:
+            # 同じモデル・過去の会話・質問・画像（内容ハッシュ）なら保存してある回答を使う
+            cache_key = None
+            if self.cache is not None:
+                session.request_builder.sync(session.history)
+                cache_key = response_cache.request_key(
+                    session.model, session.request_builder.prefix_key(),
+                    {"content": question, "images": [media_store.content_hash(path) for path in images]},
+                    max_tokens=output_limits.max_tokens_for(session.model)
+                )
+                answer = self.cache.get(cache_key)
+                if answer is not None:
+                    with self._lock:
+                        self.cache_hits += 1
+                    if on_text is not None:
+                        on_text(answer)
+                    session.add_exchange(question, images, answer, cached=True)
+                    return {"conversation_id": conversation.id, "answer": answer, "cached": True}
+            messages = session.request_messages(question, images)
+            if on_text is None:
+                answer, stop_reason = output_limits.create_with_continuation(
+                    self.client.messages.create, model=session.model, messages=messages
+                )
+            else:
+                answer, stop_reason = output_limits.stream_with_continuation(
+                    self.client.messages.create, session.model, messages, on_text
+                )
+            session.add_exchange(question, images, answer)
+            if cache_key is not None:
+                self.cache.put(cache_key, answer, session.model)
+            return {"conversation_id": conversation.id, "answer": answer, "stop_reason": stop_reason}
+        finally:
+            conversation.lock.release()
+
+    def count(self, body):
+        """質問を送った場合の入力トークン数"""
+        question, images = self._question(body)
+        if body.get("conversation_id"):
+            conversation = self.get_conversation(body["conversation_id"])
+            session = conversation.session
+            self._lock_conversation(conversation)
+            try:
+                messages = session.request_messages(question, images)
+            finally:
+                conversation.lock.release()
+            model = session.model
+        else:
+            model = body.get("model") or self.model
+            messages = cli.ChatSession(model).request_messages(question, images)
+        result = self.client.messages.count_tokens(model=model, messages=messages)
+        return {"conversation_id": body.get("conversation_id"), "input_tokens": result.input_tokens}
+
+    def data_path(self, path):
+        """保存用ディレクトリ内のパス（相対パスはその中として扱い、外を指すものは拒否する）"""
+        if not isinstance(path, str) or not path:
+            raise GatewayError(400, "pathを指定してください")
+        resolved = os.path.realpath(os.path.join(self.data_dir, path))
+        if os.path.commonpath([self.data_dir, resolved]) != self.data_dir or resolved == self.data_dir:
+            raise GatewayError(403, f"保存用ディレクトリ（{self.data_dir}）の外は使えません: {path}")
+        return resolved
+
+    def save(self, body):
+        conversation = self.get_conversation(body.get("conversation_id"))
+        path = self.data_path(body.get("path"))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._lock_conversation(conversation)
+        try:
+            compact_error = conversation.session.save(path)
+        except ValueError as e:
+            raise GatewayError(400, str(e))
+        finally:
+            conversation.lock.release()
+        result = {"conversation_id": conversation.id, "path": os.path.relpath(path, self.data_dir), "messages": len(conversation.session.history)}
+        if compact_error is not None:
+            result["warning"] = f"ZIPの詰め直しに失敗しました（次回の保存で再試行します）: {compact_error}"
+        return result
+
+    def resume(self, body):
+        path = self.data_path(body.get("path"))
+        if not os.path.isfile(path):
+            raise GatewayError(400, f"保存ファイルが見つかりません: {body['path']}")
+        conversation = Conversation(uuid.uuid4().hex, cli.ChatSession(body.get("model") or self.model, client=self.client))
+        try:
+            count = conversation.session.resume(path)
+        except (ValueError, KeyError, OSError, zipfile.BadZipFile) as e:
+            # 壊れた・形式の違う保存ファイル
+            conversation.session.close()
+            raise GatewayError(400, f"保存ファイルを読み込めません: {e}")
+        self.add_conversation(conversation)
+        return {"conversation_id": conversation.id, "messages": count}
+
+    def snapshot(self):
+        with self._lock:
+            conversations = len(self.conversations)
+            cache_hits = self.cache_hits
+        return {
+            "endpoints": self.stats.snapshot(),
+            "rate_limiter": self.limiter.snapshot(),
+            "conversations": conversations,
+            "cache_hits": cache_hits,
+        }
+
+    def close(self):
+        with self._lock:
+            conversations = list(self.conversations.values())
+            self.conversations.clear()
+        for conversation in conversations:
+            conversation.session.close()
+
+
+class GatewayHandler(BaseHTTPRequestHandler):
+    server_version = "ClaudeTkGateway/1.0"
+
+    @property
+    def gateway(self):
+        return self.server.gateway
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def do_GET(self):
+        self.handle_request("GET")
+
+    def do_POST(self):
+        self.handle_request("POST")
+
+    def do_DELETE(self):
+        self.handle_request("DELETE")
+
+    def route(self, method):
+        """(統計での名前, 処理)を返す"""
+        path = self.path.split("?", 1)[0].rstrip("/")
+        if path.startswith("/conversations/") and method in ("GET", "DELETE"):
+            conversation_id = path[len("/conversations/"):]
+            if method == "GET":
+                return "GET /conversations/<id>", lambda body: self.gateway.describe(conversation_id)
+            return "DELETE /conversations/<id>", lambda body: self.gateway.delete_conversation(conversation_id)
+        routes = {
+            ("GET", "/stats"): lambda body: self.gateway.snapshot(),
+            ("POST", "/conversations"): self.gateway.new_conversation,
+            ("POST", "/send"): self.gateway.send,
+            ("POST", "/stream"): self.stream,
+            ("POST", "/count"): self.gateway.count,
+            ("POST", "/save"): self.gateway.save,
+            ("POST", "/resume"): self.gateway.resume,
+        }
+        if (method, path) not in routes:
+            raise GatewayError(404, f"見つかりません: {method} {path}")
+        return f"{method} {path}", routes[(method, path)]
+
+    def check_origin(self):
+        """このマシンのスクリプト以外（ブラウザで開いた他のサイトなど）からのリクエストを拒否する"""
+        host = (self.headers.get("Host") or "").strip().lower()
+        if host.startswith("["):
+            host = host[1:].split("]", 1)[0]  # [::1]:8765
+        elif host.count(":") == 1:
+            host = host.split(":", 1)[0]
+        if host not in self.server.allowed_hosts:
+            raise GatewayError(403, f"許可されていないHostです: {self.headers.get('Host')}")
+        if self.headers.get("Origin") is not None:
+            raise GatewayError(403, "ブラウザからのリクエスト（Originあり）は受け付けません")
+
+    def read_body(self, method):
+        length = int(self.headers.get("Content-Length") or 0)
+        if method == "POST" or length:
+            content_type = (self.headers.get("Content-Type") or "").split(";", 1)[0].strip().lower()
+            if content_type != "application/json":
+                raise GatewayError(415, "Content-Typeはapplication/jsonにしてください")
+        if not length:
+            return {}
+        try:
+            body = json.loads(self.rfile.read(length).decode("utf-8"))
+        except (UnicodeDecodeError, json.JSONDecodeError) as e:
+            raise GatewayError(400, f"JSONを読み込めません: {e}")
+        if not isinstance(body, dict):
+            raise GatewayError(400, "JSONのオブジェクトを送ってください")
+        return body
+
+    def handle_request(self, method):
+        start = time.monotonic()
+        name = f"{method} (その他)"
+        status, data = 200, None
+        self._streaming = False
+        try:
+            self.check_origin()
+            token = self.server.token
+            if token and not secrets.compare_digest(self.headers.get("Authorization") or "", f"Bearer {token}"):
+                raise GatewayError(401, "認証に失敗しました")
+            name, handler = self.route(method)
+            data = handler(self.read_body(method))
+        except GatewayError as e:
+            status, data = e.status, {"error": str(e)}
+        except (BrokenPipeError, ConnectionResetError):
+            status = None  # 呼び出し元が接続を切った
+        except Exception as e:
+            # APIのエラーなど（ステータスコードがあればそれを返す）
+            code = getattr(e, "status_code", None)
+            status = code if isinstance(code, int) and 400 <= code < 600 else 502
+            data = {"error": f"通信エラー: {e}"}
+        # 応答を返す前に記録する（応答を受け取った直後の/statsにも含める）
+        self.gateway.stats.record(name, time.monotonic() - start, status != 200)
+        if status is None:
+            return
+        try:
+            if not self._streaming:
+                self.send_json(status, data)
+            elif status != 200:
+                # ヘッダーを送った後のエラーはイベントで伝える
+                self.send_event("error", dict(data, status=status))
+        except OSError:
+            pass
+
+    def send_json(self, status, data):
+        payload = json.dumps(data, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def send_event(self, event, data):
+        self.wfile.write(f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n".encode("utf-8"))
+        self.wfile.flush()
+
+    def stream(self, body):
+        """回答をServer-Sent Eventsで返す（textイベントで届いた分ずつ、最後にdoneイベント）"""
+        start = time.monotonic()
+        first = []
+
+        def on_text(text):
+            if not self._streaming:
+                self.start_stream()
+            if not first:
+                first.append(time.monotonic() - start)
+                self.gateway.stats.record("POST /stream first_text", first[0])
+            self.send_event("text", {"text": text})
+        result = self.gateway.send(body, on_text)
+        if not self._streaming:
+            self.start_stream()
+        self.send_event("done", result)
+        return result
+
+    def start_stream(self):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream; charset=utf-8")
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+        self._streaming = True
+
+
+class GatewayServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, gateway, token=None, verbose=False, allowed_hosts=LOOPBACK_HOSTS):
+        super().__init__(address, GatewayHandler)
+        self.gateway = gateway
+        self.token = token
+        self.verbose = verbose
+        self.allowed_hosts = tuple(host.lower() for host in allowed_hosts)
+
+
+def main(argv=None):
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="会話をHTTP（Server-Sent Events）で使えるローカルのゲートウェイを起動します")
+    parser.add_argument("--host", default=DEFAULT_HOST, help="待ち受けるアドレス（既定はこのマシンからのみ）")
+    parser.add_argument("--port", type=int, default=_env_int("CLAUDE_TK_GATEWAY_PORT", DEFAULT_PORT), help="待ち受けるポート")
+    parser.add_argument("--dir", default=os.getenv("CLAUDE_TK_GATEWAY_DIR") or DEFAULT_DATA_DIR, help="/save・/resumeで使えるディレクトリ")
+    parser.add_argument("-m", "--model", default=cli.DEFAULT_MODEL, help="会話の既定のモデル")
+    parser.add_argument("-v", "--verbose", action="store_true", help="リクエストごとにログを出力する")
+    args = parser.parse_args(argv)
+    api_key = os.getenv("ANTHROPIC_API_KEY")
+    if not api_key:
+        print("ANTHROPIC_API_KEYが設定されていません。.envファイルを確認してください。", file=sys.stderr)
+        return 1
+    token = os.getenv("CLAUDE_TK_GATEWAY_TOKEN")
+    if not token:
+        token = secrets.token_urlsafe(32)
+        print(f"CLAUDE_TK_GATEWAY_TOKENが設定されていないため、このトークンを使います: {token}", file=sys.stderr)
+    # 待ち受けるアドレスを名前で指定した場合はそのHostも受け付ける（0.0.0.0などのすべてのアドレスは除く）
+    allowed_hosts = LOOPBACK_HOSTS
+    if args.host not in ("", "0.0.0.0", "::"):
+        allowed_hosts += (args.host,)
+    gateway = Gateway(cli.create_client(api_key), args.model, cache=response_cache.from_env(), data_dir=args.dir)
+    server = GatewayServer((args.host, args.port), gateway, token=token, verbose=args.verbose, allowed_hosts=allowed_hosts)
+    print(f"http://{args.host}:{server.server_address[1]}/ で待ち受けています（Ctrl+Cで終了）", file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        gateway.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,411 @@
+"""添付画像の読み込み・前処理・base64エンコードをまとめたヘルパー
+
+画像の読み込みとエンコードはスレッドプールで並列に実行する。
+PhotoImageの生成はTkスレッドで行う必要があるため、ここではPIL画像までを扱う。
+画像ソースはファイルパス（str）か、クリップボード等から取得したMemoryImageのどちらか。
+"""
+import os
+import io
+import base64
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from PIL import Image, features
+
+# APIが受け付ける画像形式
+SUPPORTED_MIME_TYPES = ("image/jpeg", "image/png", "image/gif", "image/webp")
+# 長辺がこれを超える画像は送信前に縮小する（API側でも縮小されるため送信量の削減になる）
+MAX_LONG_EDGE = 1568
+
+_MIME_TYPES = {
+    ".jpg": "image/jpeg",
+    ".jpeg": "image/jpeg",
+    ".png": "image/png",
+    ".bmp": "image/bmp",
+    ".gif": "image/gif",
+    ".webp": "image/webp",
+}
+
+# 保存zipに同梱するサムネイル
+THUMBNAIL_SIZE = (200, 200)
+THUMBNAIL_MANIFEST = "thumbs/manifest.json"
+
+# 知覚ハッシュのハミング距離がこれ以下の画像を、同じ画像の候補として画素で確かめる（負の値で重複排除を無効化）
+DEFAULT_DEDUP_THRESHOLD = 4
+# 元の解像度で8×8画素ごとの平均を比べ、差がすべてこれ以下なら同じ画像とみなす（0-255）
+# JPEGの再圧縮による差（品質50でも7程度）は許し、文字が1つ変わったスクリーンショットは区別する
+DEDUP_PIXEL_TOLERANCE = 10
+DEDUP_BLOCK_SIZE = 8
+
+# ImageCacheが保持するサムネイル・送信用データの数（古いものから捨てる）
+DEFAULT_IMAGE_CACHE_SIZE = 64
+
+_executor = None
+
+
+class MemoryImage:
+    """ファイルを持たないメモリ上の画像（クリップボード貼り付け等）"""
+
+    def __init__(self, data, name, mime_type="image/png"):
+        self.data = data
+        self.name = name
+        self.mime_type = mime_type
+
+    def __repr__(self):
+        return f"MemoryImage({self.name!r}, {len(self.data)} bytes)"
+
+    @property
+    def size(self):
+        return len(self.data)
+
+    @classmethod
+    def from_pil(cls, img, name):
+        """PIL画像をPNGにエンコードしてMemoryImageを作成"""
+        out = io.BytesIO()
+        if img.mode not in ("RGB", "RGBA", "L", "LA", "P"):
+            img = img.convert("RGBA")
+        img.save(out, format="PNG")
+        return cls(out.getvalue(), name, "image/png")
+
+
+def grab_clipboard_image(name):
+    """クリップボードの画像をMemoryImageとして取得（画像がなければNone）
+
+    クリップボードにファイルが入っている場合はそのパスのリストを返す。
+    """
+    from PIL import ImageGrab
+    try:
+        content = ImageGrab.grabclipboard()
+    except Exception:
+        # クリップボード取得ツールがない環境など
+        return None
+    if isinstance(content, Image.Image):
+        return MemoryImage.from_pil(content, name)
+    if isinstance(content, list):
+        return [path for path in content if get_mime_type(path).startswith("image/")] or None
+    return None
+
+
+def get_executor():
+    """画像処理用の共有スレッドプールを返す"""
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=min(8, (os.cpu_count() or 1) + 2),
+            thread_name_prefix="claude_tk_image"
+        )
+    return _executor
+
+
+def get_mime_type(path):
+    """拡張子からMIMEタイプを判定（MemoryImageは保持しているMIMEタイプ）"""
+    if isinstance(path, MemoryImage):
+        return path.mime_type
+    ext = os.path.splitext(path)[1].lower()
+    return _MIME_TYPES.get(ext, "application/octet-stream")
+
+
+def image_name(source):
+    """画像ソースのファイル名（保存時のファイル名・エラー表示用）"""
+    if isinstance(source, MemoryImage):
+        return source.name
+    return os.path.basename(source)
+
+
+def read_image_bytes(source):
+    """画像ソースのバイト列を取得"""
+    if isinstance(source, MemoryImage):
+        return source.data
+    with open(source, "rb") as f:
+        return f.read()
+
+
+def image_size(source):
+    """画像ソースのバイト数"""
+    if isinstance(source, MemoryImage):
+        return source.size
+    return os.path.getsize(source)
+
+
+def open_image(source):
+    """画像ソースをPIL画像として開く"""
+    if isinstance(source, MemoryImage):
+        return Image.open(io.BytesIO(source.data))
+    return Image.open(source)
+
+
+def get_image_paths(msg):
+    """履歴メッセージから画像ソースのリストを取得（旧形式のimage_pathにも対応）"""
+    if msg.get("image_paths"):
+        return list(msg["image_paths"])
+    if msg.get("image_path"):
+        return [msg["image_path"]]
+    return []
+
+
+def preprocess_image(path):
+    """画像を読み込み、必要なら縮小・形式変換して(bytes, mime_type)を返す"""
+    data = read_image_bytes(path)
+    mime_type = get_mime_type(path)
+    try:
+        img = Image.open(io.BytesIO(data))
+        width, height = img.size
+    except Exception:
+        # 判定できない画像はそのまま送信する
+        return data, mime_type
+    if mime_type in SUPPORTED_MIME_TYPES and max(width, height) <= MAX_LONG_EDGE:
+        return data, mime_type
+    # 縮小またはAPI非対応形式（BMP等）の変換
+    if max(width, height) > MAX_LONG_EDGE:
+        img.thumbnail((MAX_LONG_EDGE, MAX_LONG_EDGE))
+    out = io.BytesIO()
+    if mime_type == "image/jpeg":
+        img.convert("RGB").save(out, format="JPEG", quality=90)
+    else:
+        if img.mode not in ("RGB", "RGBA", "L", "LA", "P"):
+            img = img.convert("RGBA")
+        img.save(out, format="PNG")
+        mime_type = "image/png"
+    return out.getvalue(), mime_type
+
+
+def encode_image(path):
+    """画像1枚をAPI送信用のimageブロックに変換"""
+    data, mime_type = preprocess_image(path)
+    return {
+        "type": "image",
+        "source": {
+            "type": "base64",
+            "media_type": mime_type,
+            "data": base64.b64encode(data).decode("utf-8"),
+        },
+    }
+
+
+def encode_images(paths):
+    """複数画像を並列にエンコードし、入力と同じ順序でimageブロックのリストを返す"""
+    if not paths:
+        return []
+    if len(paths) == 1:
+        return [encode_image(paths[0])]
+    return list(get_executor().map(encode_image, paths))
+
+
+def load_thumbnail(path, size):
+    """サムネイル用に縮小したPIL画像を返す"""
+    img = open_image(path)
+    img.thumbnail(size)
+    img.load()
+    return img
+
+
+def load_thumbnails(paths, size):
+    """複数画像のサムネイルを並列に作成する
+
+    戻り値は入力と同じ順序の(PIL画像 or None, 例外 or None)のリスト
+    """
+    def task(path):
+        try:
+            return load_thumbnail(path, size), None
+        except Exception as e:
+            return None, e
+    if not paths:
+        return []
+    if len(paths) == 1:
+        return [task(paths[0])]
+    return list(get_executor().map(task, paths))
+
+
+def make_thumbnail_bytes(source, size=THUMBNAIL_SIZE):
+    """サムネイルをWebP（非対応環境ではPNG）にエンコードして(bytes, 拡張子)を返す"""
+    img = load_thumbnail(source, size)
+    out = io.BytesIO()
+    if features.check("webp"):
+        img.save(out, format="WEBP", quality=80)
+        return out.getvalue(), ".webp"
+    img.save(out, format="PNG")
+    return out.getvalue(), ".png"
+
+
+def build_thumbnail_sidecars(images, size=THUMBNAIL_SIZE):
+    """保存zip用のサムネイルとマニフェストを並列に作成する
+
+    imagesは{zip内の画像パス: 画像ソース}。
+    戻り値は({zip内のサムネイルパス: bytes}, マニフェストのdict)。
+    作成できなかった画像はマニフェストに含めない（読み込み側は元画像から作成する）。
+    """
+    def task(item):
+        arcname, source = item
+        try:
+            return arcname, make_thumbnail_bytes(source, size)
+        except Exception:
+            return arcname, None
+    items = list(images.items())
+    results = list(get_executor().map(task, items)) if len(items) > 1 else [task(item) for item in items]
+    files = {}
+    manifest = {"version": 1, "size": list(size), "thumbnails": {}}
+    for arcname, result in results:
+        if result is None:
+            continue
+        data, ext = result
+        thumb_name = f"thumbs/{os.path.basename(arcname)}{ext}"
+        files[thumb_name] = data
+        manifest["thumbnails"][arcname] = thumb_name
+    return files, manifest
+
+
+def dhash(source, hash_size=8):
+    """差分ハッシュ(dHash)を計算し、hash_size*hash_sizeビットの整数で返す"""
+    img = open_image(source).convert("L").resize((hash_size + 1, hash_size), Image.BILINEAR)
+    pixels = np.asarray(img, dtype=np.int16)
+    bits = pixels[:, 1:] > pixels[:, :-1]
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+def _block_means(img, block):
+    pixels = np.asarray(img.convert("RGBA"), dtype=np.float32)
+    height, width = pixels.shape[0] // block * block, pixels.shape[1] // block * block
+    pixels = pixels[:height, :width]
+    return pixels.reshape(height // block, block, width // block, block, 4).mean(axis=(1, 3))
+
+
+def same_image(a, b, tolerance=DEDUP_PIXEL_TOLERANCE):
+    """2つの画像ソースが同じ画像かどうか（元の解像度で比べ、再圧縮による小さな差は許す）"""
+    img_a = open_image(a)
+    img_b = open_image(b)
+    if img_a.size != img_b.size:
+        return False
+    block = DEDUP_BLOCK_SIZE if min(img_a.size) >= DEDUP_BLOCK_SIZE else 1
+    return float(np.abs(_block_means(img_a, block) - _block_means(img_b, block)).max()) <= tolerance
+
+
+class ImageDeduplicator:
+    """再保存・再圧縮しただけの同じ画像を、最初に登録した画像ソースにまとめる
+
+    知覚ハッシュで候補を絞り、元の解像度の画素を比べて同じ画像と確かめたものだけをまとめる。
+    まとめた画像は呼び出し側が利用者に知らせる
+    （内容が完全に同じ画像はメディアストアの内容ハッシュでも1つになる）。
+    """
+
+    def __init__(self, threshold=DEFAULT_DEDUP_THRESHOLD, tolerance=DEDUP_PIXEL_TOLERANCE):
+        self.threshold = threshold
+        self.tolerance = tolerance
+        self.clear()
+
+    def clear(self):
+        self._hashes = np.zeros(0, dtype=np.uint64)
+        self._sources = []
+
+    def candidates(self, image_hash):
+        """登録済みの画像から閾値以内のものを距離の近い順に返す"""
+        if self.threshold < 0 or not self._sources:
+            return []
+        xor = np.bitwise_xor(self._hashes, np.uint64(image_hash))
+        distances = np.unpackbits(xor.view(np.uint8)).reshape(len(self._sources), -1).sum(axis=1)
+        order = np.argsort(distances, kind="stable")
+        return [self._sources[i] for i in order if distances[i] <= self.threshold]
+
+    def add(self, image_hash, source):
+        self._hashes = np.append(self._hashes, np.uint64(image_hash))
+        self._sources.append(source)
+
+    def canonicalize(self, sources):
+        """画像ソースのリストを、同じ画像を登録済みの画像ソースに置き換えたリストにする
+
+        ハッシュは並列に計算し、まとめる先がなかった画像は以降の比較のために登録する。
+        """
+        if self.threshold < 0 or not sources:
+            return list(sources)
+        def task(source):
+            try:
+                return dhash(source)
+            except Exception:
+                return None
+        if len(sources) == 1:
+            hashes = [task(sources[0])]
+        else:
+            hashes = list(get_executor().map(task, sources))
+        result = []
+        for source, image_hash in zip(sources, hashes):
+            existing = None
+            for candidate in self.candidates(image_hash) if image_hash is not None else ():
+                if candidate == source:
+                    existing = candidate  # 同じ画像ソースを添付し直しただけ
+                    break
+                try:
+                    if same_image(source, candidate, self.tolerance):
+                        existing = candidate
+                        break
+                except Exception:
+                    continue
+            if existing is None:
+                existing = source
+                if image_hash is not None:
+                    self.add(image_hash, source)
+            result.append(existing)
+        return result
+
+
+class ImageCache:
+    """サムネイルと送信用のimageブロックを画像の内容ハッシュごとに保持する
+
+    タブ間で共有し、同じ画像は何度表示・送信しても縮小やエンコードを1回で済ませる。
+    keyは画像ソースから内容ハッシュを求める関数（media_store.content_hash）。
+    作業スレッドからも使うため、辞書の操作はロックで守る。
+    """
+
+    def __init__(self, key, max_entries=DEFAULT_IMAGE_CACHE_SIZE):
+        self.key = key
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _get(self, key):
+        with self._lock:
+            if key not in self._entries:
+                return None
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+    def _put(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _keys(self, kind, sources, *extra):
+        keys = []
+        for source in sources:
+            try:
+                keys.append((kind, self.key(source)) + extra)
+            except Exception:
+                keys.append(None)  # 読めない画像はキャッシュせず、作成時のエラーをそのまま返す
+        return keys
+
+    def thumbnails(self, sources, size):
+        """load_thumbnailsと同じ形式で返す（作成できたサムネイルだけキャッシュする）"""
+        keys = self._keys("thumbnail", sources, tuple(size))
+        results = [self._get(key) if key is not None else None for key in keys]
+        missing = [i for i, result in enumerate(results) if result is None]
+        if not missing:
+            return results
+        for i, result in zip(missing, load_thumbnails([sources[i] for i in missing], size)):
+            results[i] = result
+            if keys[i] is not None and result[1] is None:
+                self._put(keys[i], result)
+        return results
+
+    def encode(self, paths):
+        """encode_imagesと同じimageブロックのリストを返す"""
+        keys = self._keys("payload", paths)
+        blocks = [self._get(key) if key is not None else None for key in keys]
+        missing = [i for i, block in enumerate(blocks) if block is None]
+        if not missing:
+            return blocks
+        for i, block in zip(missing, encode_images([paths[i] for i in missing])):
+            blocks[i] = block
+            if keys[i] is not None:
+                self._put(keys[i], block)
+        return blocks
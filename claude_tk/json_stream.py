@@ -0,0 +1,251 @@
+"""会話履歴JSONの逐次読み込み
+
+json.loadのようにファイル全体を1つのオブジェクトにせず、"conversation"配列の要素を
+1件ずつデコード・検証しながら返す。大きな履歴ファイルでは、末尾の一部だけを読んで
+最新のターンを先に取り出し（read_tail）、残りを別スレッドで先頭から読み込める。
+"""
+import os
+import json
+import codecs
+
+# 1回に読み込む文字数・末尾から最初に読むバイト数
+CHUNK_SIZE = 256 * 1024
+TAIL_WINDOW = 256 * 1024
+
+_WHITESPACE = " \t\r\n"
+_decoder = json.JSONDecoder()
+
+
+def text_reader(text):
+    """文字列をread(n)で読めるようにする"""
+    state = {"pos": 0}
+
+    def read(n):
+        start = state["pos"]
+        state["pos"] = min(len(text), start + n)
+        return text[start:state["pos"]]
+    return read
+
+
+def bounded_reader(f, limit):
+    """バイナリファイルの先頭limitバイトをUTF-8の文字列として読むread(n)"""
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    state = {"remaining": limit}
+
+    def read(n):
+        if state["remaining"] <= 0:
+            return ""
+        data = f.read(min(n, state["remaining"]))
+        state["remaining"] -= len(data)
+        final = not data or state["remaining"] <= 0
+        if not data:
+            state["remaining"] = 0
+        return decoder.decode(data, final=final)
+    return read
+
+
+class _Scanner:
+    """read(n)から読み込んだ文字列を少しずつJSONとして解析する"""
+
+    def __init__(self, read):
+        self._read = read
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self):
+        """続きを読み込む。ファイルの終わりならFalse"""
+        if self.eof:
+            return False
+        chunk = self._read(CHUNK_SIZE)
+        if not chunk:
+            self.eof = True
+            return False
+        # 解析済みの部分は捨てる
+        self.buf = self.buf[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self):
+        """空白を読み飛ばして次の文字を返す（ファイルの終わりなら空文字）"""
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in _WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buf) or not self._fill():
+                return self.buf[self.pos:self.pos + 1]
+
+    def expect(self, ch):
+        if self.peek() != ch:
+            raise ValueError(f"不正なJSONです（'{ch}'が必要です）")
+        self.pos += 1
+
+    def value(self):
+        """次のJSON値を1つデコードする"""
+        self.peek()
+        while True:
+            try:
+                obj, end = _decoder.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError as e:
+                if self._fill():
+                    continue
+                raise ValueError(f"不正なJSONです: {e}") from e
+            # 数値などがバッファの終わりで切れている可能性があるため、続きがあれば読み直す
+            if end == len(self.buf) and self._fill():
+                continue
+            self.pos = end
+            return obj
+
+
+def validate_message(msg):
+    """会話メッセージの形式を検証する"""
+    if not isinstance(msg, dict) or "role" not in msg or "content" not in msg:
+        raise ValueError("不正な会話履歴ファイルです（メッセージ形式エラー）")
+    return msg
+
+
+class ConversationStream:
+    """保存JSONの"conversation"の要素を検証しながら1件ずつ返すイテレータ
+
+    metadataなど"conversation"より前にあるキーは、最初のメッセージを返す時点でself.dataに入っている。
+    partial=Trueの場合、配列の途中（要素の区切りの直後）でファイルが終わってもよい（先頭部分だけの読み込み用）。
+    """
+
+    def __init__(self, read, partial=False):
+        self._scanner = _Scanner(read)
+        self.partial = partial
+        self.data = {}
+
+    def __iter__(self):
+        scanner = self._scanner
+        scanner.expect("{")
+        found = False
+        if scanner.peek() == "}":
+            scanner.pos += 1
+        else:
+            while True:
+                key = scanner.value()
+                if not isinstance(key, str):
+                    raise ValueError("不正なJSONです（キーが文字列ではありません）")
+                scanner.expect(":")
+                if key == "conversation":
+                    if scanner.peek() != "[":
+                        raise ValueError("不正な会話履歴ファイルです（conversationがリストではありません）")
+                    found = True
+                    for msg in self._iter_array():
+                        yield msg
+                    if self.partial:
+                        return
+                else:
+                    self.data[key] = scanner.value()
+                if scanner.peek() == ",":
+                    scanner.pos += 1
+                    continue
+                scanner.expect("}")
+                break
+        if scanner.peek():
+            raise ValueError("不正なJSONです（余分なデータがあります）")
+        if not found:
+            raise ValueError("不正な会話履歴ファイルです（conversationがリストではありません）")
+
+    def _iter_array(self):
+        scanner = self._scanner
+        scanner.expect("[")
+        if scanner.peek() == "]":
+            scanner.pos += 1
+            return
+        while True:
+            if self.partial and scanner.peek() == "":
+                return
+            yield validate_message(scanner.value())
+            ch = scanner.peek()
+            if ch == ",":
+                scanner.pos += 1
+            elif ch == "]":
+                scanner.pos += 1
+                return
+            elif not (self.partial and ch == ""):
+                raise ValueError("不正なJSONです（','または']'が必要です）")
+
+
+def read_metadata(path):
+    """"conversation"より前にあるキー（metadataなど）だけを読み込む"""
+    with open(path, "rb") as f:
+        stream = ConversationStream(bounded_reader(f, os.path.getsize(path)), partial=True)
+        for _ in stream:
+            break
+        return stream.data
+
+
+def _verify_tail(text, start):
+    """textのstartから配列の終わりまで、会話の要素が正しく並んでいればその要素のリストを返す"""
+    messages = []
+    pos = start
+    while True:
+        try:
+            msg, pos = _decoder.raw_decode(text, pos)
+        except json.JSONDecodeError:
+            return None
+        if not isinstance(msg, dict) or "role" not in msg or "content" not in msg:
+            return None
+        messages.append(msg)
+        rest = text[pos:].lstrip(_WHITESPACE)
+        if rest.startswith(","):
+            pos = len(text) - len(rest) + 1
+            while pos < len(text) and text[pos] in _WHITESPACE:
+                pos += 1
+            continue
+        if not rest.startswith("]"):
+            return None
+        rest = rest[1:].strip(_WHITESPACE)
+        if rest == "}":
+            return messages
+        # "conversation"の後にほかのキーが続く場合
+        if rest.startswith(","):
+            try:
+                json.loads("{" + rest[1:])
+                return messages
+            except ValueError:
+                return None
+        return None
+
+
+def read_tail(path, min_turns, window=None):
+    """ファイルの末尾だけを読み、最新のmin_turnsターン以上を含む会話の後半を返す
+
+    戻り値は(メッセージのリスト, 後半の先頭要素のバイト位置)。
+    ファイル全体を読んでも足りない場合や要素の境界が見つからない場合は(None, 0)を返す
+    （呼び出し側はファイル全体を先頭から読み込む）。
+    """
+    size = os.path.getsize(path)
+    window = window or TAIL_WINDOW
+    with open(path, "rb") as f:
+        while window < size:
+            window_start = size - window
+            f.seek(window_start)
+            data = f.read(window)
+            # 文字の途中から始まらないよう、UTF-8の継続バイトを読み飛ばす
+            skip = 0
+            while skip < min(4, len(data)) and (data[skip] & 0xC0) == 0x80:
+                skip += 1
+            text = data[skip:].decode("utf-8")
+            prev = ""  # 直前の空白以外の文字
+            for i, ch in enumerate(text):
+                if ch in _WHITESPACE:
+                    continue
+                is_candidate = ch == "{" and prev in (",", "[")
+                prev = ch
+                if not is_candidate:
+                    continue
+                messages = _verify_tail(text, i)
+                if messages is None:
+                    continue
+                if sum(1 for msg in messages if msg["role"] == "user") < min_turns:
+                    break  # 境界は正しいがターンが足りない
+                # 先頭がassistantの場合は次の質問から始める
+                while messages and messages[0]["role"] != "user":
+                    messages.pop(0)
+                    i = text.index("{", _decoder.raw_decode(text, i)[1])
+                offset = window_start + skip + len(text[:i].encode("utf-8"))
+                return messages, offset
+            window *= 2
+    return None, 0
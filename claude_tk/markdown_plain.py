@@ -0,0 +1,24 @@
+"""Claudeの回答（Markdown）を履歴欄・端末に表示するプレーンテキストに変換する"""
+import re
+import markdown
+
+
+def markdown_to_text(markdown_text):
+    html = markdown.markdown(markdown_text)
+    html = re.sub(r'<h[1-6]>(.*?)</h[1-6]>', r'\1\n', html, flags=re.DOTALL)
+    html = re.sub(r'<p>(.*?)</p>', r'\1\n\n', html, flags=re.DOTALL)
+    html = re.sub(r'<li>(.*?)</li>', r'• \1\n', html, flags=re.DOTALL)
+    html = re.sub(r'<pre><code>(.*?)</code></pre>', r'\1', html, flags=re.DOTALL)
+    html = re.sub(r'<code>(.*?)</code>', r'\1', html)
+    html = re.sub(r'<a[^>]*>(.*?)</a>', r'\1', html)
+    html = re.sub(r'<(strong|b)>(.*?)</(strong|b)>', r'\2', html)
+    html = re.sub(r'<(em|i)>(.*?)</(em|i)>', r'\2', html)
+    html = re.sub(r'<[^>]+>', '', html)
+    html = html.replace('&amp;', '&')
+    html = html.replace('&lt;', '<')
+    html = html.replace('&gt;', '>')
+    html = html.replace('&quot;', '"')
+    html = html.replace('&#39;', "'")
+    text = re.sub(r'\n\s*\n\s*\n', '\n\n', html)
+    text = re.sub(r'^[\-\*]\s+', '・', text, flags=re.MULTILINE)
+    return text.strip()
@@ -0,0 +1,169 @@
+"""添付画像の内容ハッシュ（SHA-256）をキーにしたメディアストア
+
+添付した画像はストアにreflink（できなければコピー）で取り込み、元ファイルを編集してもストアの画像は変わらない
+（元ファイルが読み取り専用のときだけハードリンクにする）。
+同じ内容の画像はどの会話で添付してもストア内の1ファイルを共有し、
+元ファイルを移動・削除しても履歴の画像は参照できる。
+保存zip内の画像名も内容ハッシュにするため、別フォルダの同名ファイルが上書きし合うことはない。
+"""
+import os
+import re
+import stat
+import shutil
+import hashlib
+import threading
+try:
+    from claude_tk import image_attachments
+except ImportError:  # スクリプトとして直接実行された場合
+    import image_attachments
+
+DEFAULT_MEDIA_DIR = "media"
+
+_HASH_NAME_RE = re.compile(r"^[0-9a-f]{64}$")
+_CHUNK_SIZE = 1024 * 1024
+# Linuxのreflink用ioctl（FICLONE）
+_FICLONE = 0x40049409
+
+_digest_cache = {}  # (パス, サイズ, 更新時刻) → ハッシュ
+_digest_lock = threading.Lock()
+
+
+def file_digest(path):
+    """ファイル内容のSHA-256（16進）を計算する（サイズと更新時刻が同じなら再計算しない）"""
+    st = os.stat(path)
+    key = (os.path.abspath(path), st.st_size, st.st_mtime_ns)
+    with _digest_lock:
+        if key in _digest_cache:
+            return _digest_cache[key]
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(_CHUNK_SIZE), b""):
+            h.update(chunk)
+    digest = h.hexdigest()
+    with _digest_lock:
+        _digest_cache[key] = digest
+    return digest
+
+
+def content_hash(source):
+    """画像ソースの内容ハッシュ
+
+    ファイルは名前がハッシュでも内容から計算する（サイズと更新時刻が同じ間は再計算しない）。
+    """
+    if isinstance(source, image_attachments.MemoryImage):
+        # ハッシュ名で保存されたzip・コンテナの画像は保存時に計算したハッシュがファイル名
+        stem = os.path.splitext(image_attachments.image_name(source))[0]
+        if _HASH_NAME_RE.match(stem):
+            return stem
+        return hashlib.sha256(source.data).hexdigest()
+    return file_digest(source)
+
+
+def image_extension(source):
+    """画像ソースの拡張子（小文字、MemoryImageはMIMEタイプから）"""
+    ext = os.path.splitext(image_attachments.image_name(source))[1].lower()
+    if ext:
+        return ext
+    mime_type = image_attachments.get_mime_type(source)
+    return "." + mime_type.split("/")[-1] if mime_type.startswith("image/") else ""
+
+
+def hashed_name(source):
+    """内容ハッシュによるファイル名（保存zip内の画像名）"""
+    return content_hash(source) + image_extension(source)
+
+
+def _reflink(src, dst):
+    """reflink（コピーオンライトの複製）を試みる。成功したらTrue"""
+    try:
+        import fcntl
+    except ImportError:
+        return False
+    try:
+        with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+            fcntl.ioctl(fdst.fileno(), _FICLONE, fsrc.fileno())
+        return True
+    except OSError:
+        if os.path.exists(dst):
+            os.remove(dst)
+        return False
+
+
+def _is_read_only(path):
+    return not os.stat(path).st_mode & (stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH)
+
+
+def _link(src, dst):
+    """ハードリンクを試みる。成功したらTrue"""
+    try:
+        os.link(src, dst)
+        return True
+    except OSError:
+        return False
+
+
+class MediaStore:
+    """内容ハッシュで画像を保存するディレクトリ（root/ハッシュ先頭2文字/ハッシュ.拡張子）"""
+
+    def __init__(self, root=DEFAULT_MEDIA_DIR):
+        self.root = root
+
+    def path_for(self, digest, ext):
+        return os.path.join(self.root, digest[:2], digest + ext)
+
+    def contains(self, path):
+        """パスがこのストア内の画像かどうか"""
+        root = os.path.abspath(self.root)
+        try:
+            return os.path.commonpath([root, os.path.abspath(path)]) == root
+        except ValueError:  # Windowsで別ドライブの場合
+            return False
+
+    def add_file(self, path):
+        """画像ファイルをストアに取り込み、ストア内のパスを返す"""
+        if self.contains(path):
+            return path
+        digest = file_digest(path)
+        dst = self.path_for(digest, image_extension(path))
+        if os.path.exists(dst):
+            return dst  # 同じ内容は取り込み済み
+        os.makedirs(os.path.dirname(dst), exist_ok=True)
+        tmp = f"{dst}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            # 元ファイルを編集しても変わらないよう、reflink→コピーの順に試す
+            # （書き換えられない読み取り専用のファイルはハードリンクで容量を節約する）
+            if not _reflink(path, tmp) and not (_is_read_only(path) and _link(path, tmp)):
+                shutil.copyfile(path, tmp)
+            os.replace(tmp, dst)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+        return dst
+
+    def add_bytes(self, data, ext):
+        """バイト列をストアに保存し、ストア内のパスを返す"""
+        digest = hashlib.sha256(data).hexdigest()
+        dst = self.path_for(digest, ext)
+        if not os.path.exists(dst):
+            os.makedirs(os.path.dirname(dst), exist_ok=True)
+            tmp = f"{dst}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp, "wb") as f:
+                f.write(data)
+            os.replace(tmp, dst)
+        return dst
+
+    def add_sources(self, sources):
+        """画像ソースのリストを並列に取り込む
+
+        ファイルはストア内のパスに置き換え、MemoryImageと取り込めなかったものはそのまま返す。
+        """
+        def task(source):
+            if isinstance(source, image_attachments.MemoryImage):
+                return source
+            try:
+                return self.add_file(source)
+            except OSError:
+                return source
+        if len(sources) <= 1:
+            return [task(source) for source in sources]
+        return list(image_attachments.get_executor().map(task, sources))
@@ -0,0 +1,179 @@
+"""回答の最大トークン数と、上限で途切れた回答の自動継続
+
+1回のリクエストのmax_tokensはモデルごとに決める。既定はモデルの出力上限
+（models.listで取得できればその値、なければ下の表）と、ストリーミングなしで
+送れる範囲（REQUEST_CAP）の小さいほう。.envのCLAUDE_TK_MAX_TOKENSで
+「4096」（全モデル）や「claude-opus-4=4096,claude-3-haiku=2048」（モデルIDの先頭一致）のように変更できる。
+
+回答がmax_tokensで止まった場合（stop_reason == "max_tokens"）は、それまでの回答を
+assistantメッセージとして続けて送り（プレフィル）、続きを受け取ってつなげる。
+継続の回数はCLAUDE_TK_MAX_CONTINUATIONS（既定3回）まで。
+ストリーミング（stream_with_continuation）でも同じように続きを受け取る。
+"""
+import os
+import threading
+
+# 1回のリクエストの上限（これを超えるとストリーミングなしでは送れない・待ち時間が長くなる）
+REQUEST_CAP = 8192
+DEFAULT_MAX_CONTINUATIONS = 3
+STOP_MAX_TOKENS = "max_tokens"
+
+# モデルの出力上限（モデルIDの先頭一致、長いものから順に照合する）
+MODEL_OUTPUT_LIMITS = {
+    "claude-opus-4-5": 64000,
+    "claude-opus-4": 32000,
+    "claude-sonnet-4": 64000,
+    "claude-haiku-4": 64000,
+    "claude-3-7-sonnet": 64000,
+    "claude-3-5-sonnet": 8192,
+    "claude-3-5-haiku": 8192,
+    "claude-3-opus": 4096,
+    "claude-3-sonnet": 4096,
+    "claude-3-haiku": 4096,
+}
+DEFAULT_OUTPUT_LIMIT = 4096
+
+# models.listで取得したモデルごとの出力上限
+_registered = {}
+_lock = threading.Lock()
+
+
+def register_models(models):
+    """models.listの結果からモデルごとの出力上限を覚える
+
+    requirements.txtで固定しているSDKのModelInfoにはmax_tokensがなく、今は何も登録しない。
+    将来のSDK・APIがモデルの出力上限を返すようになったときのためのもので、
+    属性がないモデルはMODEL_OUTPUT_LIMITSの値を使う。
+    """
+    with _lock:
+        for model in models:
+            limit = getattr(model, "max_tokens", None)
+            if isinstance(limit, int) and limit > 0:
+                _registered[model.id] = limit
+
+
+def _match_prefix(table, model):
+    for prefix in sorted(table, key=len, reverse=True):
+        if prefix == "*" or model.startswith(prefix):
+            return table[prefix]
+    return None
+
+
+def model_output_limit(model):
+    """モデルの出力上限"""
+    with _lock:
+        if model in _registered:
+            return _registered[model]
+    limit = _match_prefix(MODEL_OUTPUT_LIMITS, model)
+    return limit if limit is not None else DEFAULT_OUTPUT_LIMIT
+
+
+def _configured_limits():
+    """CLAUDE_TK_MAX_TOKENSの値を{モデルIDの先頭: 上限}にする（"*"は全モデル）"""
+    value = os.getenv("CLAUDE_TK_MAX_TOKENS", "").strip()
+    limits = {}
+    for item in value.split(","):
+        prefix, sep, number = item.strip().rpartition("=")
+        if not sep:
+            prefix = "*"
+        try:
+            limits[prefix.strip() or "*"] = int(number)
+        except ValueError:
+            continue
+    return {prefix: limit for prefix, limit in limits.items() if limit > 0}
+
+
+def max_tokens_for(model):
+    """1回のリクエストで使うmax_tokens"""
+    limit = model_output_limit(model)
+    configured = _match_prefix(_configured_limits(), model)
+    if configured is not None:
+        return min(configured, limit)
+    return min(limit, REQUEST_CAP)
+
+
+def max_continuations():
+    try:
+        return max(0, int(os.getenv("CLAUDE_TK_MAX_CONTINUATIONS", DEFAULT_MAX_CONTINUATIONS)))
+    except (TypeError, ValueError):
+        return DEFAULT_MAX_CONTINUATIONS
+
+
+def message_text(message):
+    """応答のテキストブロックをつなげた文字列"""
+    return "".join(block.text for block in message.content if isinstance(getattr(block, "text", None), str))
+
+
+def create_with_continuation(create, model, messages, **kwargs):
+    """回答を作成し、max_tokensで止まった場合は続きを受け取ってつなげる
+
+    createはclient.messages.create（またはbeta.messages.create）。
+    (回答, 最後のstop_reason)を返す。継続のリクエストが失敗した場合はそこまでの回答を返す。
+    """
+    max_tokens = max_tokens_for(model)
+    message = create(model=model, max_tokens=max_tokens, messages=messages, **kwargs)
+    answer = message_text(message)
+    stop_reason = getattr(message, "stop_reason", None)
+    for _ in range(max_continuations()):
+        if stop_reason != STOP_MAX_TOKENS:
+            break
+        # プレフィルの末尾の空白はAPIでエラーになるため除く（続きの先頭で補われる）
+        prefill = answer.rstrip()
+        if not prefill:
+            break
+        try:
+            message = create(
+                model=model, max_tokens=max_tokens,
+                messages=list(messages) + [{"role": "assistant", "content": prefill}], **kwargs
+            )
+        except Exception:
+            break
+        answer = prefill + message_text(message)
+        stop_reason = getattr(message, "stop_reason", None)
+    return answer, stop_reason
+
+
+def stream_with_continuation(create, model, messages, on_text, **kwargs):
+    """回答をストリーミングで受け取り、テキストが届くたびにon_text(text)を呼ぶ
+
+    max_tokensで止まった場合はcreate_with_continuationと同じように続きを受け取る。
+    (回答, 最後のstop_reason)を返す。末尾の空白は続きがあるか分かるまでon_textに渡さない
+    （継続する場合はプレフィルに合わせて除くため、表示した文字列と回答が一致する）。
+    """
+    max_tokens = max_tokens_for(model)
+    answer = ""
+    stop_reason = None
+    for round_index in range(max_continuations() + 1):
+        request = list(messages)
+        if answer:
+            request.append({"role": "assistant", "content": answer})
+        pending = ""
+        stop_reason = None
+        try:
+            stream = create(model=model, max_tokens=max_tokens, messages=request, stream=True, **kwargs)
+            try:
+                for event in stream:
+                    if event.type == "content_block_delta" and getattr(event.delta, "type", None) == "text_delta":
+                        text = pending + event.delta.text
+                        shown = text.rstrip()
+                        pending = text[len(shown):]
+                        if shown:
+                            on_text(shown)
+                            answer += shown
+                    elif event.type == "message_delta":
+                        stop_reason = event.delta.stop_reason
+            finally:
+                close = getattr(stream, "close", None)
+                if close is not None:
+                    close()
+        except Exception:
+            # 最初のリクエストの失敗はそのまま伝え、継続の失敗はそこまでの回答を返す
+            if round_index == 0:
+                raise
+            break
+        if stop_reason != STOP_MAX_TOKENS or not answer:
+            if pending:
+                on_text(pending)
+                answer += pending
+            break
+    return answer, stop_reason
@@ -0,0 +1,151 @@
+"""似た質問の検索（文字n-gramのTF-IDFとコサイン類似度、NumPyのみ）
+
+過去の質問を文字の2-gram・3-gram（ハッシュして2^20次元）のTF-IDFベクトルにし、
+特徴ごとの転置リスト（CSR形式の配列）で持つ。検索は質問に含まれる特徴の転置リストだけを
+まとめてnp.bincountで足し合わせるため、10万件でも数ミリ秒で終わる。
+日本語は単語の区切りがないため、形態素解析の代わりに文字n-gramを使う。
+"""
+import threading
+import unicodedata
+import numpy as np
+
+NGRAM_SIZES = (2, 3)
+DIMENSION_BITS = 20
+DIMENSION = 1 << DIMENSION_BITS
+DEFAULT_THRESHOLD = 0.85
+
+# 似た質問が見つかった場合の動作（.envのCLAUDE_TK_SIMILAR_QUESTIONS）
+SIMILAR_ASK = "ask"
+SIMILAR_ALWAYS = "always"
+
+# n-gramのハッシュ（乗算ハッシュの上位ビットを使う）
+_PRIME = np.uint64(1000003)
+_GOLDEN = np.uint64(0x9E3779B97F4A7C15)
+_SHIFT = np.uint64(64 - DIMENSION_BITS)
+
+
+def normalize(text):
+    """全角・半角や大文字・小文字、空白の違いを無視するための正規化"""
+    return " ".join(unicodedata.normalize("NFKC", text).casefold().split())
+
+
+def ngram_features(texts):
+    """複数の文章の文字n-gramを(文章の番号, 特徴の番号)の配列の組にする"""
+    # 文章を区切り文字（\0）でつなげて、全文章のn-gramをまとめて計算する
+    joined = "\0".join(normalize(text).replace("\0", " ") for text in texts) + "\0"
+    codes = np.frombuffer(joined.encode("utf-32-le"), dtype=np.uint32).astype(np.uint64)
+    separators = codes == 0
+    doc_of = np.cumsum(separators) - separators
+    docs = []
+    features = []
+    for n in NGRAM_SIZES:
+        count = len(codes) - n + 1
+        if count <= 0:
+            continue
+        h = np.zeros(count, dtype=np.uint64)
+        valid = np.ones(count, dtype=bool)
+        for k in range(n):
+            window = codes[k:k + count]
+            h = h * _PRIME + window + np.uint64(n)
+            valid &= window != 0
+        docs.append(doc_of[:count][valid])
+        features.append(((h[valid] * _GOLDEN) >> _SHIFT).astype(np.int64))
+    if not docs:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    return np.concatenate(docs).astype(np.int64), np.concatenate(features)
+
+
+class QuestionIndex:
+    """質問→回答の組を登録し、似た質問を検索する"""
+
+    def __init__(self, threshold=DEFAULT_THRESHOLD):
+        self.threshold = threshold
+        self._lock = threading.Lock()
+        self._set_arrays([], [], np.zeros(0, np.int32), np.zeros(0, np.float32),
+                         np.zeros(DIMENSION + 1, np.int64), np.ones(DIMENSION, np.float32))
+        self._extra = []  # addした組の(質問, 回答, 特徴, 重み)
+
+    def __len__(self):
+        return len(self.questions) + len(self._extra)
+
+    def _set_arrays(self, questions, answers, doc, weight, ptr, idf):
+        self.questions = questions
+        self.answers = answers
+        self._doc = doc
+        self._weight = weight
+        self._ptr = ptr
+        self._idf = idf
+
+    def build(self, pairs):
+        """(質問, 回答)の組から索引を作り直す（addした組は残し、新しいIDFで重みを計算し直す）"""
+        questions = []
+        answers = []
+        for question, answer in pairs:
+            questions.append(question)
+            answers.append(answer)
+        count = len(questions)
+        docs, features = ngram_features(questions)
+        # 文章ごとの特徴の出現回数（TF）
+        keys, tf = np.unique(docs * DIMENSION + features, return_counts=True)
+        docs = keys // DIMENSION
+        features = keys % DIMENSION
+        df = np.bincount(features, minlength=DIMENSION)
+        idf = (np.log((count + 1) / (df + 1)) + 1).astype(np.float32)
+        weight = (1 + np.log(tf)).astype(np.float32) * idf[features]
+        norms = np.sqrt(np.bincount(docs, weights=weight * weight, minlength=count)).astype(np.float32)
+        weight /= np.maximum(norms[docs], 1e-12)
+        # 特徴ごとの転置リスト
+        order = np.argsort(features, kind="stable")
+        ptr = np.zeros(DIMENSION + 1, dtype=np.int64)
+        np.cumsum(df, out=ptr[1:])
+        with self._lock:
+            self._set_arrays(questions, answers, docs[order].astype(np.int32), weight[order], ptr, idf)
+            self._extra = [(question, answer, *self._vector(question)) for question, answer, _, _ in self._extra]
+
+    def _vector(self, text):
+        """1つの文章の(特徴, 正規化した重み)"""
+        _, features = ngram_features([text])
+        if not len(features):
+            return features, np.zeros(0, dtype=np.float32)
+        features, tf = np.unique(features, return_counts=True)
+        weight = (1 + np.log(tf)).astype(np.float32) * self._idf[features]
+        return features, weight / np.linalg.norm(weight)
+
+    def add(self, question, answer):
+        """組を1件追加する（IDFは最後のbuildの値を使う。件数が少ない前提で、検索時は1件ずつ比べる）"""
+        with self._lock:
+            features, weight = self._vector(question)
+            self._extra.append((question, answer, features, weight))
+
+    def search(self, text):
+        """最も似た質問の(類似度, 質問, 回答)を返す（登録がない・特徴がない場合はNone）"""
+        with self._lock:
+            features, query = self._vector(text)
+            if not len(features):
+                return None
+            best = None
+            if self.questions:
+                starts = self._ptr[features]
+                lengths = self._ptr[features + 1] - starts
+                total = int(lengths.sum())
+                if total:
+                    # 質問に含まれる特徴の転置リストを1つの配列にまとめて足し合わせる
+                    offsets = np.cumsum(lengths) - lengths
+                    index = np.arange(total) - np.repeat(offsets - starts, lengths)
+                    scores = np.bincount(self._doc[index], weights=self._weight[index] * np.repeat(query, lengths),
+                                         minlength=len(self.questions))
+                    i = int(np.argmax(scores))
+                    best = (float(scores[i]), self.questions[i], self.answers[i])
+            for question, answer, extra_features, extra_weight in self._extra:
+                _, a, b = np.intersect1d(features, extra_features, assume_unique=True, return_indices=True)
+                score = float(np.dot(query[a], extra_weight[b]))
+                if best is None or score > best[0]:
+                    best = (score, question, answer)
+            return best
+
+    def find_similar(self, text):
+        """閾値以上に似た質問があれば(類似度, 質問, 回答)を返す"""
+        match = self.search(text)
+        if match is None or match[0] < self.threshold:
+            return None
+        return match
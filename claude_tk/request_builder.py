@@ -0,0 +1,108 @@
+"""APIリクエスト用メッセージの差分構築
+
+送信のたびに会話履歴全体からメッセージのリストを作り直さず、過去のメッセージのAPI形式と
+そのJSONを履歴に合わせて保持し、前回の送信以降に増えたメッセージだけを変換・追加する。
+JSONを連結した先頭部分（prefix_json）とそのSHA-256（prefix_key）は、応答やトークン数の
+キャッシュのキーに使える。
+"""
+import json
+import hashlib
+
+
+def file_block(file_id):
+    """ファイルIDで参照するimageブロック"""
+    return {"type": "image", "source": {"type": "file", "file_id": file_id}}
+
+
+def api_message(msg, file_ids=False):
+    """過去のメッセージのAPI形式（userはテキストのみ、assistantはMarkdown）
+
+    file_ids=Trueの場合、Files APIでアップロード済みの画像（file_ids）はIDで参照して含める。
+    """
+    if msg["role"] == "user":
+        if file_ids and msg.get("file_ids"):
+            blocks = [file_block(file_id) for file_id in msg["file_ids"]]
+            return {"role": "user", "content": blocks + [{"type": "text", "text": msg["content"]}]}
+        return {"role": "user", "content": msg["content"]}
+    return {"role": "assistant", "content": msg.get("markdown", msg["content"])}
+
+
+def encode_message(message):
+    """API形式のメッセージのJSON（区切りの空白なし）"""
+    return json.dumps(message, ensure_ascii=False, separators=(",", ":"))
+
+
+class RequestBuilder:
+    """会話履歴に合わせてAPI形式のメッセージとそのJSONを保持する
+
+    会話履歴のリストが置き換えられた場合や、保持している末尾のメッセージが変わった場合は
+    自動的に作り直す（クリア・再開時は明示的にreset()を呼ぶ）。
+    file_ids=Trueの場合、過去の質問の画像もFiles APIのファイルIDで参照して含める。
+    """
+
+    def __init__(self, file_ids=False):
+        self.file_ids = file_ids
+        self.reset()
+
+    def reset(self, history=None, api_messages=None):
+        """保持している内容を捨てる
+
+        historyを渡すとその内容で作り直す。api_messagesにhistoryと同じ長さのAPI形式の
+        メッセージ（セッションのスナップショットなど、テキストのみの形式）があれば、変換せずにそのまま使う
+        （ファイルIDで画像を参照する場合は使わない）。
+        """
+        self.messages = []
+        self.encoded = []
+        self._digest = hashlib.sha256()
+        self._history = None
+        self._last = None
+        if history is None:
+            return
+        if api_messages is not None and len(api_messages) == len(history) and not self.file_ids:
+            for message in api_messages:
+                self._append(message)
+            self._history = history
+            self._last = history[-1] if history else None
+        else:
+            self.sync(history)
+
+    def _append(self, message):
+        data = encode_message(message)
+        self.messages.append(message)
+        self.encoded.append(data)
+        self._digest.update(data.encode("utf-8") + b",")
+
+    def sync(self, history, count=None):
+        """history[:count]（省略時は全体）に合わせ、増えたメッセージだけを追加する"""
+        count = len(history) if count is None else count
+        n = len(self.messages)
+        if history is not self._history or n > count or (n and history[n - 1] is not self._last):
+            self.reset()
+            self._history = history
+            n = 0
+        for msg in history[n:count]:
+            self._append(api_message(msg, self.file_ids))
+        if count:
+            self._last = history[count - 1]
+
+    def build(self, history, latest_content=None):
+        """送信するメッセージのリストを返す
+
+        最後のメッセージ（今回の質問）以外は保持している内容を使う。latest_contentを渡すと、
+        最後のメッセージの内容を置き換える（画像付きの質問など）。
+        """
+        self.sync(history, len(history) - 1)
+        last = history[-1]
+        if latest_content is None:
+            latest = api_message(last, self.file_ids)
+        else:
+            latest = {"role": last["role"], "content": latest_content}
+        return self.messages + [latest]
+
+    def prefix_json(self):
+        """保持しているメッセージのJSON配列"""
+        return "[" + ",".join(self.encoded) + "]"
+
+    def prefix_key(self):
+        """保持しているメッセージのJSONのSHA-256（16進数）"""
+        return self._digest.hexdigest()
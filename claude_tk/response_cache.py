@@ -0,0 +1,117 @@
+"""同じリクエストに対する回答のディスクキャッシュ
+
+.envのCLAUDE_TK_RESPONSE_CACHEにディレクトリを設定すると有効になる。
+キーはモデル・過去のメッセージ（RequestBuilderのprefix_key）・今回の質問（画像は内容ハッシュ）・
+パラメータを正規化したJSONのSHA-256。回答は1件1ファイル（root/キー先頭2文字/キー.json）に保存し、
+最後に使ってから一定の日数（CLAUDE_TK_RESPONSE_CACHE_MAX_DAYS）が過ぎたものと、合計サイズ
+（CLAUDE_TK_RESPONSE_CACHE_MAX_MB）を超えた分は、最後に使った時刻（ファイルの更新時刻）が古い順に削除する。
+"""
+import os
+import json
+import time
+import hashlib
+import threading
+
+DEFAULT_MAX_MB = 100
+DEFAULT_MAX_DAYS = 30
+ENTRY_EXTENSION = ".json"
+
+
+def request_key(model, prefix_key, latest, **params):
+    """リクエストのキャッシュキー（latestは今回の質問をJSONにできる形にしたもの）"""
+    canonical = json.dumps(
+        {"model": model, "prefix": prefix_key, "latest": latest, "params": params},
+        ensure_ascii=False, sort_keys=True, separators=(",", ":")
+    )
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def _env_number(name, default):
+    try:
+        return float(os.getenv(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def from_env():
+    """.envの設定からキャッシュを作成する（CLAUDE_TK_RESPONSE_CACHEが未設定ならNone）"""
+    root = os.getenv("CLAUDE_TK_RESPONSE_CACHE")
+    if not root:
+        return None
+    return ResponseCache(
+        root,
+        max_bytes=int(_env_number("CLAUDE_TK_RESPONSE_CACHE_MAX_MB", DEFAULT_MAX_MB) * 1024 * 1024),
+        max_age=_env_number("CLAUDE_TK_RESPONSE_CACHE_MAX_DAYS", DEFAULT_MAX_DAYS) * 86400
+    )
+
+
+class ResponseCache:
+    """キャッシュキー→回答（Markdown）のディレクトリ"""
+
+    def __init__(self, root, max_bytes=DEFAULT_MAX_MB * 1024 * 1024, max_age=DEFAULT_MAX_DAYS * 86400):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self._lock = threading.Lock()
+
+    def path_for(self, key):
+        return os.path.join(self.root, key[:2], key + ENTRY_EXTENSION)
+
+    def get(self, key):
+        """キャッシュされた回答を返す（ない・期限切れ・読めない場合はNone）"""
+        path = self.path_for(key)
+        try:
+            if time.time() - os.path.getmtime(path) > self.max_age:
+                return None
+            with open(path, "r", encoding="utf-8") as f:
+                answer = json.load(f)["answer"]
+            # 最後に使った時刻として更新時刻を更新する
+            os.utime(path)
+            return answer
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+
+    def put(self, key, answer, model):
+        """回答を保存し、上限を超えた分を削除する（失敗してもキャッシュしないだけ）"""
+        path = self.path_for(key)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"model": model, "answer": answer, "created_at": time.time()}, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+            self.evict()
+        except OSError:
+            pass
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def entries(self):
+        """(パス, サイズ, 最後に使った時刻)のリスト"""
+        result = []
+        if not os.path.isdir(self.root):
+            return result
+        for bucket in os.scandir(self.root):
+            if not bucket.is_dir():
+                continue
+            for entry in os.scandir(bucket.path):
+                if entry.name.endswith(ENTRY_EXTENSION):
+                    st = entry.stat()
+                    result.append((entry.path, st.st_size, st.st_mtime))
+        return result
+
+    def evict(self):
+        """期限切れのものと、合計サイズの上限を超えた分を古い順に削除する"""
+        with self._lock:
+            now = time.time()
+            entries = sorted(self.entries(), key=lambda item: item[2])
+            total = sum(size for _, size, _ in entries)
+            for path, size, mtime in entries:
+                if total <= self.max_bytes and now - mtime <= self.max_age:
+                    continue
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+                total -= size
@@ -0,0 +1,101 @@
+"""終了時のセッションスナップショット（次回起動時の即時復元用）
+
+終了時に、履歴欄に表示していた内容（テキスト・タグの範囲・サムネイル画像）と会話履歴、
+API送信用のメッセージ一覧を1つのファイルに書き出す。
+次回起動時はファイルを1回読むだけで、Markdownの変換やサムネイルの作成をせずに画面を元に戻せる。
+
+ファイルの構造:
+    MAGIC
+    状態JSONの長さ（4バイト）＋状態JSON
+    サムネイル画像（PNG）のデータを順に連結したもの（位置と長さは状態JSONに記録）
+"""
+import os
+import json
+import struct
+from datetime import datetime
+try:
+    from claude_tk import conversation_journal, request_builder
+except ImportError:  # スクリプトとして直接実行された場合
+    import conversation_journal
+    import request_builder
+
+DEFAULT_SESSION_PATH = os.path.join("session", "last_session.snap")
+MAGIC = b"CTKSNAP1"
+VERSION = 1
+
+# 起動時の復元方法（.envのCLAUDE_TK_SESSION_RESTORE）
+RESTORE_ALWAYS = "always"
+RESTORE_ASK = "ask"
+RESTORE_NEVER = "never"
+
+_HEADER = struct.Struct("<I")
+
+
+def api_messages(history):
+    """API送信用のメッセージ一覧（過去のメッセージはテキストのみ、assistantはMarkdown）"""
+    return [request_builder.api_message(msg) for msg in history]
+
+
+def build_state(history, model, view, store, **extra):
+    """スナップショットの状態を作成する
+
+    viewは履歴欄の表示内容（segments, tags, images）。extraはアプリ固有の値（前回のzipなど）。
+    """
+    return {
+        "version": VERSION,
+        "saved_at": datetime.now().isoformat(),
+        "model": model,
+        "history": [conversation_journal.serialize_message(msg, store) for msg in history],
+        "api_messages": api_messages(history),
+        "view": view,
+        **extra
+    }
+
+
+def write_snapshot(path, state, blobs):
+    """状態とサムネイルのデータを書き込む（一時ファイルに書いてから置き換える）"""
+    offset = 0
+    blob_index = []
+    for data in blobs:
+        blob_index.append([offset, len(data)])
+        offset += len(data)
+    body = json.dumps(dict(state, blobs=blob_index), ensure_ascii=False).encode("utf-8")
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = path + ".tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            f.write(MAGIC + _HEADER.pack(len(body)) + body + b"".join(blobs))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def read_snapshot(path):
+    """スナップショットを1回の読み込みで読み、(状態, サムネイルのデータのリスト)を返す"""
+    with open(path, "rb") as f:
+        data = f.read()
+    start = len(MAGIC) + _HEADER.size
+    if len(data) < start or not data.startswith(MAGIC):
+        raise ValueError("セッションのスナップショットではありません")
+    (length,) = _HEADER.unpack_from(data, len(MAGIC))
+    state = json.loads(data[start:start + length].decode("utf-8"))
+    if state.get("version") != VERSION:
+        raise ValueError("対応していないスナップショットの形式です")
+    base = start + length
+    blobs = [data[base + offset:base + offset + size] for offset, size in state.pop("blobs")]
+    return state, blobs
+
+
+def load_history(state):
+    """スナップショットの会話履歴を復元し、(履歴, 開いたzipのリスト)を返す"""
+    archives = {}
+    history = [conversation_journal.deserialize_message(record, archives) for record in state["history"]]
+    return history, [archive for archive in archives.values() if archive is not None]
+
+
+def remove_snapshot(path):
+    if os.path.exists(path):
+        os.remove(path)
@@ -0,0 +1,142 @@
+import unittest
+import os
+import json
+import time
+import tempfile
+from unittest.mock import MagicMock, patch
+from anthropic.types import Message, ModelInfo, RawMessageStreamEvent
+import pydantic
+from claude_tk import api_cassette
+
+
+def make_message(text):
+    return Message.model_validate({
+        "id": "msg_1", "type": "message", "role": "assistant", "model": "model-x",
+        "content": [{"type": "text", "text": text}], "stop_reason": "end_turn", "stop_sequence": None,
+        "usage": {"input_tokens": 3, "output_tokens": 5}
+    })
+
+
+def make_events(texts):
+    adapter = pydantic.TypeAdapter(RawMessageStreamEvent)
+    events = [{"type": "content_block_start", "index": 0, "content_block": {"type": "text", "text": ""}}]
+    events += [{"type": "content_block_delta", "index": 0, "delta": {"type": "text_delta", "text": t}} for t in texts]
+    events.append({"type": "content_block_stop", "index": 0})
+    return [adapter.validate_python(e) for e in events]
+
+
+class TestApiCassette(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.path = os.path.join(self.tmpdir.name, "cassettes", "run.jsonl")
+        self.client = MagicMock()
+        self.request = {
+            "model": "model-x", "max_tokens": 1000,
+            "messages": [{"role": "user", "content": [
+                {"type": "image", "source": {"type": "base64", "media_type": "image/png", "data": "QUJD" * 100}},
+                {"type": "text", "text": "Q"}
+            ]}]
+        }
+
+    def record(self):
+        return api_cassette.RecordingClient(self.client, api_cassette.Cassette(self.path))
+
+    def test_record_and_replay_message(self):
+        self.client.messages.create.return_value = make_message("A")
+        self.client.models.list.return_value = MagicMock(data=[ModelInfo.model_construct(id="model-x", created_at="2025-01-01T00:00:00Z", display_name="X", type="model")], has_more=False, first_id="model-x", last_id="model-x")
+        recorder = self.record()
+        self.assertEqual(recorder.messages.create(**self.request).content[0].text, "A")
+        recorder.models.list()
+        # 画像のデータはハッシュに置き換えて記録する
+        with open(self.path, encoding="utf-8") as f:
+            lines = [json.loads(line) for line in f]
+        self.assertEqual([e["method"] for e in lines], ["messages.create", "models.list"])
+        self.assertTrue(lines[0]["request"]["messages"][0]["content"][0]["source"]["data"].startswith("sha256:"))
+
+        replay = api_cassette.ReplayClient(api_cassette.Cassette(self.path), speed=0)
+        message = replay.messages.create(**self.request)
+        self.assertIsInstance(message, Message)
+        self.assertEqual(message.content[0].text, "A")
+        self.assertEqual(message.usage.output_tokens, 5)
+        self.assertEqual([m.id for m in replay.models.list().data], ["model-x"])
+        # 1回分しか記録していないので2回目は見つからない
+        with self.assertRaises(api_cassette.CassetteMissError):
+            replay.messages.create(**self.request)
+        other = dict(self.request, max_tokens=10)
+        with self.assertRaises(api_cassette.CassetteMissError):
+            api_cassette.ReplayClient(api_cassette.Cassette(self.path), speed=0).messages.create(**other)
+
+    def test_record_and_replay_stream_timing(self):
+        def slow_stream():
+            for event in make_events(["a", "b"]):
+                time.sleep(0.05)
+                yield event
+        self.client.messages.create.return_value = slow_stream()
+        recorder = self.record()
+        texts = [e.delta.text for e in recorder.messages.create(stream=True, **self.request) if e.type == "content_block_delta"]
+        self.assertEqual(texts, ["a", "b"])
+        entry = api_cassette.Cassette(self.path).entries[0]
+        offsets = [offset for offset, _ in entry["events"]]
+        self.assertEqual(len(offsets), 4)
+        self.assertGreaterEqual(offsets[-1], 0.15)
+
+        # 記録した速度で再生すると同じくらいかかり、倍速なら短くなる
+        for speed, low, high in ((1, 0.15, 0.5), (10, 0, 0.1)):
+            replay = api_cassette.ReplayClient(api_cassette.Cassette(self.path), speed=speed)
+            start = time.monotonic()
+            events = list(replay.messages.create(stream=True, **self.request))
+            elapsed = time.monotonic() - start
+            self.assertEqual([e.type for e in events], ["content_block_start", "content_block_delta", "content_block_delta", "content_block_stop"])
+            self.assertTrue(low <= elapsed < high, elapsed)
+
+    def test_record_error(self):
+        error = RuntimeError("overloaded")
+        error.status_code = 529
+        self.client.messages.create.side_effect = error
+        with self.assertRaises(RuntimeError):
+            self.record().messages.create(**self.request)
+        replay = api_cassette.ReplayClient(api_cassette.Cassette(self.path), speed=0)
+        with self.assertRaises(api_cassette.ReplayedAPIError) as cm:
+            replay.messages.create(**self.request)
+        self.assertEqual(cm.exception.status_code, 529)
+
+    def test_record_and_replay_count_tokens_and_upload(self):
+        from anthropic.types import MessageTokensCount
+        self.client.messages.count_tokens.return_value = MessageTokensCount(input_tokens=42)
+        self.client.beta.files.upload.return_value = api_cassette.FileMetadata.model_construct(
+            id="file_1", created_at="2025-01-01T00:00:00Z", filename="a.png", mime_type="image/png",
+            size_bytes=3, type="file"
+        )
+        upload = {"file": ("a.png", b"PNG", "image/png"), "betas": ["files-api-2025-04-14"]}
+        recorder = self.record()
+        self.assertEqual(recorder.messages.count_tokens(**self.request).input_tokens, 42)
+        self.assertEqual(recorder.beta.files.upload(**upload).id, "file_1")
+        # アップロードしたファイルの内容はハッシュに置き換えて記録する
+        entry = api_cassette.Cassette(self.path).entries[1]
+        self.assertEqual(entry["method"], "beta.files.upload")
+        self.assertTrue(entry["request"]["file"][1].startswith("sha256:"))
+
+        replay = api_cassette.ReplayClient(api_cassette.Cassette(self.path), speed=0)
+        self.assertEqual(replay.messages.count_tokens(**self.request).input_tokens, 42)
+        self.assertEqual(replay.beta.files.upload(**upload).id, "file_1")
+        with self.assertRaises(api_cassette.CassetteMissError):
+            replay.beta.files.upload(file=("b.png", b"other", "image/png"), betas=["files-api-2025-04-14"])
+
+    def test_from_env(self):
+        env = {}
+        with patch("os.getenv", side_effect=lambda key, default=None: env.get(key, default)):
+            self.assertIs(api_cassette.from_env(self.client), self.client)
+            env.update({"CLAUDE_TK_CASSETTE": self.path, "CLAUDE_TK_CASSETTE_MODE": "record"})
+            client = api_cassette.from_env(self.client)
+            self.assertIsInstance(client, api_cassette.RecordingClient)
+            # 差し替えていない属性は元のクライアントを使う
+            self.assertIs(client.beta.models, self.client.beta.models)
+            env.update({"CLAUDE_TK_CASSETTE_MODE": "replay", "CLAUDE_TK_CASSETTE_SPEED": "4"})
+            client = api_cassette.from_env(self.client)
+            self.assertIsInstance(client, api_cassette.ReplayClient)
+            self.assertEqual(client.speed, 4)
+
+
+if __name__ == "__main__":
+    unittest.main()
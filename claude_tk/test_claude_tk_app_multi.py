@@ -4,6 +4,8 @@ import tkinter as tk
 import sys
 import os
 import json
+import time
+import tempfile
 
 # claude_tk_app_multi.pyのClaudeChatAppをimport
 from claude_tk.claude_tk_app_multi import ClaudeChatApp
@@ -158,9 +160,10 @@ class TestClaudeChatApp(unittest.TestCase):
                 self.app.exit_application()
                 mock_destroy.assert_called_once()
 
+    @patch("claude_tk.claude_tk_app_multi.os.path.getsize", return_value=100)
     @patch("claude_tk.claude_tk_app_multi.filedialog.askopenfilename", return_value="/tmp/test.json")
     @patch("builtins.open", new_callable=mock_open, read_data='{"conversation": [{"role": "user", "content": "Q"}, {"role": "assistant", "content": "A"}]}')
-    def test_resume_conversation(self, mock_file, mock_dialog):
+    def test_resume_conversation(self, mock_file, mock_dialog, mock_size):
         with patch("claude_tk.claude_tk_app_multi.messagebox.showinfo") as mock_info:
             self.app.resume_conversation()
             self.assertEqual(len(self.app.conversation_history), 2)
@@ -168,12 +171,54 @@ class TestClaudeChatApp(unittest.TestCase):
             self.assertEqual(self.app.conversation_history[1]["role"], "assistant")
             mock_info.assert_called_once()
 
+    @patch("claude_tk.claude_tk_app_multi.os.path.getsize", return_value=100)
     @patch("claude_tk.claude_tk_app_multi.filedialog.askopenfilename", return_value="/tmp/test.json")
     @patch("builtins.open", new_callable=mock_open, read_data='{"invalid": 1}')
-    def test_resume_conversation_invalid(self, mock_file, mock_dialog):
+    def test_resume_conversation_invalid(self, mock_file, mock_dialog, mock_size):
         with patch("claude_tk.claude_tk_app_multi.messagebox.showerror") as mock_error:
             self.app.resume_conversation()
             mock_error.assert_called_once()
 
+    @patch("claude_tk.claude_tk_app_multi.json_stream.TAIL_WINDOW", 512)
+    def test_resume_conversation_large_file(self):
+        conversation = []
+        for i in range(60):
+            conversation.append({"role": "user", "content": f"Q{i}"})
+            conversation.append({"role": "assistant", "content": f"**A{i}**"})
+        with tempfile.NamedTemporaryFile("w", suffix=".json", delete=False, encoding="utf-8") as f:
+            json.dump({"metadata": {"model": "m"}, "conversation": conversation}, f, indent=2)
+        self.addCleanup(os.remove, f.name)
+        with patch("claude_tk.claude_tk_app_multi.filedialog.askopenfilename", return_value=f.name), \
+                patch("claude_tk.claude_tk_app_multi.messagebox.showinfo") as mock_info:
+            self.app.resume_conversation()
+            # 最新のターンが先に表示され、古い履歴は読み込み中
+            self.assertTrue(self.app._loading_history)
+            self.assertEqual(self.app.conversation_history[-1]["markdown"], "**A59**")
+            deadline = time.time() + 10
+            while self.app._loading_history and time.time() < deadline:
+                self.root.update()
+                time.sleep(0.01)
+            mock_info.assert_called_once()
+        self.assertEqual(len(self.app.conversation_history), 120)
+        self.assertEqual(self.app.conversation_history[0], {"role": "user", "content": "Q0"})
+        self.assertIn("【質問 1】", self.app.history_text.get("1.0", "3.0"))
+
+    @patch("claude_tk.claude_tk_app_multi.json_stream.TAIL_WINDOW", 512)
+    def test_resume_conversation_window_in_bytes(self):
+        # 文字数はTAIL_WINDOWより少なくても、バイト数が多ければ末尾から読み込む
+        conversation = [{"role": "user", "content": "質問" * 40}, {"role": "assistant", "content": "回答" * 40}]
+        with tempfile.NamedTemporaryFile("w", suffix=".json", delete=False, encoding="utf-8") as f:
+            json.dump({"conversation": conversation}, f, ensure_ascii=False)
+        self.addCleanup(os.remove, f.name)
+        with open(f.name, encoding="utf-8") as f2:
+            self.assertLess(len(f2.read()), 512)
+        self.assertGreaterEqual(os.path.getsize(f.name), 512)
+        with patch("claude_tk.claude_tk_app_multi.filedialog.askopenfilename", return_value=f.name), \
+                patch("claude_tk.claude_tk_app_multi.json_stream.read_tail", return_value=(None, 0)) as mock_tail, \
+                patch.object(self.app, "start_history_loading") as mock_loading:
+            self.app.resume_conversation()
+        mock_tail.assert_called_once()
+        mock_loading.assert_called_once_with(f.name, None, 0)
+
 if __name__ == "__main__":
     unittest.main() 
\ No newline at end of file
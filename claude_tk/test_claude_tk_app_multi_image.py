@@ -1,10 +1,12 @@
 import unittest
-from unittest.mock import patch, MagicMock, mock_open
+from unittest.mock import patch, MagicMock
 import os
 import tempfile
 import shutil
 import json
+import hashlib
 from claude_tk.claude_tk_app_multi_image import ClaudeChatApp
+from claude_tk import image_attachments, request_builder
 
 class TestClaudeChatApp(unittest.TestCase):
     def setUp(self):
@@ -19,10 +21,20 @@ class TestClaudeChatApp(unittest.TestCase):
         self.addCleanup(patcher_env.stop)
         patcher_env.start()
         # APIキー取得もモック
-        patcher_getenv = patch('claude_tk.claude_tk_app_multi_image.os.getenv', return_value='dummy-key')
+        # メディアストア・ジャーナル・セッションのスナップショットは一時ディレクトリに作成する
+        self.data_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.data_dir, True)
+        self.env = {
+            'ANTHROPIC_API_KEY': 'dummy-key',
+            'CLAUDE_TK_MEDIA_DIR': os.path.join(self.data_dir, 'media'),
+            'CLAUDE_TK_JOURNAL_DIR': os.path.join(self.data_dir, 'journal'),
+            'CLAUDE_TK_SESSION_FILE': os.path.join(self.data_dir, 'session', 'last_session.snap'),
+        }
+        patcher_getenv = patch('claude_tk.claude_tk_app_multi_image.os.getenv', side_effect=lambda key, default=None: self.env.get(key, default))
         self.addCleanup(patcher_getenv.stop)
         patcher_getenv.start()
         self.app = ClaudeChatApp(self.root)
+        self.addCleanup(self.app.journal.close)
 
     def test_markdown_to_text_basic(self):
         md = '# Title\n\n- item1\n- item2\n**bold** and *italic*\n[link](http://a)'
@@ -98,6 +110,27 @@ class TestClaudeChatApp(unittest.TestCase):
                 self.assertEqual(self.app.conversation_history[0]['role'], 'user')
                 self.assertEqual(self.app.conversation_history[1]['role'], 'assistant')
 
+    def test_resume_conversation_image_paths(self):
+        # 新形式(image_paths)と旧形式(image_path)の両方を読み込める
+        import zipfile
+        with tempfile.TemporaryDirectory() as tmpdir:
+            zip_path = os.path.join(tmpdir, 'test.zip')
+            json_data = {'conversation': [
+                {'role': 'user', 'content': 'Q1', 'image_path': 'img/a.png'},
+                {'role': 'assistant', 'content': 'A1'},
+                {'role': 'user', 'content': 'Q2', 'image_paths': ['img/b.png', 'img/c.png']},
+                {'role': 'assistant', 'content': 'A2'}
+            ]}
+            with zipfile.ZipFile(zip_path, 'w') as z:
+                z.writestr('test.json', json.dumps(json_data))
+            with patch('tkinter.filedialog.askopenfilename', return_value=zip_path), \
+                 patch('tkinter.messagebox.showinfo'):
+                self.app.update_history_display = MagicMock()
+                self.app.resume_conversation()
+            self.assertEqual([image_attachments.image_name(p) for p in self.app.conversation_history[0]['image_paths']], ['a.png'])
+            self.assertEqual([image_attachments.image_name(p) for p in self.app.conversation_history[2]['image_paths']], ['b.png', 'c.png'])
+            self.app._imported_archive.close()
+
     def test_ask_save_format_ok(self):
         # ask_save_formatのOK動作をテスト
         with patch('tkinter.Toplevel'), \
@@ -107,24 +140,181 @@ class TestClaudeChatApp(unittest.TestCase):
                 self.assertIn(self.app.ask_save_format(), ['markdown', 'zip', 'both', None])
 
     def test_attach_image_cancel(self):
-        with patch('tkinter.filedialog.askopenfilename', return_value=''):
+        with patch('tkinter.filedialog.askopenfilenames', return_value=''):
             self.app.attach_image()
-            self.assertIsNone(self.app.attached_image_path)
+            self.assertEqual(self.app.attached_image_paths, [])
 
     def test_attach_image_error(self):
-        with patch('tkinter.filedialog.askopenfilename', return_value='dummy.png'), \
+        with patch('tkinter.filedialog.askopenfilenames', return_value=('dummy.png',)), \
              patch('PIL.Image.open', side_effect=OSError('bad image')), \
              patch('tkinter.messagebox.showerror') as mock_err:
             self.app.attach_image()
-            self.assertIsNone(self.app.attached_image_path)
+            self.assertEqual(self.app.attached_image_paths, [])
             mock_err.assert_called()
 
+    def test_attach_image_multiple(self):
+        # 複数画像を選択すると順序を保ったまま追加される
+        with patch('tkinter.filedialog.askopenfilenames', return_value=('a.png', 'b.png')), \
+             patch('claude_tk.claude_tk_app_multi_image.image_attachments.load_thumbnail', return_value=MagicMock()), \
+             patch('claude_tk.claude_tk_app_multi_image.ImageTk.PhotoImage'):
+            self.app.attach_image()
+            self.assertEqual(self.app.attached_image_paths, ['a.png', 'b.png'])
+            self.assertEqual(len(self.app.attached_image_previews), 2)
+
+    def test_attach_image_duplicate_shared(self):
+        # 同じ内容・再保存しただけのコピーは1つの添付画像にまとめ、まとめたことを知らせる
+        from PIL import Image
+        img = Image.new('RGB', (40, 20), 'white')
+        img.paste(Image.new('RGB', (20, 20), 'black'), (0, 0))
+        a = os.path.join(self.data_dir, 'a.png')
+        img.save(a)
+        a_copy = os.path.join(self.data_dir, 'a_copy.png')
+        shutil.copyfile(a, a_copy)
+        a_bmp = os.path.join(self.data_dir, 'a.bmp')
+        img.save(a_bmp)
+        a_jpg = os.path.join(self.data_dir, 'a.jpg')
+        img.save(a_jpg, quality=90)
+        with patch('tkinter.filedialog.askopenfilenames', return_value=(a, a_copy, a_bmp, a_jpg)), \
+             patch('claude_tk.claude_tk_app_multi_image.ImageTk.PhotoImage'), \
+             patch('claude_tk.claude_tk_app_multi_image.messagebox.showinfo') as mock_info:
+            self.app.attach_image()
+        self.assertEqual(len(self.app.attached_image_paths), 1)
+        self.assertTrue(self.app.attached_image_paths[0].endswith('.png'))
+        self.assertTrue(self.app.media_store.contains(self.app.attached_image_paths[0]))
+        mock_info.assert_called_once()
+        self.assertIn('a.bmp', mock_info.call_args[0][1])
+        self.assertIn('a.jpg', mock_info.call_args[0][1])
+        # 添付し直しても増えない
+        with patch('tkinter.filedialog.askopenfilenames', return_value=(a_jpg,)), \
+             patch('claude_tk.claude_tk_app_multi_image.ImageTk.PhotoImage'), \
+             patch('claude_tk.claude_tk_app_multi_image.messagebox.showinfo'):
+            self.app.attach_image()
+        self.assertEqual(len(self.app.attached_image_paths), 1)
+
+    def test_update_history_display_shares_thumbnail(self):
+        # 同じ画像ソースのサムネイルは1回だけ作成される
+        self.app.conversation_history = [
+            {'role': 'user', 'content': 'q1', 'image_paths': ['a.png']},
+            {'role': 'assistant', 'content': 'a1'},
+            {'role': 'user', 'content': 'q2', 'image_paths': ['a.png']}
+        ]
+        self.app.history_text = MagicMock()
+        with patch('claude_tk.claude_tk_app_multi_image.image_attachments.load_thumbnail', return_value=MagicMock()) as mock_thumb, \
+             patch('claude_tk.claude_tk_app_multi_image.ImageTk.PhotoImage'):
+            self.app.update_history_display()
+            self.app.update_history_display()
+        self.assertEqual(mock_thumb.call_count, 1)
+        self.assertEqual(len(self.app.history_images), 2)
+
+    def test_paste_image_from_clipboard(self):
+        # クリップボード画像はファイルを作らずMemoryImageとして添付される
+        mem = image_attachments.MemoryImage(b'png-bytes', 'clipboard_1.png')
+        with patch('claude_tk.claude_tk_app_multi_image.image_attachments.grab_clipboard_image', return_value=mem), \
+             patch('claude_tk.claude_tk_app_multi_image.image_attachments.load_thumbnail', return_value=MagicMock()), \
+             patch('claude_tk.claude_tk_app_multi_image.ImageTk.PhotoImage'):
+            self.assertEqual(self.app.paste_image(), 'break')
+        self.assertEqual(self.app.attached_image_paths, [mem])
+
+    def test_paste_image_no_image(self):
+        # 画像がなければ通常のテキスト貼り付けに任せる
+        with patch('claude_tk.claude_tk_app_multi_image.image_attachments.grab_clipboard_image', return_value=None):
+            self.assertIsNone(self.app.paste_image())
+        self.assertEqual(self.app.attached_image_paths, [])
+
+    def test_save_conversation_history_memory_image(self):
+        # メモリ上の画像はzipへ直接書き込まれる
+        import zipfile
+        mem = image_attachments.MemoryImage(b'png-bytes', 'clipboard_1.png')
+        self.app.conversation_history = [
+            {"role": "user", "content": "Q", "image_paths": [mem]},
+            {"role": "assistant", "content": "A", "markdown": "A_md"}
+        ]
+        with tempfile.TemporaryDirectory() as tmpdir:
+            zip_path = os.path.join(tmpdir, 'out.zip')
+            with patch.object(self.app, 'ask_save_format', return_value="json"), \
+                 patch('tkinter.filedialog.asksaveasfilename', return_value=zip_path), \
+                 patch('tkinter.messagebox.showinfo'):
+                self.assertTrue(self.app.save_conversation_history())
+            with zipfile.ZipFile(zip_path) as z:
+                # zip内の画像名は内容ハッシュ
+                hashed = 'img/' + hashlib.sha256(b'png-bytes').hexdigest() + '.png'
+                self.assertEqual(z.read(hashed), b'png-bytes')
+                json_name = [n for n in z.namelist() if n.endswith('.json')][0]
+                data = json.loads(z.read(json_name))
+            self.assertEqual(data['conversation'][0]['image_paths'], [hashed])
+
+    def test_save_and_resume_thumbnail_sidecars(self):
+        # 保存zipにサムネイルとマニフェストが同梱され、再開時はそれが表示に使われる
+        import zipfile
+        from PIL import Image
+        with tempfile.TemporaryDirectory() as tmpdir:
+            img_path = os.path.join(tmpdir, 'shot.png')
+            Image.new('RGB', (800, 600), 'red').save(img_path)
+            self.app.conversation_history = [
+                {"role": "user", "content": "Q", "image_paths": [img_path]},
+                {"role": "assistant", "content": "A", "markdown": "A"}
+            ]
+            zip_path = os.path.join(tmpdir, 'out.zip')
+            with patch.object(self.app, 'ask_save_format', return_value="json"), \
+                 patch('tkinter.filedialog.asksaveasfilename', return_value=zip_path), \
+                 patch('tkinter.messagebox.showinfo'):
+                self.assertTrue(self.app.save_conversation_history())
+            with zipfile.ZipFile(zip_path) as z:
+                manifest = json.loads(z.read('thumbs/manifest.json'))
+                thumb_name = list(manifest['thumbnails'].values())[0]
+                self.assertLessEqual(max(Image.open(z.open(thumb_name)).size), 200)
+            with patch('tkinter.filedialog.askopenfilename', return_value=zip_path), \
+                 patch('tkinter.messagebox.showinfo'):
+                self.app.update_history_display = MagicMock()
+                self.app.resume_conversation()
+            resumed_image = self.app.conversation_history[0]['image_paths'][0]
+            self.assertEqual(self.app.history_thumbnail_files[resumed_image].member, thumb_name)
+            self.app._imported_archive.close()
+
+    def test_resume_old_zip_without_thumbnails(self):
+        # サムネイルのない古いzipも読み込める
+        import zipfile
+        with tempfile.TemporaryDirectory() as tmpdir:
+            zip_path = os.path.join(tmpdir, 'old.zip')
+            with zipfile.ZipFile(zip_path, 'w') as z:
+                z.writestr('old.json', json.dumps({'conversation': [{'role': 'user', 'content': 'Q', 'image_path': 'img/a.png'}]}))
+                z.writestr('img/a.png', b'not really a png')
+            with patch('tkinter.filedialog.askopenfilename', return_value=zip_path), \
+                 patch('tkinter.messagebox.showinfo'):
+                self.app.update_history_display = MagicMock()
+                self.app.resume_conversation()
+            self.assertEqual(self.app.history_thumbnail_files, {})
+            self.assertEqual(len(self.app.conversation_history), 1)
+            self.app._imported_archive.close()
+
+    def test_resume_conversation_lazy_images(self):
+        # zipは展開されず、画像は参照されたときにzipから読み込まれる
+        import zipfile
+        with tempfile.TemporaryDirectory() as tmpdir:
+            zip_path = os.path.join(tmpdir, 'lazy.zip')
+            with zipfile.ZipFile(zip_path, 'w') as z:
+                z.writestr('c.json', json.dumps({'conversation': [
+                    {'role': 'user', 'content': 'Q', 'image_paths': ['img/a.png', '../../etc/passwd']}]}))
+                z.writestr('img/a.png', b'image-bytes')
+            with patch('tkinter.filedialog.askopenfilename', return_value=zip_path), \
+                 patch('zipfile.ZipFile.extractall') as mock_extract, \
+                 patch('tkinter.messagebox.showinfo'):
+                self.app.update_history_display = MagicMock()
+                self.app.resume_conversation()
+            mock_extract.assert_not_called()
+            image, outside = self.app.conversation_history[0]['image_paths']
+            self.assertEqual(image.data, b'image-bytes')
+            # zip外を指すパスはzipのメンバーとして扱われ、ファイルシステムには触れない
+            with self.assertRaises(KeyError):
+                outside.data
+            self.app._imported_archive.close()
+
     def test_remove_image(self):
-        self.app.attached_image_path = 'dummy.png'
+        self.app.attached_image_paths = ['dummy.png', 'dummy2.png']
         self.app.image_preview_label = MagicMock()
         self.app.remove_image_button = MagicMock()
         self.app.remove_image()
-        self.assertIsNone(self.app.attached_image_path)
+        self.assertEqual(self.app.attached_image_paths, [])
 
     def test_clear_conversation_empty(self):
         self.app.conversation_history = []
@@ -169,6 +359,639 @@ class TestClaudeChatApp(unittest.TestCase):
             self.app.update_history_display()
         # エラー時も例外にならないこと
 
+    def test_send_question_multiple_images(self):
+        # 最新の質問に複数の画像ブロックが順番どおり含まれる
+        self.app.question_text = MagicMock(get=MagicMock(return_value='compare'))
+        self.app.send_button = MagicMock()
+        self.app.remove_image = MagicMock()
+        self.app.update_history_display = MagicMock()
+        self.app.conversation_history = []
+        self.app.attached_image_paths = ['a.png', 'b.png']
+        self.app.client.messages.create.return_value = MagicMock(content=[MagicMock(text='answer')])
+        blocks = [{'type': 'image', 'source': {'data': 'A'}}, {'type': 'image', 'source': {'data': 'B'}}]
+        with patch('claude_tk.claude_tk_app_multi_image.image_attachments.encode_images', return_value=blocks):
+            self.app.send_question()
+        messages = self.app.client.messages.create.call_args.kwargs['messages']
+        self.assertEqual(messages[-1]['content'][:2], blocks)
+        self.assertEqual(messages[-1]['content'][2], {'type': 'text', 'text': 'compare'})
+        self.assertEqual(self.app.conversation_history[0]['image_paths'], ['a.png', 'b.png'])
+
+    def test_token_estimate_status_bar(self):
+        import time
+        # 入力が止まってから見積もりを作業スレッドで計算し、ステータスバーに表示する
+        self.env['CLAUDE_TK_COUNT_TOKENS'] = '1'
+        app = ClaudeChatApp(MagicMock())
+        self.addCleanup(app.journal.close)
+        app.client.messages.count_tokens.return_value = MagicMock(input_tokens=123)
+        app.conversation_history = [{'role': 'user', 'content': 'Q1'}, {'role': 'assistant', 'content': 'A1', 'markdown': 'A1'}]
+        app.question_text = MagicMock(get=MagicMock(return_value='次の質問'))
+        app.estimate_label = MagicMock()
+        app.root.after.reset_mock()
+        app.schedule_estimate()
+        app.schedule_estimate()
+        # キー入力のたびに予約し直し、最後の1回だけ実行する
+        app.root.after_cancel.assert_called_once()
+        delay, callback = app.root.after.call_args.args
+        self.assertEqual(delay, 400)
+        app.root.after.reset_mock()
+        callback()
+        for _ in range(100):
+            if app.root.after.call_args is None:
+                break
+            args = app.root.after.call_args.args
+            app.root.after.reset_mock()
+            time.sleep(0.01)
+            args[1](*args[2:])
+        texts = [c.kwargs['text'] for c in app.estimate_label.config.call_args_list]
+        self.assertTrue(texts[0].startswith('入力 約'))
+        self.assertTrue(texts[-1].startswith('入力 123トークン'))
+        app.client.messages.count_tokens.assert_called_once_with(
+            model=app.model, messages=[{'role': 'user', 'content': 'Q1'}, {'role': 'assistant', 'content': 'A1'}, {'role': 'user', 'content': '次の質問'}]
+        )
+
+    def test_send_question_continues_truncated_answer(self):
+        # max_tokensで途切れた回答は続きを受け取り、1つの回答として履歴に残す
+        self.app.question_text = MagicMock(get=MagicMock(return_value='長い説明'))
+        self.app.send_button = MagicMock()
+        self.app.remove_image = MagicMock()
+        self.app.update_history_display = MagicMock()
+        self.app.client.messages.create.side_effect = [
+            MagicMock(content=[MagicMock(text='**前半**')], stop_reason='max_tokens'),
+            MagicMock(content=[MagicMock(text='と後半')], stop_reason='end_turn')
+        ]
+        self.app.send_question()
+        self.assertEqual([m['role'] for m in self.app.conversation_history], ['user', 'assistant'])
+        self.assertEqual(self.app.conversation_history[1]['markdown'], '**前半**と後半')
+        messages = self.app.client.messages.create.call_args.kwargs['messages']
+        self.assertEqual(messages[-1], {'role': 'assistant', 'content': '**前半**'})
+
+    def test_send_question_reuses_previous_messages(self):
+        # 2回目の送信では、前回の質問は画像なしのテキストになり、前回までのメッセージは作り直さない
+        self.app.question_text = MagicMock()
+        self.app.send_button = MagicMock()
+        self.app.remove_image = MagicMock()
+        self.app.update_history_display = MagicMock()
+        self.app.client.messages.create.return_value = MagicMock(content=[MagicMock(text='**A1**')])
+        blocks = [{'type': 'image', 'source': {'data': 'A'}}]
+        self.app.question_text.get.return_value = 'Q1'
+        self.app.attached_image_paths = ['a.png']
+        with patch('claude_tk.claude_tk_app_multi_image.image_attachments.encode_images', return_value=blocks):
+            self.app.send_question()
+        self.app.attached_image_paths = []
+        self.app.question_text.get.return_value = 'Q2'
+        with patch('claude_tk.request_builder.api_message', wraps=request_builder.api_message) as mock_convert:
+            self.app.send_question()
+        self.assertEqual(mock_convert.call_count, 3)
+        with patch('claude_tk.request_builder.api_message', wraps=request_builder.api_message) as mock_convert:
+            self.app.send_question()
+        # 増えた2件と今回の質問だけを変換する
+        self.assertEqual(mock_convert.call_count, 3)
+        messages = self.app.client.messages.create.call_args.kwargs['messages']
+        self.assertEqual(messages[:3], [
+            {'role': 'user', 'content': 'Q1'},
+            {'role': 'assistant', 'content': '**A1**'},
+            {'role': 'user', 'content': 'Q2'}
+        ])
+        # 会話をクリアすると保持しているメッセージも捨てる
+        with patch.object(self.app, 'prompt_save_conversation', return_value=True), \
+             patch('tkinter.messagebox.askyesno', return_value=True):
+            self.app.clear_conversation()
+        self.assertEqual(self.app.request_builder.messages, [])
+
+    def test_send_question_with_files_api(self):
+        # アップロードした画像は以降の送信でもファイルIDで参照する
+        self.env['CLAUDE_TK_FILES_API'] = '1'
+        app = ClaudeChatApp(MagicMock())
+        self.addCleanup(app.journal.close)
+        app.question_text = MagicMock()
+        app.send_button = MagicMock()
+        app.remove_image = MagicMock()
+        app.update_history_display = MagicMock()
+        app.client = MagicMock()
+        app.file_uploader.client = app.client
+        app.client.beta.files.upload.return_value = MagicMock(id='file_1')
+        app.client.beta.messages.create.return_value = MagicMock(content=[MagicMock(text='A')])
+        png = os.path.join(self.data_dir, 'a.png')
+        from PIL import Image
+        Image.new('RGB', (10, 10), 'red').save(png)
+        app.question_text.get.return_value = 'Q1'
+        app.attached_image_paths = [png]
+        with patch('claude_tk.claude_tk_app_multi_image.image_attachments.encode_images') as mock_encode:
+            app.send_question()
+            app.attached_image_paths = []
+            app.question_text.get.return_value = 'Q2'
+            app.send_question()
+        mock_encode.assert_not_called()
+        app.client.messages.create.assert_not_called()
+        app.client.beta.files.upload.assert_called_once()
+        self.assertEqual(app.conversation_history[0]['file_ids'], ['file_1'])
+        kwargs = app.client.beta.messages.create.call_args.kwargs
+        self.assertIn('files-api-2025-04-14', kwargs['betas'])
+        self.assertEqual(kwargs['messages'][0]['content'], [
+            {'type': 'image', 'source': {'type': 'file', 'file_id': 'file_1'}},
+            {'type': 'text', 'text': 'Q1'}
+        ])
+        self.assertEqual(kwargs['messages'][2], {'role': 'user', 'content': 'Q2'})
+        # 送信時にアップロードしたファイルIDはジャーナルから復元できる
+        from claude_tk import conversation_journal
+        history, _, _ = conversation_journal.load_session(app.journal.path)
+        self.assertEqual(history[0]['file_ids'], ['file_1'])
+
+    def test_files_api_upload_after_cache_lookup(self):
+        # 保存してある回答を使う場合はアップロードしない
+        self.env['CLAUDE_TK_FILES_API'] = '1'
+        self.env['CLAUDE_TK_RESPONSE_CACHE'] = os.path.join(self.data_dir, 'cache')
+        png = os.path.join(self.data_dir, 'a.png')
+        from PIL import Image
+        Image.new('RGB', (10, 10), 'red').save(png)
+        app = ClaudeChatApp(MagicMock())
+        self.addCleanup(app.journal.close)
+        app.question_text = MagicMock(get=MagicMock(return_value='Q'))
+        app.send_button = MagicMock()
+        app.remove_image = MagicMock()
+        app.update_history_display = MagicMock()
+        app.bypass_cache_var = MagicMock(get=MagicMock(return_value=False))
+        app.client = MagicMock()
+        app.file_uploader.client = app.client
+        app.client.beta.files.upload.return_value = MagicMock(id='file_1')
+        app.client.beta.messages.create.return_value = MagicMock(content=[MagicMock(text='A')])
+        for _ in range(2):
+            app.conversation_history = []
+            app.request_builder.reset()
+            app.attached_image_paths = [png]
+            with patch.object(app.file_uploader, 'upload_all', wraps=app.file_uploader.upload_all) as mock_upload:
+                app.send_question()
+        mock_upload.assert_not_called()
+        self.assertTrue(app.conversation_history[-1]['cached'])
+        app.client.beta.messages.create.assert_called_once()
+
+    def test_send_question_response_cache(self):
+        self.env['CLAUDE_TK_RESPONSE_CACHE'] = os.path.join(self.data_dir, 'cache')
+        png = os.path.join(self.data_dir, 'a.png')
+        from PIL import Image
+        Image.new('RGB', (10, 10), 'red').save(png)
+
+        def ask(app, bypass=False):
+            app.question_text = MagicMock(get=MagicMock(return_value='同じ質問'))
+            app.send_button = MagicMock()
+            app.remove_image = MagicMock()
+            app.update_history_display = MagicMock()
+            app.bypass_cache_var = MagicMock(get=MagicMock(return_value=bypass))
+            app.attached_image_paths = [png]
+            app.client.messages.create.return_value = MagicMock(content=[MagicMock(text='**回答**')])
+            with patch('claude_tk.claude_tk_app_multi_image.image_attachments.encode_images', return_value=[]):
+                app.send_question()
+            return app.conversation_history[-1]
+
+        apps = []
+        for _ in range(3):
+            app = ClaudeChatApp(MagicMock())
+            self.addCleanup(app.journal.close)
+            app.client = MagicMock()
+            apps.append(app)
+        self.assertNotIn('cached', ask(apps[0]))
+        apps[0].client.messages.create.assert_called_once()
+        # 同じ画像・質問なら別のアプリでもAPIを呼ばない
+        answer = ask(apps[1])
+        apps[1].client.messages.create.assert_not_called()
+        self.assertTrue(answer['cached'])
+        self.assertEqual(answer['markdown'], '**回答**')
+        # キャッシュを使わない指定なら送信する
+        self.assertNotIn('cached', ask(apps[2], bypass=True))
+        apps[2].client.messages.create.assert_called_once()
+        apps[2].bypass_cache_var.set.assert_called_with(False)
+        # 履歴欄に「キャッシュ」と表示する
+        app = apps[1]
+        app.history_text = MagicMock()
+        with patch('claude_tk.claude_tk_app_multi_image.ImageTk.PhotoImage'):
+            ClaudeChatApp.update_history_display(app)
+        app.history_text.insert.assert_any_call('end', '（キャッシュ）\n', 'cached')
+
+    def test_send_question_cassette_replay(self):
+        from anthropic.types import Message
+        self.env['CLAUDE_TK_CASSETTE'] = os.path.join(self.data_dir, 'cassette.jsonl')
+
+        def ask(app):
+            app.question_text = MagicMock(get=MagicMock(return_value='記録する質問'))
+            app.send_button = MagicMock()
+            app.remove_image = MagicMock()
+            app.update_history_display = MagicMock()
+            app.send_question()
+            return app.conversation_history[-1]['markdown']
+
+        # 記録: 実際のクライアント（ここではモック）を呼び出してカセットに残す
+        self.env['CLAUDE_TK_CASSETTE_MODE'] = 'record'
+        self.mock_anthropic.return_value.messages.create.return_value = Message.model_validate({
+            'id': 'msg_1', 'type': 'message', 'role': 'assistant', 'model': 'm',
+            'content': [{'type': 'text', 'text': '**記録した回答**'}], 'stop_reason': 'end_turn',
+            'stop_sequence': None, 'usage': {'input_tokens': 1, 'output_tokens': 1}
+        })
+        app = ClaudeChatApp(MagicMock())
+        self.addCleanup(app.journal.close)
+        self.assertEqual(ask(app), '**記録した回答**')
+        # 再生: APIを呼ばずにカセットの回答を返す
+        self.env.update({'CLAUDE_TK_CASSETTE_MODE': 'replay', 'CLAUDE_TK_CASSETTE_SPEED': '0',
+                         'CLAUDE_TK_JOURNAL_DIR': os.path.join(self.data_dir, 'journal2')})
+        self.mock_anthropic.return_value.messages.create.reset_mock()
+        app = ClaudeChatApp(MagicMock())
+        self.addCleanup(app.journal.close)
+        self.assertEqual(ask(app), '**記録した回答**')
+        self.mock_anthropic.return_value.messages.create.assert_not_called()
+
+    def make_tabs(self):
+        from claude_tk import chat_tabs
+        root = MagicMock()
+        tabs = chat_tabs.ChatTabs(root, ClaudeChatApp, 'Claude Chat App')
+        self.addCleanup(tabs.shutdown)
+        tabs.add_tab()
+        for app in tabs.tabs:
+            self.addCleanup(app.journal.close)
+            app.question_text = MagicMock()
+            app.send_button = MagicMock()
+            app.remove_image = MagicMock()
+            app.update_history_display = MagicMock()
+        return root, tabs
+
+    def test_tabs_share_client_and_caches(self):
+        root, tabs = self.make_tabs()
+        first, second = tabs.tabs
+        for name in ClaudeChatApp.SHARED_ATTRIBUTES:
+            self.assertIs(getattr(second, name), getattr(first, name))
+        # 会話履歴・リクエスト用メッセージ・ジャーナル・サムネイル・見積もりはタブごと
+        for name in ('conversation_history', 'request_builder', 'journal', 'image_deduplicator',
+                     'history_thumbnails', 'history_thumbnail_images', 'history_thumbnail_files', 'token_estimator'):
+            self.assertIsNot(getattr(second, name), getattr(first, name))
+        self.assertEqual(self.mock_anthropic.call_count, 2)  # setUpのアプリと最初のタブだけ
+        # 別のタブの見積もりを頼んでも、まだ始まっていない見積もりは取り消されない
+        import threading
+        release = threading.Event()
+        first.token_estimator.submit(release.wait, 5)
+        pending = first.token_estimator.submit(lambda: 'first')
+        self.assertEqual(second.token_estimator.submit(lambda: 'second').result(5), 'second')
+        release.set()
+        self.assertEqual(pending.result(5), 'first')
+
+    def test_tabs_send_concurrently(self):
+        import threading
+        import time
+        root, tabs = self.make_tabs()
+        started = []
+        both_started = threading.Event()
+        release = threading.Event()
+
+        def create(**kwargs):
+            started.append(kwargs['messages'][-1]['content'])
+            if len(started) == 2:
+                both_started.set()
+            release.wait(5)
+            return MagicMock(content=[MagicMock(text='**' + kwargs['messages'][-1]['content'] + 'への回答**')], stop_reason='end_turn')
+        tabs.tabs[0].client.messages.create.side_effect = create
+        for app, question in zip(tabs.tabs, ['質問A', '質問B']):
+            app.question_text.get.return_value = question
+            app.send_question()
+            # 回答を待つ間は送信できない
+            self.assertTrue(app._request_pending)
+        # 2つのタブのリクエストが同時に送られている
+        self.assertTrue(both_started.wait(5))
+        release.set()
+        # 画面のスレッドの代わりにroot.afterで予約された確認を実行する
+        handled = 0
+        deadline = time.monotonic() + 5
+        while any(app._request_pending for app in tabs.tabs) and time.monotonic() < deadline:
+            calls = root.after.call_args_list[handled:]
+            handled += len(calls)
+            for c in calls:
+                if getattr(c.args[1], '__name__', '') == 'poll_request':
+                    c.args[1](*c.args[2:])
+            time.sleep(0.01)
+        for app, question in zip(tabs.tabs, ['質問A', '質問B']):
+            self.assertFalse(app._request_pending)
+            self.assertEqual([m['content'] for m in app.conversation_history], [question, question + 'への回答'])
+
+    def test_close_tab(self):
+        root, tabs = self.make_tabs()
+        first, second = tabs.tabs
+        second._request_pending = True
+        with patch('claude_tk.chat_tabs.messagebox.showwarning') as mock_warning:
+            self.assertFalse(tabs.close_tab(second))
+        mock_warning.assert_called_once()
+        second._request_pending = False
+        with patch.object(second, 'prompt_save_conversation', return_value=True):
+            self.assertTrue(tabs.close_tab(second))
+        self.assertEqual(tabs.tabs, [first])
+        # 最後のタブを閉じるとアプリを終了する
+        with patch.object(first, 'prompt_save_conversation', return_value=True):
+            tabs.close_tab(first)
+        root.destroy.assert_called_once()
+
+    def test_tabs_keep_shared_image_cache(self):
+        root, tabs = self.make_tabs()
+        first, second = tabs.tabs
+        from PIL import Image
+        path = os.path.join(self.data_dir, 'a.png')
+        Image.new('RGB', (10, 10), 'red').save(path)
+        blocks = first.image_cache.encode([path])
+        # 別のタブで会話をクリアしても、共有のキャッシュは残る
+        with patch('claude_tk.claude_tk_app_multi_image.messagebox.askyesno', return_value=True), \
+             patch.object(second, 'prompt_save_conversation', return_value=True):
+            second.clear_conversation()
+        with patch('claude_tk.claude_tk_app_multi_image.image_attachments.encode_images') as mock_encode:
+            self.assertEqual(first.image_cache.encode([path]), blocks)
+        mock_encode.assert_not_called()
+
+    def test_tabs_close_window_discards_journals(self):
+        root, tabs = self.make_tabs()
+        paths = []
+        for app in tabs.tabs:
+            app.journal.append({'role': 'user', 'content': 'q'}, 'model-x')
+            paths.append(app.journal.path)
+        # 保存を取り消せば閉じない
+        with patch.object(tabs.tabs[0], 'prompt_save_conversation', return_value=False):
+            tabs.close_window()
+        root.destroy.assert_not_called()
+        # 閉じるボタンでも保存を確認し、次回起動時に復元を確認しないようジャーナルを消す
+        with patch.object(ClaudeChatApp, 'prompt_save_conversation', return_value=True) as mock_prompt:
+            tabs.close_window()
+        self.assertEqual(mock_prompt.call_count, 2)
+        root.destroy.assert_called_once()
+        for path in paths:
+            self.assertFalse(os.path.exists(path))
+
+    def test_send_question_similar_question(self):
+        import time
+        from claude_tk import conversation_db, media_store
+        self.env['CLAUDE_TK_DB'] = os.path.join(self.data_dir, 'conversations.db')
+        self.env['CLAUDE_TK_SIMILAR_QUESTIONS'] = 'ask'
+        self.env['CLAUDE_TK_SIMILAR_THRESHOLD'] = '0.7'
+        db = conversation_db.ConversationDB(self.env['CLAUDE_TK_DB'], store=media_store.MediaStore(self.data_dir))
+        db.save_conversation([
+            {'role': 'user', 'content': 'Pythonでzipファイルを展開する方法を教えてください'},
+            {'role': 'assistant', 'content': 'zipfileを使います', 'markdown': '`zipfile`を使います'}
+        ], 'model-x')
+        db.close()
+        app = ClaudeChatApp(MagicMock())
+        self.addCleanup(app.journal.close)
+        self.addCleanup(app.conversation_db.close)
+        # 索引は別スレッドで作られる
+        deadline = time.time() + 5
+        while not len(app.question_index) and time.time() < deadline:
+            time.sleep(0.01)
+        app.client = MagicMock()
+        app.client.messages.create.return_value = MagicMock(content=[MagicMock(text='API')])
+        app.send_button = MagicMock()
+        app.remove_image = MagicMock()
+        app.update_history_display = MagicMock()
+        app.bypass_similar_var = MagicMock(get=MagicMock(return_value=False))
+        app.question_text = MagicMock(get=MagicMock(return_value='Pythonでzipファイルを展開する方法は？'))
+        with patch('tkinter.messagebox.askyesno', return_value=True) as mock_ask:
+            app.send_question()
+        mock_ask.assert_called_once()
+        app.client.messages.create.assert_not_called()
+        self.assertEqual(app.conversation_history[-1]['markdown'], '`zipfile`を使います')
+        self.assertEqual(app.conversation_history[-1]['reused_from'], 'Pythonでzipファイルを展開する方法を教えてください')
+        # 続きの質問は前の会話で意味が変わるため、似た質問を探さず索引にも登録しない
+        with patch('tkinter.messagebox.askyesno') as mock_ask:
+            app.send_question()
+        mock_ask.assert_not_called()
+        self.assertEqual(app.client.messages.create.call_count, 1)
+
+        def ask_first(question):
+            app.conversation_history = []
+            app.request_builder.reset()
+            app.question_text.get.return_value = question
+            app.send_question()
+        # 「いいえ」なら送信し、受け取った回答も索引に追加する
+        ask_first('東京の明日の天気は？')
+        with patch('tkinter.messagebox.askyesno', return_value=False) as mock_ask:
+            ask_first('明日の東京の天気は？')
+        mock_ask.assert_called_once()
+        self.assertEqual(app.client.messages.create.call_count, 3)
+        self.assertNotIn('reused_from', app.conversation_history[-1])
+        # 「似た質問の回答を使わない」なら確認せずに送信し、チェックは1回で外れる
+        app.bypass_similar_var.get.return_value = True
+        with patch('tkinter.messagebox.askyesno') as mock_ask:
+            ask_first('Pythonでzipファイルを展開する方法は？')
+        mock_ask.assert_not_called()
+        self.assertEqual(app.client.messages.create.call_count, 4)
+        app.bypass_similar_var.set.assert_called_with(False)
+
+    def test_send_question_journal_recovery(self):
+        # 送信した質問と回答はジャーナルに残り、次回起動時に復元できる
+        self.app.question_text = MagicMock(get=MagicMock(return_value='hello'))
+        self.app.send_button = MagicMock()
+        self.app.remove_image = MagicMock()
+        self.app.update_history_display = MagicMock()
+        self.app.client.messages.create.return_value = MagicMock(content=[MagicMock(text='**hi**')])
+        self.app.send_question()
+        self.app.journal.close()  # 異常終了を想定（discardしない）
+        with patch('tkinter.messagebox.askyesno', return_value=True) as mock_ask:
+            app = ClaudeChatApp(MagicMock())
+        self.addCleanup(app.journal.close)
+        mock_ask.assert_called_once()
+        self.assertEqual([m['content'] for m in app.conversation_history], ['hello', 'hi'])
+        self.assertEqual(app.conversation_history[1]['markdown'], '**hi**')
+        # 復元した会話は新しいジャーナルに引き継がれる
+        self.assertEqual(os.listdir(os.path.join(self.data_dir, 'journal')), [os.path.basename(app.journal.path)])
+
+    def test_journal_discarded_after_save_and_exit(self):
+        self.app.conversation_history = [{'role': 'user', 'content': 'Q'}]
+        self.app.journal.append(self.app.conversation_history[0])
+        self.app.journal.mark_saved()
+        with patch('tkinter.messagebox.askyesnocancel', return_value=False):
+            self.app.exit_application()
+        self.assertEqual(os.listdir(os.path.join(self.data_dir, 'journal')), [])
+        # 終了時のセッション復元の確認は対象外
+        self.env['CLAUDE_TK_SESSION_RESTORE'] = 'never'
+        with patch('tkinter.messagebox.askyesno') as mock_ask:
+            app = ClaudeChatApp(MagicMock())
+        self.addCleanup(app.journal.close)
+        mock_ask.assert_not_called()
+
+    def test_save_to_database_and_open_search_hit(self):
+        self.env['CLAUDE_TK_DB'] = os.path.join(self.data_dir, 'conversations.db')
+        app = ClaudeChatApp(MagicMock())
+        self.addCleanup(app.journal.close)
+        self.addCleanup(app.conversation_db.close)
+        app.update_history_display = MagicMock()
+        app.conversation_history = [
+            {'role': 'user', 'content': '東京の天気は？'},
+            {'role': 'assistant', 'content': '晴れです', 'markdown': '**晴れ**です'}
+        ]
+        with patch.object(app, 'ask_save_format', return_value='db'), \
+             patch('tkinter.messagebox.showinfo'):
+            self.assertTrue(app.save_conversation_history())
+        hits = app.conversation_db.search('天気')
+        self.assertEqual(len(hits), 1)
+        app.conversation_history = []
+        app.open_database_conversation(hits[0]['conversation_id'])
+        self.assertEqual(app.conversation_history[1]['markdown'], '**晴れ**です')
+        # 続けて保存すると同じ会話に追加される
+        app.conversation_history.append({'role': 'user', 'content': '明日は？'})
+        with patch.object(app, 'ask_save_format', return_value='db'), \
+             patch('tkinter.messagebox.showinfo'):
+            app.save_conversation_history()
+        self.assertEqual(len(app.conversation_db.load_conversation(hits[0]['conversation_id'])[0]), 3)
+
+    def test_save_and_resume_container(self):
+        png = os.path.join(self.data_dir, 'a.png')
+        from PIL import Image
+        Image.new('RGB', (20, 20), 'red').save(png)
+        self.app.conversation_history = [
+            {'role': 'user', 'content': 'Q', 'image_paths': [png]},
+            {'role': 'assistant', 'content': 'A', 'markdown': '**A**'}
+        ]
+        ctk_path = os.path.join(self.data_dir, 'c.ctk')
+        with patch.object(self.app, 'ask_save_format', return_value='ctk'), \
+             patch('tkinter.filedialog.asksaveasfilename', return_value=ctk_path), \
+             patch('tkinter.messagebox.showinfo'):
+            self.assertTrue(self.app.save_conversation_history())
+        self.app.conversation_history = []
+        self.app.update_history_display = MagicMock()
+        with patch('tkinter.filedialog.askopenfilename', return_value=ctk_path), \
+             patch('tkinter.messagebox.showinfo'):
+            self.app.resume_conversation()
+        self.addCleanup(self.app._imported_archive.close)
+        self.assertEqual(self.app.conversation_history[1]['markdown'], '**A**')
+        with open(png, 'rb') as f:
+            self.assertEqual(self.app.conversation_history[0]['image_paths'][0].data, f.read())
+        self.assertIsNone(self.app._last_json_zip_path)
+
+    def test_resume_container_shows_last_turns_first(self):
+        from claude_tk import conversation_container, conversation_journal
+        history = []
+        for i in range(5):
+            history += [{'role': 'user', 'content': f'Q{i}'},
+                        {'role': 'assistant', 'content': f'A{i}', 'markdown': f'**A{i}**'}]
+        ctk_path = os.path.join(self.data_dir, 'c.ctk')
+        conversation_container.write_container(history, 'model-x', ctk_path)
+        self.app.update_history_display = MagicMock()
+        self.app.question_text = MagicMock(get=MagicMock(return_value='Q'))
+        with patch('claude_tk.claude_tk_app_multi_image.RESUME_INITIAL_TURNS', 2), \
+             patch('claude_tk.claude_tk_app_multi_image.RESUME_CHUNK_MESSAGES', 4), \
+             patch('tkinter.filedialog.askopenfilename', return_value=ctk_path), \
+             patch('tkinter.messagebox.showinfo'):
+            self.app.resume_conversation()
+            self.addCleanup(self.app._imported_archive.close)
+            # 最新の2ターンを先に表示する
+            self.assertEqual([m['content'] for m in self.app.conversation_history], ['Q3', 'A3', 'Q4', 'A4'])
+            self.app.update_history_display.assert_called_once()
+            # 読み込みが終わるまでは送信しない
+            with patch('tkinter.messagebox.showinfo') as mock_info:
+                self.app.send_question()
+            mock_info.assert_called_once()
+            self.app.client.messages.create.assert_not_called()
+            # 残りはafter_idleで少しずつ読み込み、揃ってから先頭に加える
+            steps = 0
+            while self.app.history_loading():
+                self.app.root.after_idle.call_args.args[0]()
+                steps += 1
+        self.assertEqual(steps, 2)
+        self.assertEqual([m['content'] for m in self.app.conversation_history],
+                         [m['content'] for m in history])
+        self.assertEqual(self.app.conversation_history[1]['markdown'], '**A0**')
+        self.assertEqual(self.app.update_history_display.call_count, 2)
+        records, _ = conversation_journal.read_session(self.app.journal.path)
+        self.assertEqual(len(records), 10)
+
+    def test_save_cancel_from_progress_dialog(self):
+        # 時間のかかる保存は進捗ダイアログを表示し、中止すると保存先は作成されない
+        import threading
+        from claude_tk import conversation_archive
+        self.app.conversation_history = [
+            {"role": "user", "content": "Q", "image_paths": [image_attachments.MemoryImage(b'png', 'a.png')]},
+            {"role": "assistant", "content": "A", "markdown": "A"}
+        ]
+        cancelled = threading.Event()
+
+        def slow_thumbnails(images):
+            cancelled.wait(5)
+            return {}, {"thumbnails": {}}
+
+        def dialog(title, progress, thread):
+            progress.cancel()
+            cancelled.set()
+            thread.join()
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            zip_path = os.path.join(tmpdir, 'out.zip')
+            with patch('claude_tk.claude_tk_app_multi_image.PROGRESS_DIALOG_DELAY', 0), \
+                 patch.object(conversation_archive.image_attachments, 'build_thumbnail_sidecars', side_effect=slow_thumbnails), \
+                 patch.object(self.app, 'show_progress_dialog', side_effect=dialog) as mock_dialog, \
+                 patch.object(self.app, 'ask_save_format', return_value="json"), \
+                 patch('tkinter.filedialog.asksaveasfilename', return_value=zip_path), \
+                 patch('tkinter.messagebox.showinfo') as mock_info:
+                self.assertFalse(self.app.save_conversation_history())
+                mock_dialog.assert_called_once()
+                self.assertEqual(mock_info.call_args[0][0], "保存中止")
+            self.assertEqual(os.listdir(tmpdir), [])
+        self.assertEqual(self.app._background_jobs, [])
+
+    def test_exit_waits_for_background_jobs(self):
+        import threading
+        finished = threading.Event()
+        thread = threading.Thread(target=finished.wait, args=(5,))
+        thread.start()
+        self.app._background_jobs.append(thread)
+        # 保存中に閉じるボタンを押しても、すぐには閉じない
+        self.app.close_window()
+        self.root.destroy.assert_not_called()
+        self.root.update.side_effect = finished.set
+        self.app.conversation_history = []
+        self.app.exit_application()
+        self.assertFalse(thread.is_alive())
+        self.root.destroy.assert_called_once()
+
+    def test_session_snapshot_restored_on_next_start(self):
+        self.app.history_text = MagicMock()
+        self.app.history_text.dump.return_value = [('text', 'Q: 質問\nA: 回答\n', '1.0')]
+        self.app.history_text.tag_names.return_value = ('sel', 'question')
+        self.app.history_text.tag_ranges.return_value = ('1.0', '1.5')
+        self.app.conversation_history = [
+            {'role': 'user', 'content': '質問'},
+            {'role': 'assistant', 'content': '回答', 'markdown': '**回答**'}
+        ]
+        with patch('tkinter.messagebox.askyesnocancel', return_value=False):
+            self.app.exit_application()
+        self.assertTrue(os.path.exists(self.env['CLAUDE_TK_SESSION_FILE']))
+        # alwaysなら確認せずに復元する
+        self.env['CLAUDE_TK_SESSION_RESTORE'] = 'always'
+        with patch('tkinter.messagebox.askyesno') as mock_ask, \
+             patch.object(ClaudeChatApp, 'update_history_display') as mock_update:
+            app = ClaudeChatApp(MagicMock())
+        self.addCleanup(app.journal.close)
+        mock_ask.assert_not_called()
+        # Markdownから描き直さない
+        mock_update.assert_not_called()
+        self.assertEqual(app.conversation_history[1]['markdown'], '**回答**')
+        # 会話をクリアして終了するとスナップショットを削除する
+        app.conversation_history = []
+        app.exit_application()
+        self.assertFalse(os.path.exists(self.env['CLAUDE_TK_SESSION_FILE']))
+
+    def test_close_window_snapshot_replaces_journal(self):
+        # 閉じるボタンでスナップショットを書き出したら、次回はジャーナルからの復元を確認しない
+        self.app.history_text = MagicMock()
+        self.app.history_text.dump.return_value = [('text', 'Q: 質問\nA: 回答\n', '1.0')]
+        self.app.history_text.tag_names.return_value = ()
+        self.app.conversation_history = [
+            {'role': 'user', 'content': '質問'},
+            {'role': 'assistant', 'content': '回答', 'markdown': '回答'}
+        ]
+        self.app.journal.append_all(self.app.conversation_history, self.app.model)
+        self.app.close_window()
+        self.root.destroy.assert_called_once()
+        self.assertTrue(os.path.exists(self.env['CLAUDE_TK_SESSION_FILE']))
+        with patch('tkinter.messagebox.askyesno', return_value=False) as mock_ask:
+            app = ClaudeChatApp(MagicMock())
+        self.addCleanup(app.journal.close)
+        self.assertEqual([c.args[0] for c in mock_ask.call_args_list], ['前回の会話'])
+
+    def test_search_without_database(self):
+        self.assertIsNone(self.app.conversation_db)
+        with patch('tkinter.messagebox.showinfo') as mock_info:
+            self.app.open_search_dialog()
+        mock_info.assert_called_once()
+
     def test_send_question_empty(self):
         self.app.question_text = MagicMock(get=MagicMock(return_value='\n'))
         with patch('tkinter.messagebox.showwarning') as mock_warn:
@@ -233,13 +1056,8 @@ class TestClaudeChatApp(unittest.TestCase):
         ]
         with patch.object(self.app, 'ask_save_format', return_value="json"), \
              patch('tkinter.filedialog.asksaveasfilename', return_value="/tmp/test.zip"), \
-             patch('tempfile.TemporaryDirectory') as mock_tmpdir, \
-             patch('shutil.copy2'), \
              patch('zipfile.ZipFile') as mock_zip, \
-             patch('builtins.open', mock_open()), \
              patch('tkinter.messagebox.showinfo'):
-            mock_tmpdir.return_value.__enter__.return_value = "/tmp/tmpdir"
-            mock_tmpdir.return_value.__exit__.return_value = False
             self.assertTrue(self.app.save_conversation_history())
             mock_zip.assert_called()
 
@@ -250,13 +1068,8 @@ class TestClaudeChatApp(unittest.TestCase):
         ]
         with patch.object(self.app, 'ask_save_format', return_value="markdown"), \
              patch('tkinter.filedialog.asksaveasfilename', return_value="/tmp/test.zip"), \
-             patch('tempfile.TemporaryDirectory') as mock_tmpdir, \
-             patch('shutil.copy2'), \
              patch('zipfile.ZipFile') as mock_zip, \
-             patch('builtins.open', mock_open()), \
              patch('tkinter.messagebox.showinfo'):
-            mock_tmpdir.return_value.__enter__.return_value = "/tmp/tmpdir"
-            mock_tmpdir.return_value.__exit__.return_value = False
             self.assertTrue(self.app.save_conversation_history())
             mock_zip.assert_called()
 
@@ -267,13 +1080,8 @@ class TestClaudeChatApp(unittest.TestCase):
         ]
         with patch.object(self.app, 'ask_save_format', return_value="both"), \
              patch('tkinter.filedialog.asksaveasfilename', side_effect=["/tmp/test1.zip", "/tmp/test2.zip"]), \
-             patch('tempfile.TemporaryDirectory') as mock_tmpdir, \
-             patch('shutil.copy2'), \
              patch('zipfile.ZipFile') as mock_zip, \
-             patch('builtins.open', mock_open()), \
              patch('tkinter.messagebox.showinfo'):
-            mock_tmpdir.return_value.__enter__.return_value = "/tmp/tmpdir"
-            mock_tmpdir.return_value.__exit__.return_value = False
             self.assertTrue(self.app.save_conversation_history())
             self.assertGreaterEqual(mock_zip.call_count, 2)
 
@@ -298,13 +1106,8 @@ class TestClaudeChatApp(unittest.TestCase):
         self.app.conversation_history = [{"role": "user", "content": "Q", "image_path": __file__}]
         with patch.object(self.app, 'ask_save_format', return_value="json"), \
              patch('tkinter.filedialog.asksaveasfilename', return_value="/tmp/test.zip"), \
-             patch('tempfile.TemporaryDirectory') as mock_tmpdir, \
-             patch('shutil.copy2'), \
              patch('zipfile.ZipFile', side_effect=OSError("zip error")), \
-             patch('builtins.open', mock_open()), \
              patch('tkinter.messagebox.showerror') as mock_err:
-            mock_tmpdir.return_value.__enter__.return_value = "/tmp/tmpdir"
-            mock_tmpdir.return_value.__exit__.return_value = False
             self.assertFalse(self.app.save_conversation_history())
             mock_err.assert_called()
 
@@ -312,13 +1115,8 @@ class TestClaudeChatApp(unittest.TestCase):
         self.app.conversation_history = [{"role": "user", "content": "Q", "image_path": __file__}]
         with patch.object(self.app, 'ask_save_format', return_value="markdown"), \
              patch('tkinter.filedialog.asksaveasfilename', return_value="/tmp/test.zip"), \
-             patch('tempfile.TemporaryDirectory') as mock_tmpdir, \
-             patch('shutil.copy2'), \
              patch('zipfile.ZipFile', side_effect=OSError("zip error")), \
-             patch('builtins.open', mock_open()), \
              patch('tkinter.messagebox.showerror') as mock_err:
-            mock_tmpdir.return_value.__enter__.return_value = "/tmp/tmpdir"
-            mock_tmpdir.return_value.__exit__.return_value = False
             self.assertFalse(self.app.save_conversation_history())
             mock_err.assert_called()
 
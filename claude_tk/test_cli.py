@@ -0,0 +1,108 @@
+import unittest
+from unittest.mock import patch, MagicMock
+from types import SimpleNamespace
+import io
+import os
+import sys
+import subprocess
+import tempfile
+from PIL import Image
+from claude_tk import cli
+
+
+def events(chunks, stop_reason="end_turn"):
+    """ストリーミングのイベント列"""
+    result = [SimpleNamespace(type="content_block_delta", delta=SimpleNamespace(type="text_delta", text=chunk)) for chunk in chunks]
+    return result + [SimpleNamespace(type="message_delta", delta=SimpleNamespace(stop_reason=stop_reason))]
+
+
+class TestCli(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.png = os.path.join(self.tmpdir.name, "my image.png")
+        Image.new("RGB", (20, 20), "red").save(self.png)
+        self.client = MagicMock()
+        self.session = cli.ChatSession("claude-3-haiku-20240307", client=self.client)
+        self.addCleanup(self.session.close)
+
+    def test_parse_question(self):
+        question, images = cli.parse_question(f'これは何？ "{self.png}"  missing.png を説明して')
+        self.assertEqual(question, "これは何？ missing.png を説明して")
+        self.assertEqual(images, [self.png])
+        self.assertEqual(cli.parse_question("画像なし"), ("画像なし", []))
+
+    def test_ask_streams_answer(self):
+        self.client.messages.create.side_effect = [events(["**回答", "1**"]), events(["回答2"])]
+        out = io.StringIO()
+        self.assertEqual(self.session.ask("Q1", [self.png], out), "**回答1**")
+        self.session.ask("Q2", out=out)
+        self.assertEqual(out.getvalue(), "**回答1**\n回答2\n")
+        # 履歴はアプリと同じ形（assistantはプレーンテキストとMarkdown）
+        self.assertEqual(self.session.history[1], {"role": "assistant", "content": "回答1", "markdown": "**回答1**"})
+        first = self.client.messages.create.call_args_list[0].kwargs
+        self.assertTrue(first["stream"])
+        self.assertEqual([block["type"] for block in first["messages"][0]["content"]], ["image", "text"])
+        # 過去の質問はテキストのみで送る
+        second = self.client.messages.create.call_args_list[1].kwargs["messages"]
+        self.assertEqual(second[:2], [{"role": "user", "content": "Q1"}, {"role": "assistant", "content": "**回答1**"}])
+
+    def test_ask_failure_drops_question(self):
+        self.client.messages.create.side_effect = RuntimeError("overloaded")
+        with self.assertRaises(RuntimeError):
+            self.session.ask("Q", out=io.StringIO())
+        self.assertEqual(self.session.history, [])
+
+    def test_save_and_resume(self):
+        self.client.messages.create.side_effect = [events(["**A1**"]), events(["A2"])]
+        self.session.ask("Q1", [self.png], io.StringIO())
+        self.session.ask("Q2", out=io.StringIO())
+        for name in ("conversation.zip", "conversation.ctk"):
+            path = os.path.join(self.tmpdir.name, name)
+            self.session.save(path)
+            resumed = cli.ChatSession(client=self.client)
+            self.addCleanup(resumed.close)
+            self.assertEqual(resumed.resume(path), 4)
+            self.assertEqual(resumed.history[1], {"role": "assistant", "content": "A1", "markdown": "**A1**"})
+            self.assertEqual(len(resumed.history[0]["image_paths"]), 1)
+        with self.assertRaises(ValueError):
+            self.session.save(os.path.join(self.tmpdir.name, "conversation.json"))
+
+    def test_interactive(self):
+        self.client.messages.create.side_effect = [events(["A1"])]
+        save_path = os.path.join(self.tmpdir.name, "c.json")
+        lines = iter(["/model claude-3-5-haiku-20241022", "1行目\\", "2行目", "", f"/save {save_path}", "/exit"])
+        out, err = io.StringIO(), io.StringIO()
+        cli.interactive(self.session, lambda prompt: next(lines), out, err)
+        self.assertEqual(out.getvalue(), "A1\n")
+        kwargs = self.client.messages.create.call_args.kwargs
+        self.assertEqual(kwargs["model"], "claude-3-5-haiku-20241022")
+        self.assertEqual(kwargs["messages"], [{"role": "user", "content": "1行目\n2行目"}])
+        resumed = cli.ChatSession(client=self.client)
+        resumed.resume(save_path)
+        self.assertEqual([m["content"] for m in resumed.history], ["1行目\n2行目", "A1"])
+
+    def test_main_reads_piped_stdin(self):
+        self.client.messages.create.side_effect = [events(["要約です"])]
+        stdin = io.StringIO("長い文章\n")
+        with patch.dict(os.environ, {"ANTHROPIC_API_KEY": "dummy-key"}), \
+             patch("claude_tk.cli.load_dotenv"), patch("claude_tk.cli.preload_client_modules"), \
+             patch("claude_tk.cli.create_client", return_value=self.client), \
+             patch("sys.stdin", stdin), patch("sys.stdout", new_callable=io.StringIO) as stdout:
+            self.assertEqual(cli.main(["要約して"]), 0)
+        self.assertEqual(stdout.getvalue(), "要約です\n")
+        messages = self.client.messages.create.call_args.kwargs["messages"]
+        self.assertEqual(messages, [{"role": "user", "content": "要約して\n\n長い文章"}])
+
+    def test_startup_skips_tk_and_pil(self):
+        code = (
+            "import sys; from claude_tk import cli; cli.ChatSession(); "
+            "print(sorted(m for m in ('tkinter', 'PIL', 'numpy', 'anthropic', 'markdown') if m in sys.modules))"
+        )
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        result = subprocess.run([sys.executable, "-c", code], cwd=root, capture_output=True, text=True, check=True)
+        self.assertEqual(result.stdout.strip(), "[]")
+
+
+if __name__ == "__main__":
+    unittest.main()
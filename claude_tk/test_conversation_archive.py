@@ -0,0 +1,282 @@
+import unittest
+from unittest.mock import patch
+import os
+import json
+import hashlib
+import tempfile
+import zipfile
+from PIL import Image
+from claude_tk import conversation_archive, image_attachments
+
+
+class TestConversationArchive(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.png = os.path.join(self.tmpdir.name, "a.png")
+        Image.new("RGB", (50, 50), "red").save(self.png)
+        self.bmp = os.path.join(self.tmpdir.name, "b.bmp")
+        Image.new("RGB", (50, 50), "blue").save(self.bmp)
+        self.history = [
+            {"role": "user", "content": "Q1", "image_paths": [self.png, self.bmp]},
+            {"role": "assistant", "content": "A1", "markdown": "**A1**"},
+            {"role": "user", "content": "Q2", "image_paths": [self.png]},
+            {"role": "assistant", "content": "A2", "markdown": "A2"}
+        ]
+
+    def hashed(self, path):
+        with open(path, "rb") as f:
+            return "img/" + hashlib.sha256(f.read()).hexdigest() + os.path.splitext(path)[1]
+
+    def test_export_same_name_different_folders(self):
+        # 別フォルダの同名ファイルも上書きし合わない
+        other_dir = self.path("other")
+        os.makedirs(other_dir)
+        other = os.path.join(other_dir, "a.png")
+        Image.new("RGB", (50, 50), "green").save(other)
+        history = [{"role": "user", "content": "Q", "image_paths": [self.png, other]}]
+        conversation_archive.export_conversation(history, "m", json_zip_path=self.path("j.zip"))
+        with zipfile.ZipFile(self.path("j.zip")) as z:
+            self.assertEqual(len([n for n in z.namelist() if n.startswith("img/")]), 2)
+
+    def path(self, name):
+        return os.path.join(self.tmpdir.name, name)
+
+    def test_export_json_zip(self):
+        conversation_archive.export_conversation(self.history, "model-x", json_zip_path=self.path("out.zip"), json_name="c.json")
+        with zipfile.ZipFile(self.path("out.zip")) as z:
+            data = json.loads(z.read("c.json"))
+            self.assertEqual(data["metadata"]["model"], "model-x")
+            png_name, bmp_name = self.hashed(self.png), self.hashed(self.bmp)
+            self.assertEqual(data["conversation"][0]["image_paths"], [png_name, bmp_name])
+            self.assertEqual(data["conversation"][1]["content"], "**A1**")
+            # 同じ画像は1回だけ格納され、圧縮済み形式はSTOREDになる
+            self.assertEqual([n for n in z.namelist() if n.startswith("img/")], [png_name, bmp_name])
+            self.assertEqual(z.getinfo(png_name).compress_type, zipfile.ZIP_STORED)
+            self.assertEqual(z.getinfo(bmp_name).compress_type, zipfile.ZIP_DEFLATED)
+            self.assertEqual(z.getinfo("c.json").compress_type, zipfile.ZIP_DEFLATED)
+
+    def test_export_both_reads_images_once(self):
+        with patch.object(image_attachments, "read_image_bytes", wraps=image_attachments.read_image_bytes) as mock_read:
+            conversation_archive.export_conversation(
+                self.history, "m", json_zip_path=self.path("j.zip"), md_zip_path=self.path("m.zip"))
+        self.assertEqual(mock_read.call_count, 2)
+        with zipfile.ZipFile(self.path("m.zip")) as z:
+            md = z.read("m.md").decode("utf-8")
+            self.assertIn(f"![添付画像]({self.hashed(self.png)})", md)
+            self.assertIn("## 回答1\n**A1**", md)
+            with open(self.png, "rb") as f:
+                self.assertEqual(z.read(self.hashed(self.png)), f.read())
+
+    def test_export_markdown_missing_image(self):
+        history = [{"role": "user", "content": "Q", "image_paths": [self.path("gone.png")]}]
+        conversation_archive.export_conversation(history, "m", md_zip_path=self.path("m.zip"))
+        with zipfile.ZipFile(self.path("m.zip")) as z:
+            self.assertIn("[画像保存エラー: gone.png]", z.read("m.md").decode("utf-8"))
+
+    def test_export_json_missing_image_fails(self):
+        history = [{"role": "user", "content": "Q", "image_paths": [self.path("gone.png")]}]
+        with self.assertRaises(FileNotFoundError):
+            conversation_archive.export_conversation(history, "m", json_zip_path=self.path("j.zip"))
+        self.assertFalse(os.path.exists(self.path("j.zip")))
+
+    def test_export_failure_removes_partial_zip(self):
+        with patch.object(image_attachments, "build_thumbnail_sidecars", side_effect=OSError("disk full")):
+            with self.assertRaises(OSError):
+                conversation_archive.export_conversation(self.history, "m", json_zip_path=self.path("j.zip"))
+        self.assertFalse(os.path.exists(self.path("j.zip")))
+
+    def test_export_progress(self):
+        progress = conversation_archive.ArchiveProgress()
+        conversation_archive.export_conversation(self.history, "m", json_zip_path=self.path("j.zip"), progress=progress)
+        self.assertEqual((progress.done_files, progress.total_files), (2, 2))
+        self.assertEqual(progress.done_bytes, os.path.getsize(self.png) + os.path.getsize(self.bmp))
+        self.assertEqual(progress.done_bytes, progress.total_bytes)
+
+    def test_export_cancel_keeps_existing_file(self):
+        # 中止しても既存の保存先は変更されず、一時ファイルも残らない
+        path = self.path("j.zip")
+        with open(path, "wb") as f:
+            f.write(b"old")
+        progress = conversation_archive.ArchiveProgress()
+        with patch.object(image_attachments, "build_thumbnail_sidecars", side_effect=lambda images: progress.cancel() or ({}, {"thumbnails": {}})):
+            with self.assertRaises(conversation_archive.ArchiveCancelled):
+                conversation_archive.export_conversation(self.history, "m", json_zip_path=path, md_zip_path=self.path("m.zip"), progress=progress)
+        with open(path, "rb") as f:
+            self.assertEqual(f.read(), b"old")
+        self.assertEqual(sorted(os.listdir(self.tmpdir.name)), ["a.png", "b.bmp", "j.zip"])
+
+    def test_archive_reader_roundtrip(self):
+        # 展開せずに読み込み、zip内の画像をそのまま別のzipへ保存し直せる
+        conversation_archive.export_conversation(self.history, "m", json_zip_path=self.path("j.zip"), json_name="c.json")
+        archive = conversation_archive.ArchiveReader(self.path("j.zip"))
+        self.addCleanup(archive.close)
+        data = archive.load_json()
+        images = [archive.image(member) for member in data["conversation"][0]["image_paths"]]
+        with open(self.png, "rb") as f:
+            self.assertEqual(images[0].data, f.read())
+        self.assertIs(archive.image(data["conversation"][2]["image_paths"][0]), images[0])
+        thumbs = archive.thumbnail_sources()
+        self.assertEqual(set(thumbs), set(images))
+        history = [{"role": "user", "content": "Q", "image_paths": images}]
+        conversation_archive.export_conversation(history, "m", json_zip_path=self.path("k.zip"))
+        with zipfile.ZipFile(self.path("k.zip")) as z:
+            self.assertIn(self.hashed(self.bmp), z.namelist())
+
+    def test_resave_appends_only_new_turn(self):
+        path = self.path("j.zip")
+        conversation_archive.export_conversation(self.history[:2], "m", json_zip_path=path, json_name="c.json")
+        with zipfile.ZipFile(path) as z:
+            first = {info.filename: info.header_offset for info in z.infolist()}
+        new_png = self.path("c.png")
+        Image.new("RGB", (50, 50), "green").save(new_png)
+        history = self.history + [{"role": "user", "content": "Q3", "image_paths": [new_png]}]
+        with patch.object(image_attachments, "make_thumbnail_bytes", wraps=image_attachments.make_thumbnail_bytes) as mock_thumb:
+            conversation_archive.export_conversation(history, "m", json_zip_path=path, json_name="other.json")
+        # 追加された画像のサムネイルだけを作成する
+        mock_thumb.assert_called_once_with(new_png, image_attachments.THUMBNAIL_SIZE)
+        with zipfile.ZipFile(path) as z:
+            infos = z.infolist()
+        # 既存のエントリはそのまま残り、新しい画像とJSON・マニフェストだけが追記される
+        self.assertEqual({info.filename: info.header_offset for info in infos[:len(first)]}, first)
+        self.assertEqual([info.filename for info in infos[len(first):]], [
+            self.hashed(new_png), "thumbs/" + os.path.basename(self.hashed(new_png)) + ".webp",
+            "c.json", image_attachments.THUMBNAIL_MANIFEST])
+        archive = conversation_archive.ArchiveReader(path)
+        self.addCleanup(archive.close)
+        data = archive.load_json()
+        self.assertEqual(data["metadata"]["revision"], 2)
+        self.assertEqual(data["conversation"][-1]["content"], "Q3")
+        self.assertEqual(len(archive.thumbnail_sources()), 3)
+
+    def test_append_failure_restores_zip(self):
+        path = self.path("j.zip")
+        conversation_archive.export_conversation(self.history, "m", json_zip_path=path)
+        with open(path, "rb") as f:
+            original = f.read()
+        history = self.history + [{"role": "user", "content": "Q3"}]
+        with patch.object(conversation_archive, "build_save_data", side_effect=OSError("disk full")):
+            with self.assertRaises(OSError):
+                conversation_archive.export_conversation(history, "m", json_zip_path=path)
+        with open(path, "rb") as f:
+            self.assertEqual(f.read(), original)
+
+    def test_append_cancel_restores_zip(self):
+        path = self.path("j.zip")
+        conversation_archive.export_conversation(self.history[:2], "m", json_zip_path=path)
+        with open(path, "rb") as f:
+            original = f.read()
+        progress = conversation_archive.ArchiveProgress()
+        progress.cancel()
+        with self.assertRaises(conversation_archive.ArchiveCancelled):
+            conversation_archive.export_conversation(self.history, "m", json_zip_path=path, progress=progress)
+        with open(path, "rb") as f:
+            self.assertEqual(f.read(), original)
+
+    def test_interrupted_append_recovered_on_open(self):
+        path = self.path("j.zip")
+        conversation_archive.export_conversation(self.history, "m", json_zip_path=path)
+        with open(path, "rb") as f:
+            original = f.read()
+        # 追記の途中で落ちた状態: 中央ディレクトリを退避したあと、その位置から書きかけのエントリで上書きされた
+        with zipfile.ZipFile(path) as z:
+            start_dir = z.start_dir
+        conversation_archive._write_append_backup(path, start_dir, original[start_dir:])
+        with open(path, "r+b") as f:
+            f.seek(start_dir)
+            f.write(b"PK\x03\x04" + b"\0" * 100)
+            f.truncate()
+        archive = conversation_archive.ArchiveReader(path)
+        self.addCleanup(archive.close)
+        self.assertEqual(archive.load_json()["conversation"][-1]["content"], "A2")
+        self.assertFalse(os.path.exists(path + conversation_archive.APPEND_BACKUP_SUFFIX))
+        with open(path, "rb") as f:
+            self.assertEqual(f.read(), original)
+
+    def test_finished_append_kept_when_backup_remains(self):
+        path = self.path("j.zip")
+        conversation_archive.export_conversation(self.history[:2], "m", json_zip_path=path)
+        # 追記を書き終えて退避を消す前に落ちた場合は、追記した内容を使う
+        with patch.object(conversation_archive, "_remove_append_backup"):
+            conversation_archive.export_conversation(self.history, "m", json_zip_path=path)
+        self.assertTrue(os.path.exists(path + conversation_archive.APPEND_BACKUP_SUFFIX))
+        self.assertFalse(conversation_archive.recover_interrupted_append(path))
+        self.assertFalse(os.path.exists(path + conversation_archive.APPEND_BACKUP_SUFFIX))
+        archive = conversation_archive.ArchiveReader(path)
+        self.addCleanup(archive.close)
+        self.assertEqual(archive.load_json()["metadata"]["revision"], 2)
+
+    def test_compaction_removes_superseded_entries(self):
+        path = self.path("j.zip")
+        history = [{"role": "user", "content": "x" * 5000, "image_paths": [self.png]}]
+        conversation_archive.export_conversation(history, "m", json_zip_path=path)
+        with patch.object(conversation_archive, "compact_archive") as mock_compact:
+            conversation_archive.export_conversation(history, "m", json_zip_path=path)
+        mock_compact.assert_not_called()
+        # 別の画像だけの会話で上書きすると、古い画像とJSONは不要になり詰め直される
+        history = [{"role": "user", "content": "Q", "image_paths": [self.bmp]}]
+        conversation_archive.export_conversation(history, "m", json_zip_path=path)
+        with zipfile.ZipFile(path) as z:
+            names = z.namelist()
+        self.assertEqual(len(names), len(set(names)))
+        self.assertNotIn(self.hashed(self.png), names)
+        self.assertIn(self.hashed(self.bmp), names)
+
+    def test_compact_archive_keeps_latest(self):
+        path = self.path("j.zip")
+        conversation_archive.export_conversation(self.history[:2], "m", json_zip_path=path, json_name="c.json")
+        with patch.object(conversation_archive, "COMPACT_RATIO", 1.0):
+            conversation_archive.export_conversation(self.history, "m", json_zip_path=path)
+        conversation_archive.compact_archive(path)
+        with zipfile.ZipFile(path) as z:
+            names = z.namelist()
+            self.assertEqual(len(names), len(set(names)))
+            self.assertEqual(json.loads(z.read("c.json"))["metadata"]["revision"], 2)
+
+    def test_compaction_reopens_live_reader(self):
+        path = self.path("j.zip")
+        conversation_archive.export_conversation(self.history, "m", json_zip_path=path)
+        reader = conversation_archive.ArchiveReader(path)
+        self.addCleanup(reader.close)
+        image = reader.image(self.hashed(self.png))
+        data = image.data
+        closed_on_replace = []
+        replace = os.replace
+
+        def check_replace(src, dst):
+            closed_on_replace.append(reader._zip.fp is None)
+            replace(src, dst)
+        # 再開した会話の画像だけを残して保存し直すと、開いているzipを詰め直す
+        history = [{"role": "user", "content": "Q", "image_paths": [image]}, {"role": "assistant", "content": "A", "markdown": "A"}]
+        with patch.object(conversation_archive, "COMPACT_RATIO", 0.0), \
+             patch.object(conversation_archive.os, "replace", side_effect=check_replace):
+            self.assertIsNone(conversation_archive.export_conversation(history, "m", json_zip_path=path))
+        self.assertEqual(closed_on_replace, [True])
+        with zipfile.ZipFile(path) as z:
+            self.assertNotIn(self.hashed(self.bmp), z.namelist())
+        # 開き直したzipから読み込める
+        self.assertEqual(image.data, data)
+        self.assertEqual(reader.load_json()["metadata"]["revision"], 2)
+
+    def test_compaction_failure_reported(self):
+        path = self.path("j.zip")
+        conversation_archive.export_conversation(self.history, "m", json_zip_path=path)
+        with patch.object(conversation_archive, "COMPACT_RATIO", 0.0), \
+             patch.object(conversation_archive, "compact_archive", side_effect=PermissionError("in use")):
+            error = conversation_archive.export_conversation(self.history[:2], "m", json_zip_path=path)
+        self.assertIsInstance(error, PermissionError)
+        # 追記は完了している
+        with zipfile.ZipFile(path) as z:
+            self.assertEqual(json.loads(z.read("conversation.json"))["metadata"]["revision"], 2)
+
+    def test_not_incremental_overwrites(self):
+        path = self.path("j.zip")
+        conversation_archive.export_conversation(self.history, "m", json_zip_path=path)
+        conversation_archive.export_conversation(self.history, "m", json_zip_path=path, json_name="c.json", incremental=False)
+        with zipfile.ZipFile(path) as z:
+            self.assertEqual(json.loads(z.read("c.json"))["metadata"]["revision"], 1)
+            self.assertNotIn("conversation.json", z.namelist())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,127 @@
+import unittest
+from unittest.mock import patch
+import os
+import json
+import tempfile
+import zipfile
+from PIL import Image
+from claude_tk import conversation_container, conversation_archive
+
+
+class TestConversationContainer(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.png = self.path("a.png")
+        Image.new("RGB", (20, 20), "red").save(self.png)
+        self.history = []
+        for i in range(5):
+            user = {"role": "user", "content": f"Q{i}"}
+            if i in (1, 3):
+                user["image_paths"] = [self.png]
+            self.history.append(user)
+            self.history.append({"role": "assistant", "content": f"A{i}", "markdown": f"**A{i}**"})
+
+    def path(self, name):
+        return os.path.join(self.tmpdir.name, name)
+
+    def open(self, path):
+        reader = conversation_container.ContainerReader(path)
+        self.addCleanup(reader.close)
+        return reader
+
+    def test_roundtrip(self):
+        conversation_container.write_container(self.history, "model-x", self.path("c.ctk"))
+        reader = self.open(self.path("c.ctk"))
+        self.assertEqual(len(reader), 10)
+        self.assertEqual(reader.turn_count, 5)
+        self.assertEqual(reader.metadata["model"], "model-x")
+        messages = list(reader.messages())
+        self.assertEqual(messages[1], {"role": "assistant", "content": "**A0**"})
+        # 同じ画像は1回だけ格納され、同じ画像ソースを共有する
+        self.assertIs(messages[2]["image_paths"][0], messages[6]["image_paths"][0])
+        with open(self.png, "rb") as f:
+            self.assertEqual(messages[2]["image_paths"][0].data, f.read())
+        self.assertEqual(len(reader.load_json()["conversation"]), 10)
+
+    def test_last_turns_seeks(self):
+        conversation_container.write_container(self.history, "m", self.path("c.ctk"))
+        reader = self.open(self.path("c.ctk"))
+        with patch.object(reader, "_read_record_at", wraps=reader._read_record_at) as mock_read:
+            last = reader.last_turns(2)
+        # 最新の2ターン（4メッセージ）だけを読み込む
+        self.assertEqual([m["content"] for m in last], ["Q3", "**A3**", "Q4", "**A4**"])
+        self.assertEqual(mock_read.call_count, 4)
+        self.assertEqual(len(reader.last_turns(10)), 10)
+
+    def test_truncated_file_recovered(self):
+        conversation_container.write_container(self.history, "m", self.path("c.ctk"))
+        with open(self.path("c.ctk"), "rb") as f:
+            data = f.read()
+        # インデックスが書き込まれる前に途切れたファイル
+        reader = self.open(self.path("c.ctk"))
+        cut = reader._messages[7] + 3
+        with open(self.path("t.ctk"), "wb") as f:
+            f.write(data[:cut])
+        truncated = self.open(self.path("t.ctk"))
+        self.assertEqual(len(truncated), 7)
+        self.assertEqual(truncated.turn_count, 4)
+        self.assertEqual(truncated.metadata["model"], "m")
+        self.assertEqual(list(truncated.messages())[6]["image_paths"][0].data, reader.read_blob(0))
+
+    def test_not_a_container(self):
+        with open(self.path("x.ctk"), "wb") as f:
+            f.write(b"hello")
+        with self.assertRaises(ValueError):
+            conversation_container.ContainerReader(self.path("x.ctk"))
+
+    def test_write_failure_removes_file(self):
+        history = [{"role": "user", "content": "Q", "image_paths": [self.path("gone.png")]}]
+        with self.assertRaises(OSError):
+            conversation_container.write_container(history, "m", self.path("c.ctk"))
+        self.assertFalse(os.path.exists(self.path("c.ctk")))
+
+    def test_write_progress_and_cancel(self):
+        progress = conversation_archive.ArchiveProgress()
+        conversation_container.write_container(self.history, "m", self.path("c.ctk"), progress=progress)
+        self.assertEqual((progress.done_files, progress.total_files), (10, 10))
+        self.assertEqual(progress.done_bytes, os.path.getsize(self.png))
+        with open(self.path("c.ctk"), "rb") as f:
+            original = f.read()
+        # 途中で中止しても既存のファイルはそのまま
+        progress = conversation_archive.ArchiveProgress()
+        with patch.object(progress, "advance", side_effect=conversation_archive.ArchiveCancelled()):
+            with self.assertRaises(conversation_archive.ArchiveCancelled):
+                conversation_container.write_container(self.history[:4], "m", self.path("c.ctk"), progress=progress)
+        with open(self.path("c.ctk"), "rb") as f:
+            self.assertEqual(f.read(), original)
+        self.assertEqual(sorted(os.listdir(self.tmpdir.name)), ["a.png", "c.ctk"])
+
+    def test_convert_zip_and_back(self):
+        conversation_archive.export_conversation(self.history, "m", json_zip_path=self.path("a.zip"))
+        conversation_container.convert(self.path("a.zip"), self.path("b.ctk"))
+        conversation_container.convert(self.path("b.ctk"), self.path("c.zip"))
+        with zipfile.ZipFile(self.path("a.zip")) as a, zipfile.ZipFile(self.path("c.zip")) as c:
+            original = json.loads(a.read("conversation.json"))["conversation"]
+            converted = json.loads(c.read("c.json"))["conversation"]
+            self.assertEqual(converted, original)
+            self.assertEqual(
+                sorted(n for n in a.namelist() if n.startswith("img/")),
+                sorted(n for n in c.namelist() if n.startswith("img/")))
+
+    def test_convert_json(self):
+        history = [{"role": "user", "content": "Q"}, {"role": "assistant", "content": "**A**"}]
+        with open(self.path("a.json"), "w", encoding="utf-8") as f:
+            json.dump({"metadata": {"model": "m"}, "conversation": history}, f)
+        self.assertEqual(conversation_container.main([self.path("a.json"), self.path("b.ctk")]), 0)
+        self.assertEqual(conversation_container.main([self.path("b.ctk"), self.path("c.json")]), 0)
+        with open(self.path("c.json"), encoding="utf-8") as f:
+            self.assertEqual(json.load(f)["conversation"], history)
+        # 画像付きの会話はJSONに変換できない
+        conversation_container.write_container(self.history, "m", self.path("i.ctk"))
+        with patch("sys.stderr"):
+            self.assertEqual(conversation_container.main([self.path("i.ctk"), self.path("i.json")]), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
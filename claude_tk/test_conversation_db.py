@@ -0,0 +1,92 @@
+import unittest
+import os
+import tempfile
+import zipfile
+from claude_tk import conversation_db, conversation_archive, media_store, image_attachments
+
+
+class TestConversationDB(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.store = media_store.MediaStore(os.path.join(self.tmpdir.name, "media"))
+        self.db = conversation_db.ConversationDB(os.path.join(self.tmpdir.name, "c.db"), store=self.store)
+        self.addCleanup(self.db.close)
+        self.history = [
+            {"role": "user", "content": "Pythonでzipを展開する方法"},
+            {"role": "assistant", "content": "zipfileを使います", "markdown": "`zipfile`を使います"}
+        ]
+
+    def test_save_and_search(self):
+        conversation_id = self.db.save_conversation(self.history, "model-x")
+        hits = self.db.search("zipfile")
+        self.assertEqual(len(hits), 1)
+        self.assertEqual(hits[0]["conversation_id"], conversation_id)
+        self.assertEqual(hits[0]["role"], "assistant")
+        self.assertEqual(hits[0]["title"], "Pythonでzipを展開する方法")
+        self.assertIn("[zipfile]", hits[0]["snippet"])
+        self.assertEqual(self.db.search("存在しない語句"), [])
+        self.assertEqual(self.db.search("  "), [])
+
+    def test_search_short_and_special_queries(self):
+        self.db.save_conversation(self.history, "m")
+        # trigramで引けない短い語や、FTS5の演算子を含む語も検索できる
+        self.assertEqual(len(self.db.search("展開")), 1)
+        self.assertEqual(self.db.search('"OR*'), [])
+
+    def test_resave_appends_new_messages(self):
+        conversation_id = self.db.save_conversation(self.history, "m")
+        history = self.history + [{"role": "user", "content": "tarfileの場合は？"}]
+        self.assertEqual(self.db.save_conversation(history, "m2", conversation_id), conversation_id)
+        loaded, model, archives = self.db.load_conversation(conversation_id)
+        self.assertEqual(loaded, history)
+        self.assertEqual(model, "m2")
+        self.assertEqual(archives, [])
+        self.assertEqual(len(self.db.search("tarfile")), 1)
+        # 短くなった会話は入れ直され、索引からも消える
+        self.db.save_conversation(history[:1], "m", conversation_id)
+        self.assertEqual(self.db.search("tarfile"), [])
+        self.assertEqual(len(self.db.load_conversation(conversation_id)[0]), 1)
+
+    def test_image_references(self):
+        zip_path = os.path.join(self.tmpdir.name, "c.zip")
+        with zipfile.ZipFile(zip_path, "w") as z:
+            z.writestr("img/x.png", b"x")
+        archive = conversation_archive.ArchiveReader(zip_path)
+        self.addCleanup(archive.close)
+        mem = image_attachments.MemoryImage(b"clip", "clip.png")
+        history = [{"role": "user", "content": "Q", "image_paths": [archive.image("img/x.png"), mem]}]
+        conversation_id = self.db.save_conversation(history, "m")
+        loaded, _, archives = self.db.load_conversation(conversation_id)
+        self.addCleanup(lambda: [a.close() for a in archives])
+        zip_image, stored = loaded[0]["image_paths"]
+        self.assertEqual(zip_image.data, b"x")
+        self.assertTrue(self.store.contains(stored))
+
+    def test_question_answer_pairs(self):
+        # 続きの質問・画像付きの質問・回答のない質問は含めない
+        self.db.save_conversation(self.history + [
+            {"role": "user", "content": "もっと詳しく"},
+            {"role": "assistant", "content": "詳しい回答"}
+        ], "m")
+        self.db.save_conversation([
+            {"role": "user", "content": "画像の質問", "image_paths": [image_attachments.MemoryImage(b"x", "x.png")]},
+            {"role": "assistant", "content": "画像の回答"}
+        ], "m")
+        self.db.save_conversation([{"role": "user", "content": "回答のない質問"}], "m")
+        self.assertEqual(self.db.question_answer_pairs(), [("Pythonでzipを展開する方法", "`zipfile`を使います")])
+
+    def test_load_missing(self):
+        with self.assertRaises(KeyError):
+            self.db.load_conversation(999)
+
+    def test_reopen_existing_db(self):
+        self.db.save_conversation(self.history, "m")
+        self.db.close()
+        self.db = conversation_db.ConversationDB(os.path.join(self.tmpdir.name, "c.db"), store=self.store)
+        self.addCleanup(self.db.close)
+        self.assertEqual(len(self.db.search("zipfile")), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,103 @@
+import unittest
+from unittest.mock import patch
+import os
+import json
+import tempfile
+from claude_tk import conversation_indexer, conversation_db, conversation_archive
+
+
+class TestConversationIndexer(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.root = os.path.join(self.tmpdir.name, "saved")
+        os.makedirs(os.path.join(self.root, "2024"))
+        self.db = conversation_db.ConversationDB(os.path.join(self.tmpdir.name, "c.db"))
+        self.addCleanup(self.db.close)
+
+    def write(self, name, text):
+        path = os.path.join(self.root, name)
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(text)
+        return path
+
+    def write_samples(self):
+        # simple版のJSON・Markdown
+        self.write("claude_simple_1.json", json.dumps({
+            "metadata": {"created_at": "2024-01-01T10:00:00", "model": "m-simple"},
+            "question": "りんごの色は", "answer": "赤です"}, ensure_ascii=False))
+        self.write("claude_simple_1.md", "# 質問\nみかんの色は\n\n# 回答\n橙です\n")
+        # multi版のJSON・Markdown
+        self.write("2024/claude_conversation_1.json", json.dumps({
+            "metadata": {"model": "m-multi"},
+            "conversation": [
+                {"role": "user", "content": "ぶどうの色は"},
+                {"role": "assistant", "content": "**紫**です"}]}, ensure_ascii=False))
+        self.write("2024/claude_conversation_1.md", "## 質問1\nばななの色は\n\n## 回答1\n黄色です\n\n## 質問2\n熟すと？\n\n## 回答2\n茶色です\n")
+        # multi_image版のJSON zip
+        conversation_archive.export_conversation(
+            [{"role": "user", "content": "この画像の色は",
+              "image_paths": [self.write("a.png", "not really a png")]},
+             {"role": "assistant", "content": "白です", "markdown": "白です"}],
+            "m-image", json_zip_path=os.path.join(self.root, "claude_conversation_2_json.zip"))
+        # 会話ではないファイル
+        self.write("package.json", json.dumps({"name": "x"}))
+
+    def test_build_index_all_formats(self):
+        self.write_samples()
+        stats = conversation_indexer.build_index(self.root, self.db, workers=1)
+        self.assertEqual(stats["files"], 6)
+        self.assertEqual(stats["indexed"], 5)
+        self.assertEqual(stats["skipped"], 1)
+        self.assertEqual(stats["errors"], 0)
+        hit = self.db.search("りんご")[0]
+        self.assertEqual(hit["model"], "m-simple")
+        self.assertEqual(hit["updated_at"], "2024-01-01T10:00:00")
+        self.assertEqual(len(self.db.search("橙です")), 1)
+        history, model, _ = self.db.load_conversation(self.db.search("ぶどう")[0]["conversation_id"])
+        self.assertEqual(model, "m-multi")
+        self.assertEqual(history[1]["markdown"], "**紫**です")
+        history, _, _ = self.db.load_conversation(self.db.search("熟すと")[0]["conversation_id"])
+        self.assertEqual([m["content"] for m in history], ["ばななの色は", "黄色です", "熟すと？", "茶色です"])
+        history, _, archives = self.db.load_conversation(self.db.search("この画像")[0]["conversation_id"])
+        self.addCleanup(lambda: [a.close() for a in archives])
+        self.assertEqual(history[0]["image_paths"][0].data, b"not really a png")
+
+    def test_incremental_reindex(self):
+        self.write_samples()
+        conversation_indexer.build_index(self.root, self.db, workers=1)
+        stats = conversation_indexer.build_index(self.root, self.db, workers=1)
+        self.assertEqual((stats["indexed"], stats["unchanged"]), (0, 6))
+        # 更新時刻だけが変わったファイルは内容ハッシュで判定して読み込み直さない
+        path = os.path.join(self.root, "claude_simple_1.md")
+        os.utime(path, ns=(1, 1))
+        with patch.object(conversation_indexer, "parse_file") as mock_parse:
+            stats = conversation_indexer.build_index(self.root, self.db, workers=1)
+        mock_parse.assert_not_called()
+        self.assertEqual(stats["unchanged"], 6)
+        # 内容が変わったファイルは置き換え、削除されたファイルは索引から取り除く
+        self.write("claude_simple_1.md", "# 質問\nれもんの色は\n\n# 回答\n黄色です\n")
+        os.remove(os.path.join(self.root, "claude_simple_1.json"))
+        stats = conversation_indexer.build_index(self.root, self.db, workers=1)
+        self.assertEqual((stats["indexed"], stats["removed"]), (1, 1))
+        self.assertEqual(self.db.search("みかん"), [])
+        self.assertEqual(self.db.search("りんご"), [])
+        self.assertEqual(len(self.db.search("れもん")), 1)
+
+    def test_build_index_process_pool(self):
+        self.write_samples()
+        with patch.object(conversation_indexer, "CHUNK_SIZE", 1):
+            stats = conversation_indexer.build_index(self.root, self.db, workers=2)
+        self.assertEqual(stats["indexed"], 5)
+        self.assertEqual(len(self.db.search("ばなな")), 1)
+
+    def test_main(self):
+        self.write_samples()
+        db_path = os.path.join(self.tmpdir.name, "cli.db")
+        with patch("builtins.print") as mock_print:
+            self.assertEqual(conversation_indexer.main([self.root, "--db", db_path, "--workers", "1"]), 0)
+        self.assertIn("登録: 5", mock_print.call_args.args[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
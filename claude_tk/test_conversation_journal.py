@@ -0,0 +1,118 @@
+import unittest
+import os
+import json
+import tempfile
+import zipfile
+from claude_tk import conversation_journal, media_store, image_attachments
+
+
+class TestConversationJournal(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.dir = os.path.join(self.tmpdir.name, "journal")
+        self.store = media_store.MediaStore(os.path.join(self.tmpdir.name, "media"))
+        self.journal = conversation_journal.ConversationJournal(self.dir, store=self.store)
+        self.addCleanup(self.journal.close)
+
+    def test_no_file_until_first_message(self):
+        self.assertIsNone(self.journal.path)
+        self.assertFalse(os.path.exists(self.dir))
+        self.assertEqual(conversation_journal.find_unsaved_sessions(self.dir), [])
+
+    def test_append_is_one_line_per_message(self):
+        self.journal.append({"role": "user", "content": "Q1"}, "model-x")
+        self.journal.append({"role": "assistant", "content": "A1", "markdown": "**A1**"}, "model-x")
+        with open(self.journal.path, encoding="utf-8") as f:
+            lines = f.readlines()
+        # 先頭行はジャーナルを書いているプロセスの記録
+        self.assertEqual(json.loads(lines[0]), {"type": "session", "pid": os.getpid()})
+        self.assertEqual(len(lines), 3)
+        self.assertEqual(json.loads(lines[2])["markdown"], "**A1**")
+
+    def test_load_session_roundtrip(self):
+        png = os.path.join(self.tmpdir.name, "a.png")
+        with open(png, "wb") as f:
+            f.write(b"png")
+        mem = image_attachments.MemoryImage(b"clip", "clip.png")
+        self.journal.append({"role": "user", "content": "Q", "image_paths": [png, mem]}, "model-x")
+        self.journal.append({"role": "assistant", "content": "A", "markdown": "A"}, "model-x")
+        self.journal.close()
+        self.assertEqual(conversation_journal.find_unsaved_sessions(self.dir), [self.journal.path])
+        history, model, archives = conversation_journal.load_session(self.journal.path)
+        self.assertEqual(model, "model-x")
+        self.assertEqual(archives, [])
+        paths = history[0]["image_paths"]
+        self.assertEqual(paths[0], os.path.abspath(png))
+        # クリップボード画像はメディアストアに書き出されている
+        self.assertTrue(self.store.contains(paths[1]))
+        with open(paths[1], "rb") as f:
+            self.assertEqual(f.read(), b"clip")
+
+    def test_zip_image_reference(self):
+        zip_path = os.path.join(self.tmpdir.name, "c.zip")
+        with zipfile.ZipFile(zip_path, "w") as z:
+            z.writestr("img/x.png", b"x")
+        from claude_tk import conversation_archive
+        archive = conversation_archive.ArchiveReader(zip_path)
+        self.addCleanup(archive.close)
+        self.journal.append({"role": "user", "content": "Q", "image_paths": [archive.image("img/x.png")]})
+        history, _, archives = conversation_journal.load_session(self.journal.path)
+        self.addCleanup(lambda: [a.close() for a in archives])
+        self.assertEqual(history[0]["image_paths"][0].data, b"x")
+
+    def test_saved_session_not_offered(self):
+        self.journal.append({"role": "user", "content": "Q"})
+        self.journal.mark_saved()
+        self.assertFalse(self.journal.has_unsaved())
+        self.assertEqual(conversation_journal.find_unsaved_sessions(self.dir), [])
+        self.journal.append({"role": "assistant", "content": "A"})
+        self.assertEqual(conversation_journal.find_unsaved_sessions(self.dir), [self.journal.path])
+
+    def test_session_of_running_process_not_offered(self):
+        import subprocess
+        import sys
+        self.journal.append({"role": "user", "content": "Q"})
+        self.journal.close()
+        with open(self.journal.path, encoding="utf-8") as f:
+            lines = f.readlines()
+
+        def write_pid(pid):
+            lines[0] = json.dumps({"type": "session", "pid": pid}) + "\n"
+            with open(self.journal.path, "w", encoding="utf-8") as f:
+                f.writelines(lines)
+        # 別に起動して動いているアプリのジャーナルは提示しない
+        process = subprocess.Popen([sys.executable, "-c", "import time; time.sleep(30)"])
+        self.addCleanup(process.wait)
+        self.addCleanup(process.kill)
+        write_pid(process.pid)
+        self.assertEqual(conversation_journal.find_unsaved_sessions(self.dir), [])
+        # 終了したアプリのジャーナルは提示する
+        process.kill()
+        process.wait()
+        self.assertEqual(conversation_journal.find_unsaved_sessions(self.dir), [self.journal.path])
+
+    def test_pop_and_truncated_line(self):
+        self.journal.append({"role": "user", "content": "Q1"})
+        self.journal.append({"role": "user", "content": "Q2"})
+        self.journal.pop()
+        self.journal.close()
+        with open(self.journal.path, "a", encoding="utf-8") as f:
+            f.write('{"type": "message", "role": "us')  # 書き込み途中で終了した行
+        history, _, _ = conversation_journal.load_session(self.journal.path)
+        self.assertEqual([m["content"] for m in history], ["Q1"])
+
+    def test_reset_and_discard_remove_file(self):
+        self.journal.append({"role": "user", "content": "Q"})
+        first = self.journal.path
+        self.journal.reset()
+        self.assertFalse(os.path.exists(first))
+        self.journal.append({"role": "user", "content": "Q"})
+        self.assertNotEqual(self.journal.path, first)
+        second = self.journal.path
+        self.journal.discard()
+        self.assertFalse(os.path.exists(second))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+import unittest
+from unittest.mock import MagicMock
+import os
+import json
+import tempfile
+from PIL import Image
+from claude_tk import file_uploads, image_attachments
+
+
+class TestFileUploads(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.map_path = os.path.join(self.tmpdir.name, "media", file_uploads.FILE_MAP_NAME)
+        self.png = os.path.join(self.tmpdir.name, "a.png")
+        Image.new("RGB", (10, 10), "red").save(self.png)
+        self.client = MagicMock()
+        self.client.beta.files.upload.side_effect = lambda **kwargs: MagicMock(id=f"file_{self.client.beta.files.upload.call_count}")
+
+    def test_upload_once_and_persist(self):
+        uploader = file_uploads.FileUploader(self.client, self.map_path, "key-1")
+        self.assertEqual(uploader.upload(self.png), "file_1")
+        self.assertEqual(uploader.upload(self.png), "file_1")
+        self.client.beta.files.upload.assert_called_once()
+        name, data, mime_type = self.client.beta.files.upload.call_args.kwargs["file"]
+        self.assertEqual((name, mime_type), ("a.png", "image/png"))
+        self.assertEqual(self.client.beta.files.upload.call_args.kwargs["betas"], [file_uploads.FILES_API_BETA])
+        # 再起動後も同じ内容の画像はアップロードしない（貼り付け画像も内容で判定）
+        with open(self.png, "rb") as f:
+            clip = image_attachments.MemoryImage(f.read(), "clip.png")
+        uploader = file_uploads.FileUploader(self.client, self.map_path, "key-1")
+        self.assertEqual(uploader.upload_all([clip, self.png]), ["file_1", "file_1"])
+        self.client.beta.files.upload.assert_called_once()
+        with open(self.map_path, encoding="utf-8") as f:
+            self.assertNotIn("key-1", f.read())
+
+    def test_other_api_key_discards_map(self):
+        file_uploads.FileUploader(self.client, self.map_path, "key-1").upload(self.png)
+        uploader = file_uploads.FileUploader(self.client, self.map_path, "key-2")
+        self.assertIsNone(uploader.known_ids([self.png]))
+        self.assertEqual(uploader.upload(self.png), "file_2")
+        with open(self.map_path, encoding="utf-8") as f:
+            self.assertEqual(list(json.load(f)["files"].values()), ["file_2"])
+
+    def test_known_ids(self):
+        uploader = file_uploads.FileUploader(self.client, self.map_path, "key-1")
+        other = os.path.join(self.tmpdir.name, "b.png")
+        Image.new("RGB", (10, 10), "blue").save(other)
+        uploader.upload(self.png)
+        self.assertEqual(uploader.known_ids([self.png]), ["file_1"])
+        self.assertIsNone(uploader.known_ids([self.png, other]))
+        self.client.beta.files.upload.assert_called_once()
+
+    def test_broken_map_is_ignored(self):
+        os.makedirs(os.path.dirname(self.map_path))
+        with open(self.map_path, "w", encoding="utf-8") as f:
+            f.write("{broken")
+        uploader = file_uploads.FileUploader(self.client, self.map_path, "key-1")
+        self.assertEqual(uploader.upload(self.png), "file_1")
+
+
+if __name__ == "__main__":
+    unittest.main()
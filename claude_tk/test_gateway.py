@@ -0,0 +1,189 @@
+import unittest
+from unittest.mock import MagicMock
+from types import SimpleNamespace
+import os
+import json
+import time
+import tempfile
+import threading
+import urllib.request
+import urllib.error
+from claude_tk import gateway, response_cache
+
+
+def events(chunks, stop_reason="end_turn"):
+    """ストリーミングのイベント列"""
+    result = [SimpleNamespace(type="content_block_delta", delta=SimpleNamespace(type="text_delta", text=chunk)) for chunk in chunks]
+    return result + [SimpleNamespace(type="message_delta", delta=SimpleNamespace(stop_reason=stop_reason))]
+
+
+class TestGateway(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.client = MagicMock()
+
+        def create(**kwargs):
+            question = kwargs["messages"][-1]["content"]
+            if kwargs.get("stream"):
+                return events([f"**{question}", "への回答**"])
+            return MagicMock(content=[MagicMock(text=f"**{question}への回答**")], stop_reason="end_turn")
+        self.client.messages.create.side_effect = create
+        self.client.messages.count_tokens.return_value = MagicMock(input_tokens=42)
+        self.cache = response_cache.ResponseCache(os.path.join(self.tmpdir.name, "cache"))
+        self.data_dir = os.path.join(self.tmpdir.name, "saved")
+        self.gateway = gateway.Gateway(
+            self.client, "claude-3-haiku-20240307", gateway.RateLimiter(0, 4), cache=self.cache, data_dir=self.data_dir
+        )
+        self.addCleanup(self.gateway.close)
+        self.server = gateway.GatewayServer(("127.0.0.1", 0), self.gateway, token="secret")
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def request(self, method, path, body=None, token="secret", headers=None):
+        data = json.dumps(body).encode("utf-8") if body is not None else None
+        req = urllib.request.Request(self.url + path, data=data, method=method)
+        req.add_header("Content-Type", "application/json")
+        if token:
+            req.add_header("Authorization", f"Bearer {token}")
+        for key, value in (headers or {}).items():
+            req.add_header(key, value)
+        try:
+            with urllib.request.urlopen(req, timeout=5) as res:
+                return res.status, res.headers.get("Content-Type"), res.read().decode("utf-8")
+        except urllib.error.HTTPError as e:
+            return e.code, e.headers.get("Content-Type"), e.read().decode("utf-8")
+
+    def test_send_stream_and_stats(self):
+        status, _, body = self.request("POST", "/send", {"question": "Q1"})
+        self.assertEqual(status, 200)
+        result = json.loads(body)
+        self.assertEqual(result["answer"], "**Q1への回答**")
+        conversation_id = result["conversation_id"]
+        # 続きの質問はServer-Sent Eventsで受け取る
+        status, content_type, body = self.request("POST", "/stream", {"conversation_id": conversation_id, "question": "Q2"})
+        self.assertEqual(status, 200)
+        self.assertTrue(content_type.startswith("text/event-stream"))
+        sse = [block.split("\n") for block in body.strip().split("\n\n")]
+        self.assertEqual([lines[0] for lines in sse], ["event: text", "event: text", "event: done"])
+        self.assertEqual(json.loads(sse[0][1][len("data: "):]), {"text": "**Q2"})
+        self.assertEqual(json.loads(sse[-1][1][len("data: "):])["answer"], "**Q2への回答**")
+        messages = self.client.messages.create.call_args.kwargs["messages"]
+        self.assertEqual(messages[:2], [{"role": "user", "content": "Q1"}, {"role": "assistant", "content": "**Q1への回答**"}])
+        status, _, body = self.request("GET", f"/conversations/{conversation_id}")
+        self.assertEqual([m["content"] for m in json.loads(body)["messages"]], ["Q1", "**Q1への回答**", "Q2", "**Q2への回答**"])
+        # 同じ質問は保存してある回答を使う
+        status, _, body = self.request("POST", "/send", {"question": "Q1"})
+        self.assertTrue(json.loads(body)["cached"])
+        self.assertEqual(self.client.messages.create.call_count, 2)
+        stats = json.loads(self.request("GET", "/stats")[2])
+        self.assertEqual(stats["endpoints"]["POST /send"]["count"], 2)
+        self.assertIn("p95_ms", stats["endpoints"]["POST /stream"])
+        self.assertIn("POST /stream first_text", stats["endpoints"])
+        self.assertEqual(stats["rate_limiter"]["requests"], 2)
+        self.assertEqual(stats["cache_hits"], 1)
+
+    def test_count_save_and_resume(self):
+        conversation_id = json.loads(self.request("POST", "/send", {"question": "Q1"})[2])["conversation_id"]
+        status, _, body = self.request("POST", "/count", {"conversation_id": conversation_id, "question": "Q2"})
+        self.assertEqual(json.loads(body)["input_tokens"], 42)
+        self.assertEqual(len(self.client.messages.count_tokens.call_args.kwargs["messages"]), 3)
+        # パスは保存用ディレクトリ内として扱う
+        status, _, body = self.request("POST", "/save", {"conversation_id": conversation_id, "path": "conversation.ctk"})
+        self.assertEqual((status, json.loads(body)["messages"]), (200, 2))
+        self.assertTrue(os.path.isfile(os.path.join(self.data_dir, "conversation.ctk")))
+        status, _, body = self.request("POST", "/resume", {"path": "conversation.ctk"})
+        resumed = json.loads(body)
+        self.assertEqual(resumed["messages"], 2)
+        self.assertNotEqual(resumed["conversation_id"], conversation_id)
+        status, _, body = self.request("GET", f"/conversations/{resumed['conversation_id']}")
+        self.assertEqual(json.loads(body)["messages"][1]["content"], "**Q1への回答**")
+        # 保存用ディレクトリの外は使えない
+        outside = os.path.join(self.tmpdir.name, "outside.ctk")
+        for path in (outside, "../outside.ctk"):
+            self.assertEqual(self.request("POST", "/save", {"conversation_id": conversation_id, "path": path})[0], 403)
+            self.assertEqual(self.request("POST", "/resume", {"path": path})[0], 403)
+        self.assertFalse(os.path.exists(outside))
+
+    def test_errors(self):
+        self.assertEqual(self.request("GET", "/stats", token=None)[0], 401)
+        self.assertEqual(self.request("POST", "/send", {})[0], 400)
+        self.assertEqual(self.request("POST", "/send", {"conversation_id": "nothing", "question": "Q"})[0], 404)
+        self.assertEqual(self.request("GET", "/unknown")[0], 404)
+        conversation = self.gateway.create_conversation()
+        conversation.lock.acquire()
+        status, _, body = self.request("POST", "/send", {"conversation_id": conversation.id, "question": "Q"})
+        conversation.lock.release()
+        self.assertEqual(status, 409)
+        self.assertIn("error", json.loads(body))
+        self.client.messages.create.side_effect = RuntimeError("overloaded")
+        status, _, body = self.request("POST", "/send", {"question": "Q"})
+        self.assertEqual(status, 502)
+        self.assertIn("overloaded", json.loads(body)["error"])
+
+    def test_resume_broken_file(self):
+        # 壊れた・形式の違う保存ファイルは400を返す
+        os.makedirs(self.data_dir)
+        for name, data in (("broken.zip", b"PK\x03\x04broken"), ("broken.ctk", b"not a container"),
+                           ("broken.json", b'{"conversation": [{"content": "Q"}]}')):
+            with open(os.path.join(self.data_dir, name), "wb") as f:
+                f.write(data)
+            status, _, body = self.request("POST", "/resume", {"path": name})
+            self.assertEqual(status, 400, name)
+            self.assertIn("error", json.loads(body))
+        self.assertEqual(self.gateway.conversations, {})
+
+    def test_conversation_limits(self):
+        limited = gateway.Gateway(self.client, limiter=gateway.RateLimiter(0, 4), data_dir=self.data_dir,
+                                  max_conversations=2, idle_timeout=0)
+        self.addCleanup(limited.close)
+        first = limited.create_conversation()
+        second = limited.create_conversation()
+        # 上限を超えたら最も長く使われていない会話を破棄する（回答を待っている会話は残す）
+        limited.get_conversation(first.id)
+        second.lock.acquire()
+        third = limited.create_conversation()
+        second.lock.release()
+        self.assertEqual(set(limited.conversations), {second.id, third.id})
+        limited.create_conversation()
+        self.assertNotIn(second.id, limited.conversations)
+        # 使われないまま保持する時間を過ぎた会話は、次に会話を作るときに破棄する
+        limited.max_conversations = 0
+        limited.idle_timeout = 60
+        third.last_used -= 61
+        limited.create_conversation()
+        self.assertNotIn(third.id, limited.conversations)
+        self.assertEqual(len(limited.conversations), 2)
+
+    def test_rejects_browser_requests(self):
+        # 他のサイトのページから送られたリクエスト（DNSリバインディング・CSRF）を拒否する
+        self.assertEqual(self.request("GET", "/stats", headers={"Host": "evil.example:8765"})[0], 403)
+        self.assertEqual(self.request("GET", "/stats", headers={"Origin": "http://evil.example"})[0], 403)
+        self.assertEqual(self.request("POST", "/send", {"question": "Q"}, headers={"Content-Type": "text/plain"})[0], 415)
+        self.client.messages.create.assert_not_called()
+        self.assertEqual(self.request("GET", "/stats", headers={"Host": "localhost:8765"})[0], 200)
+
+    def test_rate_limiter(self):
+        # 1分あたり600件（0.1秒間隔）で、続けて送れるのは1件
+        limiter = gateway.RateLimiter(600, max_concurrent=2, burst=1)
+        start = time.monotonic()
+        for _ in range(3):
+            limiter.acquire()
+            limiter.release()
+        self.assertGreaterEqual(time.monotonic() - start, 0.19)
+        # 同時に送れるのはmax_concurrent件まで
+        limiter = gateway.RateLimiter(0, max_concurrent=2)
+        limiter.acquire()
+        limiter.acquire()
+        acquired = threading.Event()
+        threading.Thread(target=lambda: (limiter.acquire(), acquired.set()), daemon=True).start()
+        self.assertFalse(acquired.wait(0.1))
+        limiter.release()
+        self.assertTrue(acquired.wait(5))
+        self.assertEqual(limiter.snapshot()["in_flight"], 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,147 @@
+import unittest
+import os
+import io
+import base64
+import tempfile
+from PIL import Image
+from claude_tk import image_attachments
+
+
+class TestImageAttachments(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+
+    def make_image(self, name, size=(10, 10), color="red"):
+        path = os.path.join(self.tmpdir.name, name)
+        Image.new("RGB", size, color).save(path)
+        return path
+
+    def test_get_image_paths(self):
+        self.assertEqual(image_attachments.get_image_paths({"image_paths": ["a", "b"]}), ["a", "b"])
+        self.assertEqual(image_attachments.get_image_paths({"image_path": "a"}), ["a"])
+        self.assertEqual(image_attachments.get_image_paths({"content": "q"}), [])
+
+    def test_preprocess_image_small_png_unchanged(self):
+        path = self.make_image("a.png")
+        data, mime_type = image_attachments.preprocess_image(path)
+        with open(path, "rb") as f:
+            self.assertEqual(data, f.read())
+        self.assertEqual(mime_type, "image/png")
+
+    def test_preprocess_image_bmp_converted(self):
+        # API非対応のBMPはPNGに変換される
+        path = self.make_image("a.bmp")
+        data, mime_type = image_attachments.preprocess_image(path)
+        self.assertEqual(mime_type, "image/png")
+        self.assertEqual(Image.open(io.BytesIO(data)).format, "PNG")
+
+    def test_preprocess_image_large_resized(self):
+        path = self.make_image("big.jpg", size=(3000, 1000))
+        data, mime_type = image_attachments.preprocess_image(path)
+        self.assertEqual(mime_type, "image/jpeg")
+        self.assertEqual(max(Image.open(io.BytesIO(data)).size), image_attachments.MAX_LONG_EDGE)
+
+    def test_encode_images_keeps_order(self):
+        paths = [self.make_image(f"{i}.png", color=c) for i, c in enumerate(["red", "green", "blue"])]
+        blocks = image_attachments.encode_images(paths)
+        self.assertEqual(len(blocks), 3)
+        for path, block in zip(paths, blocks):
+            with open(path, "rb") as f:
+                self.assertEqual(base64.b64decode(block["source"]["data"]), f.read())
+
+    def test_memory_image_encode_and_thumbnail(self):
+        # メモリ上の画像もファイルと同じように扱える
+        mem = image_attachments.MemoryImage.from_pil(Image.new("RGB", (300, 300), "blue"), "clip.png")
+        self.assertEqual(image_attachments.get_mime_type(mem), "image/png")
+        self.assertEqual(image_attachments.image_name(mem), "clip.png")
+        block = image_attachments.encode_image(mem)
+        self.assertEqual(base64.b64decode(block["source"]["data"]), mem.data)
+        img, error = image_attachments.load_thumbnails([mem], (60, 60))[0]
+        self.assertIsNone(error)
+        self.assertEqual(img.size, (60, 60))
+
+    def test_load_thumbnails_error(self):
+        path = self.make_image("a.png", size=(400, 400))
+        results = image_attachments.load_thumbnails([path, "missing.png"], (50, 50))
+        self.assertEqual(results[0][0].size, (50, 50))
+        self.assertIsNone(results[0][1])
+        self.assertIsNone(results[1][0])
+        self.assertIsInstance(results[1][1], Exception)
+
+    def test_build_thumbnail_sidecars(self):
+        path = self.make_image("a.png", size=(1000, 500))
+        files, manifest = image_attachments.build_thumbnail_sidecars({"img/a.png": path, "img/bad.png": "missing.png"})
+        thumb_name = manifest["thumbnails"]["img/a.png"]
+        self.assertNotIn("img/bad.png", manifest["thumbnails"])
+        self.assertEqual(Image.open(io.BytesIO(files[thumb_name])).size, (200, 100))
+
+    def test_deduplicator_merges_resaved_copies(self):
+        # 再保存・再圧縮しただけのコピーは最初の画像にまとめ、リサイズしたものは別の画像とみなす
+        img = Image.new("RGB", (200, 100), "white")
+        img.paste(Image.new("RGB", (100, 100), "black"), (0, 0))
+        original = os.path.join(self.tmpdir.name, "shot.png")
+        img.save(original)
+        bmp = os.path.join(self.tmpdir.name, "shot.bmp")
+        img.save(bmp)
+        jpeg = os.path.join(self.tmpdir.name, "shot.jpg")
+        img.save(jpeg, quality=70)
+        resized = os.path.join(self.tmpdir.name, "shot_large.jpg")
+        img.resize((400, 200)).save(resized, quality=70)
+        dedup = image_attachments.ImageDeduplicator(threshold=4)
+        self.assertEqual(dedup.canonicalize([original, bmp, jpeg, resized]), [original, original, original, resized])
+        self.assertEqual(dedup.canonicalize([original]), [original])
+
+    def test_deduplicator_keeps_similar_screenshots(self):
+        # 知覚ハッシュが近くても、一部が変わったスクリーンショットは別の画像
+        first = Image.new("RGB", (400, 300), "white")
+        first.paste(Image.new("RGB", (400, 30), "navy"), (0, 0))
+        second = first.copy()
+        second.paste(Image.new("RGB", (8, 12), "black"), (200, 150))  # 1文字分の違い
+        a = image_attachments.MemoryImage.from_pil(first, "a.png")
+        b = image_attachments.MemoryImage.from_pil(second, "b.png")
+        self.assertLessEqual(bin(image_attachments.dhash(a) ^ image_attachments.dhash(b)).count("1"), 4)
+        dedup = image_attachments.ImageDeduplicator(threshold=4)
+        self.assertEqual(dedup.canonicalize([a, b]), [a, b])
+
+    def test_deduplicator_keeps_different_images(self):
+        left = Image.new("RGB", (200, 100), "white")
+        left.paste(Image.new("RGB", (100, 100), "black"), (0, 0))
+        right = Image.new("RGB", (200, 100), "white")
+        right.paste(Image.new("RGB", (100, 100), "black"), (100, 0))
+        a = image_attachments.MemoryImage.from_pil(left, "a.png")
+        b = image_attachments.MemoryImage.from_pil(right, "b.png")
+        dedup = image_attachments.ImageDeduplicator(threshold=4)
+        self.assertEqual(dedup.canonicalize([a, b, a]), [a, b, a])
+
+    def test_deduplicator_disabled(self):
+        path = self.make_image("a.png")
+        dedup = image_attachments.ImageDeduplicator(threshold=-1)
+        self.assertEqual(dedup.canonicalize([path, path]), [path, path])
+
+    def test_image_cache_reuses_same_content(self):
+        from unittest.mock import patch
+        from claude_tk import media_store
+        a = self.make_image("a.png")
+        b = os.path.join(self.tmpdir.name, "copy.png")
+        with open(a, "rb") as src, open(b, "wb") as dst:
+            dst.write(src.read())
+        cache = image_attachments.ImageCache(media_store.content_hash, max_entries=2)
+        first = cache.encode([a])
+        # 同じ内容の画像は別のパスでも作り直さない
+        with patch.object(image_attachments, "encode_images", side_effect=AssertionError), \
+             patch.object(image_attachments, "load_thumbnails", side_effect=AssertionError):
+            self.assertEqual(cache.encode([b]), first)
+        img, error = cache.thumbnails([a, "missing.png"], (5, 5))[0]
+        self.assertEqual(img.size, (5, 5))
+        self.assertIsNone(error)
+        self.assertIs(cache.thumbnails([b], (5, 5))[0][0], img)
+        # 読めない画像はエラーをそのまま返す
+        self.assertIsNotNone(cache.thumbnails(["missing.png"], (5, 5))[0][1])
+        # 上限を超えると古いものから捨てる
+        cache.encode([self.make_image("c.png", color="blue")])
+        self.assertEqual(len(cache._entries), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+import unittest
+from unittest.mock import patch
+import os
+import json
+import tempfile
+from claude_tk import json_stream
+
+
+class TestJsonStream(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.conversation = []
+        for i in range(200):
+            self.conversation.append({"role": "user", "content": f"質問{i} 日本語"})
+            self.conversation.append({"role": "assistant", "content": f"**回答{i}**\n- 項目"})
+        self.data = {"metadata": {"model": "model-x", "total_messages": 400}, "conversation": self.conversation}
+
+    def write(self, data, name="c.json", **kwargs):
+        path = os.path.join(self.tmpdir.name, name)
+        with open(path, "w", encoding="utf-8") as f:
+            if isinstance(data, str):
+                f.write(data)
+            else:
+                json.dump(data, f, ensure_ascii=False, **kwargs)
+        return path
+
+    def stream(self, text, partial=False):
+        return json_stream.ConversationStream(json_stream.text_reader(text), partial=partial)
+
+    def test_stream_matches_json_load(self):
+        text = json.dumps(self.data, ensure_ascii=False, indent=2)
+        # チャンクの境界で値が切れる場合も確認する
+        with patch.object(json_stream, "CHUNK_SIZE", 7):
+            stream = self.stream(text)
+            self.assertEqual(list(stream), self.conversation)
+        self.assertEqual(stream.data["metadata"]["model"], "model-x")
+
+    def test_stream_invalid(self):
+        cases = [
+            '{"invalid": 1}',
+            '{"conversation": {"role": "user"}}',
+            '{"conversation": [{"role": "user"}]}',
+            '{"conversation": [{"role": "user", "content": "Q"}',
+            '{"conversation": []} extra',
+            '[1, 2]',
+        ]
+        for text in cases:
+            with self.subTest(text=text), self.assertRaises(ValueError):
+                list(self.stream(text))
+
+    def test_read_metadata(self):
+        path = self.write(self.data)
+        self.assertEqual(json_stream.read_metadata(path), {"metadata": self.data["metadata"]})
+
+    def test_read_tail_and_prefix(self):
+        path = self.write(self.data, indent=2)
+        tail, offset = json_stream.read_tail(path, 5, window=1024)
+        self.assertGreaterEqual(sum(1 for msg in tail if msg["role"] == "user"), 5)
+        self.assertEqual(tail[0]["role"], "user")
+        self.assertEqual(tail, self.conversation[-len(tail):])
+        # 先頭からoffsetまでを読めば残りの会話になる
+        with open(path, "rb") as f:
+            reader = json_stream.bounded_reader(f, offset)
+            prefix = list(json_stream.ConversationStream(reader, partial=True))
+        self.assertEqual(prefix + tail, self.conversation)
+
+    def test_read_tail_with_trailing_keys(self):
+        data = {"conversation": self.conversation, "extra": {"a": [1, 2]}}
+        path = self.write(data)
+        tail, offset = json_stream.read_tail(path, 3, window=512)
+        self.assertEqual(tail, self.conversation[-len(tail):])
+
+    def test_read_tail_small_or_broken_file(self):
+        path = self.write(self.data)
+        self.assertEqual(json_stream.read_tail(path, 5, window=os.path.getsize(path)), (None, 0))
+        text = json.dumps(self.data, ensure_ascii=False)
+        path = self.write(text[:-10], name="broken.json")
+        self.assertEqual(json_stream.read_tail(path, 5, window=1024), (None, 0))
+
+
+if __name__ == "__main__":
+    unittest.main()
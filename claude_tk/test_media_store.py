@@ -0,0 +1,77 @@
+import unittest
+from unittest.mock import patch
+import os
+import hashlib
+import tempfile
+from claude_tk import media_store, image_attachments
+
+
+class TestMediaStore(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.store = media_store.MediaStore(os.path.join(self.tmpdir.name, "media"))
+
+    def write(self, name, data):
+        path = os.path.join(self.tmpdir.name, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(data)
+        return path
+
+    def test_add_file_independent_of_source(self):
+        src = self.write("shot.PNG", b"image-data")
+        stored = self.store.add_file(src)
+        digest = hashlib.sha256(b"image-data").hexdigest()
+        self.assertEqual(os.path.basename(stored), digest + ".png")
+        self.assertFalse(os.path.samefile(src, stored))
+        # 元ファイルを編集・移動してもストアの画像は変わらない
+        with open(src, "wb") as f:
+            f.write(b"edited")
+        os.rename(src, src + ".moved")
+        with open(stored, "rb") as f:
+            self.assertEqual(f.read(), b"image-data")
+        self.assertEqual(media_store.content_hash(stored), digest)
+
+    def test_add_file_hardlink_read_only(self):
+        src = self.write("a.png", b"read-only")
+        os.chmod(src, 0o444)
+        with patch("claude_tk.media_store._reflink", return_value=False):
+            stored = self.store.add_file(src)
+        self.assertTrue(os.path.samefile(src, stored))
+
+    def test_content_hash_checks_file_content(self):
+        # ハッシュのようなファイル名でも内容から計算する
+        fake = self.write("0" * 64 + ".png", b"data")
+        self.assertEqual(media_store.content_hash(fake), hashlib.sha256(b"data").hexdigest())
+
+    def test_add_file_same_content_shared(self):
+        a = self.write("a/screenshot.png", b"same")
+        b = self.write("b/screenshot.png", b"same")
+        self.assertEqual(self.store.add_file(a), self.store.add_file(b))
+
+    def test_add_file_copy_fallback(self):
+        src = self.write("a.png", b"data")
+        with patch("claude_tk.media_store._reflink", return_value=False):
+            stored = self.store.add_file(src)
+        self.assertFalse(os.path.samefile(src, stored))
+        with open(stored, "rb") as f:
+            self.assertEqual(f.read(), b"data")
+
+    def test_add_sources(self):
+        a = self.write("a.png", b"a")
+        mem = image_attachments.MemoryImage(b"m", "clip.png")
+        result = self.store.add_sources([a, mem, os.path.join(self.tmpdir.name, "missing.png")])
+        self.assertTrue(self.store.contains(result[0]))
+        self.assertIs(result[1], mem)
+        self.assertTrue(result[2].endswith("missing.png"))
+
+    def test_hashed_name(self):
+        mem = image_attachments.MemoryImage(b"m", "clip.png")
+        self.assertEqual(media_store.hashed_name(mem), hashlib.sha256(b"m").hexdigest() + ".png")
+        stored = self.store.add_bytes(b"x", ".jpg")
+        self.assertEqual(media_store.hashed_name(stored), os.path.basename(stored))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+import unittest
+from types import SimpleNamespace
+from unittest.mock import MagicMock, patch
+from claude_tk import output_limits
+
+
+def reply(text, stop_reason="end_turn"):
+    return MagicMock(content=[MagicMock(text=text)], stop_reason=stop_reason)
+
+
+def events(chunks, stop_reason="end_turn"):
+    """ストリーミングのイベント列"""
+    result = [SimpleNamespace(type="message_start")]
+    result += [SimpleNamespace(type="content_block_delta", delta=SimpleNamespace(type="text_delta", text=chunk)) for chunk in chunks]
+    return result + [SimpleNamespace(type="message_delta", delta=SimpleNamespace(stop_reason=stop_reason))]
+
+
+class TestOutputLimits(unittest.TestCase):
+    def setUp(self):
+        self.env = {}
+        patcher = patch("os.getenv", side_effect=lambda key, default=None: self.env.get(key, default))
+        self.addCleanup(patcher.stop)
+        patcher.start()
+        self.addCleanup(output_limits._registered.clear)
+
+    def test_max_tokens_for(self):
+        self.assertEqual(output_limits.max_tokens_for("claude-3-haiku-20240307"), 4096)
+        self.assertEqual(output_limits.max_tokens_for("claude-sonnet-4-20250514"), output_limits.REQUEST_CAP)
+        self.assertEqual(output_limits.max_tokens_for("unknown-model"), output_limits.DEFAULT_OUTPUT_LIMIT)
+        # 今のSDKのModelInfoにはmax_tokensがないため、表の値のまま
+        output_limits.register_models([SimpleNamespace(id="claude-sonnet-4-20250514", display_name="Claude Sonnet 4")])
+        self.assertEqual(output_limits.max_tokens_for("claude-sonnet-4-20250514"), output_limits.REQUEST_CAP)
+        # models.listがmax_tokensを返すようになったら、その上限を優先する
+        output_limits.register_models([SimpleNamespace(id="claude-sonnet-4-20250514", max_tokens=2000)])
+        self.assertEqual(output_limits.max_tokens_for("claude-sonnet-4-20250514"), 2000)
+        # .envの設定（先頭一致、長いものを優先）。モデルの上限は超えない
+        self.env["CLAUDE_TK_MAX_TOKENS"] = "16000, claude-3-haiku=100000, claude-opus-4=1024, bad=x"
+        self.assertEqual(output_limits.max_tokens_for("claude-opus-4-20250514"), 1024)
+        self.assertEqual(output_limits.max_tokens_for("claude-3-haiku-20240307"), 4096)
+        self.assertEqual(output_limits.max_tokens_for("claude-3-7-sonnet-20250219"), 16000)
+
+    def test_continues_until_end_turn(self):
+        create = MagicMock(side_effect=[reply("前半の文章で \n", "max_tokens"), reply("\n続き", "max_tokens"), reply("。終わり")])
+        messages = [{"role": "user", "content": "Q"}]
+        answer, stop_reason = output_limits.create_with_continuation(create, "claude-3-haiku", messages, temperature=0)
+        self.assertEqual(answer, "前半の文章で\n続き。終わり")
+        self.assertEqual(stop_reason, "end_turn")
+        self.assertEqual(create.call_count, 3)
+        # 末尾の空白を除いたそれまでの回答をプレフィルとして送る
+        kwargs = create.call_args_list[1].kwargs
+        self.assertEqual(kwargs["messages"], messages + [{"role": "assistant", "content": "前半の文章で"}])
+        self.assertEqual(kwargs["max_tokens"], 4096)
+        self.assertEqual(kwargs["temperature"], 0)
+        self.assertEqual(messages, [{"role": "user", "content": "Q"}])
+
+    def test_continuation_cap_and_error(self):
+        self.env["CLAUDE_TK_MAX_CONTINUATIONS"] = "1"
+        create = MagicMock(side_effect=[reply("A", "max_tokens"), reply("B", "max_tokens"), reply("C")])
+        self.assertEqual(output_limits.create_with_continuation(create, "m", []), ("AB", "max_tokens"))
+        self.assertEqual(create.call_count, 2)
+        # 継続のリクエストが失敗してもそれまでの回答を返す
+        create = MagicMock(side_effect=[reply("A", "max_tokens"), RuntimeError("overloaded")])
+        self.assertEqual(output_limits.create_with_continuation(create, "m", []), ("A", "max_tokens"))
+        # 最初のリクエストの失敗はそのまま伝える
+        create = MagicMock(side_effect=RuntimeError("overloaded"))
+        with self.assertRaises(RuntimeError):
+            output_limits.create_with_continuation(create, "m", [])
+
+    def test_stream_with_continuation(self):
+        create = MagicMock(side_effect=[events(["前半", "の文章で ", "\n"], "max_tokens"), events(["\n続き", "。"])])
+        shown = []
+        answer, stop_reason = output_limits.stream_with_continuation(create, "claude-3-haiku", [], shown.append)
+        self.assertEqual(answer, "前半の文章で\n続き。")
+        self.assertEqual("".join(shown), answer)
+        self.assertEqual(stop_reason, "end_turn")
+        kwargs = create.call_args_list[1].kwargs
+        self.assertTrue(kwargs["stream"])
+        self.assertEqual(kwargs["messages"], [{"role": "assistant", "content": "前半の文章で"}])
+
+
+if __name__ == "__main__":
+    unittest.main()
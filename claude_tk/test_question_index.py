@@ -0,0 +1,53 @@
+import unittest
+import time
+import random
+from claude_tk import question_index
+
+
+class TestQuestionIndex(unittest.TestCase):
+    def setUp(self):
+        self.pairs = [
+            ("Pythonでzipファイルを展開する方法を教えてください", "zipfileを使います"),
+            ("東京の明日の天気は？", "晴れです"),
+            ("リストを逆順にソートするには", "sorted(reverse=True)"),
+        ]
+        self.index = question_index.QuestionIndex(threshold=0.6)
+        self.index.build(self.pairs)
+
+    def test_paraphrase_matches(self):
+        score, question, answer = self.index.find_similar("ｐｙｔｈｏｎでＺＩＰファイルを展開する方法を教えて")
+        self.assertEqual(answer, "zipfileを使います")
+        self.assertGreater(score, 0.6)
+        self.assertAlmostEqual(self.index.search(self.pairs[1][0])[0], 1.0, places=5)
+        self.assertIsNone(self.index.find_similar("画像の色を変える"))
+        self.assertIsNone(self.index.search("あ"))
+
+    def test_add_and_rebuild(self):
+        self.index.add("Rustでファイルを読み込む方法", "std::fs::read")
+        self.assertEqual(self.index.find_similar("Rustでファイルを読み込む方法は？")[2], "std::fs::read")
+        # 作り直しても追加した組は残る
+        self.index.build(self.pairs[:1])
+        self.assertEqual(len(self.index), 2)
+        self.assertEqual(self.index.find_similar("Rustでファイルを読み込む方法は？")[2], "std::fs::read")
+        empty = question_index.QuestionIndex()
+        self.assertIsNone(empty.search("質問"))
+        empty.build([])
+        self.assertIsNone(empty.search("質問"))
+
+    def test_search_100k_pairs(self):
+        rng = random.Random(0)
+        words = ["東京", "大阪", "天気", "明日", "Python", "リスト", "ソート", "方法", "教えて", "画像",
+                 "変換", "エラー", "関数", "使い方", "違い", "速度", "改善", "データ", "ファイル", "保存"]
+        pairs = [("".join(rng.choice(words) for _ in range(rng.randint(3, 8))) + f" {i}", f"回答{i}")
+                 for i in range(100000)]
+        self.index.build(pairs)
+        queries = [pairs[i][0] for i in range(0, 100000, 10000)]
+        start = time.perf_counter()
+        results = [self.index.search(query) for query in queries]
+        elapsed = (time.perf_counter() - start) / len(queries)
+        self.assertLess(elapsed, 0.05)
+        self.assertEqual([r[2] for r in results], [pairs[i][1] for i in range(0, 100000, 10000)])
+
+
+if __name__ == "__main__":
+    unittest.main()
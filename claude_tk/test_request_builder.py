@@ -0,0 +1,83 @@
+import unittest
+import json
+import hashlib
+from claude_tk import request_builder
+
+
+class TestRequestBuilder(unittest.TestCase):
+    def setUp(self):
+        self.builder = request_builder.RequestBuilder()
+        self.history = [
+            {"role": "user", "content": "Q1", "image_paths": ["a.png"]},
+            {"role": "assistant", "content": "A1", "markdown": "**A1**"},
+            {"role": "user", "content": "Q2"}
+        ]
+
+    def test_build_uses_markdown_and_latest_content(self):
+        latest = [{"type": "text", "text": "Q2"}]
+        messages = self.builder.build(self.history, latest)
+        self.assertEqual(messages, [
+            {"role": "user", "content": "Q1"},
+            {"role": "assistant", "content": "**A1**"},
+            {"role": "user", "content": latest}
+        ])
+        # 今回の質問は保持しない
+        self.assertEqual(len(self.builder.messages), 2)
+
+    def test_appends_only_new_messages(self):
+        self.builder.build(self.history)
+        first = self.builder.messages[0]
+        self.history += [{"role": "assistant", "content": "A2"}, {"role": "user", "content": "Q3"}]
+        messages = self.builder.build(self.history)
+        self.assertIs(self.builder.messages[0], first)
+        self.assertEqual([m["content"] for m in messages], ["Q1", "**A1**", "Q2", "A2", "Q3"])
+
+    def test_rebuilds_when_history_replaced(self):
+        self.builder.build(self.history)
+        # 同じリストでも保持している末尾のメッセージが変わっていれば作り直す
+        self.history[:2] = [{"role": "user", "content": "X"}, {"role": "assistant", "content": "Y"}]
+        self.assertEqual([m["content"] for m in self.builder.build(self.history)], ["X", "Y", "Q2"])
+        other = [{"role": "user", "content": "Z"}]
+        self.assertEqual(self.builder.build(other), [{"role": "user", "content": "Z"}])
+        self.assertEqual(self.builder.messages, [])
+
+    def test_reset_with_api_messages(self):
+        history = self.history[:2]
+        api_messages = [{"role": "user", "content": "Q1"}, {"role": "assistant", "content": "**A1**"}]
+        self.builder.reset(history, api_messages)
+        self.assertIs(self.builder.messages[1], api_messages[1])
+        history.append({"role": "user", "content": "Q2"})
+        self.assertEqual(self.builder.build(history)[:2], api_messages)
+        self.assertIs(self.builder.messages[1], api_messages[1])
+        # 長さが合わない場合は会話履歴から作り直す
+        self.builder.reset(history, api_messages)
+        self.assertEqual(len(self.builder.messages), 3)
+
+    def test_file_ids(self):
+        self.history[0]["file_ids"] = ["file_1"]
+        self.assertEqual(self.builder.build(self.history)[0], {"role": "user", "content": "Q1"})
+        builder = request_builder.RequestBuilder(file_ids=True)
+        self.assertEqual(builder.build(self.history)[0]["content"], [
+            {"type": "image", "source": {"type": "file", "file_id": "file_1"}},
+            {"type": "text", "text": "Q1"}
+        ])
+        # テキストのみのapi_messagesは使わない
+        builder.reset(self.history, [{"role": "user", "content": "Q1"}, {}, {}])
+        self.assertEqual(len(builder.messages[0]["content"]), 2)
+
+    def test_prefix_json_and_key(self):
+        self.builder.sync(self.history)
+        self.assertEqual(json.loads(self.builder.prefix_json()), request_builder.RequestBuilder().build(self.history + [{"role": "user", "content": "x"}])[:3])
+        key = self.builder.prefix_key()
+        other = request_builder.RequestBuilder()
+        other.sync(self.history[:1])
+        other.sync(self.history)
+        self.assertEqual(other.prefix_key(), key)
+        expected = hashlib.sha256("".join(data + "," for data in self.builder.encoded).encode("utf-8"))
+        self.assertEqual(key, expected.hexdigest())
+        other.reset()
+        self.assertEqual(other.prefix_key(), hashlib.sha256().hexdigest())
+
+
+if __name__ == "__main__":
+    unittest.main()
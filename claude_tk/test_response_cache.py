@@ -0,0 +1,66 @@
+import unittest
+import os
+import time
+import tempfile
+from claude_tk import response_cache
+
+
+class TestResponseCache(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.root = os.path.join(self.tmpdir.name, "cache")
+        self.cache = response_cache.ResponseCache(self.root)
+
+    def key(self, content="Q", images=(), model="model-x", prefix="p", **params):
+        return response_cache.request_key(model, prefix, {"content": content, "images": list(images)}, max_tokens=1000, **params)
+
+    def test_request_key(self):
+        key = self.key(images=["h1"])
+        self.assertEqual(key, self.key(images=["h1"]))
+        for other in (self.key(), self.key(images=["h2"]), self.key(images=["h1"], model="model-y"),
+                      self.key(images=["h1"], prefix="q"), self.key(images=["h1"], temperature=0)):
+            self.assertNotEqual(key, other)
+
+    def test_put_and_get(self):
+        key = self.key()
+        self.assertIsNone(self.cache.get(key))
+        self.cache.put(key, "**回答**", "model-x")
+        start = time.perf_counter()
+        self.assertEqual(self.cache.get(key), "**回答**")
+        self.assertLess(time.perf_counter() - start, 0.05)
+        self.assertEqual([name for name in os.listdir(os.path.dirname(self.cache.path_for(key)))], [key + ".json"])
+
+    def test_expired_entries(self):
+        key = self.key()
+        self.cache.put(key, "A", "model-x")
+        old = time.time() - 10 * 86400
+        os.utime(self.cache.path_for(key), (old, old))
+        cache = response_cache.ResponseCache(self.root, max_age=86400)
+        self.assertIsNone(cache.get(key))
+        cache.put(self.key("Q2"), "B", "model-x")
+        self.assertFalse(os.path.exists(self.cache.path_for(key)))
+
+    def test_size_eviction_removes_least_recently_used(self):
+        keys = [self.key(f"Q{i}") for i in range(3)]
+        for i, key in enumerate(keys):
+            self.cache.put(key, "x" * 100, "model-x")
+            os.utime(self.cache.path_for(key), (time.time() - 100 + i,) * 2)
+        # 最初のものを使うと、2番目が最も古くなる
+        self.cache.get(keys[0])
+        # 作成時刻の桁数で1件のサイズが数バイト違うことがあるため、3件分に余裕を持たせる
+        size = max(os.path.getsize(self.cache.path_for(key)) for key in keys)
+        cache = response_cache.ResponseCache(self.root, max_bytes=size * 3 + size // 2)
+        cache.put(self.key("Q3"), "x" * 100, "model-x")
+        self.assertEqual([os.path.exists(cache.path_for(key)) for key in keys], [True, False, True])
+
+    def test_broken_entry(self):
+        key = self.key()
+        os.makedirs(os.path.dirname(self.cache.path_for(key)))
+        with open(self.cache.path_for(key), "w", encoding="utf-8") as f:
+            f.write("{")
+        self.assertIsNone(self.cache.get(key))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,78 @@
+import unittest
+import os
+import tempfile
+import zipfile
+from claude_tk import session_snapshot, media_store, image_attachments, conversation_archive
+
+
+class TestSessionSnapshot(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.store = media_store.MediaStore(os.path.join(self.tmpdir.name, "media"))
+        self.path = os.path.join(self.tmpdir.name, "session", "last_session.snap")
+
+    def test_api_messages(self):
+        history = [
+            {"role": "user", "content": "Q", "image_paths": ["a.png"]},
+            {"role": "assistant", "content": "A", "markdown": "**A**"}
+        ]
+        self.assertEqual(session_snapshot.api_messages(history), [
+            {"role": "user", "content": "Q"},
+            {"role": "assistant", "content": "**A**"}
+        ])
+
+    def test_roundtrip_with_blobs(self):
+        png = os.path.join(self.tmpdir.name, "a.png")
+        with open(png, "wb") as f:
+            f.write(b"png")
+        history = [
+            {"role": "user", "content": "Q", "image_paths": [png, image_attachments.MemoryImage(b"clip", "clip.png")]},
+            {"role": "assistant", "content": "A", "markdown": "A"}
+        ]
+        view = {"segments": ["Q: ", "", "\nA: A\n"], "tags": {"question": ["1.0", "1.3"]},
+                "images": [{"message": 0, "image": 0, "blob": 0}, {"message": 0, "image": 1, "blob": 1}]}
+        state = session_snapshot.build_state(history, "model-x", view, self.store, last_json_zip_path=None)
+        session_snapshot.write_snapshot(self.path, state, [b"thumb1", b"thumb22"])
+        self.assertFalse(os.path.exists(self.path + ".tmp"))
+        state, blobs = session_snapshot.read_snapshot(self.path)
+        self.assertEqual(blobs, [b"thumb1", b"thumb22"])
+        self.assertEqual(state["model"], "model-x")
+        self.assertEqual(state["view"], view)
+        self.assertEqual(state["api_messages"][1], {"role": "assistant", "content": "A"})
+        self.assertIn("last_json_zip_path", state)
+        restored, archives = session_snapshot.load_history(state)
+        self.assertEqual(archives, [])
+        paths = restored[0]["image_paths"]
+        self.assertEqual(paths[0], os.path.abspath(png))
+        # クリップボード画像はメディアストアに書き出されている
+        with open(paths[1], "rb") as f:
+            self.assertEqual(f.read(), b"clip")
+        session_snapshot.remove_snapshot(self.path)
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_zip_image_reopens_archive(self):
+        zip_path = os.path.join(self.tmpdir.name, "c.zip")
+        with zipfile.ZipFile(zip_path, "w") as z:
+            z.writestr("img/x.png", b"x")
+        archive = conversation_archive.ArchiveReader(zip_path)
+        self.addCleanup(archive.close)
+        history = [{"role": "user", "content": "Q", "image_paths": [archive.image("img/x.png")]}]
+        state = session_snapshot.build_state(history, "model-x", {"segments": [""], "tags": {}, "images": []}, self.store)
+        session_snapshot.write_snapshot(self.path, state, [])
+        restored, archives = session_snapshot.load_history(session_snapshot.read_snapshot(self.path)[0])
+        self.addCleanup(lambda: [a.close() for a in archives])
+        self.assertEqual(len(archives), 1)
+        self.assertEqual(restored[0]["image_paths"][0].data, b"x")
+
+    def test_invalid_file(self):
+        os.makedirs(os.path.dirname(self.path))
+        for data in (b"", b"not a snapshot", session_snapshot.MAGIC + b"\x05\x00\x00\x00{}"):
+            with open(self.path, "wb") as f:
+                f.write(data)
+            with self.subTest(data=data), self.assertRaises(ValueError):
+                session_snapshot.read_snapshot(self.path)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,80 @@
+import unittest
+import os
+import time
+import tempfile
+import threading
+from unittest.mock import MagicMock
+from PIL import Image
+from claude_tk import token_estimate
+
+
+class TestTokenEstimate(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.estimator = token_estimate.TokenEstimator()
+        self.addCleanup(self.estimator.shutdown)
+        self.prefix = [{"role": "user", "content": "こんにちは"}, {"role": "assistant", "content": "Hello, world!"}]
+
+    def test_text_and_image_tokens(self):
+        self.assertEqual(token_estimate.text_tokens(""), 0)
+        self.assertEqual(token_estimate.text_tokens("abcdefg"), 2)
+        self.assertEqual(token_estimate.text_tokens("日本語"), 3)
+        self.assertEqual(token_estimate.image_tokens(750, 1), 1)
+        # 長辺1568に縮小し、上限を超えない
+        self.assertEqual(token_estimate.image_tokens(4000, 3000), token_estimate.MAX_IMAGE_TOKENS)
+        self.assertEqual(token_estimate.image_tokens(200, 300), 80)
+
+    def test_estimate_local(self):
+        path = os.path.join(self.tmpdir.name, "a.png")
+        Image.new("RGB", (200, 300)).save(path)
+        estimate = self.estimator.submit_local("claude-3-haiku-20240307", "key", self.prefix, "質問", [path]).result()
+        prefix_tokens = sum(token_estimate.message_tokens(m) for m in self.prefix)
+        expected = token_estimate.REQUEST_OVERHEAD_TOKENS + prefix_tokens + token_estimate.MESSAGE_OVERHEAD_TOKENS + 2 + 80
+        self.assertEqual(estimate["tokens"], expected)
+        self.assertEqual(estimate["image_tokens"], 80)
+        self.assertFalse(estimate["exact"])
+        self.assertAlmostEqual(estimate["cost"], expected * 0.25 / 1_000_000)
+        self.assertIn("約$", token_estimate.describe(estimate))
+        # 会話履歴の部分はprefix_keyごとにキャッシュする
+        self.assertEqual(self.estimator.prefix_tokens("key", []), prefix_tokens)
+
+    def test_confirm_with_count_tokens(self):
+        count = MagicMock(return_value=MagicMock(input_tokens=42))
+        estimator = token_estimate.TokenEstimator(count)
+        self.addCleanup(estimator.shutdown)
+        local = estimator.estimate_local("m", "key", self.prefix, "Q", [])
+        for _ in range(2):
+            confirmed = estimator.submit_confirm(local, self.prefix, "Q").result()
+        self.assertEqual(confirmed["tokens"], 42)
+        self.assertTrue(confirmed["exact"])
+        self.assertTrue(token_estimate.describe(confirmed).startswith("入力 42トークン・"))
+        # 同じ履歴・質問ならAPIは1回だけ
+        count.assert_called_once_with(model="m", messages=self.prefix + [{"role": "user", "content": "Q"}])
+
+    def test_new_request_cancels_pending(self):
+        started = threading.Event()
+        release = threading.Event()
+
+        def block():
+            started.set()
+            release.wait(5)
+        running = self.estimator.submit(block)
+        started.wait(5)
+        stale = self.estimator.submit_local("m", "key", self.prefix, "古い", [])
+        latest = self.estimator.submit_local("m", "key", self.prefix, "新しい", [])
+        release.set()
+        self.assertTrue(stale.cancelled())
+        self.assertEqual(latest.result(5)["question"], "新しい")
+        running.result(5)
+
+    def test_estimate_is_fast_for_long_history(self):
+        history = [{"role": "user" if i % 2 == 0 else "assistant", "content": "長い会話の文章です。" * 50} for i in range(2000)]
+        self.estimator.estimate_local("m", "long", history, "Q", [])
+        start = time.perf_counter()
+        self.estimator.estimate_local("m", "long", history, "Q2", [])
+        self.assertLess(time.perf_counter() - start, 0.01)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,205 @@
+"""送信前のトークン数・料金・待ち時間の見積もり
+
+質問・会話履歴・添付画像の入力トークン数を手元で概算し（テキストは文字数、画像は縦横のピクセル数から）、
+必要ならcount_tokens APIで確かめる。計算は1本の作業スレッドで行い、新しい見積もりを頼むと
+まだ始まっていない古い見積もりは取り消す。会話履歴の部分はRequestBuilderのprefix_keyごとに、
+APIで数えた結果は(モデル, prefix_key, 質問)ごとにキャッシュする。
+"""
+import os
+import math
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+try:
+    from claude_tk import image_attachments
+except ImportError:  # スクリプトとして直接実行された場合
+    import image_attachments
+
+# テキストの概算（ASCIIは約3.5文字で1トークン、日本語などそれ以外は約1文字で1トークン）
+ASCII_CHARS_PER_TOKEN = 3.5
+NON_ASCII_TOKENS_PER_CHAR = 1.0
+# メッセージ・リクエストごとの固定分
+MESSAGE_OVERHEAD_TOKENS = 4
+REQUEST_OVERHEAD_TOKENS = 8
+# 画像は(幅×高さ)/750トークン（長辺MAX_LONG_EDGEに縮小した後、上限約1600トークン）
+IMAGE_PIXELS_PER_TOKEN = 750
+MAX_IMAGE_TOKENS = 1600
+
+# 入力の料金（100万トークンあたりのドル、モデルIDの先頭一致で長いものから照合）
+INPUT_PRICES = {
+    "claude-opus-4-5": 5.0,
+    "claude-opus-4": 15.0,
+    "claude-3-opus": 15.0,
+    "claude-sonnet-4": 3.0,
+    "claude-3-7-sonnet": 3.0,
+    "claude-3-5-sonnet": 3.0,
+    "claude-haiku-4": 1.0,
+    "claude-3-5-haiku": 0.8,
+    "claude-3-haiku": 0.25,
+}
+DEFAULT_INPUT_PRICE = 3.0
+
+# 最初の応答までの待ち時間の目安（固定分＋入力トークン数に比例する分）
+BASE_LATENCY = 0.8
+INPUT_TOKENS_PER_SECOND = 10000
+
+_PREFIX_CACHE_SIZE = 64
+_COUNT_CACHE_SIZE = 256
+_IMAGE_CACHE_SIZE = 256
+
+
+def text_tokens(text):
+    """テキストのトークン数の概算"""
+    ascii_count = len(text.encode("ascii", "ignore"))
+    return math.ceil(ascii_count / ASCII_CHARS_PER_TOKEN + (len(text) - ascii_count) * NON_ASCII_TOKENS_PER_CHAR)
+
+
+def image_tokens(width, height):
+    """画像のトークン数の概算"""
+    long_edge = max(width, height)
+    if long_edge > image_attachments.MAX_LONG_EDGE:
+        scale = image_attachments.MAX_LONG_EDGE / long_edge
+        width, height = width * scale, height * scale
+    return min(math.ceil(width * height / IMAGE_PIXELS_PER_TOKEN), MAX_IMAGE_TOKENS)
+
+
+def message_tokens(message):
+    """API形式のメッセージのトークン数の概算（ファイルIDで参照する画像は大きさが分からないため上限で数える）"""
+    content = message["content"]
+    if isinstance(content, str):
+        return MESSAGE_OVERHEAD_TOKENS + text_tokens(content)
+    tokens = MESSAGE_OVERHEAD_TOKENS
+    for block in content:
+        if block.get("type") == "text":
+            tokens += text_tokens(block["text"])
+        elif block.get("type") == "image":
+            tokens += MAX_IMAGE_TOKENS
+    return tokens
+
+
+def input_price(model):
+    for prefix in sorted(INPUT_PRICES, key=len, reverse=True):
+        if model.startswith(prefix):
+            return INPUT_PRICES[prefix]
+    return DEFAULT_INPUT_PRICE
+
+
+def describe(estimate):
+    """ステータスバーに表示する文字列"""
+    approx = "" if estimate["exact"] else "約"
+    text = f"入力 {approx}{estimate['tokens']:,}トークン"
+    if estimate["image_tokens"]:
+        text += f"（画像 約{estimate['image_tokens']:,}）"
+    return text + f"・約${estimate['cost']:.4f}・最初の応答まで約{estimate['latency']:.1f}秒"
+
+
+def _put(cache, key, value, size):
+    cache[key] = value
+    cache.move_to_end(key)
+    while len(cache) > size:
+        cache.popitem(last=False)
+
+
+class TokenEstimator:
+    """見積もりを作業スレッドで計算する
+
+    count_tokensにはclient.messages.count_tokens（Files APIを使う場合はbetasを指定したもの）を渡す。
+    Noneなら手元の概算だけを使う。
+    """
+
+    def __init__(self, count_tokens=None):
+        self.count_tokens = count_tokens
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="claude_tk_estimate")
+        self._lock = threading.Lock()
+        self._pending = None
+        self._prefix_cache = OrderedDict()
+        self._count_cache = OrderedDict()
+        self._image_cache = OrderedDict()
+
+    def submit(self, fn, *args):
+        """fn(*args)を作業スレッドで実行する（まだ始まっていない前の見積もりは取り消す）"""
+        with self._lock:
+            if self._pending is not None:
+                self._pending.cancel()
+            self._pending = self._executor.submit(fn, *args)
+            return self._pending
+
+    def submit_local(self, model, prefix_key, prefix_messages, question, images):
+        return self.submit(self.estimate_local, model, prefix_key, prefix_messages, question, images)
+
+    def submit_confirm(self, estimate, prefix_messages, question):
+        return self.submit(self.confirm, estimate, prefix_messages, question)
+
+    def prefix_tokens(self, prefix_key, prefix_messages):
+        """会話履歴の部分のトークン数（prefix_keyごとにキャッシュ）"""
+        with self._lock:
+            tokens = self._prefix_cache.get(prefix_key)
+        if tokens is None:
+            tokens = sum(message_tokens(message) for message in prefix_messages)
+            with self._lock:
+                _put(self._prefix_cache, prefix_key, tokens, _PREFIX_CACHE_SIZE)
+        return tokens
+
+    def _image_key(self, source):
+        if isinstance(source, str):
+            st = os.stat(source)
+            return (source, st.st_mtime_ns, st.st_size)
+        return source
+
+    def attached_image_tokens(self, source):
+        """添付画像のトークン数（ヘッダーから縦横を読み、画像ごとにキャッシュ）"""
+        try:
+            key = self._image_key(source)
+        except OSError:
+            return MAX_IMAGE_TOKENS
+        with self._lock:
+            tokens = self._image_cache.get(key)
+        if tokens is None:
+            try:
+                with image_attachments.open_image(source) as img:
+                    tokens = image_tokens(*img.size)
+            except Exception:
+                tokens = MAX_IMAGE_TOKENS
+            with self._lock:
+                _put(self._image_cache, key, tokens, _IMAGE_CACHE_SIZE)
+        return tokens
+
+    def _result(self, model, tokens, image_tokens_total, exact=False, **extra):
+        return {
+            "model": model,
+            "tokens": tokens,
+            "image_tokens": image_tokens_total,
+            "exact": exact,
+            "cost": tokens * input_price(model) / 1_000_000,
+            "latency": BASE_LATENCY + tokens / INPUT_TOKENS_PER_SECOND,
+            **extra,
+        }
+
+    def estimate_local(self, model, prefix_key, prefix_messages, question, images):
+        """手元での見積もり"""
+        images_total = sum(self.attached_image_tokens(source) for source in images)
+        tokens = (REQUEST_OVERHEAD_TOKENS + self.prefix_tokens(prefix_key, prefix_messages)
+                  + MESSAGE_OVERHEAD_TOKENS + text_tokens(question) + images_total)
+        return self._result(model, tokens, images_total, prefix_key=prefix_key, question=question)
+
+    def confirm(self, estimate, prefix_messages, question):
+        """count_tokens APIで会話履歴と質問のテキストを数え直す（添付画像は手元の概算を足す）"""
+        if self.count_tokens is None or not question:
+            return estimate
+        model = estimate["model"]
+        key = (model, estimate["prefix_key"], question)
+        with self._lock:
+            counted = self._count_cache.get(key)
+        if counted is None:
+            result = self.count_tokens(
+                model=model, messages=list(prefix_messages) + [{"role": "user", "content": question}]
+            )
+            counted = result.input_tokens
+            with self._lock:
+                _put(self._count_cache, key, counted, _COUNT_CACHE_SIZE)
+        images_total = estimate["image_tokens"]
+        return self._result(model, counted + images_total, images_total, exact=not images_total,
+                            prefix_key=estimate["prefix_key"], question=question)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)